@@ -3,16 +3,31 @@
 #   Python library that clients can invoke to interact with our DFS.
 
 # PROVIDED APIs:
-#   1. read a file
-#   2. write data (also creates files)
+#   1. read a file (as text, or as raw bytes)
+#   2. write data (also creates files; streams bytes/binary files as the body)
 #   3. delete a file
 #   4. copy a file
 #   5. rename (also moves) a file
 #   6. check if a file exists
+#   7. stat a file (size, mtime, version, checksum)
+#   8. append data (also creates files; returns the new length for tailing)
+#   9. write data at an offset, and truncate a file
+#  10. compressed transfers (reads accept compressed bytes, writes can be
+#      compressed before upload), and per-write at-rest compression
+#  11. striping: large files are split into stripes spread across families,
+#      written and read in parallel
+#  12. directories: paths may hold "/" (writes create missing parents), and
+#      directories can be made, listed (a page at a time), renamed and removed
+#  13. list every file under a prefix, across all families
 
+import json
+import lzma
+import os
 import requests
 import time
 import urllib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 ##############################################################################
 # Middleware IP Address
@@ -21,11 +36,32 @@ MIDDLEWARE_IP_ADDRESS = "54.215.223.179"
 # Middleware timeout to allocate a new resource
 MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS = 1
 
+# Size of each chunk streamed when uploading a file's contents
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Encodings we accept for <read_bytes> responses (decompressed here)
+ACCEPTED_ENCODINGS = 'deflate, xz'
+
+# Files of at least this many bytes are striped across families (None = never)
+STRIPE_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Size of each stripe of a striped file
+STRIPE_BYTES = 16 * 1024 * 1024
+
+# Most stripes read/written at once
+STRIPE_PARALLELISM = 8
+
 
 ##############################################################################
 # Request Helper
-def make_request(endpoint):
-    return requests.get('http://'+MIDDLEWARE_IP_ADDRESS+':8002/'+endpoint)
+def make_request(endpoint, headers = None):
+    return requests.get('http://'+MIDDLEWARE_IP_ADDRESS+':8002/'+endpoint, headers=headers)
+
+
+# PUT the body returned by <body_chunks()> (generators are sent with chunked
+# transfer encoding)
+def make_put_request(endpoint, body_chunks, headers = None):
+    return requests.put('http://'+MIDDLEWARE_IP_ADDRESS+':8002/'+endpoint, data=body_chunks(), headers=headers)
 
 
 def handle_failed_request(response, err_message: str):
@@ -38,38 +74,331 @@ def handle_failed_request(response, err_message: str):
 
 ##############################################################################
 # Read the contents of a file
-def read(path: str) -> str:
+# Pass <offset>/<length> (in bytes) to only read part of it (length -1 = to EOF)
+# Pass <verify=False> to skip checking a whole file read from disk against its
+# checksum (for hot paths that can trust the disk)
+def read(path: str, offset: int = 0, length: int = -1, verify: bool = True) -> str:
     url = "read/"+urllib.parse.quote(path)
+    if offset != 0 or length != -1:
+        url = url+'?offset='+str(offset)+'&length='+str(length)
+    if not verify:
+        url = url+('&' if '?' in url else '?')+'verify=0'
     response = make_request(url)
     # Handle waiting for the router to have allocated a new resource
     if response.status_code == 425:
         token = response.json().get('token')
-        url = url+'?token='+str(token)
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
         while response.status_code == 425:
             time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
             response = make_request(url)
     # Handle response once resource is allocated as needed
     if response.status_code == 200:
+        if 'stripe_manifest' in response.json():
+            return read_striped(response.json().get('stripe_manifest'), offset, length).decode('utf-8', errors='replace')
         return response.json().get("data")
     else:
         handle_failed_request(response, "Failed to read file '"+path+"'")
 
 
+##############################################################################
+# Read the raw bytes of a file (no text decoding). Files stored compressed are
+# sent still compressed, and decompressed here.
+# Pass <offset>/<length> (in bytes) to only read part of it (length -1 = to EOF)
+# Pass <verify=False> to skip checking a whole file read from disk against its
+# checksum (for hot paths that can trust the disk)
+def read_bytes(path: str, offset: int = 0, length: int = -1, verify: bool = True) -> bytes:
+    url = "read_bytes/"+urllib.parse.quote(path)
+    if offset != 0 or length != -1:
+        url = url+'?offset='+str(offset)+'&length='+str(length)
+    if not verify:
+        url = url+('&' if '?' in url else '?')+'verify=0'
+    headers = {'Accept-Encoding': ACCEPTED_ENCODINGS}
+    response = make_request(url, headers)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_request(url, headers)
+    # Handle response once resource is allocated as needed
+    if response.status_code in [200, 206]:
+        if 'X-Stripe-Manifest' in response.headers:
+            return read_striped(json.loads(response.content), offset, length)
+        if response.headers.get('Content-Encoding') == 'xz': # <requests> only decodes deflate itself
+            return lzma.decompress(response.content)
+        return response.content
+    else:
+        handle_failed_request(response, "Failed to read bytes of file '"+path+"'")
+
+
 ##############################################################################
 # Write data to a file (creates a file if DNE)
-def write(path: str, data: str):
-    url = "write/"+urllib.parse.quote(path)+"/"+urllib.parse.quote(data)
+# <durability> is one of "none", "fsync-data", "fsync-data+dir" (None = server default)
+# <compression> is one of "identity", "deflate", "xz" (None = server policy):
+#   the data is compressed here before upload, and stored compressed as is
+def write(path: str, data: str, durability: str = None, compression: str = None):
+    write_bytes(path, data.encode('utf-8'), durability, compression)
+
+
+# Compress <chunks> with <compression> ("deflate" or "xz") on the fly
+def compressed_chunks(chunks, compression: str):
+    compressor = zlib.compressobj() if compression == 'deflate' else lzma.LZMACompressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
+# Stream <source> (bytes, or a binary file object) to a file in bounded-size
+# chunks (creates a file if DNE). File objects are read from their current
+# position, and must be seekable in case the router asks us to retry.
+def write_bytes(path: str, source, durability: str = None, compression: str = None):
+    if isinstance(source, (bytes, bytearray)):
+        start, size = 0, len(source)
+        def body_chunks():
+            for offset in range(0, len(source), UPLOAD_CHUNK_BYTES):
+                yield bytes(source[offset:offset+UPLOAD_CHUNK_BYTES])
+    else:
+        start = source.tell()
+        try:
+            size = os.fstat(source.fileno()).st_size-start
+        except Exception:
+            size = 0 # unknown size: the router can't check capacity ahead of time
+        def body_chunks():
+            source.seek(start)
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_BYTES)
+                if len(chunk) == 0:
+                    return
+                yield chunk
+    if STRIPE_THRESHOLD_BYTES != None and size >= STRIPE_THRESHOLD_BYTES:
+        if write_striped(path, source, start, size, durability, compression):
+            return
+    url = "write/"+urllib.parse.quote(path)+"?size="+str(size)
+    if durability != None:
+        url = url+"&durability="+urllib.parse.quote(durability, safe='')
+    headers = None
+    if compression in [None, 'identity']:
+        if compression != None:
+            url = url+"&compression=identity"
+        upload_chunks = body_chunks
+    else:
+        headers = {'Content-Encoding': compression}
+        upload_chunks = lambda: compressed_chunks(body_chunks(), compression)
+    response = make_put_request(url, upload_chunks, headers)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'&token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_put_request(url, upload_chunks, headers)
+    # Handle response once resource is allocated as needed
+    if response.status_code != 200:
+        handle_failed_request(response, "Failed to write to file '"+path+"'")
+
+
+##############################################################################
+# Striping: the router plans which family each stripe goes to, the stripes are
+# written/read straight to/from their families' UVMs in parallel (falling back
+# to the router, which finds a stripe wherever it lives now), and a manifest
+# listing them is written to <path> itself.
+# @return list: [(stripe index, offset within the stripe, n_bytes), ...]
+#               covering <offset>..<offset+length> of a striped file
+def stripe_ranges(manifest: dict, offset: int, length: int) -> list:
+    end = manifest['size'] if length == -1 else min(manifest['size'], offset+length)
+    stripe_bytes = manifest['stripe_bytes']
+    ranges = []
+    position = offset
+    while position < end:
+        index = position//stripe_bytes
+        n_bytes = min(end, (index+1)*stripe_bytes)-position
+        ranges.append((index, position-index*stripe_bytes, n_bytes))
+        position += n_bytes
+    return ranges
+
+
+def read_stripe(stripe: dict, offset: int, n_bytes: int) -> bytes:
+    try:
+        url = stripe['uvm']+'/read_bytes/'+urllib.parse.quote(stripe['path'], safe='')+'?offset='+str(offset)+'&length='+str(n_bytes)
+        response = requests.get(url)
+        if response.status_code == 200 and len(response.content) == n_bytes:
+            return response.content
+    except Exception:
+        pass # its family's UVM moved: ask the router
+    contents = read_bytes(stripe['path'], offset, n_bytes)
+    if len(contents) != n_bytes:
+        raise Exception("Stripe '"+stripe['path']+"' is shorter than its manifest says")
+    return contents
+
+
+def read_striped(manifest: dict, offset: int = 0, length: int = -1) -> bytes:
+    ranges = stripe_ranges(manifest, offset, length)
+    with ThreadPoolExecutor(max_workers=STRIPE_PARALLELISM) as executor:
+        stripes = executor.map(lambda stripe_range: read_stripe(manifest['stripes'][stripe_range[0]], stripe_range[1], stripe_range[2]), ranges)
+        return b''.join(stripes)
+
+
+# Chunks of <source>'s bytes <offset>..<offset+n_bytes> (bytes, or a file read
+# via <os.pread> so that stripes can be read from it concurrently)
+def source_chunks(source, offset: int, n_bytes: int):
+    view = memoryview(source) if isinstance(source, (bytes, bytearray)) else None
+    for chunk_offset in range(offset, offset+n_bytes, UPLOAD_CHUNK_BYTES):
+        chunk_bytes = min(UPLOAD_CHUNK_BYTES, offset+n_bytes-chunk_offset)
+        if view != None:
+            yield bytes(view[chunk_offset:chunk_offset+chunk_bytes])
+        else:
+            yield os.pread(source.fileno(), chunk_bytes, chunk_offset)
+
+
+def write_stripe(stripe: dict, source, offset: int, n_bytes: int, durability: str, compression: str):
+    query = "?size="+str(n_bytes)
+    if durability != None:
+        query = query+"&durability="+urllib.parse.quote(durability, safe='')
+    headers = None
+    if compression in [None, 'identity']:
+        if compression != None:
+            query = query+"&compression=identity"
+        upload_chunks = lambda: source_chunks(source, offset, n_bytes)
+    else:
+        headers = {'Content-Encoding': compression}
+        upload_chunks = lambda: compressed_chunks(source_chunks(source, offset, n_bytes), compression)
+    try:
+        response = requests.put(stripe['uvm']+'/write/'+urllib.parse.quote(stripe['path'], safe='')+query, data=upload_chunks(), headers=headers)
+        if response.status_code == 200:
+            return
+    except Exception:
+        pass # its family's UVM moved (or is full): let the router place it
+    url = "write/"+urllib.parse.quote(stripe['path'])+query
+    response = make_put_request(url, upload_chunks, headers)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'&token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_put_request(url, upload_chunks, headers)
+    if response.status_code != 200:
+        handle_failed_request(response, "Failed to write stripe '"+stripe['path']+"'")
+
+
+# Write <size> bytes of <source> (from its offset <start>) as a striped file
+# @return bool: False if it can't be striped (fewer than 2 families to stripe
+#               across), for it to be written as a plain file instead
+def write_striped(path: str, source, start: int, size: int, durability: str = None, compression: str = None) -> bool:
+    response = make_request("stripe_plan/"+urllib.parse.quote(path)+"?size="+str(size)+"&stripe_bytes="+str(STRIPE_BYTES))
+    if response.status_code != 200:
+        return False
+    plan = response.json()
+    if len(set(stripe['uvm'] for stripe in plan['stripes'])) < 2:
+        return False
+    manifest = {'size': size, 'stripe_bytes': plan['stripe_bytes'], 'stripes': plan['stripes']}
+    ranges = stripe_ranges(manifest, 0, size)
+    with ThreadPoolExecutor(max_workers=STRIPE_PARALLELISM) as executor:
+        writes = [executor.submit(write_stripe, plan['stripes'][index], source, start+offset+index*plan['stripe_bytes'], n_bytes, durability, compression) for index, offset, n_bytes in ranges]
+        try:
+            for stripe_write in writes:
+                stripe_write.result()
+        except Exception:
+            for stripe in plan['stripes']: # don't leave the stripes already written behind
+                try:
+                    delete(stripe['path'])
+                except Exception:
+                    pass
+            raise
+    write_manifest(path, manifest, durability)
+    return True
+
+
+# Write the <manifest> of a striped file to <path> (flagging it as striped,
+# see the UVM's <stripe_manifest>)
+def write_manifest(path: str, manifest: dict, durability: str = None):
+    contents = json.dumps(manifest).encode('utf-8')
+    url = "write_manifest/"+urllib.parse.quote(path)
+    if durability != None:
+        url = url+"?durability="+urllib.parse.quote(durability, safe='')
+    response = make_put_request(url, lambda: contents)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_put_request(url, lambda: contents)
+    # Handle response once resource is allocated as needed
+    if response.status_code != 200:
+        handle_failed_request(response, "Failed to write the stripe manifest of file '"+path+"'")
+
+
+##############################################################################
+# Append data (a string, or bytes) to a file (creates a file if DNE). Only the
+# appended bytes are sent (and replicated), never the whole file.
+# <durability> is one of "none", "fsync-data", "fsync-data+dir" (None = server default)
+# @return int: the file's new length in bytes (e.g. to tail it with <read_bytes(path, offset)>)
+def append(path: str, data, durability: str = None) -> int:
+    contents = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+    url = "append/"+urllib.parse.quote(path)
+    if durability != None:
+        url = url+"?durability="+urllib.parse.quote(durability, safe='')
+    response = make_put_request(url, lambda: contents)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_put_request(url, lambda: contents)
+    # Handle response once resource is allocated as needed
+    if response.status_code == 200:
+        return response.json().get('length')
+    else:
+        handle_failed_request(response, "Failed to append to file '"+path+"'")
+
+
+##############################################################################
+# Overwrite the bytes at <offset> of a file with <data> (a string, or bytes)
+# in place, creating the file if DNE. Only the written bytes are sent (and
+# replicated), never the whole file.
+# @return int: the file's new length in bytes
+def write_at(path: str, offset: int, data, durability: str = None) -> int:
+    contents = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+    url = "write_at/"+urllib.parse.quote(path)+"?offset="+str(offset)
+    if durability != None:
+        url = url+"&durability="+urllib.parse.quote(durability, safe='')
+    response = make_put_request(url, lambda: contents)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'&token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_put_request(url, lambda: contents)
+    # Handle response once resource is allocated as needed
+    if response.status_code == 200:
+        return response.json().get('length')
+    else:
+        handle_failed_request(response, "Failed to write to file '"+path+"' at offset "+str(offset))
+
+
+##############################################################################
+# Truncate (or zero-extend) a file to <length> bytes
+def truncate(path: str, length: int, durability: str = None):
+    url = "truncate/"+urllib.parse.quote(path)+"/"+str(length)
+    if durability != None:
+        url = url+"?durability="+urllib.parse.quote(durability, safe='')
     response = make_request(url)
     # Handle waiting for the router to have allocated a new resource
     if response.status_code == 425:
         token = response.json().get('token')
-        url = url+'?token='+str(token)
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
         while response.status_code == 425:
             time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
             response = make_request(url)
     # Handle response once resource is allocated as needed
     if response.status_code != 200:
-        handle_failed_request(response, "Failed to write to file '"+path+"'")
+        handle_failed_request(response, "Failed to truncate file '"+path+"'")
 
 
 ##############################################################################
@@ -89,10 +418,17 @@ def delete(path: str):
         handle_failed_request(response, "Failed to delete file '"+path+"'")
 
 
+##############################################################################
+# <path> as a single URL segment of a two-path route (copy/rename): quoted
+# twice, since the "/"s it may hold are unquoted once before routing
+def path_segment(path: str) -> str:
+    return urllib.parse.quote(urllib.parse.quote(path, safe=''), safe='')
+
+
 ##############################################################################
 # Copy a file
 def copy(src_path: str, dest_path: str):
-    url = "copy/"+urllib.parse.quote(src_path)+"/"+urllib.parse.quote(dest_path)
+    url = "copy/"+path_segment(src_path)+"/"+path_segment(dest_path)
     response = make_request(url)
     # Handle waiting for the router to have allocated a new resource
     if response.status_code == 425:
@@ -107,9 +443,9 @@ def copy(src_path: str, dest_path: str):
 
 
 ##############################################################################
-# Rename a file (also moves files)
+# Rename a file or directory (also moves them)
 def rename(old_path: str, new_path: str):
-    url = "rename/"+urllib.parse.quote(old_path)+"/"+urllib.parse.quote(new_path)
+    url = "rename/"+path_segment(old_path)+"/"+path_segment(new_path)
     response = make_request(url)
     # Handle waiting for the router to have allocated a new resource
     if response.status_code == 425:
@@ -140,3 +476,134 @@ def exists(path: str) -> bool:
         return response.json().get("exists")
     else:
         handle_failed_request(response, "Error checking if file '"+path+"' exists")
+
+
+##############################################################################
+# Get a file's metadata: {'size': int, 'mtime': float, 'version': int, 'checksum': str,
+#                         'encoding': str, 'stored_size': int}
+# (plus 'stripes': int for striped files, whose other fields are their manifest's)
+# A directory's metadata is {'type': 'directory', 'entries': int}
+def stat(path: str) -> dict:
+    url = "stat/"+urllib.parse.quote(path)
+    response = make_request(url)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'?token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_request(url)
+    # Handle response once resource is allocated as needed
+    if response.status_code == 200:
+        return response.json().get("stat")
+    else:
+        handle_failed_request(response, "Failed to stat file '"+path+"'")
+
+
+##############################################################################
+# Make a directory (and any missing parents)
+# @return bool: whether it was created (False if it already existed)
+def mkdir(path: str, durability: str = None) -> bool:
+    url = "mkdir/"+urllib.parse.quote(path)
+    if durability != None:
+        url = url+"?durability="+urllib.parse.quote(durability, safe='')
+    response = make_request(url)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+('&' if '?' in url else '?')+'token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_request(url)
+    # Handle response once resource is allocated as needed
+    if response.status_code == 200:
+        return response.json().get("created")
+    else:
+        handle_failed_request(response, "Failed to make directory '"+path+"'")
+
+
+##############################################################################
+# Remove an empty directory
+def rmdir(path: str):
+    url = "rmdir/"+urllib.parse.quote(path)
+    response = make_request(url)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'?token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_request(url)
+    # Handle response once resource is allocated as needed
+    if response.status_code != 200:
+        handle_failed_request(response, "Failed to remove directory '"+path+"'")
+
+
+##############################################################################
+# List one page of a directory's entries named <prefix>..., in name order,
+# starting after the name <start_after> (pass the previous page's 'next')
+# @return dict: {'entries': [{'name': str, 'type': 'file'|'directory',
+#               'size': int, 'mtime': float}, ...], 'next': str or None}
+def list_page(path: str = '', prefix: str = '', start_after: str = '', limit: int = None) -> dict:
+    params = {'prefix': prefix, 'start_after': start_after}
+    if limit != None:
+        params['limit'] = limit
+    url = "list/"+urllib.parse.quote(path)+"?"+urllib.parse.urlencode(params)
+    response = make_request(url)
+    # Handle waiting for the router to have allocated a new resource
+    if response.status_code == 425:
+        token = response.json().get('token')
+        url = url+'&token='+str(token)
+        while response.status_code == 425:
+            time.sleep(MIDDLEWARE_UVM_SPAWNING_TIMEOUT_SECONDS)
+            response = make_request(url)
+    # Handle response once resource is allocated as needed
+    if response.status_code == 200:
+        return response.json()
+    else:
+        handle_failed_request(response, "Failed to list directory '"+path+"'")
+
+
+# Yield every entry of a directory named <prefix>... (see <list_page>),
+# fetching a page at a time
+def list_directory(path: str = '', prefix: str = ''):
+    start_after = ''
+    while True:
+        page = list_page(path, prefix, start_after)
+        for entry in page['entries']:
+            yield entry
+        if page['next'] == None:
+            return
+        start_after = page['next']
+
+
+##############################################################################
+# List one page of every file whose path starts with <prefix> (in any
+# directory below), across all families, in path order. Pass the previous
+# page's 'continuation' to get the next page.
+# @return dict: {'files': [{'path': str, 'size': int, 'mtime': float}, ...],
+#               'continuation': str or None}
+def list_all_page(prefix: str = '', continuation: str = None, limit: int = None) -> dict:
+    params = {'prefix': prefix}
+    if continuation != None:
+        params['continuation'] = continuation
+    if limit != None:
+        params['limit'] = limit
+    response = make_request("list_all?"+urllib.parse.urlencode(params))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        handle_failed_request(response, "Failed to list files with prefix '"+prefix+"'")
+
+
+# Yield every file whose path starts with <prefix> (see <list_all_page>),
+# fetching a page at a time
+def list_all(prefix: str = ''):
+    continuation = None
+    while True:
+        page = list_all_page(prefix, continuation)
+        for entry in page['files']:
+            yield entry
+        if page['continuation'] == None:
+            return
+        continuation = page['continuation']
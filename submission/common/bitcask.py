@@ -0,0 +1,393 @@
+# File: bitcask.py
+# Purpose:
+#   Log-structured (Bitcask-style) key/value store, used by <fs.py> as an
+#   alternative to one-file-per-path storage for families holding many small
+#   files: every write is a sequential append to the active data segment, and
+#   reads are a single <pread> located via an in-memory keydir.
+
+# ON-DISK LAYOUT (all under one directory):
+#   * "<id>.data": data segments. Only the highest id (the active segment) is
+#     appended to; once it passes <BITCASK_MAX_SEGMENT_BYTES> a new one starts.
+#     Each record is: header | key | value, where the header holds a CRC32 of
+#     everything after it, the write's timestamp, and the key/value sizes
+#     (value size <BITCASK_TOMBSTONE> marks a deletion).
+#   * "<id>.hint": written by <merge> next to each merged segment, listing
+#     every live key's (timestamp, value position, value size), so startup can
+#     rebuild the keydir without reading any values.
+
+# MERGE:
+#   Copies the live records of every immutable segment into one new segment
+#   (with a hint file), then deletes the old segments. Tombstones are dropped,
+#   since every older record they could shadow is in the merged segments too.
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+##############################################################################
+# Constant Value(s)
+# Size past which the active segment is closed, and a new one started
+BITCASK_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Fraction of dead (overwritten/deleted) bytes past which <needs_merge> is true
+BITCASK_MERGE_DEAD_FRACTION = 0.5
+
+# Value size marking a record as a tombstone
+BITCASK_TOMBSTONE = 0xFFFFFFFF
+
+# Data record header: crc32, timestamp, key size, value size
+RECORD_HEADER = struct.Struct('>IdII')
+
+# Hint record header: timestamp, key size, value size, value position
+HINT_HEADER = struct.Struct('>dIIQ')
+
+DATA_SUFFIX = '.data'
+HINT_SUFFIX = '.hint'
+MERGE_SUFFIX = '.merge'
+
+
+##############################################################################
+# Keydir Entry: where a key's latest value lives
+class KeydirEntry:
+    def __init__(self, segment_id: int, value_position: int, value_size: int, timestamp: float):
+        self.segment_id = segment_id
+        self.value_position = value_position
+        self.value_size = value_size
+        self.timestamp = timestamp
+
+
+    # Size of the whole data record holding this entry's value
+    def record_size(self, key_size: int) -> int:
+        return RECORD_HEADER.size+key_size+self.value_size
+
+
+##############################################################################
+# Bitcask Store
+class Bitcask:
+    def __init__(self, directory: str, max_segment_bytes: int = BITCASK_MAX_SEGMENT_BYTES):
+        self.directory = os.path.join(directory, '')
+        self.max_segment_bytes = max_segment_bytes
+        self.lock = threading.Lock()
+        self.merge_lock = threading.Lock()
+        self.keydir = {} # {key: KeydirEntry, ...}
+        self.read_fds = {} # {segment_id: fd, ...}
+        self.retired_fds = [] # fds of merged-away segments (closed on the next merge)
+        self.segment_bytes = {} # {segment_id: total bytes, ...}
+        self.dead_bytes = 0
+        self.total_bytes = 0
+        self.merges = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+
+    ##########################################################################
+    # Startup
+    def segment_filename(self, segment_id: int, suffix: str) -> str:
+        return self.directory+str(segment_id).zfill(10)+suffix
+
+
+    def segment_ids(self) -> list:
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.endswith(MERGE_SUFFIX):
+                os.remove(self.directory+name) # interrupted merge: the old segments are untouched
+            elif name.endswith(DATA_SUFFIX) and name[:-len(DATA_SUFFIX)].isdigit():
+                ids.append(int(name[:-len(DATA_SUFFIX)]))
+        return sorted(ids)
+
+
+    # Rebuild the keydir from oldest to newest segment, via hint files where
+    # available. A torn record at the end of the active segment is cut off.
+    def load(self):
+        ids = self.segment_ids()
+        for segment_id in ids:
+            if os.path.exists(self.segment_filename(segment_id, HINT_SUFFIX)):
+                self.load_hint_file(segment_id)
+            else:
+                valid_bytes = self.load_data_file(segment_id)
+                if valid_bytes < os.path.getsize(self.segment_filename(segment_id, DATA_SUFFIX)):
+                    os.truncate(self.segment_filename(segment_id, DATA_SUFFIX), valid_bytes)
+            self.segment_bytes[segment_id] = os.path.getsize(self.segment_filename(segment_id, DATA_SUFFIX))
+            self.read_fds[segment_id] = os.open(self.segment_filename(segment_id, DATA_SUFFIX), os.O_RDONLY)
+        self.total_bytes = sum(self.segment_bytes.values())
+        live_bytes = sum(entry.record_size(len(key.encode('utf-8'))) for key, entry in self.keydir.items())
+        self.dead_bytes = self.total_bytes-live_bytes
+        if len(ids) == 0:
+            self.open_active_segment(0)
+        elif os.path.exists(self.segment_filename(ids[-1], HINT_SUFFIX)):
+            self.open_active_segment(ids[-1]+1) # merged segments are never appended to
+        else:
+            self.open_active_segment(ids[-1])
+
+
+    def load_hint_file(self, segment_id: int):
+        with open(self.segment_filename(segment_id, HINT_SUFFIX), 'rb') as file:
+            hints = file.read()
+        position = 0
+        while position+HINT_HEADER.size <= len(hints):
+            timestamp, key_size, value_size, value_position = HINT_HEADER.unpack_from(hints, position)
+            position += HINT_HEADER.size
+            key = hints[position:position+key_size].decode('utf-8')
+            position += key_size
+            self.keydir[key] = KeydirEntry(segment_id, value_position, value_size, timestamp)
+
+
+    # @return int: number of bytes holding complete, uncorrupted records
+    def load_data_file(self, segment_id: int) -> int:
+        with open(self.segment_filename(segment_id, DATA_SUFFIX), 'rb') as file:
+            data = file.read()
+        position = 0
+        while position+RECORD_HEADER.size <= len(data):
+            crc, timestamp, key_size, value_size = RECORD_HEADER.unpack_from(data, position)
+            stored_value_size = 0 if value_size == BITCASK_TOMBSTONE else value_size
+            end = position+RECORD_HEADER.size+key_size+stored_value_size
+            if end > len(data) or zlib.crc32(data[position+4:end]) != crc:
+                break
+            key = data[position+RECORD_HEADER.size:position+RECORD_HEADER.size+key_size].decode('utf-8')
+            if value_size == BITCASK_TOMBSTONE:
+                self.keydir.pop(key, None)
+            else:
+                self.keydir[key] = KeydirEntry(segment_id, end-value_size, value_size, timestamp)
+            position = end
+        return position
+
+
+    def open_active_segment(self, segment_id: int):
+        created = not os.path.exists(self.segment_filename(segment_id, DATA_SUFFIX))
+        self.active_id = segment_id
+        self.active_fd = os.open(self.segment_filename(segment_id, DATA_SUFFIX), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        self.active_size = os.fstat(self.active_fd).st_size
+        self.segment_bytes.setdefault(segment_id, self.active_size)
+        if segment_id not in self.read_fds:
+            self.read_fds[segment_id] = os.open(self.segment_filename(segment_id, DATA_SUFFIX), os.O_RDONLY)
+        if created:
+            self.sync_directory()
+
+
+    def sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    def close(self):
+        with self.lock:
+            os.close(self.active_fd)
+            for fd in list(self.read_fds.values())+self.retired_fds:
+                os.close(fd)
+            self.read_fds = {}
+            self.retired_fds = []
+
+
+    ##########################################################################
+    # Writes (callers hold <self.lock>)
+    def _append_record(self, key: str, value, timestamp: float) -> int:
+        encoded_key = key.encode('utf-8')
+        value_size = BITCASK_TOMBSTONE if value == None else len(value)
+        body = struct.pack('>dII', timestamp, len(encoded_key), value_size)+encoded_key+(b'' if value == None else value)
+        record = struct.pack('>I', zlib.crc32(body))+body
+        if self.active_size > 0 and self.active_size+len(record) > self.max_segment_bytes:
+            os.close(self.active_fd)
+            self.open_active_segment(self.active_id+1)
+        os.write(self.active_fd, record)
+        record_position = self.active_size
+        self.active_size += len(record)
+        self.segment_bytes[self.active_id] += len(record)
+        self.total_bytes += len(record)
+        return record_position+len(record)-(0 if value == None else len(value))
+
+
+    def _retire(self, key: str):
+        entry = self.keydir.pop(key, None)
+        if entry != None:
+            self.dead_bytes += entry.record_size(len(key.encode('utf-8')))
+
+
+    def _put(self, key: str, value: bytes, timestamp: float):
+        self._retire(key)
+        value_position = self._append_record(key, value, timestamp)
+        self.keydir[key] = KeydirEntry(self.active_id, value_position, len(value), timestamp)
+
+
+    def _delete(self, key: str, timestamp: float):
+        self._retire(key)
+        self.dead_bytes += RECORD_HEADER.size+len(key.encode('utf-8')) # tombstones are dead on arrival
+        self._append_record(key, None, timestamp)
+
+
+    def _sync(self, sync: bool):
+        if sync:
+            if hasattr(os, 'fdatasync'):
+                os.fdatasync(self.active_fd)
+            else:
+                os.fsync(self.active_fd)
+
+
+    # @return float: the write's timestamp
+    def put(self, key: str, value: bytes, sync: bool = False) -> float:
+        with self.lock:
+            timestamp = time.time()
+            self._put(key, value, timestamp)
+            self._sync(sync)
+            return timestamp
+
+
+    # Store an iterable of bytes as <key>'s value (buffered: values are small)
+    # @return tuple: (size: int, timestamp: float)
+    def put_stream(self, key: str, pieces, sync: bool = False):
+        value = b''.join(pieces)
+        return len(value), self.put(key, value, sync)
+
+
+    # @return float: the copy's timestamp
+    def copy(self, src_key: str, dest_key: str, sync: bool = False) -> float:
+        with self.lock:
+            value = self._get(src_key)
+            timestamp = time.time()
+            self._put(dest_key, value, timestamp)
+            self._sync(sync)
+            return timestamp
+
+
+    def delete(self, key: str, sync: bool = False):
+        with self.lock:
+            if key not in self.keydir:
+                raise KeyError(key)
+            self._delete(key, time.time())
+            self._sync(sync)
+
+
+    # Move <old_key>'s value to <new_key> (both records are appended together)
+    # @return float: the write's timestamp
+    def rename(self, old_key: str, new_key: str, sync: bool = False) -> float:
+        with self.lock:
+            value = self._get(old_key)
+            timestamp = time.time()
+            self._put(new_key, value, timestamp)
+            if old_key != new_key:
+                self._delete(old_key, timestamp)
+            self._sync(sync)
+            return timestamp
+
+
+    ##########################################################################
+    # Reads
+    def _get(self, key: str) -> bytes:
+        entry = self.keydir[key]
+        return os.pread(self.read_fds[entry.segment_id], entry.value_size, entry.value_position)
+
+
+    def get(self, key: str) -> bytes:
+        return self.read(key, 0, -1)
+
+
+    # Read up to <n_bytes> of <key>'s value from <position> (to the end if N=-1)
+    def read(self, key: str, position: int, n_bytes: int) -> bytes:
+        with self.lock:
+            entry = self.keydir[key]
+            fd = self.read_fds[entry.segment_id]
+        if position >= entry.value_size:
+            return b''
+        length = entry.value_size-position if n_bytes < 0 else min(n_bytes, entry.value_size-position)
+        return os.pread(fd, length, entry.value_position+position)
+
+
+    # Same contract as <chunkstore.ChunkStore.stream> (bitcask values are
+    # small, so the range is read in one go)
+    # @return tuple: (total_bytes_to_stream: int, chunk_generator)
+    def stream(self, key: str, position: int = 0, n_bytes: int = -1):
+        value = self.read(key, position, n_bytes)
+        return len(value), iter([value] if len(value) > 0 else [])
+
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            return key in self.keydir
+
+
+    # @return dict: {key: (value_size, timestamp), ...}
+    def items(self) -> dict:
+        with self.lock:
+            return {key: (entry.value_size, entry.timestamp) for key, entry in self.keydir.items()}
+
+
+    ##########################################################################
+    # Merge/Compaction
+    def needs_merge(self) -> bool:
+        with self.lock:
+            return self.active_id > min(self.segment_bytes) and self.total_bytes > 0 and self.dead_bytes/self.total_bytes >= BITCASK_MERGE_DEAD_FRACTION
+
+
+    # Rewrite every immutable segment's live records into one merged segment
+    # (taking the newest merged segment's id, so replay order is preserved)
+    def merge(self):
+        with self.merge_lock:
+            with self.lock:
+                for fd in self.retired_fds:
+                    os.close(fd)
+                self.retired_fds = []
+                os.close(self.active_fd)
+                self.open_active_segment(self.active_id+1) # everything before is now immutable
+                merged_ids = sorted(segment_id for segment_id in self.segment_bytes if segment_id < self.active_id)
+                live = {key: entry for key, entry in self.keydir.items() if entry.segment_id in merged_ids}
+            if len(merged_ids) == 0:
+                return
+            merged_id = merged_ids[-1]
+            merged_entries = self.write_merged_segment(merged_id, live)
+            with self.lock:
+                for key, (old_entry, new_entry) in merged_entries.items():
+                    if self.keydir.get(key) is old_entry: # skip keys rewritten/deleted since
+                        self.keydir[key] = new_entry
+                os.replace(self.segment_filename(merged_id, DATA_SUFFIX+MERGE_SUFFIX), self.segment_filename(merged_id, DATA_SUFFIX))
+                os.replace(self.segment_filename(merged_id, HINT_SUFFIX+MERGE_SUFFIX), self.segment_filename(merged_id, HINT_SUFFIX))
+                for segment_id in merged_ids:
+                    self.retired_fds.append(self.read_fds.pop(segment_id))
+                    self.total_bytes -= self.segment_bytes.pop(segment_id)
+                    if segment_id != merged_id:
+                        os.remove(self.segment_filename(segment_id, DATA_SUFFIX))
+                        if os.path.exists(self.segment_filename(segment_id, HINT_SUFFIX)):
+                            os.remove(self.segment_filename(segment_id, HINT_SUFFIX))
+                self.read_fds[merged_id] = os.open(self.segment_filename(merged_id, DATA_SUFFIX), os.O_RDONLY)
+                self.segment_bytes[merged_id] = os.path.getsize(self.segment_filename(merged_id, DATA_SUFFIX))
+                self.total_bytes += self.segment_bytes[merged_id]
+                live_bytes = sum(entry.record_size(len(key.encode('utf-8'))) for key, entry in self.keydir.items())
+                self.dead_bytes = self.total_bytes-live_bytes
+                self.sync_directory()
+                self.merges += 1
+
+
+    # @return dict: {key: (old KeydirEntry, merged KeydirEntry), ...}
+    def write_merged_segment(self, merged_id: int, live: dict) -> dict:
+        merged_entries = {}
+        position = 0
+        with open(self.segment_filename(merged_id, DATA_SUFFIX+MERGE_SUFFIX), 'wb') as data_file, \
+             open(self.segment_filename(merged_id, HINT_SUFFIX+MERGE_SUFFIX), 'wb') as hint_file:
+            for key, entry in live.items():
+                value = os.pread(self.read_fds[entry.segment_id], entry.value_size, entry.value_position)
+                encoded_key = key.encode('utf-8')
+                body = struct.pack('>dII', entry.timestamp, len(encoded_key), len(value))+encoded_key+value
+                data_file.write(struct.pack('>I', zlib.crc32(body))+body)
+                value_position = position+RECORD_HEADER.size+len(encoded_key)
+                hint_file.write(HINT_HEADER.pack(entry.timestamp, len(encoded_key), len(value), value_position)+encoded_key)
+                merged_entries[key] = (entry, KeydirEntry(merged_id, value_position, len(value), entry.timestamp))
+                position += RECORD_HEADER.size+len(encoded_key)+len(value)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+            hint_file.flush()
+            os.fsync(hint_file.fileno())
+        return merged_entries
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'keys': len(self.keydir),
+                'segments': len(self.segment_bytes),
+                'total_bytes': self.total_bytes,
+                'dead_bytes': self.dead_bytes,
+                'merges': self.merges,
+            }
@@ -0,0 +1,108 @@
+# File: cache.py
+# Purpose:
+#   Byte-bounded LRU cache of file contents (as bytes) for the UVM/RVM read path.
+#   Kept coherent by <fs.py>, which updates/invalidates it on every mutation.
+
+import threading
+from collections import OrderedDict
+
+##############################################################################
+# Constant Value(s)
+# Total bytes of file contents we're willing to hold in memory
+PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Files larger than this are never cached (so one big read can't flush the cache)
+PAGE_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+
+
+##############################################################################
+# LRU Page Cache
+class PageCache:
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES, max_entry_bytes: int = PAGE_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # {path: (contents, size)}, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def _remove(self, path: str):
+        entry = self.entries.pop(path, None)
+        if entry != None:
+            self.total_bytes -= entry[1]
+
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+
+    # @return the cached contents of <path>, or None on a miss
+    def get(self, path: str):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry == None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[0]
+
+
+    # Cache <contents> (<size> bytes on disk) for <path>. If given,
+    # <is_current()> is checked under the cache lock so a slow reader can't
+    # overwrite the contents stored by a newer mutation.
+    def put(self, path: str, contents, size: int, is_current = None):
+        with self.lock:
+            if is_current != None and not is_current():
+                return
+            self._remove(path)
+            if size > self.max_entry_bytes:
+                return
+            self.entries[path] = (contents, size)
+            self.total_bytes += size
+            self._evict()
+
+
+    # Whether <path> is cached (without counting as a hit or miss)
+    def contains(self, path: str) -> bool:
+        with self.lock:
+            return path in self.entries
+
+
+    def invalidate(self, path: str):
+        with self.lock:
+            self._remove(path)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+    def rename(self, old_path: str, new_path: str):
+        with self.lock:
+            entry = self.entries.pop(old_path, None)
+            self._remove(new_path)
+            if entry != None:
+                self.entries[new_path] = entry
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits+self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits/lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,432 @@
+# File: chunkstore.py
+# Purpose:
+#   Content-addressed, deduplicating key/value store, used by <fs.py> as a
+#   storage backend: every path is a manifest listing its chunks by content
+#   hash, and each distinct chunk is stored once, however many paths hold it.
+#   Copies only write a manifest, and writes skip chunks that already exist.
+
+# ON-DISK LAYOUT (all under one directory):
+#   * "chunks/<hh>/<hash>": a chunk's bytes, named by their SHA-256 (<hh> is
+#     the hash's first 2 hex digits, to keep directories small).
+#   * "manifests/<quoted key>": JSON {"size", "mtime", "chunks": [[hash, size], ...]}.
+#   Reference counts aren't persisted: they're recounted from the manifests on
+#   load, which also deletes any chunk a crash left unreferenced.
+
+# CHUNKING:
+#   * "fixed": <CHUNK_BYTES>-sized chunks. Fast, but inserting a byte shifts
+#              (so changes) every later chunk.
+#   * "cdc":   content-defined chunking: a gear rolling hash cuts a chunk
+#              wherever its top <CDC_MASK_BITS> bits are 0 (FastCDC-style,
+#              bounded by <CDC_MIN_CHUNK_BYTES>/<CDC_MAX_CHUNK_BYTES>), so
+#              boundaries move with the content and edits only change nearby
+#              chunks. Slower, as every byte goes through the rolling hash.
+
+# PINNING:
+#   A chunk's reference count includes every manifest holding it, plus every
+#   in-flight write/read using it, so a chunk can't be deleted out from under
+#   a reader or a writer that found it already stored.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+##############################################################################
+# Constant Value(s)
+CHUNKING_FIXED = 'fixed'
+CHUNKING_CDC = 'cdc'
+CHUNKINGS = [CHUNKING_FIXED, CHUNKING_CDC]
+
+# Chunking used by new stores (existing chunks stay valid if this changes)
+CHUNKSTORE_CHUNKING = CHUNKING_FIXED
+
+# Size of every chunk (but the last) under "fixed" chunking
+CHUNK_BYTES = 64 * 1024
+
+# Bounds on chunk sizes under "cdc" chunking (avg ~= min+2^<CDC_MASK_BITS>)
+CDC_MIN_CHUNK_BYTES = 16 * 1024
+CDC_MAX_CHUNK_BYTES = 256 * 1024
+CDC_MASK_BITS = 15
+
+CHUNKS_DIRECTORY_NAME = 'chunks'
+MANIFESTS_DIRECTORY_NAME = 'manifests'
+TEMP_SUFFIX = '.tmp'
+
+# Gear table: a fixed pseudo-random 64-bit value per byte value
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+GEAR_HASH_MASK = (1 << 64)-1
+CDC_CUT_MASK = ((1 << CDC_MASK_BITS)-1) << (64-CDC_MASK_BITS)
+
+
+##############################################################################
+# Chunking
+def chunk_hash(chunk: bytes) -> str:
+    return hashlib.sha256(chunk).hexdigest()
+
+
+# Where to end the chunk starting <data>: the first gear-hash cut point past
+# the min size, else the max size (or the end of <data>, if shorter)
+def cdc_cut_point(data) -> int:
+    end = min(len(data), CDC_MAX_CHUNK_BYTES)
+    if end <= CDC_MIN_CHUNK_BYTES:
+        return end
+    gear_hash = 0
+    for i in range(CDC_MIN_CHUNK_BYTES-64, end): # a gear hash only depends on its last 64 bytes
+        gear_hash = ((gear_hash << 1)+GEAR[data[i]]) & GEAR_HASH_MASK
+        if i >= CDC_MIN_CHUNK_BYTES and gear_hash & CDC_CUT_MASK == 0:
+            return i+1
+    return end
+
+
+# Re-cut a stream of arbitrarily sized <pieces> into chunks
+def split_chunks(pieces, chunking: str):
+    cut_point = cdc_cut_point if chunking == CHUNKING_CDC else (lambda data: min(len(data), CHUNK_BYTES))
+    max_chunk_bytes = CDC_MAX_CHUNK_BYTES if chunking == CHUNKING_CDC else CHUNK_BYTES
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= max_chunk_bytes: # a full max-size window: the cut can't move
+            cut = cut_point(buffer)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+    while len(buffer) > 0:
+        cut = cut_point(buffer)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+##############################################################################
+# Manifest: a key's chunk list
+class Manifest:
+    def __init__(self, size: int, mtime: float, chunks: list):
+        self.size = size
+        self.mtime = mtime
+        self.chunks = chunks # [(hash, size), ...]
+
+
+    def to_json(self) -> dict:
+        return {'size': self.size, 'mtime': self.mtime, 'chunks': [list(chunk) for chunk in self.chunks]}
+
+
+    @staticmethod
+    def from_json(data: dict):
+        return Manifest(data['size'], data['mtime'], [tuple(chunk) for chunk in data['chunks']])
+
+
+##############################################################################
+# Chunk Store
+class ChunkStore:
+    def __init__(self, directory: str, chunking: str = None):
+        chunking = CHUNKSTORE_CHUNKING if chunking == None else chunking
+        if chunking not in CHUNKINGS:
+            raise ValueError('unknown chunking "'+str(chunking)+'" (expected one of: '+', '.join(CHUNKINGS)+')')
+        self.directory = os.path.join(directory, '')
+        self.chunks_directory = self.directory+CHUNKS_DIRECTORY_NAME+'/'
+        self.manifests_directory = self.directory+MANIFESTS_DIRECTORY_NAME+'/'
+        self.chunking = chunking
+        self.lock = threading.Lock()
+        self.manifests = {} # {key: Manifest, ...}
+        self.refs = {} # {chunk hash: reference count, ...}
+        self.chunk_sizes = {} # {chunk hash: size, ...}
+        self.chunks_written = 0
+        self.chunks_deduplicated = 0
+        self.bytes_deduplicated = 0
+        os.makedirs(self.chunks_directory, exist_ok=True)
+        os.makedirs(self.manifests_directory, exist_ok=True)
+        self.load()
+
+
+    ##########################################################################
+    # Startup
+    def chunk_filename(self, chash: str) -> str:
+        return self.chunks_directory+chash[:2]+'/'+chash
+
+
+    def manifest_filename(self, key: str) -> str:
+        return self.manifests_directory+urllib.parse.quote(key, safe='')
+
+
+    # Load every manifest and recount references, then delete unreferenced
+    # chunks and temp files (both left behind by a crash mid-write)
+    def load(self):
+        for name in os.listdir(self.manifests_directory):
+            if name.endswith(TEMP_SUFFIX):
+                os.remove(self.manifests_directory+name)
+                continue
+            with open(self.manifests_directory+name, 'r') as file:
+                manifest = Manifest.from_json(json.load(file))
+            self.manifests[urllib.parse.unquote(name)] = manifest
+            for chash, size in manifest.chunks:
+                self.refs[chash] = self.refs.get(chash, 0)+1
+                self.chunk_sizes[chash] = size
+        for prefix in os.listdir(self.chunks_directory):
+            for name in os.listdir(self.chunks_directory+prefix):
+                if name not in self.refs:
+                    os.remove(self.chunks_directory+prefix+'/'+name)
+
+
+    def sync_directory(self, directory: str):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    def close(self):
+        pass
+
+
+    ##########################################################################
+    # Reference Counting (callers hold <self.lock>)
+    # Pin a chunk, storing <chunk> first if nothing holds it yet
+    # @return bool: whether the chunk had to be written
+    def _pin(self, chash: str, chunk: bytes, sync: bool) -> bool:
+        if self.refs.get(chash, 0) > 0:
+            self.refs[chash] += 1
+            self.chunks_deduplicated += 1
+            self.bytes_deduplicated += len(chunk)
+            return False
+        filename = self.chunk_filename(chash)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+            if sync:
+                self.sync_directory(self.chunks_directory)
+        with open(filename+TEMP_SUFFIX, 'wb') as file:
+            file.write(chunk)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(filename+TEMP_SUFFIX, filename)
+        if sync:
+            self.sync_directory(os.path.dirname(filename))
+        self.refs[chash] = 1
+        self.chunk_sizes[chash] = len(chunk)
+        self.chunks_written += 1
+        return True
+
+
+    # Pin a chunk that must already be stored
+    def _pin_existing(self, chash: str):
+        if self.refs.get(chash, 0) == 0:
+            raise KeyError(chash)
+        self.refs[chash] += 1
+        self.chunks_deduplicated += 1
+        self.bytes_deduplicated += self.chunk_sizes[chash]
+
+
+    # Drop a reference to each of <chunks>, deleting any left unreferenced
+    def _release(self, chunks: list):
+        for chash, _ in chunks:
+            self.refs[chash] -= 1
+            if self.refs[chash] == 0:
+                del self.refs[chash]
+                del self.chunk_sizes[chash]
+                os.remove(self.chunk_filename(chash))
+
+
+    # Atomically replace <key>'s manifest, releasing its old chunks (the new
+    # manifest's chunks must already be pinned)
+    def _commit(self, key: str, manifest: Manifest, sync: bool):
+        filename = self.manifest_filename(key)
+        with open(filename+TEMP_SUFFIX, 'w') as file:
+            json.dump(manifest.to_json(), file)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(filename+TEMP_SUFFIX, filename)
+        if sync:
+            self.sync_directory(self.manifests_directory)
+        old_manifest = self.manifests.get(key)
+        self.manifests[key] = manifest
+        if old_manifest != None:
+            self._release(old_manifest.chunks)
+
+
+    ##########################################################################
+    # Writes
+    # Chunk and store <pieces> (an iterable of bytes) as <key>'s value,
+    # writing only the chunks that aren't stored yet
+    # @return tuple: (size: int, mtime: float)
+    def put_stream(self, key: str, pieces, sync: bool = False):
+        pinned = []
+        try:
+            for chunk in split_chunks(pieces, self.chunking):
+                chash = chunk_hash(chunk)
+                with self.lock:
+                    self._pin(chash, chunk, sync)
+                pinned.append((chash, len(chunk)))
+            manifest = Manifest(sum(size for _, size in pinned), time.time(), pinned)
+            with self.lock:
+                self._commit(key, manifest, sync)
+            return manifest.size, manifest.mtime
+        except BaseException:
+            with self.lock:
+                self._release(pinned)
+            raise
+
+
+    # @return float: the write's timestamp
+    def put(self, key: str, value: bytes, sync: bool = False) -> float:
+        return self.put_stream(key, [value], sync)[1]
+
+
+    # Store <key> as the given <chunks> list ([(hash, size), ...]), reading
+    # the bytes of each chunk in <included> (a set of hashes) via
+    # <read_chunk(size)>, in manifest order (first occurrence only). Every other
+    # chunk must already be stored. Used to apply replicated writes that only
+    # carry the chunks the receiver was missing.
+    # @return tuple: (size: int, mtime: float)
+    def put_manifest(self, key: str, chunks: list, included: set, read_chunk, sync: bool = False):
+        pinned = []
+        received = set()
+        try:
+            for chash, size in chunks:
+                if chash in included and chash not in received:
+                    chunk = read_chunk(size)
+                    if len(chunk) != size or chunk_hash(chunk) != chash:
+                        raise ValueError('chunk '+chash+' is corrupt')
+                    received.add(chash)
+                    with self.lock:
+                        self._pin(chash, chunk, sync)
+                else:
+                    with self.lock:
+                        self._pin_existing(chash)
+                pinned.append((chash, size))
+            manifest = Manifest(sum(size for _, size in pinned), time.time(), pinned)
+            with self.lock:
+                self._commit(key, manifest, sync)
+            return manifest.size, manifest.mtime
+        except BaseException:
+            with self.lock:
+                self._release(pinned)
+            raise
+
+
+    # Point <dest_key> at <src_key>'s chunks (no chunk data is copied)
+    # @return float: the copy's timestamp
+    def copy(self, src_key: str, dest_key: str, sync: bool = False) -> float:
+        with self.lock:
+            source = self.manifests[src_key]
+            for chash, _ in source.chunks:
+                self._pin_existing(chash)
+            manifest = Manifest(source.size, time.time(), list(source.chunks))
+            try:
+                self._commit(dest_key, manifest, sync)
+            except BaseException:
+                self._release(manifest.chunks)
+                raise
+            return manifest.mtime
+
+
+    # Move <old_key>'s manifest to <new_key> (a single file rename)
+    # @return float: the value's (unchanged) timestamp
+    def rename(self, old_key: str, new_key: str, sync: bool = False) -> float:
+        with self.lock:
+            manifest = self.manifests[old_key]
+            if old_key == new_key:
+                return manifest.mtime
+            os.replace(self.manifest_filename(old_key), self.manifest_filename(new_key))
+            if sync:
+                self.sync_directory(self.manifests_directory)
+            del self.manifests[old_key]
+            old_manifest = self.manifests.get(new_key)
+            self.manifests[new_key] = manifest
+            if old_manifest != None:
+                self._release(old_manifest.chunks)
+            return manifest.mtime
+
+
+    def delete(self, key: str, sync: bool = False):
+        with self.lock:
+            manifest = self.manifests[key]
+            os.remove(self.manifest_filename(key))
+            if sync:
+                self.sync_directory(self.manifests_directory)
+            del self.manifests[key]
+            self._release(manifest.chunks)
+
+
+    ##########################################################################
+    # Reads
+    # @return list: [(hash, size), ...] of <key>'s chunks
+    def manifest(self, key: str) -> list:
+        with self.lock:
+            return list(self.manifests[key].chunks)
+
+
+    # @return list: the hashes in <chunk_hashes> that aren't stored
+    def missing(self, chunk_hashes: list) -> list:
+        with self.lock:
+            return [chash for chash in chunk_hashes if self.refs.get(chash, 0) == 0]
+
+
+    def read_chunk(self, chash: str) -> bytes:
+        with open(self.chunk_filename(chash), 'rb') as file:
+            return file.read()
+
+
+    # Yield <key>'s value from <position> (up to <n_bytes>, to the end if N=-1),
+    # one chunk (slice) at a time. The chunks are pinned while streaming.
+    # @return tuple: (total_bytes_to_stream: int, chunk_generator)
+    def stream(self, key: str, position: int = 0, n_bytes: int = -1):
+        with self.lock:
+            manifest = self.manifests[key]
+            for chash, _ in manifest.chunks:
+                self.refs[chash] += 1
+        end = manifest.size if n_bytes < 0 else min(manifest.size, position+n_bytes)
+        def generate():
+            try:
+                chunk_start = 0
+                for chash, size in manifest.chunks:
+                    chunk_end = chunk_start+size
+                    if chunk_end > position and chunk_start < end:
+                        chunk = self.read_chunk(chash)
+                        yield chunk[max(position-chunk_start,0):min(end,chunk_end)-chunk_start]
+                    chunk_start = chunk_end
+            finally:
+                with self.lock:
+                    self._release(manifest.chunks)
+        return max(end-position,0), generate()
+
+
+    # Read up to <n_bytes> of <key>'s value from <position> (to the end if N=-1)
+    def read(self, key: str, position: int, n_bytes: int) -> bytes:
+        _, chunks = self.stream(key, position, n_bytes)
+        return b''.join(chunks)
+
+
+    def get(self, key: str) -> bytes:
+        return self.read(key, 0, -1)
+
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            return key in self.manifests
+
+
+    # @return dict: {key: (value_size, timestamp), ...}
+    def items(self) -> dict:
+        with self.lock:
+            return {key: (manifest.size, manifest.mtime) for key, manifest in self.manifests.items()}
+
+
+    # Deduplication report: logical bytes (what the keys hold) vs. stored
+    # bytes (each distinct chunk once)
+    def stats(self) -> dict:
+        with self.lock:
+            logical_bytes = sum(manifest.size for manifest in self.manifests.values())
+            stored_bytes = sum(self.chunk_sizes.values())
+            return {
+                'keys': len(self.manifests),
+                'chunking': self.chunking,
+                'chunks': len(self.refs),
+                'logical_bytes': logical_bytes,
+                'stored_bytes': stored_bytes,
+                'dedup_ratio': logical_bytes/stored_bytes if stored_bytes > 0 else 1.0,
+                'chunks_written': self.chunks_written,
+                'chunks_deduplicated': self.chunks_deduplicated,
+                'bytes_deduplicated': self.bytes_deduplicated,
+            }
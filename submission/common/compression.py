@@ -0,0 +1,184 @@
+# File: compression.py
+# Purpose:
+#   Stdlib compression codecs for <fs.py>'s at-rest compression and for
+#   compressed transfers between nodes, plus the policy choosing which files
+#   get compressed, and "Accept-Encoding" negotiation.
+
+# CODECS (named after their HTTP content-coding tokens):
+#   * "identity": stored/sent as is.
+#   * "deflate":  zlib. Fast, the default.
+#   * "xz":       lzma. Smaller output, but several times slower to compress.
+
+# POLICY:
+#   A file is compressed with <COMPRESSION_CODEC> if its name matches one of
+#   <COMPRESS_PATTERNS>, or if it's at least <COMPRESS_MIN_BYTES> long (when
+#   set). Files under <COMPRESS_FLOOR_BYTES>, or matching <NEVER_COMPRESS_PATTERNS>
+#   (already-compressed formats), never are. Writes may override the policy.
+
+import fnmatch
+import lzma
+import zlib
+
+##############################################################################
+# Constant Value(s)
+CODEC_IDENTITY = 'identity'
+CODEC_DEFLATE = 'deflate'
+CODEC_XZ = 'xz'
+
+CODECS = [CODEC_DEFLATE, CODEC_XZ] # every codec that actually compresses
+ENCODINGS = [CODEC_IDENTITY]+CODECS
+
+# Codec the policy compresses with
+COMPRESSION_CODEC = CODEC_DEFLATE
+
+ZLIB_LEVEL = 6
+LZMA_PRESET = 6
+
+# Most bytes <decode_chunks> inflates at once (so a tiny, highly compressed
+# chunk can't balloon in memory)
+DECODE_CHUNK_BYTES = 64 * 1024
+
+# File name patterns that are compressed regardless of size (text compresses well)
+COMPRESS_PATTERNS = ['*.txt', '*.log', '*.csv', '*.tsv', '*.json', '*.xml', '*.html', '*.md', '*.yaml', '*.yml']
+
+# Files at least this long are compressed whatever their name (None = only by pattern)
+COMPRESS_MIN_BYTES = None
+
+# Files shorter than this are never compressed (the codec overhead isn't worth it)
+COMPRESS_FLOOR_BYTES = 512
+
+# Already-compressed formats, never compressed again
+NEVER_COMPRESS_PATTERNS = ['*.gz', '*.tgz', '*.zip', '*.xz', '*.bz2', '*.zst', '*.jpg', '*.jpeg', '*.png', '*.gif', '*.mp3', '*.mp4', '*.pdf']
+
+
+##############################################################################
+# Policy + Negotiation
+def validate_encoding(encoding: str) -> str:
+    if encoding not in ENCODINGS:
+        raise ValueError('unknown compression "'+str(encoding)+'" (expected one of: '+', '.join(ENCODINGS)+')')
+    return encoding
+
+
+# @return str: the encoding <path> should be stored with (<size> = None if
+#              not known up front, as for streamed writes)
+def policy_encoding(path: str, size = None) -> str:
+    name = path.lower()
+    if size != None and size < COMPRESS_FLOOR_BYTES:
+        return CODEC_IDENTITY
+    if any(fnmatch.fnmatchcase(name, pattern) for pattern in NEVER_COMPRESS_PATTERNS):
+        return CODEC_IDENTITY
+    if any(fnmatch.fnmatchcase(name, pattern) for pattern in COMPRESS_PATTERNS):
+        return COMPRESSION_CODEC
+    if COMPRESS_MIN_BYTES != None and size != None and size >= COMPRESS_MIN_BYTES:
+        return COMPRESSION_CODEC
+    return CODEC_IDENTITY
+
+
+# Codecs accepted by an "Accept-Encoding" header, e.g. "deflate, xz;q=0"
+# @return list: accepted codecs from <CODECS>
+def accepted_encodings(accept_encoding) -> list:
+    accepted = []
+    for item in (accept_encoding or '').split(','):
+        token, _, params = item.strip().partition(';')
+        quality = params.strip()
+        try:
+            if quality.startswith('q=') and float(quality[2:] or '0') == 0:
+                continue
+        except ValueError:
+            continue
+        if token.strip().lower() in CODECS:
+            accepted.append(token.strip().lower())
+    return accepted
+
+
+##############################################################################
+# Codecs
+def compressor(encoding: str):
+    if encoding == CODEC_DEFLATE:
+        return zlib.compressobj(ZLIB_LEVEL)
+    if encoding == CODEC_XZ:
+        return lzma.LZMACompressor(preset=LZMA_PRESET)
+    raise ValueError('can\'t compress with "'+str(encoding)+'"')
+
+
+def decompressor(encoding: str):
+    if encoding == CODEC_DEFLATE:
+        return zlib.decompressobj()
+    if encoding == CODEC_XZ:
+        return lzma.LZMADecompressor()
+    raise ValueError('can\'t decompress "'+str(encoding)+'"')
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == CODEC_IDENTITY:
+        return data
+    codec = compressor(encoding)
+    return codec.compress(data)+codec.flush()
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == CODEC_IDENTITY:
+        return data
+    return decompressor(encoding).decompress(data)
+
+
+# Compress an iterable of byte chunks on the fly
+def encode_chunks(chunks, encoding: str):
+    if encoding == CODEC_IDENTITY:
+        yield from chunks
+        return
+    codec = compressor(encoding)
+    for chunk in chunks:
+        compressed = codec.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield codec.flush()
+
+
+# Inflate one more <chunk> through <codec>, in pieces of at most <DECODE_CHUNK_BYTES>
+def _inflate(codec, encoding: str, chunk: bytes):
+    while True:
+        decompressed = codec.decompress(chunk, DECODE_CHUNK_BYTES)
+        if len(decompressed) > 0:
+            yield decompressed
+        if encoding == CODEC_DEFLATE:
+            chunk = codec.unconsumed_tail
+            if len(chunk) == 0:
+                return
+        else:
+            chunk = b''
+            if codec.needs_input or codec.eof:
+                return
+
+
+def _check_complete(codec, encoding: str):
+    if not codec.eof:
+        raise ValueError('truncated "'+encoding+'" stream')
+
+
+# Decompress an iterable of byte chunks on the fly
+def decode_chunks(chunks, encoding: str):
+    if encoding == CODEC_IDENTITY:
+        yield from chunks
+        return
+    codec = decompressor(encoding)
+    for chunk in chunks:
+        yield from _inflate(codec, encoding, chunk)
+    _check_complete(codec, encoding)
+
+
+# Pass <chunks> (compressed with <encoding>) through unchanged, handing their
+# decompressed bytes to <consume> along the way (to hash/measure a compressed
+# upload that's stored as is)
+def inspect_chunks(chunks, encoding: str, consume):
+    if encoding == CODEC_IDENTITY:
+        for chunk in chunks:
+            consume(chunk)
+            yield chunk
+        return
+    codec = decompressor(encoding)
+    for chunk in chunks:
+        for decompressed in _inflate(codec, encoding, chunk):
+            consume(decompressed)
+        yield chunk
+    _check_complete(codec, encoding)
@@ -0,0 +1,211 @@
+# File: delta.py
+# Purpose:
+#   rsync-style delta encoding, so that rewriting a large file after a small
+#   edit only ships the bytes that changed: the old version is summarized by
+#   per-block signatures, and the new version is encoded against them as runs
+#   of old blocks to copy, plus the literal bytes between them.
+
+# SIGNATURES:
+#   The old version is cut into <DELTA_BLOCK_BYTES> blocks (the last may be
+#   shorter), each summarized by a weak checksum (Adler-32, which can be
+#   rolled along a byte at a time) and a strong one (a truncated BLAKE2b, only
+#   computed when a weak checksum matches).
+
+# ENCODING:
+#   A block-sized window slides over the new version: wherever it matches an
+#   old block (weak, then strong checksum), that block is copied and the
+#   window jumps past it, else the window rolls forward 1 byte (which becomes
+#   a literal). An inserted or deleted run of bytes thus only costs those
+#   bytes (plus up to a block around them): the blocks after it are found
+#   again at their new offset. A delta is a header (magic, block size, the new
+#   version's size) followed by ops:
+#     * "C" + <uint64 first block> + <uint32 block count>: copy old blocks
+#     * "L" + <uint32 n> + <n bytes>: literal bytes
+# >> NOTE: the rolling runs in Python (like CDC chunking, see
+#          <chunkstore.py>), so encoding is only fast where most blocks
+#          match: it gives up (returns None) once the literals pass
+#          <DELTA_MAX_LITERAL_FRACTION> of the new version (which is then
+#          about as cheap to send whole), or <DELTA_MAX_LITERAL_BYTES>
+
+import hashlib
+import struct
+import zlib
+
+##############################################################################
+# Constant Value(s)
+# Smaller blocks find smaller edits, but take more signatures (and ops)
+DELTA_BLOCK_BYTES = 8 * 1024
+
+# Smaller files are always sent whole (their delta wouldn't save much)
+DELTA_MIN_BYTES = 1024 * 1024
+
+# Most of the new version (as a fraction, and in bytes) that may be literals
+# before we stop encoding: rolling over literals takes ~1.5s per MB, so edits
+# bigger than this are sent whole
+DELTA_MAX_LITERAL_FRACTION = 0.5
+DELTA_MAX_LITERAL_BYTES = 1024 * 1024
+
+# Bytes of BLAKE2b kept as a block's strong checksum
+DELTA_STRONG_BYTES = 16
+
+DELTA_MAGIC = b'DFSDT1'
+DELTA_HEADER_FORMAT = '>6sIQ'
+DELTA_HEADER_BYTES = struct.calcsize(DELTA_HEADER_FORMAT)
+DELTA_COPY_FORMAT = '>QI'
+DELTA_COPY_BYTES = struct.calcsize(DELTA_COPY_FORMAT)
+DELTA_LITERAL_FORMAT = '>I'
+DELTA_LITERAL_BYTES = struct.calcsize(DELTA_LITERAL_FORMAT)
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+
+# Adler-32's modulus (rolling must reduce by it, like <zlib.adler32> does)
+ADLER_MODULUS = 65521
+
+
+##############################################################################
+# Checksums
+def weak_checksum(block) -> int:
+    return zlib.adler32(block)
+
+
+def strong_checksum(block) -> bytes:
+    return hashlib.blake2b(block, digest_size=DELTA_STRONG_BYTES).digest()
+
+
+##############################################################################
+# Signatures of an old version
+class Signatures:
+    def __init__(self, size: int, block_bytes: int = DELTA_BLOCK_BYTES):
+        self.size = size
+        self.block_bytes = block_bytes
+        self.blocks = {} # {weak checksum: [(block index, strong checksum), ...], ...}
+
+
+    def block_length(self, index: int) -> int:
+        return min(self.block_bytes, self.size-index*self.block_bytes)
+
+
+    # @return int: the index of the old block <window> is (None if none)
+    def match(self, checksum: int, window) -> int:
+        candidates = self.blocks.get(checksum)
+        if candidates == None:
+            return None
+        strong = strong_checksum(window)
+        for index, block_strong in candidates:
+            if block_strong == strong and self.block_length(index) == len(window):
+                return index
+        return None
+
+
+def signatures(data: bytes, block_bytes: int = DELTA_BLOCK_BYTES) -> Signatures:
+    view = memoryview(data)
+    result = Signatures(len(data), block_bytes)
+    for index, start in enumerate(range(0, len(data), block_bytes)):
+        block = view[start:start+block_bytes]
+        result.blocks.setdefault(weak_checksum(block), []).append((index, strong_checksum(block)))
+    return result
+
+
+##############################################################################
+# Encoding + Decoding
+# Delta of <data> (the new version) against the old version's <old_signatures>
+# @return bytes: the delta, or None if it'd be mostly literals
+def encode(old_signatures: Signatures, data: bytes):
+    view = memoryview(data)
+    block_bytes = old_signatures.block_bytes
+    blocks = old_signatures.blocks
+    max_literal_bytes = min(int(len(data)*DELTA_MAX_LITERAL_FRACTION), DELTA_MAX_LITERAL_BYTES)
+    ops = [struct.pack(DELTA_HEADER_FORMAT, DELTA_MAGIC, block_bytes, len(data))]
+    literal_bytes = 0
+    literal_start = 0 # start of the literals not yet added to <ops>
+    copy_start, copy_count = None, 0 # run of old blocks not yet added to <ops>
+    def flush_literals(end: int):
+        if end > literal_start:
+            ops.append(OP_LITERAL+struct.pack(DELTA_LITERAL_FORMAT, end-literal_start))
+            ops.append(view[literal_start:end])
+    def flush_copies():
+        if copy_count > 0:
+            ops.append(OP_COPY+struct.pack(DELTA_COPY_FORMAT, copy_start, copy_count))
+    position = 0
+    checksum = None
+    while position < len(data):
+        window_end = min(position+block_bytes, len(data))
+        if checksum == None:
+            checksum = weak_checksum(view[position:window_end])
+            a, b = checksum & 0xffff, checksum >> 16
+        index = old_signatures.match(checksum, view[position:window_end]) if checksum in blocks else None
+        if index != None:
+            if position > literal_start:
+                flush_copies()
+                copy_count = 0
+                flush_literals(position)
+                literal_bytes += position-literal_start
+            if copy_count > 0 and copy_start+copy_count == index:
+                copy_count += 1
+            else:
+                flush_copies()
+                copy_start, copy_count = index, 1
+            position = literal_start = window_end
+            checksum = None
+            continue
+        if window_end == len(data): # a shorter window at the end: the rest are literals
+            break
+        # roll the window 1 byte on: its first byte leaves, and the next enters
+        out_byte = data[position]
+        a = (a-out_byte+data[window_end]) % ADLER_MODULUS
+        b = (b-block_bytes*out_byte+a-1) % ADLER_MODULUS
+        checksum = (b << 16) | a
+        position += 1
+        if literal_bytes+position-literal_start > max_literal_bytes:
+            return None
+        if position-literal_start >= block_bytes: # keep literal runs bounded
+            flush_copies()
+            copy_count = 0
+            flush_literals(position)
+            literal_bytes += position-literal_start
+            literal_start = position
+    if len(data)-literal_start > 0:
+        flush_copies()
+        copy_count = 0
+        literal_bytes += len(data)-literal_start
+        if literal_bytes > max_literal_bytes:
+            return None
+        flush_literals(len(data))
+    flush_copies()
+    return b''.join(ops)
+
+
+# Rebuild the new version from <delta> and the <old> version it was encoded
+# against
+def decode(delta: bytes, old: bytes) -> bytes:
+    view = memoryview(delta)
+    old_view = memoryview(old)
+    if len(delta) < DELTA_HEADER_BYTES:
+        raise ValueError('delta is too short for its header')
+    magic, block_bytes, size = struct.unpack_from(DELTA_HEADER_FORMAT, delta)
+    if magic != DELTA_MAGIC or block_bytes == 0:
+        raise ValueError('not a delta')
+    pieces = []
+    position = DELTA_HEADER_BYTES
+    while position < len(delta):
+        op = delta[position:position+1]
+        position += 1
+        if op == OP_COPY:
+            start, count = struct.unpack_from(DELTA_COPY_FORMAT, delta, position)
+            position += DELTA_COPY_BYTES
+            if (start+count-1)*block_bytes >= len(old):
+                raise ValueError('delta copies blocks past the end of the old version')
+            pieces.append(old_view[start*block_bytes:(start+count)*block_bytes])
+        elif op == OP_LITERAL:
+            (n_bytes,) = struct.unpack_from(DELTA_LITERAL_FORMAT, delta, position)
+            position += DELTA_LITERAL_BYTES
+            if position+n_bytes > len(delta):
+                raise ValueError('delta is truncated')
+            pieces.append(view[position:position+n_bytes])
+            position += n_bytes
+        else:
+            raise ValueError('delta holds an unknown op')
+    data = b''.join(pieces)
+    if len(data) != size:
+        raise ValueError('delta rebuilt '+str(len(data))+' bytes, expected '+str(size))
+    return data
@@ -0,0 +1,122 @@
+# File: diskio.py
+# Purpose:
+#   Bounded thread pool that the UVM/RVM request handlers hand their blocking
+#   disk I/O (<fs.py> reads, writes, copies, ...) to. A slow or stalled disk
+#   then backs work up in this pool's queue, instead of tying up every request
+#   thread (which the heartbeat routes, e.g. "/rvm_leader_ping", need too).
+
+# ADMISSION:
+#   At most <DISK_IO_WORKERS> operations run at once, and at most
+#   <DISK_IO_MAX_QUEUED> more wait for a worker. Past that, <run> either
+#   refuses the operation (raising <DiskBusy>, for requests clients can retry)
+#   or waits for a slot (<block=True>, for replicated commands that must be
+#   applied). A read may also give up after <DISK_IO_READ_TIMEOUT_SECONDS>
+#   (the read still finishes in the background).
+
+import concurrent.futures
+import threading
+import time
+
+##############################################################################
+# Constant Value(s)
+DISK_IO_WORKERS = 8
+
+DISK_IO_MAX_QUEUED = 64
+
+DISK_IO_READ_TIMEOUT_SECONDS = 10
+
+
+##############################################################################
+# Custom Exceptions
+# Raised when the pool's queue is full, or an operation timed out
+class DiskBusy(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__("disk busy> "+self.message)
+
+
+##############################################################################
+# Bounded Disk I/O Executor
+class DiskExecutor:
+    def __init__(self, workers: int = DISK_IO_WORKERS, max_queued: int = DISK_IO_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='disk-io')
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.queued = 0 # submitted, waiting for a worker
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0 # time spent queued
+        self.total_service_seconds = 0.0 # time spent running
+
+
+    def _dequeued(self):
+        self.queued -= 1
+        self.slot_freed.notify()
+
+
+    def _call(self, enqueued: float, fn, args):
+        started = time.perf_counter()
+        with self.lock:
+            self._dequeued()
+            self.running += 1
+            self.total_wait_seconds += started-enqueued
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_service_seconds += time.perf_counter()-started
+
+
+    # Queue <fn(*args)>, waiting for a free slot if <block> (else raising
+    # <DiskBusy> if there is none)
+    # @return concurrent.futures.Future
+    def submit(self, fn, *args, block: bool = False):
+        with self.lock:
+            while self.queued >= self.max_queued:
+                if not block:
+                    self.rejected += 1
+                    raise DiskBusy('submit: '+str(self.queued)+' disk operations are already queued!')
+                self.slot_freed.wait()
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        return self.executor.submit(self._call, time.perf_counter(), fn, args)
+
+
+    # Run <fn(*args)> on the pool and return its result (re-raising its
+    # exception), waiting at most <timeout> seconds for it (None = no limit)
+    def run(self, fn, *args, timeout: float = None, block: bool = False):
+        future = self.submit(fn, *args, block=block)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if future.done(): # <fn> itself timed out
+                raise
+            with self.lock:
+                self.timed_out += 1
+            if future.cancel(): # never started
+                with self.lock:
+                    self._dequeued()
+            raise DiskBusy('run: disk operation took over '+str(timeout)+'s!')
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'running': self.running,
+                'queued': self.queued,
+                'peak_queued': self.peak_queued,
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'mean_wait_ms': round(1000*self.total_wait_seconds/self.completed, 3) if self.completed > 0 else 0.0,
+                'mean_service_ms': round(1000*self.total_service_seconds/self.completed, 3) if self.completed > 0 else 0.0,
+            }
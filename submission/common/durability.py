@@ -0,0 +1,175 @@
+# File: durability.py
+# Purpose:
+#   Durability modes for <fs.py>'s atomic (temp file + rename) writes, and a
+#   group-fsync coordinator that shares fsync work between concurrent writers.
+
+# DURABILITY MODES:
+#   * "none":           temp file renamed into place, nothing fsynced.
+#   * "fsync-data":     temp file's data fsynced before the rename.
+#   * "fsync-data+dir": also fsyncs the directory after the rename, so the
+#                       rename itself survives a crash.
+
+# GROUP FSYNC:
+#   Each writer still fsyncs its own temp file's data (in parallel, there's no
+#   portable way to merge fsyncs of different files), but "fsync-data+dir"
+#   writers then queue their rename instead of fsyncing the directory alone.
+#   The first writer to queue becomes the batch leader: it renames every queued
+#   file in arrival order, then issues ONE fsync per directory the batch wrote
+#   into (usually just one, for the whole batch).
+#   Writers arriving mid-fsync queue up for the leader's next batch, so batches
+#   grow with the disk's fsync latency. Followers wait for the leader's result.
+
+import os
+import threading
+import time
+
+##############################################################################
+# Constant Value(s)
+DURABILITY_NONE = 'none'
+DURABILITY_FSYNC_DATA = 'fsync-data'
+DURABILITY_FSYNC_DATA_AND_DIR = 'fsync-data+dir'
+
+DURABILITY_MODES = [DURABILITY_NONE, DURABILITY_FSYNC_DATA, DURABILITY_FSYNC_DATA_AND_DIR]
+
+# How long a group-fsync leader waits for other writers to join its first batch
+# (0 = don't wait: only writers that arrive during a flush are grouped)
+GROUP_FSYNC_WINDOW_SECONDS = 0
+
+# Max number of writes flushed by a single group-fsync batch
+GROUP_FSYNC_MAX_WRITES = 64
+
+
+##############################################################################
+# Sync Helper(s)
+# Flush <fd>'s data to disk (metadata like mtime isn't needed to read it back)
+def sync_data(fd: int):
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def sync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def validate_mode(mode: str) -> str:
+    if mode not in DURABILITY_MODES:
+        raise ValueError('unknown durability mode "'+str(mode)+'" (expected one of: '+', '.join(DURABILITY_MODES)+')')
+    return mode
+
+
+# Make a flushed temp file durable per <mode>, then rename it over <target>
+def commit(fd: int, temp_path: str, target_path: str, directory: str, mode: str):
+    if mode != DURABILITY_NONE:
+        sync_data(fd)
+    os.replace(temp_path, target_path)
+    if mode == DURABILITY_FSYNC_DATA_AND_DIR:
+        sync_directory(directory)
+
+
+##############################################################################
+# Group Fsync Coordinator
+class PendingCommit:
+    def __init__(self, temp_path: str, target_path: str):
+        self.temp_path = temp_path
+        self.target_path = target_path
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    def __init__(self, directory: str, window_seconds: float = GROUP_FSYNC_WINDOW_SECONDS, max_writes: int = GROUP_FSYNC_MAX_WRITES):
+        self.directory = directory
+        self.window_seconds = window_seconds
+        self.max_writes = max_writes
+        self.lock = threading.Lock()
+        self.pending = []
+        self.leader_active = False
+        self.writes = 0
+        self.batches = 0
+        self.directory_syncs = 0
+
+
+    # Same contract as the module-level <commit>, but shares the directory
+    # fsync with every other writer that joins the same batch
+    def commit(self, fd: int, temp_path: str, target_path: str, mode: str):
+        if mode != DURABILITY_FSYNC_DATA_AND_DIR:
+            commit(fd, temp_path, target_path, self.directory, mode)
+            return
+        sync_data(fd)
+        pending = PendingCommit(temp_path, target_path)
+        with self.lock:
+            self.pending.append(pending)
+            is_leader = not self.leader_active
+            self.leader_active = True
+        if is_leader:
+            self.lead()
+        pending.done.wait()
+        if pending.error != None:
+            raise pending.error
+
+
+    # Take the next batch, or give up leadership if no writers are waiting
+    def take_batch(self) -> list:
+        with self.lock:
+            batch = self.pending[:self.max_writes]
+            self.pending = self.pending[self.max_writes:]
+            if len(batch) == 0:
+                self.leader_active = False
+            return batch
+
+
+    # Flush batches until no writers are left waiting (a batch that fills up
+    # early is flushed right away rather than waiting out the window)
+    def lead(self):
+        deadline = time.time()+self.window_seconds
+        while time.time() < deadline:
+            with self.lock:
+                if len(self.pending) >= self.max_writes:
+                    break
+            time.sleep(self.window_seconds/4)
+        while True:
+            batch = self.take_batch()
+            if len(batch) == 0:
+                return
+            self.flush(batch)
+
+
+    def flush(self, batch: list):
+        renamed = []
+        for pending in batch:
+            try:
+                os.replace(pending.temp_path, pending.target_path)
+                renamed.append(pending)
+            except Exception as err_msg:
+                pending.error = err_msg
+        directories = {}
+        for pending in renamed:
+            directories.setdefault(os.path.dirname(pending.target_path) or self.directory, []).append(pending)
+        for directory, pendings in directories.items():
+            try:
+                sync_directory(directory)
+            except Exception as err_msg:
+                for pending in pendings:
+                    pending.error = err_msg
+        with self.lock:
+            self.writes += len(batch)
+            self.batches += 1
+            self.directory_syncs += len(directories)
+        for pending in batch:
+            pending.done.set()
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'writes': self.writes,
+                'batches': self.batches,
+                'directory_syncs': self.directory_syncs,
+                'average_batch_size': self.writes/self.batches if self.batches > 0 else 0.0,
+            }
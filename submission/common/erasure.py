@@ -0,0 +1,198 @@
+# File: erasure.py
+# Purpose:
+#   Systematic Reed-Solomon erasure coding over GF(2^8), for families that keep
+#   large files on their RVMs as <k> data + <m> parity shards (any <k> of which
+#   rebuild the file) instead of as full copies. Also the shard file format,
+#   and the parsing of a family's redundancy mode.
+
+# GALOIS FIELD MATH:
+#   Bytes are elements of GF(2^8) (reducing polynomial 0x11d), where addition
+#   is XOR. Whole shards are processed at once rather than byte by byte: a
+#   shard is multiplied by a constant via one <bytes.translate> through that
+#   constant's 256-byte product table, and shards are added by XORing them as
+#   big integers. Both run in C, so no NumPy is needed.
+
+# GENERATOR MATRIX:
+#   Identity rows (data shard j is just the j-th slice of the file), stacked on
+#   a Cauchy matrix C[i][j] = 1/(x_i + y_j) with x_i = k+i and y_j = j. Every
+#   k x k submatrix of that is invertible, so any k shards suffice to decode.
+
+# REDUNDANCY MODES (<ips/<n>/redundancy.txt>):
+#   * "replicate":   every RVM keeps a full copy of every file (the default)
+#   * "erasure":     files of at least <ERASURE_MIN_BYTES> are kept as
+#                    <DEFAULT_DATA_SHARDS>+<DEFAULT_PARITY_SHARDS> shards
+#   * "erasure:K+M": same, with K data and M parity shards
+
+import struct
+
+##############################################################################
+# Constant Value(s)
+REDUNDANCY_REPLICATE = 'replicate'
+REDUNDANCY_ERASURE = 'erasure'
+REDUNDANCY_MODES = [REDUNDANCY_REPLICATE, REDUNDANCY_ERASURE]
+
+# 2+1 stores 1.5x a file's size across the RVMs, and survives losing any 1 RVM
+DEFAULT_DATA_SHARDS = 2
+DEFAULT_PARITY_SHARDS = 1
+
+# Smaller files are still fully replicated (shards of tiny files aren't worth
+# the bookkeeping, nor the extra requests to read them back)
+ERASURE_MIN_BYTES = 1024 * 1024
+
+# Shard files start with: magic, shard index, k, m, the file's logical size,
+# and its SHA-256 content hash (so shards can be indexed without decoding)
+SHARD_MAGIC = b'DFSRS1'
+SHARD_HEADER_FORMAT = '>6sBBBQ32s'
+SHARD_HEADER_BYTES = struct.calcsize(SHARD_HEADER_FORMAT)
+
+
+##############################################################################
+# GF(2^8) Arithmetic
+GF_POLYNOMIAL = 0x11d
+
+GF_EXP = [0]*512 # doubled, so <gf_mul> needn't reduce the log sum
+GF_LOG = [0]*256
+_value = 1
+for _power in range(255):
+    GF_EXP[_power] = _value
+    GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= GF_POLYNOMIAL
+for _power in range(255, 512):
+    GF_EXP[_power] = GF_EXP[_power-255]
+
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a]+GF_LOG[b]]
+
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError('0 has no inverse in GF(2^8)')
+    return GF_EXP[255-GF_LOG[a]]
+
+
+# MUL_TABLES[c] maps every byte x to c*x (a <bytes.translate> table)
+MUL_TABLES = [bytes(gf_mul(c, x) for x in range(256)) for c in range(256)]
+
+
+# Sum of <coefficients[i]> * <shards[i]>, every shard being <size> bytes long
+def _combine(coefficients: list, shards: list, size: int) -> bytes:
+    total = 0
+    for coefficient, shard in zip(coefficients, shards):
+        if coefficient == 0:
+            continue
+        product = shard if coefficient == 1 else shard.translate(MUL_TABLES[coefficient])
+        total ^= int.from_bytes(product, 'little')
+    return total.to_bytes(size, 'little')
+
+
+# Invert a square matrix over GF(2^8) (Gauss-Jordan elimination)
+def _invert(matrix: list) -> list:
+    n = len(matrix)
+    rows = [list(row)+[1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+    for column in range(n):
+        pivot = next((i for i in range(column, n) if rows[i][column] != 0), None)
+        if pivot == None:
+            raise ValueError('singular shard matrix')
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        scale = gf_inv(rows[column][column])
+        rows[column] = [gf_mul(scale, value) for value in rows[column]]
+        for i in range(n):
+            factor = rows[i][column]
+            if i != column and factor != 0:
+                rows[i] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[i], rows[column])]
+    return [row[n:] for row in rows]
+
+
+##############################################################################
+# Reed-Solomon Coding
+def validate_shape(k: int, m: int):
+    if k < 1 or m < 0 or k+m > 255:
+        raise ValueError('invalid shard layout '+str(k)+'+'+str(m))
+
+
+# Generator matrix row of shard <index> (data shards first, then parity)
+def generator_row(index: int, k: int) -> list:
+    if index < k:
+        return [1 if j == index else 0 for j in range(k)]
+    return [gf_inv(index ^ j) for j in range(k)] # Cauchy: x = k+(index-k), y_j = j
+
+
+def shard_size(size: int, k: int) -> int:
+    return (size+k-1)//k
+
+
+# The <k> data shards of <data>, zero-padded to the same length
+def data_shards(data: bytes, k: int) -> list:
+    n_bytes = shard_size(len(data), k)
+    return [data[j*n_bytes:(j+1)*n_bytes].ljust(n_bytes, b'\0') for j in range(k)]
+
+
+# @return list: all <k>+<m> shards of <data>
+def encode(data: bytes, k: int, m: int) -> list:
+    validate_shape(k, m)
+    shards = data_shards(data, k)
+    n_bytes = shard_size(len(data), k)
+    return shards+[_combine(generator_row(index, k), shards, n_bytes) for index in range(k, k+m)]
+
+
+# @return bytes: shard <index> of <data> alone
+def encode_shard(data: bytes, index: int, k: int, m: int) -> bytes:
+    validate_shape(k, m)
+    if index < 0 or index >= k+m:
+        raise ValueError('shard index '+str(index)+' out of range for '+str(k)+'+'+str(m))
+    if index < k:
+        n_bytes = shard_size(len(data), k)
+        return data[index*n_bytes:(index+1)*n_bytes].ljust(n_bytes, b'\0')
+    return _combine(generator_row(index, k), data_shards(data, k), shard_size(len(data), k))
+
+
+# Rebuild the <size>-byte file from at least <k> of its shards
+# @param shards: {shard index: shard bytes, ...}
+def decode(shards: dict, k: int, m: int, size: int) -> bytes:
+    validate_shape(k, m)
+    if len(shards) < k:
+        raise ValueError('need '+str(k)+' shards to decode, only have '+str(len(shards)))
+    n_bytes = shard_size(size, k)
+    if all(j in shards for j in range(k)):
+        return b''.join(shards[j] for j in range(k))[:size]
+    chosen = sorted(shards)[:k] # data shards first: their rows are cheapest
+    inverse = _invert([generator_row(index, k) for index in chosen])
+    chosen_shards = [shards[index] for index in chosen]
+    data = [shards[j] if j in shards else _combine(inverse[j], chosen_shards, n_bytes) for j in range(k)]
+    return b''.join(data)[:size]
+
+
+##############################################################################
+# Shard Files
+def pack_header(index: int, k: int, m: int, size: int, checksum: str) -> bytes:
+    return struct.pack(SHARD_HEADER_FORMAT, SHARD_MAGIC, index, k, m, size, bytes.fromhex(checksum))
+
+
+# @return tuple: (index: int, k: int, m: int, size: int, checksum: str)
+def unpack_header(header: bytes):
+    magic, index, k, m, size, checksum = struct.unpack(SHARD_HEADER_FORMAT, header[:SHARD_HEADER_BYTES])
+    if magic != SHARD_MAGIC:
+        raise ValueError('not a shard file')
+    return index, k, m, size, checksum.hex()
+
+
+##############################################################################
+# Redundancy Modes
+# @return tuple: (mode: str, k: int, m: int), k/m being None when replicating
+def parse_redundancy(text: str):
+    mode, _, shape = (text or '').strip().partition(':')
+    if mode in ['', REDUNDANCY_REPLICATE]:
+        return REDUNDANCY_REPLICATE, None, None
+    if mode != REDUNDANCY_ERASURE:
+        raise ValueError('unknown redundancy mode "'+text+'" (expected one of: '+', '.join(REDUNDANCY_MODES)+')')
+    if len(shape) == 0:
+        return REDUNDANCY_ERASURE, DEFAULT_DATA_SHARDS, DEFAULT_PARITY_SHARDS
+    k, _, m = shape.partition('+')
+    k, m = int(k), int(m)
+    validate_shape(k, m)
+    return REDUNDANCY_ERASURE, k, m
@@ -0,0 +1,2086 @@
+# File: fs.py
+# Purpose:
+#   Server functionality to operate on local files.
+#   Called by an HTTP webserver process.
+
+# SUPPORTED APIs:
+#   1. read a file
+#   2. write data (also creates files)
+#   3. delete a file
+#   4. copy a file
+#   5. rename (also moves) a file
+#   6. check if a file exists
+#   7. stat a file (size, mtime, version, checksum) from the in-memory index
+#   8. merkle tree of every file's content hash (for replica anti-entropy)
+#   9. page cache statistics (hot file contents are served from memory)
+#  10. stream a file's raw bytes (mmap-backed, for binary read responses)
+#  11. atomic writes (temp file + rename) with selectable durability modes
+#  12. append data (O_APPEND, in place; returns the new length)
+#  13. write data at an offset (pwrite, in place), and truncate a file
+#  14. pluggable storage backend per family: one file per path, bitcask, or
+#      a deduplicating chunk store (metadata-only copies)
+#  15. transparent at-rest compression per file (by policy or per write, see
+#      <compression.py>), with the compressed bytes servable as is
+#  16. hold a single erasure-coded shard of a file instead of the whole file
+#      (see <erasure.py>)
+#  17. hot/cold tiering: reads are tracked per path, idle files are demoted to
+#      a compressed cold pack (and promoted back when next accessed), and hot
+#      files evicted from the page cache are reloaded into it
+#  18. per-path readers-writer locking (see <pathlock.py>): reads of a path
+#      run concurrently, mutations of it are serialized, and operations on
+#      different paths never contend
+#  19. directories (see <namespace.py>): paths may be "/"-separated, parent
+#      directories are created as needed, and directories can be created,
+#      listed (a page at a time, from the in-memory namespace tree), renamed
+#      (one rename on disk, however many files they hold) and removed
+#  20. integrity checks: whole-file reads from disk are verified against the
+#      file's checksum (unless skipped), and a scrubber rereads every stored
+#      file in turn; corrupt files are rewritten from a healthy peer's copy
+#  21. version stamps (family epoch, sequence) on every file's metadata,
+#      given by the UVM and copied by its RVMs, so that replicas can tell
+#      which of their copies is newest (and adopt a newer one, see <adopt>)
+#  22. delta-encoded rewrites (see <delta.py>): a file's new version is
+#      encoded against the signatures of its previous one, and a replica
+#      holding that version rebuilds the new one from the delta
+#  23. flag the files holding a stripe manifest (see <write_manifest>)
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import bitcask
+import cache
+import chunkstore
+import compression
+import delta
+import durability
+import erasure
+import merkle
+import namespace
+import pathlock
+
+##############################################################################
+# Anchoring our FS operations to a certain directory
+ROOT_DIRECTORY = os.path.dirname(__file__)+'/../rootdir/'
+
+# Snapshot of the metadata index, reused on startup to skip rehashing files
+INDEX_SNAPSHOT_FILENAME = os.path.dirname(__file__)+'/../rootdir-index.json'
+
+
+##############################################################################
+# Custom Exceptions
+# "File Not Found" Exception. Raised by every file except <exists>.
+class DistributedFileNotFound(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__("dfs> "+self.message)
+
+# Generic Error Class
+class DistributedFileSystemError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__("dfs> "+self.message)
+
+# "Only Holding A Shard" Exception. Raised when reading a path that this
+# machine only holds one erasure-coded shard of (rebuild it from its peers).
+class DistributedFileSharded(DistributedFileSystemError):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+# "Corrupt File" Exception. Raised when a file's stored bytes don't match its
+# checksum (e.g. bit rot): rewrite it from a peer's copy (see <repair>).
+class DistributedFileCorrupt(DistributedFileSystemError):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+##############################################################################
+# Constant Value(s)
+READ_ENTIRE_PATH = -1 # used by <read>
+
+# Paths that never count towards a machine's file capacity
+UNCOUNTED_PATHS = ['README.md']
+
+# Size of each chunk yielded by <stream>
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Writes land in a "<TEMP_FILE_PREFIX><random>" file first, then are renamed
+# into place. Leftovers from a crash are deleted by <rebuild_index>.
+TEMP_FILE_PREFIX = '.dfs-tmp-'
+
+# Durability mode used when a write doesn't specify one (see <durability.py>)
+DEFAULT_DURABILITY_MODE = durability.DURABILITY_NONE
+
+# Whether fsyncing writes share their directory fsync with concurrent writers
+GROUP_FSYNC = False
+
+# Compressed files (files backend only) are stored as
+# "<COMPRESSED_FILE_PREFIX><encoding>.<path>" (see <stored_name>)
+COMPRESSED_FILE_PREFIX = '.dfs-z-'
+
+# Erasure-coded shards are stored as "<SHARD_FILE_PREFIX><path>", and indexed
+# with the <SHARD_ENCODING> encoding
+SHARD_FILE_PREFIX = '.dfs-ec.'
+SHARD_ENCODING = 'shard'
+
+# Whether whole-file reads from disk are checked against the file's checksum
+# when a read doesn't say (see <read_contents>)
+VERIFY_READS = True
+
+# Files read per namespace walk by <scrub>
+SCRUB_BATCH_FILES = 100
+
+# Number of appended-to paths whose running content hash we keep in memory
+# (so appending doesn't have to rehash the whole file)
+APPEND_HASHER_CACHE_ENTRIES = 256
+
+
+##############################################################################
+# Hot/Cold Tiering (files backend only, see <retier>)
+#   * "memory": contents held in the <PAGE_CACHE>
+#   * "disk":   one (maybe compressed) file per path, as usual
+#   * "cold":   files idle for <COLD_TIER_IDLE_SECONDS> are packed into a
+#               bitcask store in <ROOT_DIRECTORY><COLD_TIER_DIRECTORY_NAME>,
+#               recompressed with <COLD_TIER_CODEC>, and indexed with the
+#               <COLD_ENCODING> encoding. Accessing one moves it back to disk.
+TIER_MEMORY = 'memory'
+TIER_DISK = 'disk'
+TIER_COLD = 'cold'
+TIERS = [TIER_MEMORY, TIER_DISK, TIER_COLD]
+
+COLD_ENCODING = 'cold'
+COLD_TIER_DIRECTORY_NAME = '.cold'
+COLD_TIER_CODEC = compression.CODEC_XZ
+
+# Seconds since a file was last read or written before it's demoted (None = never)
+COLD_TIER_IDLE_SECONDS = 7 * 24 * 60 * 60
+
+# Larger files always stay on disk (a cold file is read back whole to promote it)
+COLD_TIER_MAX_BYTES = 64 * 1024 * 1024
+
+# Cold values start with the file's mtime, logical size, SHA-256 content hash,
+# the encoding to restore it with, and the encoding it's packed with (those
+# being indexes into <compression.ENCODINGS>): files that <COLD_TIER_CODEC>
+# doesn't shrink are packed as they were stored
+COLD_HEADER = struct.Struct('>dQ32sBB')
+
+# Reads of a path are counted with this half-life: paths with at least
+# <HOT_TIER_MIN_READS> are "hot", and reloaded into the page cache if evicted
+HOT_TIER_HALF_LIFE_SECONDS = 10 * 60
+HOT_TIER_MIN_READS = 4
+
+
+##############################################################################
+# Storage Backends (selected per family via <use_storage_backend>)
+#   * "files":   one file per path in <ROOT_DIRECTORY> (the default)
+#   * "bitcask": every path's contents in one log-structured store, kept in
+#                <ROOT_DIRECTORY><BITCASK_DIRECTORY_NAME> (see <bitcask.py>)
+#   * "chunks":  content-addressed, refcounted chunks shared between paths,
+#                kept in <ROOT_DIRECTORY><CHUNKSTORE_DIRECTORY_NAME> (see
+#                <chunkstore.py>)
+STORAGE_BACKEND_FILES = 'files'
+STORAGE_BACKEND_BITCASK = 'bitcask'
+STORAGE_BACKEND_CHUNKS = 'chunks'
+STORAGE_BACKENDS = [STORAGE_BACKEND_FILES, STORAGE_BACKEND_BITCASK, STORAGE_BACKEND_CHUNKS]
+
+BITCASK_DIRECTORY_NAME = '.bitcask'
+CHUNKSTORE_DIRECTORY_NAME = '.chunks'
+
+STORAGE_BACKEND = STORAGE_BACKEND_FILES
+STORE = None # the open key/value store, iff <STORAGE_BACKEND> isn't "files"
+
+
+##############################################################################
+# Per-path locks: every operation below holds the paths it touches, shared to
+# read them and exclusively to mutate them (copies read-lock their source),
+# and read-locks the directories they're in
+PATH_LOCKS = pathlock.PathLocks(separator=namespace.SEPARATOR)
+
+def lock_stats() -> dict:
+    return PATH_LOCKS.stats()
+
+
+##############################################################################
+# Merkle tree of every path's content hash, kept in sync by each mutation
+MERKLE_TREE = merkle.MerkleTree()
+
+def hash_file(path: str) -> str:
+    return file_hasher(path).hexdigest()
+
+
+# Hasher fed with <path>'s (decompressed) contents, read in <STREAM_CHUNK_BYTES> chunks
+def file_hasher(path: str):
+    hasher = merkle.content_hasher()
+    with PATH_LOCKS.reading(path):
+        if STORE != None:
+            for chunk in STORE.stream(path)[1]:
+                hasher.update(chunk)
+            return hasher
+        encoding = _encoding_of(path)
+        if encoding == COLD_ENCODING:
+            encoding = _promote(path).encoding
+        _check_unsharded(path, encoding)
+        with open(ROOT_DIRECTORY+stored_name(path, encoding), 'rb') as file:
+            for chunk in compression.decode_chunks(iter(lambda: file.read(STREAM_CHUNK_BYTES), b''), encoding):
+                hasher.update(chunk)
+    return hasher
+
+
+##############################################################################
+# Integrity: a file's checksum (its content hash, computed incrementally by
+# every write) is checked whenever its whole contents are read from disk, and
+# by <scrub>, which rereads every stored file in turn. Paths found corrupt are
+# remembered (with the metadata they were found corrupt with) until <repair>
+# rewrites them, or they're rewritten anyway.
+_corrupt_paths = {} # {path: FileMetadata, ...}
+_integrity_lock = threading.Lock()
+_integrity_stats = {'verified_reads': 0, 'corrupt_reads': 0, 'scrub_passes': 0, 'scrubbed_files': 0, 'scrubbed_bytes': 0, 'scrub_seconds': 0.0, 'corrupt_scrubbed': 0, 'repairs': 0}
+_scrub_lock = threading.Lock()
+_scrub_cursor = namespace.ROOT_PATH # <scrub> resumes after this path
+
+
+# Record that <path>'s copy (per <metadata>) is corrupt, counted as <counter>
+def _flag_corrupt(path: str, metadata, counter: str):
+    with _integrity_lock:
+        _corrupt_paths[path] = metadata
+        _integrity_stats[counter] += 1
+
+
+# Raise if <contents> (all of <path>'s, per <metadata>) don't match its checksum
+def _verify(path: str, contents: bytes, metadata):
+    with _integrity_lock:
+        _integrity_stats['verified_reads'] += 1
+    if metadata != None and merkle.content_hash(contents) != metadata.checksum:
+        _flag_corrupt(path, metadata, 'corrupt_reads')
+        raise DistributedFileCorrupt(f"read: Path {path} is corrupt (its contents don't match its checksum)!")
+
+
+# Yield <chunks> (all of <path>'s contents, per <metadata>), holding back the
+# last one until they've all been checked against its checksum (so a corrupt
+# file's stream raises before it's complete). Bytes written in place meanwhile
+# (see <stream>) change the metadata, so they aren't mistaken for corruption.
+def _verified_chunks(path: str, chunks, metadata):
+    hasher, held = merkle.content_hasher(), None
+    for chunk in chunks:
+        hasher.update(chunk)
+        if held != None:
+            yield held
+        held = chunk
+    with _integrity_lock:
+        _integrity_stats['verified_reads'] += 1
+    if hasher.hexdigest() != metadata.checksum and _index_get(path) is metadata:
+        _flag_corrupt(path, metadata, 'corrupt_reads')
+        raise DistributedFileCorrupt(f"stream: Path {path} is corrupt (its contents don't match its checksum)!")
+    if held != None:
+        yield held
+
+
+# Checksum of <path>'s contents as stored (per <metadata>), read straight
+# from storage: bypassing the page cache, and without promoting cold files
+def _stored_checksum(path: str, metadata) -> str:
+    hasher = merkle.content_hasher()
+    if STORE != None:
+        for chunk in STORE.stream(path)[1]:
+            hasher.update(chunk)
+    elif metadata.encoding == COLD_ENCODING:
+        value = _cold_store().get(path)
+        packed_encoding = _unpack_cold_header(value)[4]
+        hasher.update(compression.decompress(value[COLD_HEADER.size:], packed_encoding))
+    else:
+        with open(ROOT_DIRECTORY+stored_name(path, metadata.encoding), 'rb') as file:
+            for chunk in compression.decode_chunks(iter(lambda: file.read(STREAM_CHUNK_BYTES), b''), metadata.encoding):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# Scrub stored files (reread each, and check it against its checksum) in path
+# order, resuming after the last one scrubbed, until about <max_bytes> have
+# been read. Shards are skipped (their checksum is the whole file's).
+# @return tuple: (scrubbed_bytes: int, corrupt_paths: list, pass_complete: bool)
+def scrub(max_bytes: int):
+    global _scrub_cursor
+    with _scrub_lock:
+        started = time.perf_counter()
+        scrubbed_files = scrubbed_bytes = 0
+        corrupt, pass_complete = [], False
+        while scrubbed_bytes < max_bytes and not pass_complete:
+            paths, truncated = NAMESPACE.walk(namespace.ROOT_PATH, _scrub_cursor, SCRUB_BATCH_FILES)
+            for path in paths:
+                _scrub_cursor = path
+                with PATH_LOCKS.reading(path):
+                    metadata = _index_get(path)
+                    if metadata == None or metadata.encoding == SHARD_ENCODING:
+                        continue
+                    try:
+                        checksum = _stored_checksum(path, metadata)
+                    except Exception: # missing, or undecodable
+                        checksum = None
+                scrubbed_files += 1
+                scrubbed_bytes += metadata.stored_size
+                if checksum != metadata.checksum:
+                    _flag_corrupt(path, metadata, 'corrupt_scrubbed')
+                    corrupt.append(path)
+                if scrubbed_bytes >= max_bytes:
+                    break
+            if not truncated and (len(paths) == 0 or _scrub_cursor == paths[-1]):
+                _scrub_cursor, pass_complete = namespace.ROOT_PATH, True
+        with _integrity_lock:
+            _integrity_stats['scrub_passes'] += pass_complete
+            _integrity_stats['scrubbed_files'] += scrubbed_files
+            _integrity_stats['scrubbed_bytes'] += scrubbed_bytes
+            _integrity_stats['scrub_seconds'] += time.perf_counter()-started
+    return scrubbed_bytes, corrupt, pass_complete
+
+
+# Every path found corrupt and not yet repaired (forgetting those rewritten
+# or deleted since)
+def corrupt_paths() -> list:
+    with _integrity_lock:
+        for path in [path for path, metadata in _corrupt_paths.items() if _index_get(path) is not metadata]:
+            del _corrupt_paths[path]
+        return list(_corrupt_paths)
+
+
+# Rewrite the corrupt <path> with <contents> (a healthy peer's copy), unless
+# they don't match its checksum
+# @return bool: whether <path> was repaired
+def repair(path: str, contents: bytes) -> bool:
+    with PATH_LOCKS.writing(path):
+        metadata = _index_get(path)
+        if path not in corrupt_paths():
+            return False
+        if merkle.content_hash(contents) != metadata.checksum:
+            return False
+        encoding = metadata.encoding if metadata.encoding in compression.ENCODINGS else compression.CODEC_IDENTITY
+        write_bytes(path, contents, DEFAULT_DURABILITY_MODE, encoding)
+        restamp(path, metadata.stamp)
+        _index_set_striped(path, metadata.striped)
+    with _integrity_lock:
+        _corrupt_paths.pop(path, None)
+        _integrity_stats['repairs'] += 1
+    return True
+
+
+# Scrub throughput, and how much corruption reads and scrubbing have found
+def integrity_stats() -> dict:
+    with _integrity_lock:
+        stats = dict(_integrity_stats)
+        stats['corrupt_pending'] = len(_corrupt_paths)
+    seconds = stats.pop('scrub_seconds')
+    stats['scrub_mb_per_second'] = round(stats['scrubbed_bytes']/seconds/(1024*1024), 3) if seconds > 0 else 0.0
+    return stats
+
+
+##############################################################################
+# Namespace: every directory, and every file in it, kept in sync with the
+# metadata index below. Directories live on disk as real directories under
+# <ROOT_DIRECTORY>, or in a store as an empty value keyed "<path>/".
+NAMESPACE = namespace.Namespace()
+
+# Top-level directories holding our own data, never user paths
+RESERVED_DIRECTORY_NAMES = [BITCASK_DIRECTORY_NAME, CHUNKSTORE_DIRECTORY_NAME, COLD_TIER_DIRECTORY_NAME]
+
+# Prefixes of the names of our own files (which <rebuild_index> deletes or
+# parses), never of a user path's components
+RESERVED_NAME_PREFIXES = [TEMP_FILE_PREFIX, COMPRESSED_FILE_PREFIX, SHARD_FILE_PREFIX]
+
+def _validate_path(path: str, operation: str):
+    try:
+        components = namespace.split(path)
+    except ValueError as err_msg:
+        raise DistributedFileSystemError(f"{operation}: {err_msg}")
+    if len(components) > 0 and components[0] in RESERVED_DIRECTORY_NAMES:
+        raise DistributedFileSystemError(f"{operation}: Path {path} is reserved!")
+    if any(component.startswith(prefix) for component in components for prefix in RESERVED_NAME_PREFIXES):
+        raise DistributedFileSystemError(f"{operation}: Path {path} uses a reserved name prefix!")
+
+
+# Store key of the directory <path>'s marker
+def _directory_key(path: str) -> str:
+    return path+namespace.SEPARATOR
+
+
+# Create the directory <path> and its missing parents (on disk, or as markers
+# in the store), making new directories durable per <durability_mode>
+# @return list: the directories created
+def _create_directory(path: str, durability_mode: str) -> list:
+    if STORE == None:
+        os.makedirs(ROOT_DIRECTORY+path, exist_ok=True)
+    created = NAMESPACE.mkdir(path)
+    for directory in created:
+        if STORE != None:
+            STORE.put(_directory_key(directory), b'', durability_mode != durability.DURABILITY_NONE)
+        elif durability_mode == durability.DURABILITY_FSYNC_DATA_AND_DIR:
+            durability.sync_directory(ROOT_DIRECTORY+namespace.parent(directory))
+    return created
+
+
+# Before creating the file <path>: check it can be one (no file is one of its
+# parents, and it isn't a directory), and create its missing parents
+def _make_parents(path: str, durability_mode: str, operation: str = 'write'):
+    _validate_path(path, operation)
+    try:
+        NAMESPACE.check_file(path)
+        directory = namespace.parent(path)
+        if directory != namespace.ROOT_PATH and not NAMESPACE.is_directory(directory):
+            _create_directory(directory, durability_mode)
+    except OSError as err_msg:
+        raise DistributedFileSystemError(f"{operation}: Path {path} can't be created ({err_msg.strerror}: {err_msg.filename})!")
+
+
+##############################################################################
+# In-memory metadata index (path -> FileMetadata), kept in sync by every
+# mutation so that <exists>, <stat> and capacity checks never touch the disk
+# >> NOTE: <size> is the logical (decompressed) size, <stored_size> what the
+#          file takes up on disk with its <encoding>
+class FileMetadata:
+    def __init__(self, size: int, mtime: float, version: int, checksum: str, encoding: str = compression.CODEC_IDENTITY, stored_size: int = None, stamp: tuple = None, striped: bool = False):
+        self.size = size
+        self.mtime = mtime
+        self.version = version
+        self.checksum = checksum
+        self.encoding = encoding
+        self.stored_size = size if stored_size == None else stored_size
+        self.stamp = stamp
+        self.striped = striped # holds a stripe manifest (see <write_manifest>)
+
+
+    def to_json(self) -> dict:
+        return {'size': self.size, 'mtime': self.mtime, 'version': self.version, 'checksum': self.checksum, 'encoding': self.encoding, 'stored_size': self.stored_size, 'stamp': format_stamp(self.stamp), 'striped': self.striped}
+
+
+_index = {} # {path: FileMetadata, ...}
+_index_lock = threading.Lock()
+_index_sequence = 0 # last version handed out
+_index_file_count = 0
+_index_total_bytes = 0
+_index_dirty = False
+
+
+# @return int: the version assigned to <path>'s new metadata
+def _index_put(path: str, size: int, mtime: float, checksum: str, encoding: str = compression.CODEC_IDENTITY, stored_size: int = None) -> int:
+    global _index_sequence, _index_file_count, _index_total_bytes, _index_dirty
+    stamp = _new_stamp()
+    with _index_lock:
+        _index_sequence += 1
+        old_metadata = _index.get(path)
+        if path not in UNCOUNTED_PATHS:
+            if old_metadata == None:
+                _index_file_count += 1
+            else:
+                _index_total_bytes -= old_metadata.size
+            _index_total_bytes += size
+        _index[path] = FileMetadata(size, mtime, _index_sequence, checksum, encoding, stored_size, stamp)
+        _index_dirty = True
+        version = _index_sequence
+    if old_metadata == None:
+        NAMESPACE.add_file(path)
+    MERKLE_TREE.update(path, checksum)
+    return version
+
+
+def _index_remove(path: str):
+    global _index_file_count, _index_total_bytes, _index_dirty
+    with _index_lock:
+        old_metadata = _index.pop(path, None)
+        if old_metadata != None and path not in UNCOUNTED_PATHS:
+            _index_file_count -= 1
+            _index_total_bytes -= old_metadata.size
+        _index_dirty = True
+    NAMESPACE.remove_file(path)
+    MERKLE_TREE.remove(path)
+
+
+# Re-key each file moved from <old_path> to <new_path> (by renaming the
+# directory it's in): only its path changed, so it keeps its metadata (and
+# version stamp), under a new version
+# @param moves: [(old_path, new_path), ...]
+def _index_move(moves: list):
+    global _index_sequence, _index_dirty
+    moved = []
+    with _index_lock:
+        for old_path, new_path in moves:
+            metadata = _index.pop(old_path, None)
+            if metadata == None:
+                continue
+            _index_sequence += 1
+            _index[new_path] = FileMetadata(metadata.size, metadata.mtime, _index_sequence, metadata.checksum, metadata.encoding, metadata.stored_size, metadata.stamp, metadata.striped)
+            moved.append((old_path, new_path, metadata.checksum))
+        _index_dirty = True
+    for old_path, new_path, checksum in moved:
+        MERKLE_TREE.remove(old_path)
+        MERKLE_TREE.update(new_path, checksum)
+
+
+def _index_get(path: str):
+    with _index_lock:
+        return _index.get(path)
+
+
+# Restore <path> as stored with <encoding> (<stored_size> bytes) if its
+# metadata is still <metadata>: only where its bytes live changed, so its
+# version, version stamp and checksum are kept
+# @return FileMetadata: the new metadata (None if <path> changed meanwhile)
+def _index_retier(path: str, metadata, encoding: str, stored_size: int):
+    global _index_dirty
+    with _index_lock:
+        if _index.get(path) is not metadata:
+            return None
+        _index[path] = FileMetadata(metadata.size, metadata.mtime, metadata.version, metadata.checksum, encoding, stored_size, metadata.stamp, metadata.striped)
+        _index_dirty = True
+        return _index[path]
+
+
+# Flag <path> as holding a stripe manifest (or not), keeping its version
+def _index_set_striped(path: str, striped: bool):
+    global _index_dirty
+    with _index_lock:
+        metadata = _index.get(path)
+        if metadata != None and metadata.striped != striped:
+            metadata.striped = striped
+            _index_dirty = True
+
+
+# Encoding <path> is stored with (identity if it DNE)
+def _encoding_of(path: str) -> str:
+    metadata = _index_get(path)
+    return compression.CODEC_IDENTITY if metadata == None else metadata.encoding
+
+
+# Name of the file in <ROOT_DIRECTORY> holding <path> stored with <encoding>
+# (the encoding's prefix goes on the file's own name, in <path>'s directory)
+def stored_name(path: str, encoding: str) -> str:
+    if encoding == compression.CODEC_IDENTITY:
+        return path
+    directory, separator, name = path.rpartition(namespace.SEPARATOR)
+    if encoding == SHARD_ENCODING:
+        return directory+separator+SHARD_FILE_PREFIX+name
+    return directory+separator+COMPRESSED_FILE_PREFIX+encoding+'.'+name
+
+
+# @return tuple: (path: str, encoding: str) stored in the file named <name>
+def _parse_stored_name(name: str):
+    directory, separator, name = name.rpartition(namespace.SEPARATOR)
+    if name.startswith(SHARD_FILE_PREFIX) and len(name) > len(SHARD_FILE_PREFIX):
+        return directory+separator+name[len(SHARD_FILE_PREFIX):], SHARD_ENCODING
+    if name.startswith(COMPRESSED_FILE_PREFIX):
+        encoding, _, path = name[len(COMPRESSED_FILE_PREFIX):].partition('.')
+        if encoding in compression.CODECS and len(path) > 0:
+            return directory+separator+path, encoding
+    return directory+separator+name, compression.CODEC_IDENTITY
+
+
+# Shards can't be read as the file itself (see <DistributedFileSharded>)
+def _check_unsharded(path: str, encoding: str):
+    if encoding == SHARD_ENCODING:
+        raise DistributedFileSharded(f"read: Path {path} is only held as an erasure-coded shard here!")
+
+
+# @return tuple: (index: int, k: int, m: int, size: int, checksum: str)
+def _shard_header(path: str):
+    with open(ROOT_DIRECTORY+stored_name(path, SHARD_ENCODING), 'rb') as file:
+        return erasure.unpack_header(file.read(erasure.SHARD_HEADER_BYTES))
+
+
+##############################################################################
+# Cold Tier Pack (opened on first use, so machines that never demote anything
+# don't get an empty store)
+# >> NOTE: a file's moves between disk and the cold pack are serialized by its
+#          path's write lock (or, for promotions, which run under its read
+#          lock, by <_promote_locks>): <_tier_lock> only guards opening and
+#          closing <COLD_STORE> itself
+COLD_STORE = None
+_tier_lock = threading.Lock()
+_promote_locks = pathlock.PathLocks()
+
+def _cold_store(create: bool = False):
+    global COLD_STORE
+    with _tier_lock:
+        if COLD_STORE == None and (create or os.path.isdir(ROOT_DIRECTORY+COLD_TIER_DIRECTORY_NAME)):
+            COLD_STORE = bitcask.Bitcask(ROOT_DIRECTORY+COLD_TIER_DIRECTORY_NAME)
+        return COLD_STORE
+
+
+# @return tuple: (mtime: float, size: int, checksum: str, encoding: str,
+#                packed_encoding: str) from a cold value's header
+def _unpack_cold_header(value: bytes):
+    mtime, size, checksum, encoding, packed_encoding = COLD_HEADER.unpack(value[:COLD_HEADER.size])
+    return mtime, size, checksum.hex(), compression.ENCODINGS[encoding], compression.ENCODINGS[packed_encoding]
+
+
+def _cold_header(path: str):
+    return _unpack_cold_header(COLD_STORE.read(path, 0, COLD_HEADER.size))
+
+
+# Drop <path>'s cold value, if there is one
+def _discard_cold(path: str):
+    cold_store = _cold_store()
+    if cold_store != None:
+        try:
+            cold_store.delete(path)
+        except KeyError:
+            pass
+
+
+# Number of files held by this machine (excluding <UNCOUNTED_PATHS>)
+def file_count() -> int:
+    with _index_lock:
+        return _index_file_count
+
+
+# Number of bytes held by this machine (excluding <UNCOUNTED_PATHS>)
+def total_bytes() -> int:
+    with _index_lock:
+        return _index_total_bytes
+
+
+##############################################################################
+# Version stamps: (family epoch, sequence) pairs ordering the versions of a
+# file held by the machines of a family (see <stamp_key>)
+# >> NOTE: only the UVM stamps new versions (with <STAMP_EPOCH> set to its
+#          family's epoch); RVMs leave <STAMP_EPOCH> unset, and take the UVM's
+#          stamp from each replicated command (see <restamp>)
+# >> NOTE: sequences are microsecond timestamps (or 1 more than the last, if
+#          greater), so they keep increasing across restarts; an RVM taking
+#          over as UVM bumps the epoch, so its versions are newer than all of
+#          the old UVM's
+STAMP_EPOCH = None
+_stamp_lock = threading.Lock()
+_stamp_sequence = 0 # last sequence handed out
+_stamp_local = threading.local() # .stamp: the stamp of the thread's last mutation
+
+
+# Stamp for a new version (None if this machine doesn't stamp versions)
+def _new_stamp():
+    global _stamp_sequence
+    stamp = None
+    if STAMP_EPOCH != None:
+        with _stamp_lock:
+            _stamp_sequence = max(_stamp_sequence+1, int(time.time()*1000000))
+            stamp = (STAMP_EPOCH, _stamp_sequence)
+    _stamp_local.stamp = stamp
+    return stamp
+
+
+def format_stamp(stamp) -> str:
+    return None if stamp == None else str(stamp[0])+'.'+str(stamp[1])
+
+
+# Inverse of <format_stamp> (None for a missing or malformed stamp)
+def parse_stamp(text: str):
+    try:
+        epoch, sequence = text.split('.')
+        return (int(epoch), int(sequence))
+    except Exception:
+        return None
+
+
+# Sort key of <stamp>: later versions sort higher, unstamped ones lowest
+def stamp_key(stamp) -> tuple:
+    return (-1, -1) if stamp == None else tuple(stamp)
+
+
+# Stamp given to the version created by the calling thread's last mutation
+# (then forgotten)
+def take_stamp():
+    stamp = getattr(_stamp_local, 'stamp', None)
+    _stamp_local.stamp = None
+    return stamp
+
+
+# Set the stamp of <path>'s current version to <stamp> (as given by the UVM),
+# if its content hash is still <checksum> (when given)
+# @return bool: whether <path> was restamped
+def restamp(path: str, stamp, checksum: str = None) -> bool:
+    global _index_dirty
+    with _index_lock:
+        metadata = _index.get(path)
+        if metadata == None or (checksum != None and metadata.checksum != checksum):
+            return False
+        metadata.stamp = stamp
+        _index_dirty = True
+        return True
+
+
+# Stamp every file whose stamp is unknown (changed or written since the last
+# index snapshot) as a new version: called by the UVM on launch, its copies
+# being the newest its family has accepted
+# @return int: the number of files stamped
+def stamp_unstamped() -> int:
+    global _index_dirty
+    stamped = 0
+    with _index_lock:
+        for metadata in _index.values():
+            if metadata.stamp == None:
+                metadata.stamp = _new_stamp()
+                stamped += 1
+        _index_dirty = _index_dirty or stamped > 0
+    return stamped
+
+
+# Read repair: replace <path> with <contents>, a newer version of it (stamped
+# <stamp>) held by a peer, unless <path> was changed since we compared its
+# stamp (<local_stamp>) with the peer's (<striped>: whether the peer's
+# version is a stripe manifest)
+# @return bool: whether <path> was replaced
+def adopt(path: str, contents: bytes, stamp, local_stamp, striped: bool = False) -> bool:
+    with PATH_LOCKS.writing(path):
+        metadata = _index_get(path)
+        if (None if metadata == None else metadata.stamp) != local_stamp:
+            return False
+        encoding = compression.CODEC_IDENTITY
+        if metadata != None and metadata.encoding in compression.ENCODINGS:
+            encoding = metadata.encoding
+        write_bytes(path, contents, DEFAULT_DURABILITY_MODE, encoding)
+        restamp(path, stamp)
+        _index_set_striped(path, striped)
+    return True
+
+
+##############################################################################
+# Index Snapshot Persistence + Startup Rebuild
+def load_index_snapshot() -> dict:
+    try:
+        with open(INDEX_SNAPSHOT_FILENAME, 'r') as file:
+            return json.load(file)
+    except Exception:
+        return {}
+
+
+# Atomically persist the index (no-op if unchanged since the last save)
+_index_snapshot_lock = threading.Lock() # one save at a time (they share a temp file)
+
+def save_index_snapshot():
+    global _index_dirty
+    with _index_snapshot_lock:
+        with _index_lock:
+            if not _index_dirty:
+                return
+            snapshot = {path: metadata.to_json() for path, metadata in _index.items()}
+            _index_dirty = False
+        with open(INDEX_SNAPSHOT_FILENAME+'.tmp', 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(INDEX_SNAPSHOT_FILENAME+'.tmp', INDEX_SNAPSHOT_FILENAME)
+
+
+# Every stored path's (path, stored_size, mtime, encoding), and every
+# directory: from one scan of the directory tree (plus the cold pack's
+# keydir), or from the open store's in-memory keydir/manifests (no disk
+# access at all)
+# @return tuple: (files: list, directories: list)
+def _stored_files():
+    if STORE != None:
+        files, directories = [], []
+        for key, (size, mtime) in STORE.items().items():
+            if key.endswith(namespace.SEPARATOR):
+                directories.append(key[:-len(namespace.SEPARATOR)])
+            else:
+                files.append((key, size, mtime, compression.CODEC_IDENTITY))
+        return files, directories
+    stored_files = {} # {path: (path, stored_size, mtime, encoding), ...}
+    directories = []
+    pending = [namespace.ROOT_PATH]
+    while len(pending) > 0:
+        directory = pending.pop()
+        with os.scandir(ROOT_DIRECTORY+directory) as entries:
+            for entry in entries:
+                relative_path = namespace.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if directory != namespace.ROOT_PATH or entry.name not in RESERVED_DIRECTORY_NAMES:
+                        directories.append(relative_path)
+                        pending.append(relative_path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if entry.name.startswith(TEMP_FILE_PREFIX):
+                    os.remove(entry.path) # interrupted write: the target is untouched
+                    continue
+                stats = entry.stat()
+                path, encoding = _parse_stored_name(relative_path)
+                stored_file = (path, stats.st_size, stats.st_mtime, encoding)
+                other = stored_files.get(path)
+                if other != None: # crashed before removing the old encoding's file
+                    stale, stored_file = (other, stored_file) if other[2] <= stored_file[2] else (stored_file, other)
+                    os.remove(ROOT_DIRECTORY+stored_name(stale[0], stale[3]))
+                stored_files[path] = stored_file
+    cold_store = _cold_store()
+    if cold_store != None:
+        for path, (value_size, _) in cold_store.items().items():
+            if path in stored_files: # crashed mid demotion/promotion: the file on disk is current
+                cold_store.delete(path)
+                continue
+            stored_files[path] = (path, value_size, _cold_header(path)[0], COLD_ENCODING)
+    return list(stored_files.values()), directories
+
+
+# Decompress a stored file to get its logical (size, checksum)
+def _measure_stored_file(path: str, encoding: str):
+    hasher = merkle.content_hasher()
+    size = 0
+    with open(ROOT_DIRECTORY+stored_name(path, encoding), 'rb') as file:
+        for chunk in compression.decode_chunks(iter(lambda: file.read(STREAM_CHUNK_BYTES), b''), encoding):
+            hasher.update(chunk)
+            size += len(chunk)
+    return size, hasher.hexdigest()
+
+
+# Rebuild from the stored files, only rehashing files whose size, mtime or
+# encoding changed since the last snapshot (their version stamps are unknown)
+def rebuild_index():
+    global _index_file_count, _index_total_bytes, _index_dirty
+    snapshot = load_index_snapshot()
+    with _index_lock:
+        _index.clear()
+        _index_file_count = 0
+        _index_total_bytes = 0
+    MERKLE_TREE.clear()
+    NAMESPACE.clear()
+    files, directories = _stored_files()
+    for directory in directories:
+        NAMESPACE.mkdir(directory)
+    for path, stored_size, mtime, encoding in files:
+        cached = snapshot.get(path)
+        if cached != None and cached.get('stored_size', cached['size']) == stored_size and cached['mtime'] == mtime and cached.get('encoding', compression.CODEC_IDENTITY) == encoding:
+            size, checksum = cached['size'], cached['checksum']
+        elif encoding == SHARD_ENCODING:
+            _, _, _, size, checksum = _shard_header(path)
+        elif encoding == COLD_ENCODING:
+            _, size, checksum, _, _ = _cold_header(path)
+        elif encoding != compression.CODEC_IDENTITY:
+            size, checksum = _measure_stored_file(path, encoding)
+        else:
+            size, checksum = stored_size, hash_file(path)
+        _index_put(path, size, mtime, checksum, encoding, stored_size)
+        if cached != None and cached['checksum'] == checksum: # same bytes: keep what only the index knows
+            restamp(path, parse_stamp(cached.get('stamp')))
+            _index_set_striped(path, cached.get('striped', False))
+        else:
+            restamp(path, None)
+    with _index_lock:
+        _index_dirty = True
+    save_index_snapshot()
+
+
+rebuild_index()
+
+
+##############################################################################
+# Byte-bounded LRU cache of file contents, updated/invalidated by every mutation
+PAGE_CACHE = cache.PageCache()
+
+def cache_stats() -> dict:
+    return PAGE_CACHE.stats()
+
+
+# Decompressed contents of <path>'s file stored with <encoding>
+def _read_stored(path: str, encoding: str) -> bytes:
+    _check_unsharded(path, encoding)
+    with open(ROOT_DIRECTORY+stored_name(path, encoding), 'rb') as file:
+        return compression.decompress(file.read(), encoding)
+
+
+# @return tuple: (contents: bytes, tier: str) <path>'s entire contents, and
+#                the tier they were read from (if from disk, checked against
+#                its checksum unless not <verify>)
+def _load_contents(path: str, verify: bool = True):
+    contents = PAGE_CACHE.get(path)
+    if contents != None:
+        return contents, TIER_MEMORY
+    if STORE != None:
+        metadata, tier = _index_get(path), TIER_DISK
+        contents = STORE.get(path)
+    else:
+        metadata, tier = _ensure_hot(path)
+        contents = PAGE_CACHE.get(path) if tier == TIER_COLD else None # cached by promoting it
+        if contents != None:
+            return contents, tier
+        contents = _read_stored(path, compression.CODEC_IDENTITY if metadata == None else metadata.encoding)
+    if verify:
+        _verify(path, contents, metadata)
+    PAGE_CACHE.put(path, contents, len(contents), lambda: _index_get(path) is metadata)
+    return contents, tier
+
+
+# Read <path>'s entire contents, going to disk only on a cache miss (and
+# then checking them against its checksum, unless not <verify>: None =
+# <VERIFY_READS>)
+def read_contents(path: str, verify: bool = None) -> bytes:
+    verify = VERIFY_READS if verify == None else verify
+    started = time.perf_counter()
+    with PATH_LOCKS.reading(path):
+        contents, tier = _load_contents(path, verify)
+    _record_read(path, tier, started)
+    return contents
+
+
+# Read up to <n_bytes> bytes starting at byte <position> (to EOF if N=-1),
+# seeking so that only the requested range is ever read into memory (except
+# for compressed files, which can't be seeked into, and are read whole and
+# checked unless not <verify>)
+def read_range(path: str, position: int, n_bytes: int, verify: bool = None) -> bytes:
+    verify = VERIFY_READS if verify == None else verify
+    started = time.perf_counter()
+    with PATH_LOCKS.reading(path):
+        contents, tier = PAGE_CACHE.get(path), TIER_MEMORY
+        if contents == None:
+            metadata, tier = (None, TIER_DISK) if STORE != None else _ensure_hot(path)
+            if metadata != None and metadata.encoding != compression.CODEC_IDENTITY:
+                contents = _load_contents(path, verify)[0]
+        if contents != None:
+            data = contents[position:] if n_bytes == READ_ENTIRE_PATH else contents[position:position+n_bytes]
+        elif STORE != None:
+            data = STORE.read(path, position, n_bytes)
+        else:
+            with open(ROOT_DIRECTORY+path, 'rb') as file:
+                file.seek(position)
+                data = file.read(n_bytes)
+    _record_read(path, tier, started)
+    return data
+
+
+##############################################################################
+# Read N bytes from a path (read everything if N=-1)
+# >> NOTE: <position> and <n_bytes> are byte offsets into the file!
+# >> NOTE: whole-file reads from disk are checked against the file's checksum
+#          (see <read_contents>), unless not <verify>
+# @return tuple: (new_position: int, read_data: str)
+def read(path: str, position: int, n_bytes: int = READ_ENTIRE_PATH, verify: bool = None):
+    if n_bytes != READ_ENTIRE_PATH and n_bytes < 0:
+        raise DistributedFileSystemError(f"read: n_bytes {n_bytes} can't be negative!")
+    if position < 0:
+        raise DistributedFileSystemError(f"read: position {position} can't be negative!")
+    try:
+        if position == 0 and n_bytes == READ_ENTIRE_PATH:
+            contents = read_contents(path, verify)
+            return len(contents), contents.decode('utf-8', errors='replace')
+        data = read_range(path, position, n_bytes, verify)
+        return position+len(data), data.decode('utf-8', errors='replace')
+    except (DistributedFileSharded, DistributedFileCorrupt):
+        raise
+    except Exception:
+        raise DistributedFileNotFound(f"read: Path {path} doesn't exist!")
+
+
+##############################################################################
+# Stream <path>'s raw bytes in <STREAM_CHUNK_BYTES> chunks, from the page cache
+# if it's hot, otherwise straight out of an mmap of the file (no full copy)
+# >> NOTE: <path> is only read-locked while the stream is opened: an atomic
+#          write swaps in a new file (the stream keeps reading the old one),
+#          but an in-place <write_at> may land in the part not yet streamed
+# >> NOTE: whole files streamed from disk are checked against their checksum
+#          as they go (unless not <verify>: None = <VERIFY_READS>), raising
+#          <DistributedFileCorrupt> once the last chunk has been yielded
+# @return tuple: (total_bytes_to_stream: int, chunk_generator)
+def stream(path: str, position: int = 0, n_bytes: int = READ_ENTIRE_PATH, verify: bool = None):
+    if position < 0 or (n_bytes != READ_ENTIRE_PATH and n_bytes < 0):
+        raise DistributedFileSystemError(f"stream: invalid range for path {path}!")
+    verify = (VERIFY_READS if verify == None else verify) and position == 0 and n_bytes == READ_ENTIRE_PATH
+    with PATH_LOCKS.reading(path):
+        total_bytes, chunks, metadata = _open_stream(path, position, n_bytes)
+    if verify and metadata != None:
+        chunks = _verified_chunks(path, chunks, metadata)
+    return total_bytes, chunks
+
+
+# @return tuple: (total_bytes_to_stream: int, chunk_generator, metadata:
+#                FileMetadata of the file streamed from disk, else None)
+def _open_stream(path: str, position: int, n_bytes: int):
+    started = time.perf_counter()
+    contents, tier = PAGE_CACHE.get(path), TIER_MEMORY
+    if contents == None and STORE != None:
+        try:
+            total_bytes, chunks = STORE.stream(path, position, n_bytes)
+        except KeyError:
+            raise DistributedFileNotFound(f"stream: Path {path} doesn't exist!")
+        _record_read(path, TIER_DISK, started)
+        return total_bytes, chunks, _index_get(path)
+    if contents == None:
+        metadata, tier = _ensure_hot(path)
+        contents = PAGE_CACHE.get(path) if tier == TIER_COLD else None # cached by promoting it
+    if contents != None:
+        _record_read(path, tier, started)
+        end = len(contents) if n_bytes == READ_ENTIRE_PATH else min(len(contents), position+n_bytes)
+        view = memoryview(contents)
+        return max(end-position,0), (bytes(view[start:min(start+STREAM_CHUNK_BYTES,end)]) for start in range(position, end, STREAM_CHUNK_BYTES)), None
+    if metadata != None and metadata.encoding != compression.CODEC_IDENTITY:
+        streamed = _stream_decoded(path, metadata, position, n_bytes)
+        _record_read(path, tier, started)
+        return streamed+(metadata,)
+    try:
+        file = open(ROOT_DIRECTORY+path, 'rb')
+    except Exception:
+        raise DistributedFileNotFound(f"stream: Path {path} doesn't exist!")
+    _record_read(path, tier, started)
+    size = os.fstat(file.fileno()).st_size
+    end = size if n_bytes == READ_ENTIRE_PATH else min(size, position+n_bytes)
+    def generate():
+        with file:
+            if end <= position:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(position, end, STREAM_CHUNK_BYTES):
+                    yield mapped[start:min(start+STREAM_CHUNK_BYTES,end)]
+    return max(end-position,0), generate(), metadata
+
+
+# Stream a compressed file's range, decompressing on the fly
+def _stream_decoded(path: str, metadata, position: int, n_bytes: int):
+    _check_unsharded(path, metadata.encoding)
+    try:
+        file = open(ROOT_DIRECTORY+stored_name(path, metadata.encoding), 'rb')
+    except Exception:
+        raise DistributedFileNotFound(f"stream: Path {path} doesn't exist!")
+    end = metadata.size if n_bytes == READ_ENTIRE_PATH else min(metadata.size, position+n_bytes)
+    def generate():
+        with file:
+            offset = 0
+            for chunk in compression.decode_chunks(iter(lambda: file.read(STREAM_CHUNK_BYTES), b''), metadata.encoding):
+                start, stop = max(position-offset, 0), min(end-offset, len(chunk))
+                offset += len(chunk)
+                if start < stop:
+                    yield chunk[start:stop]
+                if offset >= end:
+                    return
+    return max(end-position,0), generate()
+
+
+# Stream <path>'s bytes as stored (still compressed, if it is), so they can be
+# served/replicated without decompressing them. Uncompressed files are
+# checked as in <stream> (compressed ones are checked by the codec's own
+# checksum, once decompressed).
+# @return tuple: (encoding: str, total_bytes_to_stream: int, chunk_generator)
+def stream_stored(path: str, verify: bool = None):
+    with PATH_LOCKS.reading(path):
+        return _open_stream_stored(path, verify)
+
+
+def _open_stream_stored(path: str, verify: bool):
+    started = time.perf_counter()
+    metadata, tier = (_index_get(path), TIER_DISK) if STORE != None else _ensure_hot(path)
+    if STORE != None or metadata == None or metadata.encoding == compression.CODEC_IDENTITY:
+        return (compression.CODEC_IDENTITY,)+stream(path, verify=verify)
+    _check_unsharded(path, metadata.encoding)
+    try:
+        file = open(ROOT_DIRECTORY+stored_name(path, metadata.encoding), 'rb')
+    except Exception:
+        raise DistributedFileNotFound(f"stream_stored: Path {path} doesn't exist!")
+    _record_read(path, tier, started)
+    size = os.fstat(file.fileno()).st_size
+    def generate():
+        with file:
+            yield from iter(lambda: file.read(STREAM_CHUNK_BYTES), b'')
+    return metadata.encoding, size, generate()
+
+
+# Encoding to serve <path> with, given a client's "Accept-Encoding" header:
+# its stored encoding if the client accepts it (so it's sent without
+# decompressing), else identity (decompressed on the fly)
+def negotiate_encoding(path: str, accept_encoding) -> str:
+    encoding = _encoding_of(path)
+    if encoding in compression.accepted_encodings(accept_encoding):
+        return encoding
+    return compression.CODEC_IDENTITY
+
+
+# Get the bytes of <path> if cached (else None)
+def cached_bytes(path: str):
+    started = time.perf_counter()
+    contents = PAGE_CACHE.get(path)
+    if contents != None:
+        _record_read(path, TIER_MEMORY, started)
+    return contents
+
+
+# Absolute on-disk location of <path> (for <sendfile>-backed responses), or
+# None if the storage backend doesn't keep paths in their own files (or
+# <path> is stored compressed)
+def file_path(path: str):
+    with PATH_LOCKS.reading(path):
+        metadata, tier = (_index_get(path), TIER_DISK) if STORE != None else _ensure_hot(path)
+    if metadata == None:
+        raise DistributedFileNotFound(f"file_path: Path {path} doesn't exist!")
+    if STORE != None or metadata.encoding != compression.CODEC_IDENTITY:
+        return None
+    _record_read(path, tier)
+    return os.path.abspath(ROOT_DIRECTORY+path)
+
+
+##############################################################################
+# Atomic Writes
+GROUP_COMMITTER = durability.GroupCommitter(ROOT_DIRECTORY)
+
+def durability_stats() -> dict:
+    return GROUP_COMMITTER.stats()
+
+
+def validate_durability_mode(durability_mode) -> str:
+    if durability_mode == None:
+        return DEFAULT_DURABILITY_MODE
+    try:
+        return durability.validate_mode(durability_mode)
+    except ValueError as err_msg:
+        raise DistributedFileSystemError(f"write: {err_msg}")
+
+
+# Write <chunks> to a fresh temp file, make it durable per <durability_mode>,
+# then rename it over <path>: readers (and crashes) see either the old or the
+# new contents, never a partially written file. Store writes are atomic as is:
+# bitcask discards a torn record (by its CRC) when reloaded, and the chunk
+# store only switches a path to its new chunks by renaming its manifest.
+# <chunks> are already compressed with <encoding> (always identity for stores).
+# @return tuple: (stored_size: int, mtime: float) of the new file
+def _atomic_write(path: str, chunks, durability_mode: str, encoding: str = compression.CODEC_IDENTITY):
+    if STORE != None:
+        return STORE.put_stream(path, chunks, durability_mode != durability.DURABILITY_NONE)
+    target_path = ROOT_DIRECTORY+stored_name(path, encoding)
+    temp_path = ROOT_DIRECTORY+TEMP_FILE_PREFIX+uuid.uuid4().hex
+    try:
+        with open(temp_path, 'xb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+            file.flush()
+            stats = os.fstat(file.fileno())
+            if GROUP_FSYNC:
+                GROUP_COMMITTER.commit(file.fileno(), temp_path, target_path, durability_mode)
+            else:
+                durability.commit(file.fileno(), temp_path, target_path, os.path.dirname(target_path), durability_mode)
+        _remove_stale_encoding(path, encoding)
+        return stats.st_size, stats.st_mtime
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# Once <path> is stored with <encoding>, delete its file under any other
+# encoding (or its cold value)
+def _remove_stale_encoding(path: str, encoding: str):
+    old_encoding = _encoding_of(path)
+    if old_encoding == COLD_ENCODING:
+        _discard_cold(path)
+    elif old_encoding != encoding:
+        try:
+            os.remove(ROOT_DIRECTORY+stored_name(path, old_encoding))
+        except FileNotFoundError:
+            pass
+
+
+##############################################################################
+# Compression Policy
+def validate_compression(encoding) -> str:
+    try:
+        return compression.validate_encoding(encoding)
+    except ValueError as err_msg:
+        raise DistributedFileSystemError(f"write: {err_msg}")
+
+
+# Encoding to store <path> with: <encoding> if given (else per the policy, for
+# <size> bytes if known). Stores never compress.
+def _target_encoding(path: str, encoding, size = None) -> str:
+    if encoding != None:
+        encoding = validate_compression(encoding)
+    if STORE != None:
+        return compression.CODEC_IDENTITY
+    return compression.policy_encoding(path, size) if encoding == None else encoding
+
+
+##############################################################################
+# Write a string to the path (creates a new file if <path> DNE)
+def write(path: str, data: str, durability_mode: str = None, encoding: str = None):
+    write_bytes(path, data.encode('utf-8'), durability_mode, encoding)
+
+
+# Write raw bytes to the path (creates a new file if <path> DNE), compressed
+# with <encoding> (None = per the policy) unless that doesn't shrink them
+def write_bytes(path: str, contents: bytes, durability_mode: str = None, encoding: str = None):
+    durability_mode = validate_durability_mode(durability_mode)
+    encoding = _target_encoding(path, encoding, len(contents))
+    stored_contents = compression.compress(contents, encoding)
+    if len(stored_contents) >= len(contents):
+        encoding, stored_contents = compression.CODEC_IDENTITY, contents
+    with PATH_LOCKS.writing(path):
+        _make_parents(path, durability_mode)
+        try:
+            stored_size, mtime = _atomic_write(path, [stored_contents], durability_mode, encoding)
+        except Exception:
+            raise DistributedFileSystemError(f"write: Path {path} can't be written!")
+        _index_put(path, len(contents), mtime, merkle.content_hash(contents), encoding, stored_size)
+        PAGE_CACHE.put(path, contents, len(contents))
+
+
+# Write an iterable of byte chunks to the path (creates a new file if <path>
+# DNE), hashing incrementally so the whole contents are never in memory.
+# <chunks> are compressed with <content_encoding>: if that's the encoding to
+# store (<encoding>, else <content_encoding> itself if compressed, else per
+# the policy for a <size>-byte file), they're stored as is; otherwise they're
+# recompressed on the fly.
+def write_stream(path: str, chunks, durability_mode: str = None, encoding: str = None, content_encoding: str = compression.CODEC_IDENTITY, size: int = None):
+    durability_mode = validate_durability_mode(durability_mode)
+    content_encoding = validate_compression(content_encoding)
+    if encoding == None and content_encoding != compression.CODEC_IDENTITY:
+        encoding = content_encoding
+    encoding = _target_encoding(path, encoding, size)
+    hasher = merkle.content_hasher()
+    logical_size = 0
+    def consume(chunk: bytes):
+        nonlocal logical_size
+        hasher.update(chunk)
+        logical_size += len(chunk)
+    if encoding == content_encoding:
+        stored_chunks = compression.inspect_chunks(chunks, content_encoding, consume)
+    else:
+        decoded_chunks = compression.inspect_chunks(compression.decode_chunks(chunks, content_encoding), compression.CODEC_IDENTITY, consume)
+        stored_chunks = compression.encode_chunks(decoded_chunks, encoding)
+    with PATH_LOCKS.writing(path):
+        _make_parents(path, durability_mode)
+        try:
+            stored_size, mtime = _atomic_write(path, stored_chunks, durability_mode, encoding)
+        except Exception:
+            raise DistributedFileSystemError(f"write: Path {path} can't be written!")
+        _index_put(path, logical_size, mtime, hasher.hexdigest(), encoding, stored_size)
+        PAGE_CACHE.invalidate(path)
+
+
+##############################################################################
+# Deduplicated writes between chunk stores: a replicated write only carries
+# the chunks the receiver doesn't already hold
+# @return list: <path>'s chunks as [(hash, size), ...], or None if this
+#               machine doesn't use the chunk store
+def chunk_manifest(path: str):
+    if not isinstance(STORE, chunkstore.ChunkStore):
+        return None
+    try:
+        with PATH_LOCKS.reading(path):
+            return STORE.manifest(path)
+    except KeyError:
+        raise DistributedFileNotFound(f"chunk_manifest: Path {path} doesn't exist!")
+
+
+def read_chunk(chunk_hash: str) -> bytes:
+    return STORE.read_chunk(chunk_hash)
+
+
+# @return list: the hashes in <chunk_hashes> that we don't hold
+def missing_chunks(chunk_hashes: list) -> list:
+    if not isinstance(STORE, chunkstore.ChunkStore):
+        raise DistributedFileSystemError("missing_chunks: this machine doesn't use the chunk store!")
+    return STORE.missing(chunk_hashes)
+
+
+# Write <path> as <chunks> ([(hash, size), ...]), reading the bytes of each
+# chunk in <included> via <read_chunk(size)> (see <ChunkStore.put_manifest>)
+def write_chunks(path: str, chunks: list, included: set, read_chunk, durability_mode: str = None):
+    durability_mode = validate_durability_mode(durability_mode)
+    if not isinstance(STORE, chunkstore.ChunkStore):
+        raise DistributedFileSystemError("write_chunks: this machine doesn't use the chunk store!")
+    with PATH_LOCKS.writing(path):
+        _make_parents(path, durability_mode, 'write_chunks')
+        try:
+            size, mtime = STORE.put_manifest(path, chunks, included, read_chunk, durability_mode != durability.DURABILITY_NONE)
+        except KeyError as chash:
+            raise DistributedFileSystemError(f"write_chunks: Path {path} needs chunk {chash}, which we don't hold!")
+        except Exception:
+            raise DistributedFileSystemError(f"write: Path {path} can't be written!")
+        _index_put(path, size, mtime, hash_file(path))
+        PAGE_CACHE.invalidate(path)
+
+
+##############################################################################
+# Stripe manifests: a file striped across families is held as its manifest,
+# flagged as such in its metadata by <write_manifest> alone (never inferred
+# from its bytes, which any write could forge). The flag follows the file
+# through renames, tiering and repairs, and any other write clears it.
+def write_manifest(path: str, contents: bytes, durability_mode: str = None):
+    with PATH_LOCKS.writing(path):
+        write_bytes(path, contents, durability_mode)
+        _index_set_striped(path, True)
+    save_index_snapshot() # only the index knows it's a manifest: persist that now
+
+
+def is_striped(path: str) -> bool:
+    metadata = _index_get(path)
+    return metadata != None and metadata.striped
+
+
+##############################################################################
+# Delta-encoded rewrites (see <delta.py>): a replica holding a file's previous
+# version is sent the new one as a delta against it
+# @return tuple: (stamp, signatures: delta.Signatures) of <path>'s current
+#                version, to encode its next version against
+def delta_signatures(path: str):
+    with PATH_LOCKS.reading(path):
+        metadata = _index_get(path)
+        if metadata == None:
+            raise DistributedFileNotFound(f"delta_signatures: Path {path} doesn't exist!")
+        _check_unsharded(path, metadata.encoding)
+        contents = _load_contents(path)[0]
+    return metadata.stamp, delta.signatures(contents)
+
+
+# @return tuple: (stamp, checksum: str, encoding: str, delta: bytes) of
+#                <path>'s current version, with its delta against the version
+#                with <old_signatures> (None if it isn't worth sending)
+def delta_against(path: str, old_signatures):
+    with PATH_LOCKS.reading(path):
+        metadata = _index_get(path)
+        if metadata == None:
+            raise DistributedFileNotFound(f"delta_against: Path {path} doesn't exist!")
+        _check_unsharded(path, metadata.encoding)
+        contents = _load_contents(path)[0]
+    encoding = metadata.encoding if metadata.encoding in compression.ENCODINGS else compression.CODEC_IDENTITY
+    return metadata.stamp, metadata.checksum, encoding, delta.encode(old_signatures, contents)
+
+
+# Rewrite <path> from <delta_bytes>, a delta against its version stamped
+# <base_stamp>, which must rebuild a file with content hash <checksum>
+# (stored with <encoding>, None = per the policy)
+# @return bool: False if we don't hold that version (nor the rebuilt one)
+def write_delta(path: str, delta_bytes: bytes, base_stamp, checksum: str, durability_mode: str = None, encoding: str = None) -> bool:
+    with PATH_LOCKS.writing(path):
+        metadata = _index_get(path)
+        if metadata != None and metadata.checksum == checksum:
+            return True
+        if metadata == None or metadata.stamp == None or metadata.stamp != base_stamp:
+            return False
+        _check_unsharded(path, metadata.encoding)
+        try:
+            contents = delta.decode(delta_bytes, _load_contents(path)[0])
+        except ValueError as err_msg:
+            raise DistributedFileSystemError(f"write_delta: Path {path} got a bad delta ({err_msg})!")
+        if merkle.content_hash(contents) != checksum:
+            raise DistributedFileSystemError(f"write_delta: Path {path} was rebuilt with the wrong checksum!")
+        write_bytes(path, contents, durability_mode, encoding)
+    return True
+
+
+##############################################################################
+# Erasure-coded shards (files backend only): a machine may hold just one shard
+# of a large file. Its index entry keeps the whole file's size and checksum
+# (also in the shard's header), so its merkle tree still matches its peers'.
+# @return int: the index of the shard of <path> we hold (None if we hold all
+#              of it, or nothing)
+def shard_index(path: str):
+    if _encoding_of(path) != SHARD_ENCODING:
+        return None
+    try:
+        return _shard_header(path)[0]
+    except Exception:
+        return None
+
+
+# Hold only shard <index> (of <k>+<m>) of the <size>-byte <path> whose content
+# hash is <checksum>, instead of the whole file
+def write_shard(path: str, index: int, k: int, m: int, size: int, checksum: str, shard: bytes, durability_mode: str = None):
+    durability_mode = validate_durability_mode(durability_mode)
+    if STORE != None:
+        raise DistributedFileSystemError(f"write_shard: the \"{STORAGE_BACKEND}\" storage backend can't hold shards!")
+    with PATH_LOCKS.writing(path):
+        _make_parents(path, durability_mode, 'write_shard')
+        try:
+            erasure.validate_shape(k, m)
+            header = erasure.pack_header(index, k, m, size, checksum)
+            stored_size, mtime = _atomic_write(path, [header, shard], durability_mode, SHARD_ENCODING)
+        except Exception:
+            raise DistributedFileSystemError(f"write_shard: Path {path} can't be written!")
+        _index_put(path, size, mtime, checksum, SHARD_ENCODING, stored_size)
+        PAGE_CACHE.invalidate(path)
+
+
+# @return tuple: (index: int, k: int, m: int, size: int, checksum: str, shard: bytes)
+#                of the shard of <path> we hold
+def read_shard(path: str):
+    if _encoding_of(path) != SHARD_ENCODING:
+        raise DistributedFileNotFound(f"read_shard: No shard of path {path} is held here!")
+    try:
+        with PATH_LOCKS.reading(path), open(ROOT_DIRECTORY+stored_name(path, SHARD_ENCODING), 'rb') as file:
+            header = erasure.unpack_header(file.read(erasure.SHARD_HEADER_BYTES))
+            return header+(file.read(),)
+    except Exception:
+        raise DistributedFileNotFound(f"read_shard: Path {path} doesn't exist!")
+
+
+# Shard <index> (of <k>+<m>) of <path>: encoded from our whole copy, or the
+# shard we hold if it's that one
+# @return tuple: (size: int, checksum: str, shard: bytes), size and checksum
+#                being the whole file's
+def encode_shard(path: str, index: int, k: int, m: int):
+    with PATH_LOCKS.reading(path):
+        if _encoding_of(path) == SHARD_ENCODING:
+            held_index, held_k, held_m, size, checksum, shard = read_shard(path)
+            if (held_index, held_k, held_m) != (index, k, m):
+                raise DistributedFileSharded(f"encode_shard: Path {path} is only held as another shard here!")
+            return size, checksum, shard
+        try:
+            contents = read_contents(path)
+        except Exception:
+            raise DistributedFileNotFound(f"encode_shard: Path {path} doesn't exist!")
+    return len(contents), merkle.content_hash(contents), erasure.encode_shard(contents, index, k, m)
+
+
+# Every path we only hold a shard of
+def sharded_paths() -> list:
+    with _index_lock:
+        return [path for path, metadata in _index.items() if metadata.encoding == SHARD_ENCODING]
+
+
+##############################################################################
+# Hot/Cold Tiering: reads are counted per path (decaying over time), <retier>
+# demotes idle files to the cold pack and reloads hot ones into the page
+# cache, and any access to a cold file promotes it back to disk first
+_tier_stats_lock = threading.Lock()
+_read_tracker = {} # {path: (last_read: float, decayed_reads: float), ...}
+_tier_moves = {'promotions': 0, 'demotions': 0}
+_tier_reads = {tier: [0, 0.0] for tier in TIERS} # {tier: [reads, total seconds], ...}
+
+
+def _decayed_reads(entry, now: float) -> float:
+    return entry[1] * 0.5**((now-entry[0])/HOT_TIER_HALF_LIFE_SECONDS)
+
+
+# Count a read of <path> served from <tier>, timed from <started> (a
+# <time.perf_counter>; None if the read's latency isn't ours to measure, as
+# for <sendfile>)
+def _record_read(path: str, tier: str, started: float = None):
+    now = time.time()
+    with _tier_stats_lock:
+        entry = _read_tracker.get(path)
+        _read_tracker[path] = (now, 1 if entry == None else _decayed_reads(entry, now)+1)
+        if started != None:
+            _tier_reads[tier][0] += 1
+            _tier_reads[tier][1] += time.perf_counter()-started
+
+
+# Stop tracking <old_path>'s reads (carrying them over to <new_path>, if given)
+def _forget_reads(old_path: str, new_path: str = None):
+    with _tier_stats_lock:
+        entry = _read_tracker.pop(old_path, None)
+        if new_path != None and entry != None:
+            _read_tracker[new_path] = entry
+
+
+# @return tuple: (metadata: FileMetadata, tier: str) <path>'s metadata once
+#                it's back on disk, and the tier it was in
+def _ensure_hot(path: str):
+    metadata = _index_get(path)
+    if metadata == None or metadata.encoding != COLD_ENCODING:
+        return metadata, TIER_DISK
+    return _promote(path), TIER_COLD
+
+
+# Move cold <path> back to disk, stored with the encoding it had before (and
+# with its old mtime). Its contents also go in the page cache, since they're
+# about to be read. The file is linked into place, so a concurrent write of
+# <path> always wins.
+# @return FileMetadata: <path>'s metadata afterwards
+def _promote(path: str):
+    with _promote_locks.writing(path):
+        metadata = _index_get(path)
+        if metadata == None or metadata.encoding != COLD_ENCODING:
+            return metadata
+        try:
+            value = _cold_store().get(path)
+            mtime, _, _, encoding, packed_encoding = _unpack_cold_header(value)
+            packed = value[COLD_HEADER.size:]
+            contents = compression.decompress(packed, packed_encoding)
+            if merkle.content_hash(contents) != metadata.checksum:
+                _flag_corrupt(path, metadata, 'corrupt_reads')
+                raise DistributedFileCorrupt(f"promote: Path {path} is corrupt in the cold tier (its contents don't match its checksum)!")
+            temp_path = ROOT_DIRECTORY+TEMP_FILE_PREFIX+uuid.uuid4().hex
+            try:
+                with open(temp_path, 'xb') as file:
+                    file.write(packed if packed_encoding == encoding else compression.compress(contents, encoding))
+                    file.flush()
+                    durability.sync_data(file.fileno()) # the cold value is dropped next
+                    stored_size = os.fstat(file.fileno()).st_size
+                os.utime(temp_path, (mtime, mtime))
+                os.link(temp_path, ROOT_DIRECTORY+stored_name(path, encoding))
+            finally:
+                os.remove(temp_path)
+        except FileExistsError: # rewritten meanwhile
+            return _index_get(path)
+        except DistributedFileCorrupt:
+            raise
+        except Exception:
+            raise DistributedFileSystemError(f"promote: Path {path} can't be moved out of the cold tier!")
+        promoted = _index_retier(path, metadata, encoding, stored_size)
+        if promoted == None:
+            return _index_get(path)
+        _discard_cold(path)
+    PAGE_CACHE.put(path, contents, len(contents), lambda: _index_get(path) is promoted)
+    with _tier_stats_lock:
+        _tier_moves['promotions'] += 1
+    return promoted
+
+
+# Move <path> (whose metadata was <metadata>) into the cold pack, unless it's
+# changed by the time it's been recompressed
+# @return bool: whether it was demoted
+def _demote(path: str, metadata) -> bool:
+    source_path = ROOT_DIRECTORY+stored_name(path, metadata.encoding)
+    try:
+        inode = os.stat(source_path).st_ino
+        with open(source_path, 'rb') as file:
+            stored = file.read()
+    except FileNotFoundError:
+        return False
+    packed_encoding, packed = metadata.encoding, stored
+    if metadata.encoding != COLD_TIER_CODEC:
+        repacked = compression.compress(compression.decompress(stored, metadata.encoding), COLD_TIER_CODEC)
+        if len(repacked) < len(stored):
+            packed_encoding, packed = COLD_TIER_CODEC, repacked
+    value = COLD_HEADER.pack(metadata.mtime, metadata.size, bytes.fromhex(metadata.checksum), compression.ENCODINGS.index(metadata.encoding), compression.ENCODINGS.index(packed_encoding))+packed
+    with PATH_LOCKS.writing(path):
+        if _index_get(path) is not metadata:
+            return False
+        _cold_store(True).put(path, value, True)
+        if _index_retier(path, metadata, COLD_ENCODING, len(value)) == None:
+            _discard_cold(path)
+            return False
+        parked_path = ROOT_DIRECTORY+TEMP_FILE_PREFIX+uuid.uuid4().hex
+        os.rename(source_path, parked_path)
+        if os.stat(parked_path).st_ino != inode: # a write renamed its file in since: put it back
+            try:
+                os.link(parked_path, source_path)
+            except FileExistsError:
+                pass
+        os.remove(parked_path)
+    PAGE_CACHE.invalidate(path)
+    with _tier_stats_lock:
+        _tier_moves['demotions'] += 1
+    return True
+
+
+# Demote every file idle (neither read nor written) for <COLD_TIER_IDLE_SECONDS>,
+# drop cold values that a write raced past, and reload hot files that were
+# evicted from the page cache (up to half of it, hottest first)
+# >> NOTE: reads are only tracked in memory, so after a restart a file's
+#          idle time counts from its mtime
+# @return tuple: (demoted: int, reloaded: int)
+def retier():
+    if STORE != None:
+        return 0, 0
+    now = time.time()
+    with _index_lock:
+        files = list(_index.items())
+    with _tier_stats_lock:
+        reads = {path: (entry[0], _decayed_reads(entry, now)) for path, entry in _read_tracker.items()}
+    demoted = 0
+    if COLD_TIER_IDLE_SECONDS != None:
+        for path, metadata in files:
+            last_access = max(metadata.mtime, reads.get(path, (0, 0))[0])
+            if metadata.encoding in compression.ENCODINGS and metadata.size <= COLD_TIER_MAX_BYTES and path not in UNCOUNTED_PATHS and now-last_access >= COLD_TIER_IDLE_SECONDS:
+                demoted += _demote(path, metadata)
+    cold_store = _cold_store()
+    if cold_store != None:
+        for path in cold_store.items():
+            with PATH_LOCKS.writing(path): # not mid demotion
+                if _encoding_of(path) != COLD_ENCODING:
+                    _discard_cold(path)
+    reloaded = reloaded_bytes = 0
+    for path, (_, decayed_reads) in sorted(reads.items(), key=lambda item: -item[1][1]):
+        metadata = _index_get(path)
+        if decayed_reads < HOT_TIER_MIN_READS or reloaded_bytes >= PAGE_CACHE.max_bytes//2:
+            break
+        if metadata == None or metadata.encoding not in compression.ENCODINGS or metadata.size > PAGE_CACHE.max_entry_bytes or PAGE_CACHE.contains(path):
+            continue
+        try:
+            contents = _read_stored(path, metadata.encoding)
+        except Exception:
+            continue
+        PAGE_CACHE.put(path, contents, len(contents), lambda: _index_get(path) is metadata)
+        reloaded += 1
+        reloaded_bytes += len(contents)
+    return demoted, reloaded
+
+
+# @return dict: files and bytes per tier (cached files are on disk/cold too),
+#               the number of hot files, promotion/demotion counts, and the
+#               number and mean latency (ms) of reads served from each tier
+def tier_stats() -> dict:
+    now = time.time()
+    tiers = {tier: {'files': 0, 'bytes': 0, 'stored_bytes': 0} for tier in [TIER_DISK, TIER_COLD]}
+    with _index_lock:
+        for metadata in _index.values():
+            tier = tiers[TIER_COLD if metadata.encoding == COLD_ENCODING else TIER_DISK]
+            tier['files'] += 1
+            tier['bytes'] += metadata.size
+            tier['stored_bytes'] += metadata.stored_size
+    cache = PAGE_CACHE.stats()
+    tiers[TIER_MEMORY] = {'files': cache['entries'], 'bytes': cache['bytes'], 'stored_bytes': cache['bytes']}
+    cold_store = _cold_store()
+    if cold_store != None:
+        tiers[TIER_COLD]['pack'] = cold_store.stats()
+    with _tier_stats_lock:
+        hot_files = sum(1 for entry in _read_tracker.values() if _decayed_reads(entry, now) >= HOT_TIER_MIN_READS)
+        reads = {tier: {'reads': count, 'mean_ms': round(1000*seconds/count, 3) if count > 0 else 0.0} for tier, (count, seconds) in _tier_reads.items()}
+        moves = dict(_tier_moves)
+    return {'tiers': tiers, 'hot_files': hot_files, 'reads': reads, 'idle_seconds': COLD_TIER_IDLE_SECONDS if STORE == None else None, **moves}
+
+
+# Write all of <contents> to <fd>, at byte <offset> if given
+def _write_fully(fd: int, contents: bytes, offset: int = None):
+    view = memoryview(contents)
+    while len(view) > 0:
+        written = os.write(fd, view) if offset == None else os.pwrite(fd, view, offset)
+        view = view[written:]
+        if offset != None:
+            offset += written
+
+
+# Compressed files can't be updated in place: store <path> decompressed first
+# (it stays so until its next whole-file write)
+def _inflate(path: str, durability_mode: str):
+    metadata = _index_get(path) if STORE != None else _ensure_hot(path)[0]
+    if STORE != None or metadata == None or metadata.encoding == compression.CODEC_IDENTITY:
+        return
+    _check_unsharded(path, metadata.encoding)
+    contents = read_contents(path)
+    _, mtime = _atomic_write(path, [contents], durability_mode)
+    _index_put(path, len(contents), mtime, metadata.checksum)
+
+
+##############################################################################
+# Append raw bytes to the path in place via O_APPEND (creates a new file if
+# <path> DNE). The running content hash of recently appended-to paths is kept
+# so appending doesn't rehash the whole file. Replicas pass the <offset> the
+# UVM appended at: if the file isn't that long (or is longer, e.g. when a
+# replayed whole-file write already held these bytes), they're written there
+# via <write_at> instead, so replaying an append never duplicates its bytes.
+# @return int: the file's new length
+_append_hashers = OrderedDict() # {path: (version, hasher)}, least recently used first
+_append_hashers_lock = threading.Lock()
+
+def _appended_hasher(path: str, metadata):
+    with _append_hashers_lock:
+        entry = _append_hashers.pop(path, None)
+    if entry != None and metadata != None and entry[0] == metadata.version:
+        return entry[1]
+    if metadata == None:
+        return merkle.content_hasher()
+    return file_hasher(path)
+
+
+def append_bytes(path: str, contents: bytes, durability_mode: str = None, offset: int = None) -> int:
+    durability_mode = validate_durability_mode(durability_mode)
+    with PATH_LOCKS.writing(path):
+        metadata = _index_get(path)
+        if offset != None and offset != (0 if metadata == None else metadata.size):
+            return write_at(path, offset, contents, durability_mode)
+        _make_parents(path, durability_mode, 'append')
+        try:
+            _inflate(path, durability_mode)
+            metadata = _index_get(path)
+            hasher = _appended_hasher(path, metadata)
+            if STORE != None:
+                size, mtime, _ = _store_rewrite(path, lambda value: value+contents, durability_mode)
+            else:
+                fd = os.open(ROOT_DIRECTORY+path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+                try:
+                    _write_fully(fd, contents)
+                    if durability_mode != durability.DURABILITY_NONE:
+                        durability.sync_data(fd)
+                    stats = os.fstat(fd)
+                finally:
+                    os.close(fd)
+                size, mtime = stats.st_size, stats.st_mtime
+                if durability_mode == durability.DURABILITY_FSYNC_DATA_AND_DIR and metadata == None:
+                    durability.sync_directory(os.path.dirname(ROOT_DIRECTORY+path))
+        except Exception:
+            raise DistributedFileSystemError(f"append: Path {path} can't be appended!")
+        hasher.update(contents)
+        version = _index_put(path, size, mtime, hasher.copy().hexdigest())
+        with _append_hashers_lock:
+            _append_hashers[path] = (version, hasher)
+            while len(_append_hashers) > APPEND_HASHER_CACHE_ENTRIES:
+                _append_hashers.popitem(last=False)
+        PAGE_CACHE.invalidate(path)
+    return size
+
+
+##############################################################################
+# Stores have no in-place updates: rewrite <path>'s whole value as
+# <update(old_value)> instead (cheap for bitcask's small values, and the chunk
+# store only writes the chunks that changed)
+# @return tuple: (size: int, mtime: float, new_value: bytes)
+def _store_rewrite(path: str, update, durability_mode: str, must_exist: bool = False):
+    try:
+        value = STORE.get(path)
+    except KeyError:
+        if must_exist:
+            raise
+        value = b''
+    value = update(value)
+    return len(value), STORE.put(path, value, durability_mode != durability.DURABILITY_NONE), value
+
+
+# <value> with <contents> written at byte <offset> (zero-filling any gap)
+def _spliced(value: bytes, offset: int, contents: bytes) -> bytes:
+    return value[:offset]+b'\0'*max(0, offset-len(value))+contents+value[offset+len(contents):]
+
+
+##############################################################################
+# Write raw bytes at byte <offset> of the path in place via pwrite (creates a
+# new file if <path> DNE; any gap past the old EOF reads back as zeros).
+# >> NOTE: unlike <write_bytes>, this isn't atomic! A crash mid-write can leave
+#          only part of the range written.
+# @return int: the file's new length
+def write_at(path: str, offset: int, contents: bytes, durability_mode: str = None) -> int:
+    if offset < 0:
+        raise DistributedFileSystemError(f"write_at: offset {offset} can't be negative!")
+    durability_mode = validate_durability_mode(durability_mode)
+    with PATH_LOCKS.writing(path):
+        _make_parents(path, durability_mode, 'write_at')
+        created = _index_get(path) == None
+        try:
+            _inflate(path, durability_mode)
+            if STORE != None:
+                size, mtime, value = _store_rewrite(path, lambda value: _spliced(value, offset, contents), durability_mode)
+                checksum = merkle.content_hash(value)
+            else:
+                fd = os.open(ROOT_DIRECTORY+path, os.O_WRONLY | os.O_CREAT, 0o666)
+                try:
+                    _write_fully(fd, contents, offset)
+                    if durability_mode != durability.DURABILITY_NONE:
+                        durability.sync_data(fd)
+                    stats = os.fstat(fd)
+                finally:
+                    os.close(fd)
+                size, mtime = stats.st_size, stats.st_mtime
+                if durability_mode == durability.DURABILITY_FSYNC_DATA_AND_DIR and created:
+                    durability.sync_directory(os.path.dirname(ROOT_DIRECTORY+path))
+                checksum = hash_file(path)
+        except Exception:
+            raise DistributedFileSystemError(f"write_at: Path {path} can't be written!")
+        _index_put(path, size, mtime, checksum)
+        PAGE_CACHE.invalidate(path)
+    return size
+
+
+##############################################################################
+# Truncate (or zero-extend) <path> to <length> bytes
+def truncate(path: str, length: int, durability_mode: str = None):
+    if length < 0:
+        raise DistributedFileSystemError(f"truncate: length {length} can't be negative!")
+    durability_mode = validate_durability_mode(durability_mode)
+    with PATH_LOCKS.writing(path):
+        if _index_get(path) == None:
+            raise DistributedFileNotFound(f"truncate: Path {path} doesn't exist!")
+        try:
+            _inflate(path, durability_mode)
+            if STORE != None:
+                size, mtime, value = _store_rewrite(path, lambda value: value[:length]+b'\0'*max(0, length-len(value)), durability_mode, True)
+                checksum = merkle.content_hash(value)
+            else:
+                fd = os.open(ROOT_DIRECTORY+path, os.O_WRONLY)
+                try:
+                    os.ftruncate(fd, length)
+                    if durability_mode != durability.DURABILITY_NONE:
+                        durability.sync_data(fd)
+                    stats = os.fstat(fd)
+                finally:
+                    os.close(fd)
+                size, mtime = stats.st_size, stats.st_mtime
+                checksum = hash_file(path)
+        except Exception:
+            raise DistributedFileSystemError(f"truncate: Path {path} can't be truncated!")
+        _index_put(path, size, mtime, checksum)
+        PAGE_CACHE.invalidate(path)
+
+
+##############################################################################
+# Delete the file <path> (see <rmdir> for directories)
+def delete(path: str):
+    with PATH_LOCKS.writing(path):
+        try:
+            if STORE != None:
+                STORE.delete(path)
+            elif _encoding_of(path) == COLD_ENCODING:
+                _cold_store().delete(path)
+            else:
+                os.remove(ROOT_DIRECTORY+stored_name(path, _encoding_of(path)))
+                _discard_cold(path) # left behind by a write racing its demotion
+        except Exception:
+            raise DistributedFileNotFound(f"delete: Path {path} doesn't exist!")
+        _index_remove(path)
+        PAGE_CACHE.invalidate(path)
+    _forget_reads(path)
+
+
+##############################################################################
+# Copy <src_path> to <dest_path> (compressed files are copied as is)
+def copy(src_path: str, dest_path: str):
+    with PATH_LOCKS.locking(reads=[src_path], writes=[dest_path]):
+        if NAMESPACE.is_directory(src_path):
+            raise DistributedFileSystemError(f"copy: Path {src_path} is a directory!")
+        _make_parents(dest_path, validate_durability_mode(None), 'copy')
+        metadata = _index_get(src_path) if STORE != None else _ensure_hot(src_path)[0]
+        encoding = compression.CODEC_IDENTITY if metadata == None else metadata.encoding
+        try:
+            if STORE != None:
+                mtime = STORE.copy(src_path, dest_path) # metadata-only in the chunk store
+                size = stored_size = STORE.items()[dest_path][0]
+            else:
+                shutil.copyfile(ROOT_DIRECTORY+stored_name(src_path, encoding),ROOT_DIRECTORY+stored_name(dest_path, encoding))
+                _remove_stale_encoding(dest_path, encoding)
+                stats = os.stat(ROOT_DIRECTORY+stored_name(dest_path, encoding))
+                size, stored_size, mtime = stats.st_size, stats.st_size, stats.st_mtime
+        except Exception as e:
+            raise DistributedFileNotFound(f"copy: Path {src_path} doesn't exist!")
+        if metadata != None:
+            size, checksum = metadata.size, metadata.checksum
+        else:
+            checksum = hash_file(dest_path)
+        _index_put(dest_path, size, mtime, checksum, encoding, stored_size)
+        PAGE_CACHE.invalidate(dest_path)
+
+
+##############################################################################
+# Rename <old_path> as <new_path> (a file, or a directory with all it holds)
+def rename(old_path: str, new_path: str):
+    if NAMESPACE.is_directory(old_path):
+        return _rename_directory(old_path, new_path)
+    with PATH_LOCKS.writing(old_path, new_path):
+        _make_parents(new_path, validate_durability_mode(None), 'rename')
+        metadata = _index_get(old_path) if STORE != None else _ensure_hot(old_path)[0]
+        encoding = compression.CODEC_IDENTITY if metadata == None else metadata.encoding
+        try:
+            if STORE != None:
+                mtime = STORE.rename(old_path, new_path)
+            else:
+                os.rename(ROOT_DIRECTORY+stored_name(old_path, encoding),ROOT_DIRECTORY+stored_name(new_path, encoding))
+                _remove_stale_encoding(new_path, encoding)
+        except Exception as e:
+            raise DistributedFileNotFound(f"rename: Path {old_path} doesn't exist!")
+        checksum = metadata.checksum if metadata != None else hash_file(new_path)
+        if STORE != None:
+            size = stored_size = STORE.items()[new_path][0] if metadata == None else metadata.size
+        else:
+            stats = os.stat(ROOT_DIRECTORY+stored_name(new_path, encoding))
+            size = stats.st_size if metadata == None else metadata.size
+            stored_size, mtime = stats.st_size, stats.st_mtime
+        _index_remove(old_path)
+        _index_put(new_path, size, mtime, checksum, encoding, stored_size)
+        _index_set_striped(new_path, metadata != None and metadata.striped)
+        PAGE_CACHE.rename(old_path, new_path)
+    _forget_reads(old_path, new_path)
+
+
+# Rename the directory <old_path> as <new_path>: a single rename on disk
+# (files backend), and moving its node in <NAMESPACE>. Only the flat index
+# (and the store backends' keys) need each file in it re-keyed.
+def _rename_directory(old_path: str, new_path: str):
+    _validate_path(new_path, 'rename')
+    with PATH_LOCKS.writing(old_path, new_path):
+        if not NAMESPACE.is_directory(old_path):
+            raise DistributedFileNotFound(f"rename: Path {old_path} doesn't exist!")
+        if namespace.is_within(new_path, old_path):
+            raise DistributedFileSystemError(f"rename: Directory {old_path} can't be moved into itself!")
+        if NAMESPACE.kind(new_path) != None:
+            raise DistributedFileSystemError(f"rename: Path {new_path} already exists!")
+        moved = lambda path: new_path+path[len(old_path):]
+        files = NAMESPACE.files_within(old_path)
+        directories = [old_path]+NAMESPACE.directories_within(old_path)
+        try:
+            new_parent = namespace.parent(new_path)
+            if new_parent != namespace.ROOT_PATH:
+                _create_directory(new_parent, validate_durability_mode(None))
+            if STORE == None:
+                os.rename(ROOT_DIRECTORY+old_path, ROOT_DIRECTORY+new_path)
+                for path in files:
+                    if _encoding_of(path) == COLD_ENCODING:
+                        _cold_store().rename(path, moved(path))
+            else:
+                for path in files:
+                    STORE.rename(path, moved(path))
+                for directory in directories:
+                    if STORE.contains(_directory_key(directory)):
+                        STORE.rename(_directory_key(directory), _directory_key(moved(directory)))
+                    else:
+                        STORE.put(_directory_key(moved(directory)), b'')
+        except Exception:
+            raise DistributedFileSystemError(f"rename: Directory {old_path} can't be renamed as {new_path}!")
+        NAMESPACE.move_directory(old_path, new_path)
+        _index_move([(path, moved(path)) for path in files])
+        for path in files:
+            PAGE_CACHE.rename(path, moved(path))
+            with _append_hashers_lock:
+                _append_hashers.pop(path, None)
+    for path in files:
+        _forget_reads(path, moved(path))
+
+
+##############################################################################
+# Directories: created with any missing parents (writes create them too), and
+# only removed once empty
+# @return bool: whether <path> was created (False if it already existed)
+def mkdir(path: str, durability_mode: str = None) -> bool:
+    durability_mode = validate_durability_mode(durability_mode)
+    _validate_path(path, 'mkdir')
+    with PATH_LOCKS.writing(path):
+        if _index_get(path) != None:
+            raise DistributedFileSystemError(f"mkdir: Path {path} is a file!")
+        try:
+            return len(_create_directory(path, durability_mode)) > 0
+        except OSError:
+            raise DistributedFileSystemError(f"mkdir: Path {path} can't be created!")
+
+
+def rmdir(path: str):
+    _validate_path(path, 'rmdir')
+    with PATH_LOCKS.writing(path):
+        if path == namespace.ROOT_PATH or not NAMESPACE.is_directory(path):
+            raise DistributedFileNotFound(f"rmdir: Directory {path} doesn't exist!")
+        if NAMESPACE.entry_count(path) > 0:
+            raise DistributedFileSystemError(f"rmdir: Directory {path} isn't empty!")
+        try:
+            if STORE == None:
+                os.rmdir(ROOT_DIRECTORY+path)
+            elif STORE.contains(_directory_key(path)):
+                STORE.delete(_directory_key(path))
+        except Exception:
+            raise DistributedFileSystemError(f"rmdir: Directory {path} can't be removed!")
+        NAMESPACE.rmdir(path)
+
+
+def is_directory(path: str) -> bool:
+    return NAMESPACE.is_directory(path)
+
+
+# One page of the directory <path>'s entries named <prefix>..., in name order,
+# starting after the name <start_after>. Pass the page's <next> as the next
+# call's <start_after> to get the following page (None = no more pages).
+# @return dict: {'entries': [{'name': str, 'type': 'file'|'directory',
+#               'size': int, 'mtime': float}, ...], 'next': str}
+#               (directories have no size/mtime)
+def list_directory(path: str = namespace.ROOT_PATH, prefix: str = '', start_after: str = '', limit: int = namespace.MAX_LIST_ENTRIES) -> dict:
+    try:
+        names, truncated = NAMESPACE.list(path, prefix, start_after, limit)
+    except ValueError as err_msg:
+        raise DistributedFileSystemError(f"list: {err_msg}")
+    except OSError:
+        raise DistributedFileNotFound(f"list: Directory {path} doesn't exist!")
+    entries = []
+    for name, is_directory in names:
+        if is_directory:
+            entries.append({'name': name, 'type': 'directory'})
+            continue
+        metadata = _index_get(namespace.join(path, name))
+        if metadata != None: # else deleted since
+            entries.append({'name': name, 'type': 'file', 'size': metadata.size, 'mtime': metadata.mtime})
+    return {'entries': entries, 'next': names[-1][0] if truncated else None}
+
+
+# One page of every file whose path starts with <prefix> (in any directory
+# below), in path order (see <namespace.path_key>), starting after the path
+# <start_after>. Pass the page's <next> as the next call's <start_after>.
+# @return dict: {'files': [{'path': str, 'size': int, 'mtime': float}, ...],
+#               'next': str}
+def list_files(prefix: str = '', start_after: str = '', limit: int = namespace.MAX_LIST_ENTRIES) -> dict:
+    try:
+        paths, truncated = NAMESPACE.walk(prefix, start_after, limit)
+    except ValueError as err_msg:
+        raise DistributedFileSystemError(f"list_files: {err_msg}")
+    files = []
+    for path in paths:
+        metadata = _index_get(path)
+        if metadata != None: # else deleted since
+            files.append({'path': path, 'size': metadata.size, 'mtime': metadata.mtime})
+    return {'files': files, 'next': paths[-1] if truncated else None}
+
+
+##############################################################################
+# Check if the file <path> exists
+def exists(path: str) -> bool:
+    return _index_get(path) != None
+
+
+##############################################################################
+# Get <path>'s metadata
+# @return dict: {'size': int, 'mtime': float, 'version': int, 'checksum': str,
+#               'encoding': str, 'stored_size': int}
+#               (or {'type': 'directory', 'entries': int} for a directory)
+def stat(path: str) -> dict:
+    metadata = _index_get(path)
+    if metadata == None:
+        if NAMESPACE.is_directory(path):
+            return {'type': 'directory', 'entries': NAMESPACE.entry_count(path)}
+        raise DistributedFileNotFound(f"stat: Path {path} doesn't exist!")
+    return metadata.to_json()
+
+
+##############################################################################
+# Re-anchor our FS operations to <root_directory> (used by <fs_metrics.py> to
+# benchmark against a scratch directory), then rebuild the index from it
+def mount(root_directory: str):
+    global ROOT_DIRECTORY, INDEX_SNAPSHOT_FILENAME
+    ROOT_DIRECTORY = os.path.join(root_directory, '')
+    INDEX_SNAPSHOT_FILENAME = os.path.normpath(root_directory)+'-index.json'
+    GROUP_COMMITTER.directory = ROOT_DIRECTORY
+    use_storage_backend(STORAGE_BACKEND)
+
+
+##############################################################################
+# Switch this machine to <backend> (one of <STORAGE_BACKENDS>, None = "files"),
+# then rebuild the index from it. Called once a UVM/RVM knows its family.
+def use_storage_backend(backend):
+    global STORAGE_BACKEND, STORE, COLD_STORE
+    backend = STORAGE_BACKEND_FILES if backend == None or len(backend) == 0 else backend
+    if backend not in STORAGE_BACKENDS:
+        raise DistributedFileSystemError(f"use_storage_backend: unknown backend \"{backend}\" (expected one of: {', '.join(STORAGE_BACKENDS)})")
+    if STORE != None:
+        STORE.close()
+    STORAGE_BACKEND = backend
+    if backend == STORAGE_BACKEND_BITCASK:
+        STORE = bitcask.Bitcask(ROOT_DIRECTORY+BITCASK_DIRECTORY_NAME)
+    elif backend == STORAGE_BACKEND_CHUNKS:
+        STORE = chunkstore.ChunkStore(ROOT_DIRECTORY+CHUNKSTORE_DIRECTORY_NAME)
+    else:
+        STORE = None
+    with _tier_lock:
+        if COLD_STORE != None:
+            COLD_STORE.close()
+            COLD_STORE = None
+    PAGE_CACHE.clear()
+    with _tier_stats_lock:
+        _read_tracker.clear()
+    rebuild_index()
+
+
+# Merge the bitcask store's (or cold pack's) segments if enough of it is dead
+# (no-op otherwise)
+# @return bool: whether a merge ran
+def compact_storage() -> bool:
+    merged = False
+    for store in [STORE, _cold_store()]:
+        if isinstance(store, bitcask.Bitcask) and store.needs_merge():
+            store.merge()
+            merged = True
+    return merged
+
+
+def storage_stats() -> dict:
+    stats = {'backend': STORAGE_BACKEND}
+    stats.update(NAMESPACE.stats())
+    if STORE != None:
+        stats.update(STORE.stats())
+    else:
+        stats['compression'] = compression_stats()
+    return stats
+
+
+# Files per encoding, and their logical (decompressed) vs stored bytes
+def compression_stats() -> dict:
+    files = {encoding: 0 for encoding in compression.ENCODINGS+[SHARD_ENCODING, COLD_ENCODING]}
+    logical_bytes = stored_bytes = 0
+    with _index_lock:
+        for metadata in _index.values():
+            files[metadata.encoding] += 1
+            logical_bytes += metadata.size
+            stored_bytes += metadata.stored_size
+    return {'files': files, 'logical_bytes': logical_bytes, 'stored_bytes': stored_bytes, 'ratio': round(logical_bytes/stored_bytes, 3) if stored_bytes > 0 else 1.0}
@@ -0,0 +1,124 @@
+# File: membership.py
+# Purpose:
+#   In-memory, epoch-numbered view of a UVM/RVM family's membership.
+#   Backed by <ips/<n>/uvm.txt>, <ips/<n>/rvm.txt>, and <ips/<n>/epoch.txt>,
+#   which are only read when (re)loading and only written upon a change.
+#   <ips/<n>/backend.txt> optionally picks the family's storage backend (see
+#   <fs.STORAGE_BACKENDS>; missing/empty = "files"), and
+#   <ips/<n>/redundancy.txt> how its RVMs keep large files (see
+#   <erasure.REDUNDANCY_MODES>; missing/empty = "replicate").
+
+# EPOCHS:
+#   * Every local membership change bumps the epoch by 1.
+#   * Remote updates carry the sender's epoch, and are rejected if older than
+#     ours so that a delayed update can't overwrite newer state.
+
+import os
+import threading
+
+##############################################################################
+# Atomic File Helpers
+def read_file(filename: str) -> str:
+    try:
+        with open(filename, 'r') as file:
+            return file.read()
+    except FileNotFoundError:
+        return ''
+
+
+def write_file_atomically(filename: str, contents: str):
+    with open(filename+'.tmp', 'w') as file:
+        file.write(contents)
+    os.replace(filename+'.tmp', filename)
+
+
+def parse_ips(contents: str) -> list:
+    return [line for line in [line.strip() for line in contents.split('\n')] if len(line) > 0]
+
+
+##############################################################################
+# Family Membership
+class Membership:
+    def __init__(self, family_path: str):
+        self.lock = threading.Lock()
+        self.load(family_path)
+
+
+    # (Re)load membership from <family_path> (a directory ending with '/')
+    def load(self, family_path: str):
+        with self.lock:
+            self.family_path = family_path
+            self.uvm_filename = family_path+'uvm.txt'
+            self.rvm_filename = family_path+'rvm.txt'
+            self.epoch_filename = family_path+'epoch.txt'
+            self.backend_filename = family_path+'backend.txt'
+            self.redundancy_filename = family_path+'redundancy.txt'
+            self._uvm_ip = read_file(self.uvm_filename).strip()
+            self._rvm_ips = parse_ips(read_file(self.rvm_filename))
+            epoch = read_file(self.epoch_filename).strip()
+            self._epoch = int(epoch) if epoch.isdigit() else 0
+            self._storage_backend = read_file(self.backend_filename).strip()
+            self._redundancy = read_file(self.redundancy_filename).strip()
+
+
+    def uvm_ip(self) -> str:
+        with self.lock:
+            return self._uvm_ip
+
+
+    def rvm_ips(self) -> list:
+        with self.lock:
+            return list(self._rvm_ips)
+
+
+    def epoch(self) -> int:
+        with self.lock:
+            return self._epoch
+
+
+    def storage_backend(self) -> str:
+        with self.lock:
+            return self._storage_backend
+
+
+    # Record the family's storage backend (a pooled RVM learns it upon joining)
+    def set_storage_backend(self, backend: str):
+        with self.lock:
+            if backend != self._storage_backend:
+                write_file_atomically(self.backend_filename, backend)
+                self._storage_backend = backend
+
+
+    def redundancy(self) -> str:
+        with self.lock:
+            return self._redundancy
+
+
+    # Record the family's redundancy mode (a pooled RVM learns it upon joining)
+    def set_redundancy(self, redundancy: str):
+        with self.lock:
+            if redundancy != self._redundancy:
+                write_file_atomically(self.redundancy_filename, redundancy)
+                self._redundancy = redundancy
+
+
+    # Change the UVM IP and/or RVM IP list (None leaves a field unchanged).
+    # <epoch> = None is a local change (bumps our epoch), otherwise the change
+    # came from a remote node and is dropped if older than our epoch.
+    # @return bool: whether the update was applied
+    def update(self, uvm_ip = None, rvm_ips = None, epoch = None) -> bool:
+        with self.lock:
+            if epoch == None:
+                epoch = self._epoch+1
+            elif epoch < self._epoch:
+                return False
+            if uvm_ip != None and uvm_ip != self._uvm_ip:
+                write_file_atomically(self.uvm_filename, uvm_ip)
+                self._uvm_ip = uvm_ip
+            if rvm_ips != None and rvm_ips != self._rvm_ips:
+                write_file_atomically(self.rvm_filename, '\n'.join(rvm_ips))
+                self._rvm_ips = list(rvm_ips)
+            if epoch != self._epoch:
+                write_file_atomically(self.epoch_filename, str(epoch))
+                self._epoch = epoch
+            return True
@@ -0,0 +1,155 @@
+# File: merkle.py
+# Purpose:
+#   Incrementally updated Merkle tree over (path, content hash) pairs.
+#   Used by UVMs/RVMs to detect which files diverged between replicas.
+
+# TREE LAYOUT:
+#   * Paths are hashed into one of 2^depth leaf buckets.
+#   * A leaf's hash is the XOR of its entries' digests, so adding/removing a
+#     path is O(1) for the leaf plus O(depth) to rehash its ancestors.
+#   * Nodes are stored heap-style: node 1 is the root, node i has children
+#     2i and 2i+1, and leaves occupy indices [2^depth, 2^(depth+1)).
+
+import hashlib
+import threading
+
+##############################################################################
+# Constant Value(s)
+# Number of levels below the root (2^MERKLE_TREE_DEPTH leaf buckets)
+MERKLE_TREE_DEPTH = 10
+
+# Index of the root node
+MERKLE_ROOT_NODE = 1
+
+
+##############################################################################
+# Hashing Helper(s)
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Incremental version of <content_hash>: feed chunks with <.update(chunk)>,
+# then get the hash via <.hexdigest()>
+def content_hasher():
+    return hashlib.sha256()
+
+
+def entry_digest(path: str, chash: str) -> int:
+    return int.from_bytes(hashlib.sha256((path+'\0'+chash).encode('utf-8')).digest(), 'big')
+
+
+def node_hash(left: str, right: str) -> str:
+    return hashlib.sha256((left+right).encode('utf-8')).hexdigest()
+
+
+def leaf_hash(accumulator: int) -> str:
+    return format(accumulator, '064x')
+
+
+##############################################################################
+# Merkle Tree
+class MerkleTree:
+    def __init__(self, depth: int = MERKLE_TREE_DEPTH):
+        self.depth = depth
+        self.leaf_count = 1 << depth
+        self.lock = threading.Lock()
+        self.clear()
+
+
+    # Reset the tree to hold no entries
+    def clear(self):
+        with self.lock:
+            self.buckets = [{} for _ in range(self.leaf_count)] # [{path: content_hash}, ...]
+            self.accumulators = [0] * self.leaf_count
+            self.nodes = [''] * (2 * self.leaf_count)
+            for leaf in range(self.leaf_count):
+                self.nodes[self.leaf_count+leaf] = leaf_hash(0)
+            for node in range(self.leaf_count-1, 0, -1):
+                self.nodes[node] = node_hash(self.nodes[2*node], self.nodes[2*node+1])
+
+
+    # Leaf bucket that <path> hashes into
+    def leaf_of(self, path: str) -> int:
+        return int.from_bytes(hashlib.sha256(path.encode('utf-8')).digest()[:4], 'big') % self.leaf_count
+
+
+    def is_leaf_node(self, node: int) -> bool:
+        return node >= self.leaf_count
+
+
+    # Rehash <leaf> and every ancestor up to the root
+    def _rehash(self, leaf: int):
+        node = self.leaf_count+leaf
+        self.nodes[node] = leaf_hash(self.accumulators[leaf])
+        node //= 2
+        while node >= MERKLE_ROOT_NODE:
+            self.nodes[node] = node_hash(self.nodes[2*node], self.nodes[2*node+1])
+            node //= 2
+
+
+    # Set <path>'s content hash (<chash> = None removes <path>)
+    def update(self, path: str, chash):
+        leaf = self.leaf_of(path)
+        with self.lock:
+            bucket = self.buckets[leaf]
+            old_chash = bucket.get(path)
+            if old_chash == chash:
+                return
+            if old_chash != None:
+                self.accumulators[leaf] ^= entry_digest(path, old_chash)
+                del bucket[path]
+            if chash != None:
+                self.accumulators[leaf] ^= entry_digest(path, chash)
+                bucket[path] = chash
+            self._rehash(leaf)
+
+
+    def remove(self, path: str):
+        self.update(path, None)
+
+
+    def get(self, path: str):
+        with self.lock:
+            return self.buckets[self.leaf_of(path)].get(path)
+
+
+    def root(self) -> str:
+        with self.lock:
+            return self.nodes[MERKLE_ROOT_NODE]
+
+
+    # Get the hashes of the given node indices
+    def node_hashes(self, nodes: list) -> dict:
+        with self.lock:
+            return {node: self.nodes[node] for node in nodes if MERKLE_ROOT_NODE <= node < len(self.nodes)}
+
+
+    # Get the {path: content_hash} entries of the leaf at node index <node>
+    def bucket(self, node: int) -> dict:
+        with self.lock:
+            return dict(self.buckets[node-self.leaf_count])
+
+
+##############################################################################
+# Compare a local tree against a remote one, descending only into subtrees
+# whose hashes differ. <fetch_nodes(indices) -> {index: hash}> and
+# <fetch_bucket(index) -> {path: content_hash}> query the remote tree.
+# @return dict: {path: remote_content_hash or None} for every differing path
+def diff(tree: MerkleTree, fetch_nodes, fetch_bucket) -> dict:
+    differences = {}
+    frontier = [MERKLE_ROOT_NODE]
+    while len(frontier) > 0:
+        remote = fetch_nodes(frontier)
+        local = tree.node_hashes(frontier)
+        mismatched = [node for node in frontier if remote.get(node) != local.get(node)]
+        frontier = []
+        for node in mismatched:
+            if not tree.is_leaf_node(node):
+                frontier.extend([2*node, 2*node+1])
+                continue
+            remote_bucket = fetch_bucket(node)
+            local_bucket = tree.bucket(node)
+            for path in set(remote_bucket) | set(local_bucket):
+                if remote_bucket.get(path) != local_bucket.get(path):
+                    differences[path] = remote_bucket.get(path)
+    return differences
@@ -0,0 +1,346 @@
+# File: namespace.py
+# Purpose:
+#   In-memory tree of a machine's directories and files (paths are "/"
+#   separated, e.g. "logs/2024/app.log"), kept in sync by <fs.py> alongside
+#   its metadata index. Directory listings are served from it (never from
+#   directory scans), and renaming a directory just moves its node.
+
+# PATHS:
+#   Relative, "/"-separated names with no empty, "." or ".." components (and
+#   no leading/trailing "/"). The root directory is "". A path is either a file
+#   or a directory, never both.
+
+# DIRECTORIES:
+#   Each directory keeps its entries in a dict plus a sorted list of their
+#   names, so a listing page is found by bisecting that list (for a prefix, or
+#   for the name the previous page ended at) rather than sorting the directory.
+#   Directories are created explicitly (<mkdir>) or implicitly, as the parents
+#   of a new file, and stay until removed (<rmdir>, only once empty).
+
+# PATH ORDER:
+#   Walks of every file under a prefix (<walk>) visit the tree depth first, in
+#   name order, so paths come out sorted component by component ("a/b" before
+#   "a.txt", as "a" < "a.txt"). <path_key> sorts paths the same way, so walks
+#   of different machines' trees can be merged into one sorted stream.
+
+import bisect
+import errno
+import threading
+
+##############################################################################
+# Constant Value(s)
+SEPARATOR = '/'
+
+ROOT_PATH = ''
+
+# Most entries a single listing page returns
+MAX_LIST_ENTRIES = 1000
+
+
+##############################################################################
+# Path Helper(s)
+# @return list: <path>'s components (empty for the root)
+def split(path: str) -> list:
+    if path == ROOT_PATH:
+        return []
+    components = path.split(SEPARATOR)
+    for component in components:
+        if component in ['', '.', '..']:
+            raise ValueError('invalid path "'+path+'" (empty, "." and ".." components aren\'t allowed)')
+    return components
+
+
+def join(directory: str, name: str) -> str:
+    return name if directory == ROOT_PATH else directory+SEPARATOR+name
+
+
+def parent(path: str) -> str:
+    return path.rpartition(SEPARATOR)[0]
+
+
+# Whether <path> is <directory> or anywhere below it
+def is_within(path: str, directory: str) -> bool:
+    return directory == ROOT_PATH or path == directory or path.startswith(directory+SEPARATOR)
+
+
+# Sort key putting paths in the order <Namespace.walk> yields them
+def path_key(path: str) -> list:
+    return path.split(SEPARATOR)
+
+
+##############################################################################
+# Directory Tree
+class DirectoryNode:
+    def __init__(self):
+        self.entries = {} # {name: DirectoryNode (subdirectory) or None (file), ...}
+        self.names = [] # sorted names of <entries>
+
+
+    def add(self, name: str, node):
+        if name not in self.entries:
+            bisect.insort(self.names, name)
+        self.entries[name] = node
+
+
+    def remove(self, name: str):
+        del self.entries[name]
+        del self.names[bisect.bisect_left(self.names, name)]
+
+
+class Namespace:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root = DirectoryNode()
+        self.directory_count = 0 # excluding the root
+
+
+    def clear(self):
+        with self.lock:
+            self.root = DirectoryNode()
+            self.directory_count = 0
+
+
+    # @return DirectoryNode: the directory at <components> (None if DNE)
+    def _directory(self, components: list):
+        node = self.root
+        for component in components:
+            node = node.entries.get(component)
+            if node == None:
+                return None
+        return node
+
+
+    # Walk down to the parent of <components>, creating missing directories
+    # @return tuple: (parent: DirectoryNode, created: list of directory paths)
+    def _make_parents(self, components: list):
+        node, created = self.root, []
+        for depth, component in enumerate(components[:-1]):
+            if component not in node.entries:
+                node.add(component, DirectoryNode())
+                self.directory_count += 1
+                created.append(SEPARATOR.join(components[:depth+1]))
+            node = node.entries[component]
+            if node == None:
+                raise NotADirectoryError(errno.ENOTDIR, 'not a directory', SEPARATOR.join(components[:depth+1]))
+        return node, created
+
+
+    # Raise if <path> can't be created as a file (an ancestor is a file, or
+    # <path> is a directory)
+    def check_file(self, path: str):
+        components = split(path)
+        if len(components) == 0:
+            raise IsADirectoryError(errno.EISDIR, 'is a directory', path)
+        with self.lock:
+            node = self.root
+            for depth, component in enumerate(components):
+                node = node.entries.get(component, False)
+                if node == False:
+                    return
+                if isinstance(node, DirectoryNode) and depth == len(components)-1:
+                    raise IsADirectoryError(errno.EISDIR, 'is a directory', path)
+                if node == None and depth < len(components)-1:
+                    raise NotADirectoryError(errno.ENOTDIR, 'not a directory', SEPARATOR.join(components[:depth+1]))
+
+
+    # Record the file <path>, creating its missing parent directories
+    # @return list: the directories created
+    def add_file(self, path: str) -> list:
+        components = split(path)
+        with self.lock:
+            directory, created = self._make_parents(components)
+            if isinstance(directory.entries.get(components[-1]), DirectoryNode):
+                raise IsADirectoryError(errno.EISDIR, 'is a directory', path)
+            directory.add(components[-1], None)
+            return created
+
+
+    def remove_file(self, path: str):
+        components = split(path)
+        with self.lock:
+            directory = self._directory(components[:-1])
+            if directory != None and components[-1] in directory.entries and directory.entries[components[-1]] == None:
+                directory.remove(components[-1])
+
+
+    # Create the directory <path> and any missing parents
+    # @return list: the directories created (empty if <path> already existed)
+    def mkdir(self, path: str) -> list:
+        components = split(path)
+        if len(components) == 0:
+            return []
+        with self.lock:
+            directory, created = self._make_parents(components)
+            existing = directory.entries.get(components[-1], False)
+            if existing == None:
+                raise FileExistsError(errno.EEXIST, 'a file already exists', path)
+            if existing == False:
+                directory.add(components[-1], DirectoryNode())
+                self.directory_count += 1
+                created.append(path)
+            return created
+
+
+    # Remove the empty directory <path>
+    def rmdir(self, path: str):
+        components = split(path)
+        if len(components) == 0:
+            raise PermissionError(errno.EPERM, 'the root directory can\'t be removed', path)
+        with self.lock:
+            directory = self._directory(components[:-1])
+            node = None if directory == None else directory.entries.get(components[-1], False)
+            if node == False or directory == None:
+                raise FileNotFoundError(errno.ENOENT, 'no such directory', path)
+            if node == None:
+                raise NotADirectoryError(errno.ENOTDIR, 'not a directory', path)
+            if len(node.entries) > 0:
+                raise OSError(errno.ENOTEMPTY, 'directory not empty', path)
+            directory.remove(components[-1])
+            self.directory_count -= 1
+
+
+    # Move the directory <old_path> (with everything in it) to <new_path>,
+    # creating <new_path>'s missing parents
+    # @return list: the directories created
+    def move_directory(self, old_path: str, new_path: str) -> list:
+        old_components, new_components = split(old_path), split(new_path)
+        if len(old_components) == 0 or len(new_components) == 0:
+            raise PermissionError(errno.EPERM, 'the root directory can\'t be moved', old_path)
+        if is_within(new_path, old_path):
+            raise OSError(errno.EINVAL, 'can\'t move a directory into itself', new_path)
+        with self.lock:
+            old_parent = self._directory(old_components[:-1])
+            node = None if old_parent == None else old_parent.entries.get(old_components[-1])
+            if not isinstance(node, DirectoryNode):
+                raise NotADirectoryError(errno.ENOTDIR, 'not a directory', old_path)
+            new_parent = self._directory(new_components[:-1])
+            if new_parent != None and new_components[-1] in new_parent.entries:
+                raise FileExistsError(errno.EEXIST, 'already exists', new_path)
+            new_parent, created = self._make_parents(new_components)
+            old_parent.remove(old_components[-1])
+            new_parent.add(new_components[-1], node)
+            return created
+
+
+    # @return str: "directory", "file", or None if <path> DNE
+    def kind(self, path: str):
+        try:
+            components = split(path)
+        except ValueError:
+            return None
+        if len(components) == 0:
+            return 'directory'
+        with self.lock:
+            directory = self._directory(components[:-1])
+            if directory == None or components[-1] not in directory.entries:
+                return None
+            return 'file' if directory.entries[components[-1]] == None else 'directory'
+
+
+    def is_directory(self, path: str) -> bool:
+        return self.kind(path) == 'directory'
+
+
+    # One page of the directory <path>'s entries named <prefix>..., in name
+    # order, starting after the name <start_after> (the previous page's last)
+    # @return tuple: (entries: [(name, is_directory), ...], truncated: bool)
+    def list(self, path: str, prefix: str = '', start_after: str = '', limit: int = MAX_LIST_ENTRIES):
+        components = split(path)
+        limit = max(1, min(limit, MAX_LIST_ENTRIES))
+        with self.lock:
+            directory = self._directory(components)
+            if directory == None:
+                raise FileNotFoundError(errno.ENOENT, 'no such directory', path)
+            start = max(bisect.bisect_left(directory.names, prefix), bisect.bisect_right(directory.names, start_after))
+            entries = []
+            for name in directory.names[start:start+limit+1]:
+                if not name.startswith(prefix):
+                    break
+                entries.append((name, directory.entries[name] != None))
+        return entries[:limit], len(entries) > limit
+
+
+    # One page of every file whose path starts with <prefix> (the last
+    # component of which may be partial, e.g. "logs/20"), in path order,
+    # starting after the path <start_after>
+    # @return tuple: (paths: list, truncated: bool)
+    def walk(self, prefix: str = '', start_after: str = '', limit: int = MAX_LIST_ENTRIES):
+        directory_path, _, name_prefix = prefix.rpartition(SEPARATOR)
+        directory_components = split(directory_path)
+        start = split(start_after)
+        limit = max(1, min(limit, MAX_LIST_ENTRIES))
+        if len(start) > len(directory_components) and start[:len(directory_components)] == directory_components:
+            start = start[len(directory_components):] # resume inside the directory
+        elif start <= directory_components:
+            start = [] # every file in the directory sorts after <start_after>
+        else:
+            start = None # every file in the directory sorts before <start_after>
+        paths = []
+        with self.lock:
+            directory = self._directory(directory_components)
+            if isinstance(directory, DirectoryNode) and start != None:
+                self._walk(directory_path, directory, name_prefix, start, paths, limit+1)
+        return paths[:limit], len(paths) > limit
+
+
+    # Add the files below <node> (named <name_prefix>... at this level, and
+    # after the relative path <start>) to <paths>, until it holds <limit>
+    def _walk(self, directory_path: str, node: DirectoryNode, name_prefix: str, start: list, paths: list, limit: int):
+        first = bisect.bisect_left(node.names, max(name_prefix, start[0]) if len(start) > 0 else name_prefix)
+        for name in node.names[first:]:
+            if not name.startswith(name_prefix) or len(paths) >= limit:
+                return
+            child = node.entries[name]
+            resumed = len(start) > 0 and name == start[0]
+            if child == None:
+                if not resumed: # else it's <start> itself, or sorts before it
+                    paths.append(join(directory_path, name))
+            else:
+                self._walk(join(directory_path, name), child, '', start[1:] if resumed else [], paths, limit)
+
+
+    # Every file path below the directory <path>
+    def files_within(self, path: str) -> list:
+        components = split(path)
+        with self.lock:
+            directory = self._directory(components)
+            if not isinstance(directory, DirectoryNode):
+                return []
+            files, pending = [], [(path, directory)]
+            while len(pending) > 0:
+                directory_path, node = pending.pop()
+                for name, child in node.entries.items():
+                    if child == None:
+                        files.append(join(directory_path, name))
+                    else:
+                        pending.append((join(directory_path, name), child))
+            return files
+
+
+    # Every directory path below the directory <path>
+    def directories_within(self, path: str = ROOT_PATH) -> list:
+        components = split(path)
+        with self.lock:
+            directory = self._directory(components)
+            if not isinstance(directory, DirectoryNode):
+                return []
+            directories, pending = [], [(path, directory)]
+            while len(pending) > 0:
+                directory_path, node = pending.pop()
+                for name, child in node.entries.items():
+                    if child != None:
+                        directories.append(join(directory_path, name))
+                        pending.append((join(directory_path, name), child))
+            return directories
+
+
+    # @return int: number of entries directly in the directory <path>
+    def entry_count(self, path: str) -> int:
+        with self.lock:
+            directory = self._directory(split(path))
+            return len(directory.entries) if isinstance(directory, DirectoryNode) else 0
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'directories': self.directory_count}
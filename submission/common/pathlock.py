@@ -0,0 +1,251 @@
+# File: pathlock.py
+# Purpose:
+#   Per-path readers-writer locks for <fs.py>: reads of a path run
+#   concurrently, mutations of it are serialized (with each other and with its
+#   reads), and operations on different paths never wait on each other.
+
+# LOCK TABLE:
+#   A path's lock only exists while some thread holds or waits for it. The
+#   table of them is split into <PATH_LOCK_STRIPES> stripes (by the path's
+#   hash), each with its own mutex, so that finding/freeing the locks of
+#   unrelated paths rarely touches the same mutex (and never for long).
+
+# REENTRANCY + ORDERING:
+#   A thread may lock a path it already holds (e.g. <fs.read> calling
+#   <fs.read_contents>): a nested read inside a write, or a nested lock of the
+#   same mode, just bumps a count. Upgrading a read to a write would deadlock
+#   against another reader doing the same, so it raises instead. Operations
+#   on several paths lock them all at once, in sorted order (so two of them
+#   can't each wait on the other's path). Writers are preferred: new readers
+#   queue behind a waiting writer, so a stream of reads can't starve it.
+
+# DIRECTORIES:
+#   Given a <separator>, locking "a/b/c" also read-locks its ancestors "a" and
+#   "a/b". Operations inside a directory thus run alongside each other, but
+#   not alongside a write lock of the directory itself (e.g. while it's being
+#   renamed or removed). Ancestors sort before their descendants, so this
+#   keeps the sorted locking order.
+
+import threading
+import time
+
+##############################################################################
+# Constant Value(s)
+PATH_LOCK_STRIPES = 64
+
+
+##############################################################################
+# Readers-Writer Lock (writer-preferring)
+class RWLock:
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+        self.users = 0 # threads holding or waiting for it (guarded by its stripe's mutex)
+
+
+    # @return float: seconds we had to wait for it
+    def acquire_read(self) -> float:
+        with self.condition:
+            if not self.writing and self.waiting_writers == 0:
+                self.readers += 1
+                return 0.0
+            started = time.perf_counter()
+            while self.writing or self.waiting_writers > 0:
+                self.condition.wait()
+            self.readers += 1
+            return time.perf_counter()-started
+
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+
+    # @return float: seconds we had to wait for it
+    def acquire_write(self) -> float:
+        with self.condition:
+            if not self.writing and self.readers == 0:
+                self.writing = True
+                return 0.0
+            started = time.perf_counter()
+            self.waiting_writers += 1
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+            return time.perf_counter()-started
+
+
+    def release_write(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+
+##############################################################################
+# Striped Table of Per-Path Locks
+class LockStripe:
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.locks = {} # {path: RWLock, ...}
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+
+class PathLocks:
+    def __init__(self, stripes: int = PATH_LOCK_STRIPES, separator: str = None):
+        self.stripes = [LockStripe() for _ in range(stripes)]
+        self.local = threading.local()
+        self.separator = separator
+
+
+    def _stripe(self, path: str) -> LockStripe:
+        return self.stripes[hash(path) % len(self.stripes)]
+
+
+    # {path: [lock, write, depth, wait_seconds], ...} held by the calling thread
+    def _held(self) -> dict:
+        held = getattr(self.local, 'held', None)
+        if held == None:
+            held = self.local.held = {}
+        return held
+
+
+    def _checkout(self, path: str) -> RWLock:
+        stripe = self._stripe(path)
+        with stripe.mutex:
+            lock = stripe.locks.get(path)
+            if lock == None:
+                lock = stripe.locks[path] = RWLock()
+            lock.users += 1
+            return lock
+
+
+    def _checkin(self, path: str, lock: RWLock, wait_seconds: float = None):
+        stripe = self._stripe(path)
+        with stripe.mutex:
+            lock.users -= 1
+            if lock.users == 0:
+                del stripe.locks[path]
+            if wait_seconds != None:
+                stripe.acquisitions += 1
+                stripe.waits += wait_seconds > 0
+                stripe.wait_seconds += wait_seconds
+
+
+    def acquire(self, path: str, write: bool):
+        held = self._held()
+        entry = held.get(path)
+        if entry != None:
+            if write and not entry[1]:
+                raise RuntimeError('pathlock: can\'t upgrade the read lock of "'+path+'" to a write lock')
+            entry[2] += 1
+            return
+        lock = self._checkout(path)
+        try:
+            wait_seconds = lock.acquire_write() if write else lock.acquire_read()
+        except BaseException:
+            self._checkin(path, lock)
+            raise
+        held[path] = [lock, write, 1, wait_seconds]
+
+
+    def release(self, path: str):
+        held = self._held()
+        entry = held[path]
+        entry[2] -= 1
+        if entry[2] > 0:
+            return
+        del held[path]
+        lock, write, _, wait_seconds = entry
+        if write:
+            lock.release_write()
+        else:
+            lock.release_read()
+        self._checkin(path, lock, wait_seconds)
+
+
+    # Ancestor directories of <path>, outermost first
+    def _ancestors(self, path: str) -> list:
+        if self.separator == None:
+            return []
+        ancestors = []
+        position = path.find(self.separator)
+        while position > 0:
+            ancestors.append(path[:position])
+            position = path.find(self.separator, position+1)
+        return ancestors
+
+
+    # Hold <reads> shared and <writes> exclusively (a path in both is
+    # written), and read-lock their ancestors
+    # @return PathGuard: context manager holding them
+    def locking(self, reads = (), writes = ()):
+        modes = {}
+        for path in list(reads)+list(writes):
+            for ancestor in self._ancestors(path):
+                modes.setdefault(ancestor, False)
+        modes.update({path: False for path in reads})
+        modes.update({path: True for path in writes})
+        return PathGuard(self, sorted(modes.items()))
+
+
+    def reading(self, path: str):
+        if self.separator != None and self.separator in path:
+            return self.locking(reads=[path])
+        return PathGuard(self, [(path, False)])
+
+
+    def writing(self, *paths):
+        if self.separator != None and any(self.separator in path for path in paths):
+            return self.locking(writes=paths)
+        return PathGuard(self, [(path, True) for path in sorted(set(paths))])
+
+
+    def stats(self) -> dict:
+        locked_paths = acquisitions = waits = 0
+        wait_seconds = 0.0
+        for stripe in self.stripes:
+            with stripe.mutex:
+                locked_paths += len(stripe.locks)
+                acquisitions += stripe.acquisitions
+                waits += stripe.waits
+                wait_seconds += stripe.wait_seconds
+        return {
+            'locked_paths': locked_paths,
+            'acquisitions': acquisitions,
+            'waits': waits,
+            'mean_wait_ms': round(1000*wait_seconds/waits, 3) if waits > 0 else 0.0,
+        }
+
+
+# Context manager holding [(path, write), ...] (in that order) while entered
+class PathGuard:
+    __slots__ = ('path_locks', 'modes')
+
+    def __init__(self, path_locks: PathLocks, modes: list):
+        self.path_locks = path_locks
+        self.modes = modes
+
+
+    def __enter__(self):
+        acquired = 0
+        try:
+            for path, write in self.modes:
+                self.path_locks.acquire(path, write)
+                acquired += 1
+        except BaseException:
+            for path, _ in reversed(self.modes[:acquired]):
+                self.path_locks.release(path)
+            raise
+        return self
+
+
+    def __exit__(self, *exc_info):
+        for path, _ in reversed(self.modes):
+            self.path_locks.release(path)
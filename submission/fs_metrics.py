@@ -0,0 +1,577 @@
+# File: fs_metrics.py
+# Purpose:
+#   Print performance measurements for a single machine's storage layer
+#   (<common/fs.py>), without needing a running UVM/RVM/router cluster.
+#   Run as: python3 fs_metrics.py [scratch-directory]
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common'))
+import chunkstore
+import compression
+import delta
+import durability
+import erasure
+import fs
+import merkle
+
+##############################################################################
+# Invariants
+# Number of writes each writer thread performs per measurement
+TOTAL_WRITES_PER_WRITER = 100
+
+# Number of concurrent writers used when measuring group fsync
+NUMBER_OF_CONCURRENT_WRITERS = 8
+
+# Size of each file written
+WRITE_SIZE_BYTES = 4 * 1024
+
+# Number (and size) of small files written when comparing storage backends
+TOTAL_SMALL_FILES = 2000
+SMALL_FILE_SIZE_BYTES = 1024
+
+# Deduplication workload: a base file, then duplicates, copies, and edited
+# variants (a few bytes inserted mid-file) of it
+DEDUP_FILE_SIZE_BYTES = 1024 * 1024
+TOTAL_DEDUP_VARIANTS = 4
+
+# Compression workload: files of text-like (CSV rows) and random bytes
+COMPRESSION_FILE_SIZE_BYTES = 4 * 1024 * 1024
+TOTAL_COMPRESSION_FILES = 4
+
+# Erasure coding workload: one file, and the shard layouts encoding it
+ERASURE_FILE_SIZE_BYTES = 16 * 1024 * 1024
+ERASURE_LAYOUTS = [(2, 1), (4, 2), (6, 3)]
+
+# Tiering workload: text-like files read from disk, demoted to the cold tier,
+# promoted back by reading them, then read from the page cache
+TIERING_FILE_SIZE_BYTES = 64 * 1024
+TOTAL_TIERING_FILES = 200
+
+# Path lock stress workload: each thread mixes whole-file writes, appends of
+# fixed-size records, and reads (1 of each 4 ops mutates), over its own path or
+# over one path shared by every thread. Writes fsync their data, so threads
+# overlap while waiting on the disk. Enough ops that each run outlasts
+# starting its threads. The overwrite workload only rewrites records in place
+# (<fs.write_at>) in files of a fixed size: fsyncing them needn't wait on the
+# file system's journal, so it's the one disjoint paths can overlap.
+LOCK_STRESS_THREADS = [1, 2, 4, 8]
+LOCK_STRESS_OPS_PER_THREAD = 2000
+LOCK_STRESS_RECORD_BYTES = 4 * 1024
+LOCK_STRESS_OVERWRITE_RECORDS = 4
+
+# Integrity workload: files read from disk with and without verifying their
+# checksum, scrubbed, then scrubbed again after bytes of some are flipped on disk
+INTEGRITY_FILE_SIZE_BYTES = 256 * 1024
+TOTAL_INTEGRITY_FILES = 200
+TOTAL_CORRUPTED_FILES = 5
+
+# Delta replication workload: a file rewritten after edits of growing size
+DELTA_FILE_SIZE_BYTES = 16 * 1024 * 1024
+DELTA_EDITS = [('overwrite 100B', 0, 100), ('insert 10B', 10, 0), ('insert 256KB', 256*1024, 0), ('rewrite all', 0, DELTA_FILE_SIZE_BYTES)]
+
+# Mutex to syncronize printing several lines at once in a single thread
+PRINTER_LOCK = threading.Lock()
+
+
+##############################################################################
+# Helper Functions
+def ms_str(seconds: float):
+  return str(round(seconds*1000,3))
+
+
+def run_writers(total_writers: int, durability_mode: str):
+  contents = os.urandom(WRITE_SIZE_BYTES)
+  def writer(writer_id: int):
+    for i in range(TOTAL_WRITES_PER_WRITER):
+      fs.write_bytes('bench-'+str(writer_id)+'-'+str(i % 10), contents, durability_mode)
+  threads = [threading.Thread(target=writer, args=(writer_id,)) for writer_id in range(total_writers)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return time.time()-start
+
+
+##############################################################################
+# Profile Write Durability Modes
+def profile_durability_mode(total_writers: int, durability_mode: str, group_fsync: bool):
+  fs.GROUP_FSYNC = group_fsync
+  stats_before = fs.durability_stats()
+  elapsed = run_writers(total_writers, durability_mode)
+  stats_after = fs.durability_stats()
+  total_writes = total_writers*TOTAL_WRITES_PER_WRITER
+  batches = stats_after['batches']-stats_before['batches']
+  directory_syncs = stats_after['directory_syncs']-stats_before['directory_syncs']
+  with PRINTER_LOCK:
+    line = '  -> '+durability_mode.ljust(len(durability.DURABILITY_FSYNC_DATA_AND_DIR))+(' (group fsync)' if group_fsync else '              ')
+    line += ': '+ms_str(elapsed/total_writes)+'ms/write, '+str(round(total_writes/elapsed))+' writes/s'
+    if group_fsync and batches > 0:
+      line += ' ('+str(round((total_writes)/batches,2))+' writes/batch, '+str(directory_syncs)+' dir fsyncs)'
+    print(line)
+  fs.GROUP_FSYNC = False
+
+
+def profile_durability_modes():
+  print('\n**********************************************************')
+  print('> 1 writer; '+str(TOTAL_WRITES_PER_WRITER)+' writes of '+str(WRITE_SIZE_BYTES)+' bytes:')
+  for durability_mode in durability.DURABILITY_MODES:
+    profile_durability_mode(1, durability_mode, False)
+  print('\n> '+str(NUMBER_OF_CONCURRENT_WRITERS)+' writers; '+str(TOTAL_WRITES_PER_WRITER)+' writes of '+str(WRITE_SIZE_BYTES)+' bytes each:')
+  for durability_mode in durability.DURABILITY_MODES:
+    profile_durability_mode(NUMBER_OF_CONCURRENT_WRITERS, durability_mode, False)
+    if durability_mode == durability.DURABILITY_FSYNC_DATA_AND_DIR: # group fsync only shares directory fsyncs
+      profile_durability_mode(NUMBER_OF_CONCURRENT_WRITERS, durability_mode, True)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Storage Backends (many small files)
+def profile_storage_backend(backend: str, scratch_directory: str):
+  backend_directory = os.path.join(scratch_directory, backend)
+  os.makedirs(backend_directory, exist_ok=True)
+  fs.mount(backend_directory)
+  fs.use_storage_backend(backend)
+  contents = os.urandom(SMALL_FILE_SIZE_BYTES)
+  start = time.time()
+  for i in range(TOTAL_SMALL_FILES):
+    fs.write_bytes('small-'+str(i), contents, durability.DURABILITY_NONE)
+  write_elapsed = time.time()-start
+  fs.PAGE_CACHE.clear()
+  start = time.time()
+  for i in range(TOTAL_SMALL_FILES):
+    fs.read_contents('small-'+str(i))
+  read_elapsed = time.time()-start
+  fs.save_index_snapshot()
+  start = time.time()
+  fs.use_storage_backend(backend) # restart with a current index snapshot
+  warm_startup_elapsed = time.time()-start
+  os.remove(fs.INDEX_SNAPSHOT_FILENAME)
+  start = time.time()
+  fs.use_storage_backend(backend) # restart that must rehash every file
+  cold_startup_elapsed = time.time()-start
+  print('  -> '+backend.ljust(max(len(b) for b in fs.STORAGE_BACKENDS))+': '
+        +str(round(TOTAL_SMALL_FILES/write_elapsed))+' writes/s, '
+        +str(round(TOTAL_SMALL_FILES/read_elapsed))+' reads/s, '
+        +'startup '+ms_str(warm_startup_elapsed)+'ms (snapshot) / '+ms_str(cold_startup_elapsed)+'ms (no snapshot)')
+  fs.use_storage_backend(fs.STORAGE_BACKEND_FILES)
+
+
+def profile_storage_backends(scratch_directory: str):
+  print('\n**********************************************************')
+  print('> '+str(TOTAL_SMALL_FILES)+' files of '+str(SMALL_FILE_SIZE_BYTES)+' bytes (durability "none", page cache cleared before reading):')
+  for backend in fs.STORAGE_BACKENDS:
+    profile_storage_backend(backend, scratch_directory)
+  fs.mount(scratch_directory)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Chunk Store Deduplication
+def profile_deduplication_with(label: str, backend: str, chunking: str, scratch_directory: str):
+  backend_directory = os.path.join(scratch_directory, 'dedup-'+label)
+  os.makedirs(backend_directory, exist_ok=True)
+  chunkstore.CHUNKSTORE_CHUNKING = chunking
+  fs.mount(backend_directory)
+  fs.use_storage_backend(backend)
+  base = os.urandom(DEDUP_FILE_SIZE_BYTES)
+  start = time.time()
+  fs.write_bytes('base', base, durability.DURABILITY_NONE)
+  for i in range(TOTAL_DEDUP_VARIANTS):
+    fs.write_bytes('duplicate-'+str(i), base, durability.DURABILITY_NONE)
+    offset = (i+1)*DEDUP_FILE_SIZE_BYTES//(TOTAL_DEDUP_VARIANTS+2)
+    fs.write_bytes('edited-'+str(i), base[:offset]+b'inserted-'+str(i).encode('utf-8')+base[offset:], durability.DURABILITY_NONE)
+  write_elapsed = time.time()-start
+  start = time.time()
+  for i in range(TOTAL_DEDUP_VARIANTS):
+    fs.copy('base', 'copy-'+str(i))
+  copy_elapsed = time.time()-start
+  logical_bytes = fs.total_bytes()
+  stored_bytes = fs.storage_stats().get('stored_bytes', logical_bytes) # one file per path: nothing shared
+  total_writes = 1+2*TOTAL_DEDUP_VARIANTS
+  print('  -> '+label.ljust(14)+': '+str(round(total_writes*DEDUP_FILE_SIZE_BYTES/(1024*1024)/write_elapsed,1))+' MB/s written, '
+        +ms_str(copy_elapsed/TOTAL_DEDUP_VARIANTS)+'ms/copy, '
+        +str(round(logical_bytes/(1024*1024),1))+' MB stored as '+str(round(stored_bytes/(1024*1024),1))+' MB'
+        +' (dedup ratio '+str(round(logical_bytes/stored_bytes,2))+')')
+  fs.use_storage_backend(fs.STORAGE_BACKEND_FILES)
+
+
+def profile_deduplication(scratch_directory: str):
+  default_chunking = chunkstore.CHUNKSTORE_CHUNKING
+  print('\n**********************************************************')
+  print('> 1 file of '+str(DEDUP_FILE_SIZE_BYTES)+' bytes, plus '+str(TOTAL_DEDUP_VARIANTS)+' duplicates, copies, and edited variants (bytes inserted) each:')
+  profile_deduplication_with('files', fs.STORAGE_BACKEND_FILES, default_chunking, scratch_directory)
+  for chunking in chunkstore.CHUNKINGS:
+    profile_deduplication_with('chunks ('+chunking+')', fs.STORAGE_BACKEND_CHUNKS, chunking, scratch_directory)
+  chunkstore.CHUNKSTORE_CHUNKING = default_chunking
+  fs.mount(scratch_directory)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile At-Rest Compression (writes include compressing, cold reads include
+# decompressing)
+def text_like_bytes(n_bytes: int) -> bytes:
+  rows = []
+  length = 0
+  while length < n_bytes:
+    rows.append(str(len(rows))+','+str(len(rows)*7919 % 104729)+',sensor-'+str(len(rows) % 16)+',ok\n')
+    length += len(rows[-1])
+  return ''.join(rows).encode('utf-8')[:n_bytes]
+
+
+def profile_compression_with(label: str, contents: bytes, encoding: str):
+  start = time.time()
+  for i in range(TOTAL_COMPRESSION_FILES):
+    fs.write_bytes('compressed-'+str(i), contents, durability.DURABILITY_NONE, encoding)
+  write_elapsed = time.time()-start
+  fs.PAGE_CACHE.clear()
+  start = time.time()
+  for i in range(TOTAL_COMPRESSION_FILES):
+    fs.read_contents('compressed-'+str(i))
+  read_elapsed = time.time()-start
+  metadata = fs.stat('compressed-0')
+  total_mb = TOTAL_COMPRESSION_FILES*len(contents)/(1024*1024)
+  print('  -> '+(label+', '+encoding).ljust(16)+': '+str(round(total_mb/write_elapsed,1))+' MB/s written, '
+        +str(round(total_mb/read_elapsed,1))+' MB/s read, '
+        +'stored as '+metadata['encoding']+' (ratio '+str(round(metadata['size']/metadata['stored_size'],2))+')')
+  for i in range(TOTAL_COMPRESSION_FILES):
+    fs.delete('compressed-'+str(i))
+
+
+def profile_compression():
+  print('\n**********************************************************')
+  print('> '+str(TOTAL_COMPRESSION_FILES)+' files of '+str(COMPRESSION_FILE_SIZE_BYTES)+' bytes (durability "none", page cache cleared before reading):')
+  for label, contents in [('text', text_like_bytes(COMPRESSION_FILE_SIZE_BYTES)), ('random', os.urandom(COMPRESSION_FILE_SIZE_BYTES))]:
+    for encoding in compression.ENCODINGS:
+      profile_compression_with(label, contents, encoding)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Erasure Coding (encoding every shard, then decoding from the data
+# shards alone, and from as many parity shards as data shards are lost)
+def profile_erasure_layout(contents: bytes, k: int, m: int):
+  start = time.time()
+  shards = erasure.encode(contents, k, m)
+  encode_elapsed = time.time()-start
+  start = time.time()
+  assert erasure.decode({index: shards[index] for index in range(k)}, k, m, len(contents)) == contents
+  intact_elapsed = time.time()-start
+  survivors = {index: shards[index] for index in range(m, k+m)} # the first m (data) shards are lost
+  start = time.time()
+  assert erasure.decode(survivors, k, m, len(contents)) == contents
+  degraded_elapsed = time.time()-start
+  total_mb = len(contents)/(1024*1024)
+  print('  -> '+(str(k)+'+'+str(m)).ljust(3)+': '+str(round(total_mb/encode_elapsed,1))+' MB/s encoded, '
+        +str(round(total_mb/intact_elapsed,1))+' MB/s decoded (intact), '
+        +str(round(total_mb/degraded_elapsed,1))+' MB/s decoded ('+str(m)+' lost), '
+        +'stored as '+str(round((k+m)/k,2))+'x')
+
+
+def profile_erasure_coding():
+  print('\n**********************************************************')
+  print('> 1 file of '+str(ERASURE_FILE_SIZE_BYTES)+' bytes:')
+  contents = os.urandom(ERASURE_FILE_SIZE_BYTES)
+  for k, m in ERASURE_LAYOUTS:
+    profile_erasure_layout(contents, k, m)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Hot/Cold Tiering (read latency per tier, and the cold tier's savings)
+def time_tiering_reads() -> float:
+  start = time.time()
+  for i in range(TOTAL_TIERING_FILES):
+    fs.read_contents('tiered-'+str(i)+'.csv')
+  return (time.time()-start)/TOTAL_TIERING_FILES
+
+
+def profile_tiering():
+  print('\n**********************************************************')
+  print('> '+str(TOTAL_TIERING_FILES)+' files of '+str(TIERING_FILE_SIZE_BYTES)+' bytes (durability "none", compressed per the policy):')
+  contents = text_like_bytes(TIERING_FILE_SIZE_BYTES)
+  for i in range(TOTAL_TIERING_FILES):
+    fs.write_bytes('tiered-'+str(i)+'.csv', contents, durability.DURABILITY_NONE)
+  fs.PAGE_CACHE.clear()
+  disk_read = time_tiering_reads()
+  disk_bytes = fs.tier_stats()['tiers'][fs.TIER_DISK]['stored_bytes']
+  idle_seconds, fs.COLD_TIER_IDLE_SECONDS = fs.COLD_TIER_IDLE_SECONDS, 0
+  try:
+    start = time.time()
+    demoted, _ = fs.retier()
+    demote_elapsed = time.time()-start
+  finally:
+    fs.COLD_TIER_IDLE_SECONDS = idle_seconds
+  cold_bytes = fs.tier_stats()['tiers'][fs.TIER_COLD]['stored_bytes']
+  cold_read = time_tiering_reads()
+  memory_read = time_tiering_reads()
+  print('  -> disk  : '+ms_str(disk_read)+'ms/read, '+str(disk_bytes)+' bytes stored')
+  print('  -> cold  : '+ms_str(cold_read)+'ms/read (promoting it), '+str(cold_bytes)+' bytes stored, '+ms_str(demote_elapsed/max(demoted,1))+'ms/demotion')
+  print('  -> memory: '+ms_str(memory_read)+'ms/read')
+  for i in range(TOTAL_TIERING_FILES):
+    fs.delete('tiered-'+str(i)+'.csv')
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Path Locks (throughput per thread count, and torn reads)
+# Whether <contents> is whole records, each of one repeated byte (as every
+# writer/appender in <run_lock_stress> leaves it)
+def is_torn(contents: bytes) -> bool:
+  if len(contents) % LOCK_STRESS_RECORD_BYTES != 0:
+    return True
+  for start in range(0, len(contents), LOCK_STRESS_RECORD_BYTES):
+    record = contents[start:start+LOCK_STRESS_RECORD_BYTES]
+    if record.count(record[:1]) != len(record):
+      return True
+  return False
+
+
+# @return tuple: (elapsed: float, torn_reads: int, cpu_seconds: float)
+def run_lock_stress(total_threads: int, shared: bool, overwrites: bool = False):
+  paths = ['locked-shared'] if shared else ['locked-'+str(thread_id) for thread_id in range(total_threads)]
+  for path in paths:
+    fs.write_bytes(path, b'\0'*LOCK_STRESS_RECORD_BYTES*(LOCK_STRESS_OVERWRITE_RECORDS if overwrites else 1), durability.DURABILITY_FSYNC_DATA)
+  torn_reads = 0
+  def worker(thread_id: int):
+    nonlocal torn_reads
+    path = paths[0] if shared else paths[thread_id]
+    record = bytes([thread_id+1])*LOCK_STRESS_RECORD_BYTES
+    for i in range(LOCK_STRESS_OPS_PER_THREAD):
+      if overwrites:
+        fs.write_at(path, (i % LOCK_STRESS_OVERWRITE_RECORDS)*LOCK_STRESS_RECORD_BYTES, record, durability.DURABILITY_FSYNC_DATA)
+      elif i % 8 == 0:
+        fs.write_bytes(path, record*2, durability.DURABILITY_FSYNC_DATA)
+      elif i % 8 == 4:
+        fs.append_bytes(path, record, durability.DURABILITY_FSYNC_DATA)
+      elif is_torn(fs.read_range(path, 0, fs.READ_ENTIRE_PATH) if i % 2 else fs.read_contents(path)):
+        with PRINTER_LOCK:
+          torn_reads += 1
+  threads = [threading.Thread(target=worker, args=(thread_id,)) for thread_id in range(total_threads)]
+  start, cpu_start = time.time(), time.process_time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed, cpu_seconds = time.time()-start, time.process_time()-cpu_start
+  for path in paths:
+    contents = fs.read_contents(path)
+    if is_torn(contents) or fs.stat(path)['checksum'] != merkle.content_hash(contents):
+      torn_reads += 1
+    fs.delete(path)
+  return elapsed, torn_reads, cpu_seconds
+
+
+# >> NOTE: "CPU busy" is the process's CPU time over the run's wall time (per
+#          CPU): once it nears 100%, more threads can't help, however
+#          disjoint their paths (the GIL lets one thread run Python at a time)
+def profile_path_locks():
+  print('\n**********************************************************')
+  for overwrites in [False, True]:
+    print(('\n' if overwrites else '')+'> '+str(LOCK_STRESS_OPS_PER_THREAD)+' ops per thread on records of '+str(LOCK_STRESS_RECORD_BYTES)+' bytes ('+('overwrites in place' if overwrites else 'writes/appends')+': durability "fsync-data"), '+str(os.cpu_count())+' CPU(s):')
+    for shared in [False, True]:
+      base_throughput = None
+      for total_threads in LOCK_STRESS_THREADS:
+        waits_before = fs.lock_stats()['waits']
+        elapsed, torn_reads, cpu_seconds = run_lock_stress(total_threads, shared, overwrites)
+        waits = fs.lock_stats()['waits']-waits_before
+        throughput = total_threads*LOCK_STRESS_OPS_PER_THREAD/elapsed
+        base_throughput = base_throughput or throughput
+        line = '  -> '+('1 shared path' if shared else 'own paths    ')+', '+str(total_threads)+' threads: '+str(round(throughput))+' ops/s'
+        line += ' ('+str(round(throughput/base_throughput,2))+'x), '+str(round(100*cpu_seconds/elapsed/os.cpu_count()))+'% CPU busy, '+str(waits)+' lock waits, '+str(torn_reads)+' torn reads'
+        print(line)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Integrity Checks (verified vs unverified reads, scrub throughput,
+# and whether the scrubber finds every file corrupted on disk)
+def time_integrity_reads(verify: bool) -> float:
+  fs.PAGE_CACHE.clear()
+  start = time.time()
+  for i in range(TOTAL_INTEGRITY_FILES):
+    fs.read_contents('scrubbed-'+str(i)+'.bin', verify)
+  return (time.time()-start)/TOTAL_INTEGRITY_FILES
+
+
+# Flip one byte in the middle of <path>'s file on disk
+def corrupt_on_disk(path: str):
+  with open(fs.ROOT_DIRECTORY+path, 'r+b') as file:
+    file.seek(INTEGRITY_FILE_SIZE_BYTES//2)
+    byte = file.read(1)
+    file.seek(INTEGRITY_FILE_SIZE_BYTES//2)
+    file.write(bytes([byte[0] ^ 0xff]))
+
+
+def profile_integrity():
+  print('\n**********************************************************')
+  print('> '+str(TOTAL_INTEGRITY_FILES)+' files of '+str(INTEGRITY_FILE_SIZE_BYTES)+' random bytes (page cache cleared before reading), '+str(TOTAL_CORRUPTED_FILES)+' then corrupted on disk:')
+  originals = {}
+  for i in range(TOTAL_INTEGRITY_FILES):
+    originals['scrubbed-'+str(i)+'.bin'] = os.urandom(INTEGRITY_FILE_SIZE_BYTES)
+    fs.write_bytes('scrubbed-'+str(i)+'.bin', originals['scrubbed-'+str(i)+'.bin'], durability.DURABILITY_NONE)
+  unverified_read = time_integrity_reads(False)
+  verified_read = time_integrity_reads(True)
+  start = time.time()
+  scrubbed_bytes, _, _ = fs.scrub(2*TOTAL_INTEGRITY_FILES*INTEGRITY_FILE_SIZE_BYTES)
+  scrub_elapsed = time.time()-start
+  corrupted = ['scrubbed-'+str(i)+'.bin' for i in range(0, TOTAL_INTEGRITY_FILES, TOTAL_INTEGRITY_FILES//TOTAL_CORRUPTED_FILES)]
+  for path in corrupted:
+    corrupt_on_disk(path)
+  _, found, _ = fs.scrub(2*TOTAL_INTEGRITY_FILES*INTEGRITY_FILE_SIZE_BYTES)
+  repaired = sum(fs.repair(path, originals[path]) for path in found)
+  print('  -> reads : '+ms_str(unverified_read)+'ms/read unverified, '+ms_str(verified_read)+'ms/read verified')
+  print('  -> scrub : '+str(round(scrubbed_bytes/scrub_elapsed/(1024*1024), 1))+' MB/s')
+  print('  -> corrupt: '+str(len(set(found) & set(corrupted)))+'/'+str(len(corrupted))+' found by scrubbing ('+str(len(set(found)-set(corrupted)))+' false positives), '+str(repaired)+' repaired')
+  for path in originals:
+    fs.delete(path)
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Profile Delta Replication (bytes sent per rewrite, vs the whole file)
+# <contents> with <inserted> random bytes inserted mid-file, after
+# <overwritten> bytes there are overwritten
+def edited(contents: bytes, inserted: int, overwritten: int) -> bytes:
+  middle = len(contents)//2 if overwritten < len(contents) else 0
+  return contents[:middle]+os.urandom(inserted+overwritten)+contents[middle+overwritten:]
+
+
+def profile_delta():
+  print('\n**********************************************************')
+  print('> 1 file of '+str(DELTA_FILE_SIZE_BYTES)+' random bytes, rewritten after an edit ('+str(delta.DELTA_BLOCK_BYTES)+'-byte blocks):')
+  contents = os.urandom(DELTA_FILE_SIZE_BYTES)
+  start = time.time()
+  signatures = delta.signatures(contents)
+  print('  -> signatures    : '+ms_str(time.time()-start)+'ms')
+  for label, inserted, overwritten in DELTA_EDITS:
+    new_contents = edited(contents, inserted, overwritten)
+    start = time.time()
+    delta_bytes = delta.encode(signatures, new_contents)
+    encode_elapsed = time.time()-start
+    if delta_bytes == None:
+      print('  -> '+label.ljust(14)+': sent whole (gave up after '+ms_str(encode_elapsed)+'ms)')
+      continue
+    start = time.time()
+    assert delta.decode(delta_bytes, contents) == new_contents
+    decode_elapsed = time.time()-start
+    print('  -> '+label.ljust(14)+': '+str(len(delta_bytes))+' bytes sent ('+str(round(100*len(delta_bytes)/len(new_contents), 2))+'% of the file), '
+          +ms_str(encode_elapsed)+'ms encoded, '+ms_str(decode_elapsed)+'ms decoded')
+  print('**********************************************************\n')
+
+
+##############################################################################
+# Main Execution
+def main():
+  scratch_directory = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp(prefix='fs-metrics-')
+  os.makedirs(scratch_directory, exist_ok=True)
+  fs.mount(scratch_directory)
+  print('\n>> Benchmarking <common/fs.py> in: '+scratch_directory)
+  print('   * Results depend heavily on the disk (and on fsync being honored)!')
+  try:
+    print('\n===============================================================================')
+    print('Profiling Write Durability Modes:')
+    print('===============================================================================')
+    # > 8 writers; 100 writes of 4096 bytes each (NVMe-backed VM):
+    # -> none                        : 0.207ms/write, 4834 writes/s
+    # -> fsync-data                  : 0.279ms/write, 3584 writes/s
+    # -> fsync-data+dir              : 0.332ms/write, 3012 writes/s
+    # -> fsync-data+dir (group fsync): 0.341ms/write, 2935 writes/s (3.23 writes/batch, 248 dir fsyncs)
+    profile_durability_modes()
+    print('\n===============================================================================')
+    print('Profiling Storage Backends:')
+    print('===============================================================================')
+    # > 2000 files of 1024 bytes (durability "none", page cache cleared before reading):
+    # -> files  : 9899 writes/s, 60564 reads/s, startup 112.462ms (snapshot) / 142.157ms (no snapshot)
+    # -> bitcask: 25019 writes/s, 176628 reads/s, startup 103.558ms (snapshot) / 114.614ms (no snapshot)
+    # -> chunks : 7024 writes/s, 62247 reads/s, startup 110.474ms (snapshot) / 133.438ms (no snapshot)
+    profile_storage_backends(scratch_directory)
+    print('\n===============================================================================')
+    print('Profiling Chunk Store Deduplication:')
+    print('===============================================================================')
+    # > 1 file of 1048576 bytes, plus 4 duplicates, copies, and edited variants (bytes inserted) each:
+    # -> files         : 638.3 MB/s written, 0.433ms/copy, 13.0 MB stored as 13.0 MB (dedup ratio 1.0)
+    # -> chunks (fixed): 253.1 MB/s written, 0.221ms/copy, 13.0 MB stored as 2.1 MB (dedup ratio 6.3)
+    # -> chunks (cdc)  : 5.0 MB/s written, 0.201ms/copy, 13.0 MB stored as 1.3 MB (dedup ratio 9.75)
+    profile_deduplication(scratch_directory)
+    print('\n===============================================================================')
+    print('Profiling At-Rest Compression:')
+    print('===============================================================================')
+    # > 4 files of 4194304 bytes (durability "none", page cache cleared before reading):
+    # -> text, identity  : 556.0 MB/s written, 2573.6 MB/s read, stored as identity (ratio 1.0)
+    # -> text, deflate   : 13.8 MB/s written, 189.6 MB/s read, stored as deflate (ratio 3.71)
+    # -> text, xz        : 0.7 MB/s written, 36.1 MB/s read, stored as xz (ratio 6.1)
+    # -> random, identity: 708.4 MB/s written, 4894.5 MB/s read, stored as identity (ratio 1.0)
+    # -> random, deflate : 25.7 MB/s written, 4077.6 MB/s read, stored as identity (ratio 1.0)
+    # -> random, xz      : 1.8 MB/s written, 2824.8 MB/s read, stored as identity (ratio 1.0)
+    profile_compression()
+    print('\n===============================================================================')
+    print('Profiling Erasure Coding:')
+    print('===============================================================================')
+    # > 1 file of 16777216 bytes:
+    # -> 2+1: 163.5 MB/s encoded, 1172.0 MB/s decoded (intact), 232.0 MB/s decoded (1 lost), stored as 1.5x
+    # -> 4+2: 160.1 MB/s encoded, 3006.3 MB/s decoded (intact), 177.5 MB/s decoded (2 lost), stored as 1.5x
+    # -> 6+3: 96.7 MB/s encoded, 628.4 MB/s decoded (intact), 69.2 MB/s decoded (3 lost), stored as 1.5x
+    profile_erasure_coding()
+    print('\n===============================================================================')
+    print('Profiling Hot/Cold Tiering:')
+    print('===============================================================================')
+    # > 200 files of 65536 bytes (durability "none", compressed per the policy):
+    # -> disk  : 0.349ms/read, 3920600 bytes stored
+    # -> cold  : 7.98ms/read (promoting it), 2529200 bytes stored, 47.868ms/demotion
+    # -> memory: 0.004ms/read
+    profile_tiering()
+    print('\n===============================================================================')
+    print('Profiling Path Locks:')
+    print('===============================================================================')
+    # > 2000 ops per thread on records of 4096 bytes (writes/appends: durability "fsync-data"), 1 CPU(s):
+    # -> own paths    , 1 threads: 10528 ops/s (1.0x), 73% CPU busy, 0 lock waits, 0 torn reads
+    # -> own paths    , 8 threads: 11274 ops/s (1.07x), 88% CPU busy, 0 lock waits, 0 torn reads
+    # -> 1 shared path, 1 threads: 8551 ops/s (1.0x), 70% CPU busy, 0 lock waits, 0 torn reads
+    # -> 1 shared path, 8 threads: 6703 ops/s (0.78x), 81% CPU busy, 6650 lock waits, 0 torn reads
+    #
+    # > 2000 ops per thread on records of 4096 bytes (overwrites in place: durability "fsync-data"), 1 CPU(s):
+    # -> own paths    , 1 threads: 5057 ops/s (1.0x), 69% CPU busy, 0 lock waits, 0 torn reads
+    # -> own paths    , 4 threads: 8088 ops/s (1.6x), 86% CPU busy, 0 lock waits, 0 torn reads
+    # -> own paths    , 8 threads: 7648 ops/s (1.51x), 93% CPU busy, 0 lock waits, 0 torn reads
+    # -> 1 shared path, 1 threads: 6959 ops/s (1.0x), 68% CPU busy, 0 lock waits, 0 torn reads
+    # -> 1 shared path, 8 threads: 5015 ops/s (0.72x), 75% CPU busy, 7 lock waits, 0 torn reads
+    # (writes/appends create, rename or grow files, and fsyncing that waits on
+    # ext4's journal, which serializes it even across disjoint files: per-path
+    # locks buy those nothing here (1.07x). Overwrites in place skip the
+    # journal, so disjoint paths overlap their fsyncs: ~1.5x at 4-8 threads,
+    # where a shared path loses throughput. Past that, 1 CPU caps it.)
+    profile_path_locks()
+    print('\n===============================================================================')
+    print('Profiling Integrity Checks:')
+    print('===============================================================================')
+    # > 200 files of 262144 random bytes (page cache cleared before reading), 5 then corrupted on disk:
+    # -> reads : 0.191ms/read unverified, 0.506ms/read verified
+    # -> scrub : 767.3 MB/s
+    # -> corrupt: 5/5 found by scrubbing (0 false positives), 5 repaired
+    profile_integrity()
+    print('\n===============================================================================')
+    print('Profiling Delta Replication:')
+    print('===============================================================================')
+    # > 1 file of 16777216 random bytes, rewritten after an edit (8192-byte blocks):
+    # -> signatures    : 60.765ms
+    # -> overwrite 100B: 8241 bytes sent (0.05% of the file), 73.027ms encoded, 17.999ms decoded
+    # -> insert 10B    : 59 bytes sent (0.0% of the file), 60.924ms encoded, 6.663ms decoded
+    # -> insert 256KB  : 262348 bytes sent (1.54% of the file), 437.066ms encoded, 20.06ms decoded
+    # -> rewrite all   : sent whole (gave up after 1510.809ms)
+    profile_delta()
+  finally:
+    if len(sys.argv) <= 1:
+      shutil.rmtree(scratch_directory, ignore_errors=True)
+      if os.path.exists(fs.INDEX_SNAPSHOT_FILENAME):
+        os.remove(fs.INDEX_SNAPSHOT_FILENAME)
+
+
+main()
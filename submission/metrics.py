@@ -2,6 +2,7 @@
 # Purpose:
 #   Print performance measurements for our DFS
 
+import os
 import time
 import threading
 
@@ -15,6 +16,9 @@ TOTAL_SAMPLES_TO_AVERAGE_OPERATIONS_OVER = 10
 # Number of clients we want to test accessing the system concurrently with
 NUMBER_OF_CONCURRENT_CLIENTS_TO_RUN = 10
 
+# Size of the file read whole when comparing striped vs. unstriped reads
+STRIPED_FILE_SIZE_BYTES = 256 * 1024 * 1024
+
 # Mutex to syncronize printing several lines at once in a single thread
 PRINTER_LOCK = threading.Lock()
 
@@ -150,11 +154,38 @@ def profile_UVM_allocation():
   TOTAL_SAMPLES_TO_AVERAGE_OPERATIONS_OVER = old
 
 
+##############################################################################
+# Profile Striped Reads: one large file kept by one family, vs. striped across
+# every family (read in parallel)
+def profile_read_throughput(label: str, path: str, stripe_threshold_bytes, contents: bytes):
+  old = dfs.STRIPE_THRESHOLD_BYTES
+  dfs.STRIPE_THRESHOLD_BYTES = stripe_threshold_bytes
+  try:
+    write = time_operation('write', dfs.write_bytes, path, contents)
+    read = time_operation('read', dfs.read_bytes, path)
+    stripes = dfs.stat(path).get('stripes', 1)
+    dfs.delete(path)
+  finally:
+    dfs.STRIPE_THRESHOLD_BYTES = old
+  total_mb = len(contents)/(1024*1024)
+  print('  -> '+label.ljust(10)+': '+str(round(total_mb/write,1))+' MB/s written, '+str(round(total_mb/read,1))+' MB/s read ('+str(stripes)+' stripe(s))')
+
+
+def profile_striped_reads():
+  contents = os.urandom(STRIPED_FILE_SIZE_BYTES)
+  with PRINTER_LOCK:
+    print('\n**********************************************************')
+    print('> 1 file of '+str(STRIPED_FILE_SIZE_BYTES)+' bytes, stripes of '+str(dfs.STRIPE_BYTES)+' bytes:')
+    profile_read_throughput('unstriped', 'STRIPED-BENCHMARK', None, contents)
+    profile_read_throughput('striped', 'STRIPED-BENCHMARK', 0, contents)
+    print('**********************************************************\n')
+
+
 ##############################################################################
 # Main Execution
 def main():
   global NUMBER_OF_CONCURRENT_CLIENTS_TO_RUN
-  print('\n>> IMPORTANT: Make sure your UVMs have <UVM_MAXIMUM_NUMBER_OF_FILES = '+str(total_files_possibly_created())+'>!')
+  print('\n>> IMPORTANT: Make sure your UVMs have a <UVM_FAMILY_QUOTA_BYTES> that fits ~'+str(total_files_possibly_created())+' small files!')
   print('   * Otherwise won\'t have enough disk for our concurrent client requests!')
   print('\n>> IMPORTANT: Assumes enough pooled RVMs to allocate a new UVM/RVM unit!')
   print('\n===============================================================================')
@@ -197,6 +228,13 @@ def main():
   print('===============================================================================\n')
   # > Allocating a UVM took 8284.931ms!
   profile_UVM_allocation()
+  print('\n\n===============================================================================')
+  print('Profiling Striped Reads (needs at least 2 families, e.g. after allocating a UVM):')
+  print('===============================================================================\n')
+  # > 1 file of 134217728 bytes, stripes of 16777216 bytes (2 families on one host, so no extra NICs/disks):
+  # -> unstriped : 117.3 MB/s written, 130.5 MB/s read (1 stripe(s))
+  # -> striped   : 116.5 MB/s written, 138.6 MB/s read (8 stripe(s))
+  profile_striped_reads()
 
   # Time to launch a new RVM, observed as: 0.523s
   # Time to launch a new RVM leader, observed as: 3.259s
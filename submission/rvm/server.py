@@ -4,12 +4,25 @@
 #   Also monitors the other RVMs via a leadership election protocol.
 
 # SUPPORTED FILE APIs:
-#   1. read a file
-#   2. write data (also creates files)
+#   1. read a file (as JSON text, or as raw bytes)
+#   2. write data (also creates files, and can stream the request body)
 #   3. delete a file
 #   4. copy a file
 #   5. rename (also moves) a file
 #   6. check if a file exists
+#   7. stat a file
+#   8. append data (also creates files; returns the new length)
+#   9. write data at an offset, and truncate a file
+#  10. keep (or read) just an erasure-coded shard of a file
+#  11. make, list (a page at a time) and remove directories (paths may hold
+#      "/"; renames also move directories)
+#  12. verify reads against each file's checksum, and scrub every file in the
+#      background (corrupt files are rewritten from the UVM's copy)
+#  13. keep the version stamp the UVM gives each version of a file, and
+#      compare it with the UVM's after reads (read repair)
+#  14. rewrite a file from a delta against the version we hold (see
+#      <delta.py>)
+#  15. hold the manifest of a file striped across families (flagged as one)
 
 # SUPPORTED UVM/RVM-HEALTH APIs:
 #   1. Ping UVM to verify alive, and replace as needed
@@ -18,17 +31,29 @@
 #   3. Listen for request to become the leader
 #      * Start pinging nodes to test if alive after leadership
 #   4. Change RVM IP address list
+#   5. Reconcile files against the UVM's (merkle tree anti-entropy)
 
+import io
+import itertools
+import json
 import os
 import requests
 import sys
 import threading
+import random
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 
+# Modules shared with the UVM server (see <../common/>)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import diskio
+import erasure
 import fs
+import membership
+import merkle
 
 ##############################################################################
 # App Creation + Invariants
@@ -58,6 +83,41 @@ RVM_PUBLIC_IP_GETTER_TIMEOUT = 0.25
 # How long we want to wait for <os.system> to exe prior killing this RVM
 LAUNCH_UVM_SYSTEM_TIMEOUT = 0.25
 
+# Most commands we replay to a new RVM per batch request
+REPLICATION_BATCH_MAX_COMMANDS = 64
+
+# How often we persist the metadata index snapshot (speeds up restarts)
+INDEX_SNAPSHOT_TIMEOUT_SECONDS = 10
+
+# How often we check whether the bitcask storage backend needs a merge
+STORAGE_COMPACTION_TIMEOUT_SECONDS = 30
+
+# How often we demote idle files to the cold tier (and reload hot ones into
+# the page cache)
+TIERING_TIMEOUT_SECONDS = 60
+
+# How often we reconcile our files against the UVM's via merkle tree comparison
+ANTI_ENTROPY_TIMEOUT_SECONDS = 5
+
+# Bytes per second the scrubber rereads (so it never hogs the disk), and how
+# long it waits between complete passes over every file
+SCRUB_BYTES_PER_SECOND = 4 * 1024 * 1024
+SCRUB_PASS_TIMEOUT_SECONDS = 10 * 60
+
+# How long we wait on the UVM for its copy of a corrupt file
+CORRUPT_REPAIR_TIMEOUT_SECONDS = 10
+
+# Chance that a read also compares the file's version with the UVM's copy
+# (see <read_repair>), and how long after launching every read does
+READ_REPAIR_CHANCE = 0.05
+READ_REPAIR_WARMUP_SECONDS = 5 * 60
+
+# Most reads' comparisons we run at once, and keep queued (more are skipped),
+# and how long we wait on the UVM during one
+READ_REPAIR_THREADS = 2
+READ_REPAIR_MAX_PENDING = 256
+READ_REPAIR_TIMEOUT_SECONDS = 10
+
 
 ##############################################################################
 # Logging Helper(s)
@@ -82,56 +142,782 @@ def log(msg: str):
 _command_history = []
 _command_history_lock = threading.Lock()
 
-def register_command(url: str):
+def record_command(command: str):
     with _command_history_lock:
-        _command_history.append(url[url.find(':5000')+6:])
+        _command_history.append(command)
+
 
+def register_command(url: str):
+    record_command(url[url.find(':5000')+6:])
 
+
+# Seed <rvm_ip> with our whole history. It's sent in copied slices, never
+# while holding its lock (sending reads the files, taking their path locks);
+# whatever's recorded meanwhile is caught up on after.
 def forward_commands(rvm_ip: str):
-    with _command_history_lock:
-        for command in _command_history:
-            if not ping_rvm(rvm_ip,command):
-                log_leader('Failed to forward action "'+command+'" to VM '+rvm_ip)
+    replayed = 0
+    while True:
+        with _command_history_lock:
+            commands = _command_history[replayed:replayed+REPLICATION_BATCH_MAX_COMMANDS]
+        if len(commands) == 0:
+            return
+        for group in group_commands(commands):
+            sent = put_body(rvm_ip, group[0]) if is_body_command(group[0]) else post_batch(rvm_ip, group)
+            if not sent:
+                log_leader('Failed to forward '+str(len(group))+' action(s) to VM '+rvm_ip)
+        replayed += len(commands)
+
+
+##############################################################################
+# Apply a batch of UVM commands in order, one batch at a time (no interleaving)
+# >> NOTE: not atomic: commands before one that fails stay applied (there is
+#          no rollback); each command's status is returned instead
+_batch_apply_lock = threading.Lock()
+
+def apply_command(command: str) -> int:
+    try:
+        with app.test_request_context('/'+command, base_url='http://localhost:5000'):
+            return app.make_response(app.dispatch_request()).status_code
+    except Exception as err_msg:
+        log('Failed to apply action "'+command+'": '+str(err_msg))
+        return 404
+
+
+@app.route('/rvm_apply_batch', methods=['POST'])
+def rvm_apply_batch():
+    try:
+        commands = request.get_json().get('commands')
+        with _batch_apply_lock:
+            statuses = [apply_command(command) for command in commands]
+        return jsonify({'statuses': statuses}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# POST <commands> to an RVM to be applied in order, without interleaving with
+# other batches
+# >> NOTE: not atomic: commands before one that fails stay applied (anti-
+#          entropy repairs the divergence)
+def post_batch(rvm_ip: str, commands: list) -> bool:
+    try:
+        response = requests.post('http://'+rvm_ip+':5000/rvm_apply_batch', json={'commands': commands})
+        return response.status_code == 200
+    except Exception as err_msg:
+        log('Error posting batch to RVM '+rvm_ip+': '+str(err_msg))
+        return False
+
+
+# Streamed (request body) commands are recorded without a data segment, their
+# bytes are streamed from our local copy instead:
+#   * "write/<path>?durability=MODE": the whole file
+#   * "write_manifest/<path>?durability=MODE": the whole file, a stripe manifest
+#   * "append/<path>?offset=N&length=M&durability=MODE": just the appended range
+#   * "write_at/<path>?offset=N&length=M&durability=MODE": just the written range
+BODY_OPERATIONS = ['write', 'write_manifest', 'append', 'write_at']
+
+def is_body_command(command: str) -> bool:
+    operation, _, rest = command.partition('/')
+    return operation in BODY_OPERATIONS and '/' not in rest.partition('?')[0]
+
+
+def body_command(operation: str, path: str, durability_mode: str, offset: int = None, length: int = None) -> str:
+    params = {} if offset == None else {'offset': offset, 'length': length}
+    params['durability'] = durability_mode
+    return operation+'/'+urllib.parse.quote(path, safe='')+'?'+urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+
+
+def body_command_path(command: str) -> str:
+    return urllib.parse.unquote(command.partition('/')[2].partition('?')[0])
+
+
+# <command> carrying <?stamp=E.S>: the version stamp (see <fs.format_stamp>)
+# of what it leaves at its path, which RVMs give their copy too
+def with_stamp(command: str, stamp: str) -> str:
+    if stamp == None:
+        return command
+    return command+('&' if '?' in command else '?')+'stamp='+stamp
+
+
+# Give <path> the version stamp the UVM's command carries (if any)
+def apply_requested_stamp(path: str):
+    stamp = request.args.get('stamp')
+    if stamp != None:
+        fs.restamp(path, fs.parse_stamp(stamp))
+
+
+# <path> as a single URL segment of a two-path route (</copy/<src>/<dest>>,
+# </rename/<old>/<new>>): quoted twice, since the "/"s it may hold are
+# unquoted once before routing (the route then unquotes the rest)
+def path_segment(path: str) -> str:
+    return urllib.parse.quote(urllib.parse.quote(path, safe=''), safe='')
+
+
+# @return tuple: (offset: int, length: int) of the local bytes to stream
+def body_command_range(command: str):
+    params = urllib.parse.parse_qs(command.partition('?')[2])
+    return int(params.get('offset',['0'])[0]), int(params.get('length',[str(fs.READ_ENTIRE_PATH)])[0])
+
+
+# Chunk-store writes only send the chunks the RVM lacks: ask which those are,
+# then PUT "write_chunks/..." with the manifest as one JSON line, followed by
+# the missing chunks' bytes (see the RVM's </write_chunks> route)
+def put_chunks(rvm_ip: str, command: str, manifest: list) -> bool:
+    try:
+        response = requests.post('http://'+rvm_ip+':5000/missing_chunks', json={'chunks': [chash for chash, _ in manifest]})
+        if response.status_code != 200:
+            return False
+        missing = set(response.json().get('missing'))
+        def body():
+            yield (json.dumps({'chunks': manifest, 'included': sorted(missing)})+'\n').encode('utf-8')
+            sent = set()
+            for chash, _ in manifest:
+                if chash in missing and chash not in sent:
+                    sent.add(chash)
+                    yield fs.read_chunk(chash)
+        response = requests.put('http://'+rvm_ip+':5000/write_chunks/'+command.partition('/')[2], data=body())
+        return response.status_code == 200
+    except Exception as err_msg:
+        log('Error sending the chunks of "'+command+'" to RVM '+rvm_ip+' (resending the whole file): '+str(err_msg))
+        return False
+
+
+# Stream our local copy of a body command's bytes to an RVM via chunked PUT.
+# Whole-file writes are sent as stored (still compressed, if they are), for
+# the RVM to store with the same encoding. RVMs keeping a shard of the file
+# get their (re-encoded) shard instead.
+def put_body(rvm_ip: str, command: str) -> bool:
+    try:
+        if command.startswith('write/') or command.startswith('write_manifest/'): # sends our current copy: stamp (and flag) it as such
+            path = body_command_path(command)
+            operation = 'write_manifest' if fs.is_striped(path) else 'write'
+            command = with_stamp(operation+'/'+command.partition('/')[2], fs.stat(path)['stamp'])
+            if operation == 'write_manifest':
+                response = requests.put('http://'+rvm_ip+':5000/'+command, data=fs.read_contents(path))
+                return response.status_code == 200
+        layout = shard_layout_for(rvm_ip, body_command_path(command))
+        if layout != None:
+            return put_shard(rvm_ip, command, *layout)
+        if fs.shard_index(body_command_path(command)) != None: # we only hold a shard, they keep it all
+            contents = DISK_IO.run(rebuild_sharded, body_command_path(command), block=True)
+            response = requests.put('http://'+rvm_ip+':5000/'+with_stamp(body_command('write', body_command_path(command), fs.DEFAULT_DURABILITY_MODE), fs.stat(body_command_path(command))['stamp']), data=contents)
+            return response.status_code == 200
+        if command.startswith('write/'):
+            manifest = fs.chunk_manifest(body_command_path(command))
+            if manifest != None and put_chunks(rvm_ip, command, manifest):
+                return True
+            encoding, _, chunks = fs.stream_stored(body_command_path(command))
+            response = requests.put('http://'+rvm_ip+':5000/'+command+'&compression='+encoding, data=chunks, headers={'Content-Encoding': encoding})
+            return response.status_code == 200
+        offset, length = body_command_range(command)
+        _, chunks = fs.stream(body_command_path(command), offset, length)
+        response = requests.put('http://'+rvm_ip+':5000/'+command, data=chunks)
+        return response.status_code == 200
+    except Exception as err_msg:
+        log('Error streaming "'+command+'" to RVM '+rvm_ip+': '+str(err_msg))
+        return False
+
+
+##############################################################################
+# Erasure coding (see <erasure.py>): in an "erasure" family with at least k+m
+# RVMs, the i-th RVM of <rvm.txt> (i < k+m) only keeps shard i of each file of
+# at least <erasure.ERASURE_MIN_BYTES>. Shards are (re-)encoded whenever a
+# write to the file is forwarded, so a replacement RVM gets its shards back
+# from the replayed command history.
+def erasure_layout():
+    mode, k, m = erasure.parse_redundancy(MEMBERSHIP.redundancy())
+    return None if mode == erasure.REDUNDANCY_REPLICATE else (k, m)
+
+
+# @return tuple: (index, k, m) of the shard of <path> that <rvm_ip> should
+#                keep, or None if it should keep the whole file
+def shard_layout_for(rvm_ip: str, path: str):
+    layout = erasure_layout()
+    if layout == None or fs.STORE != None:
+        return None
+    k, m = layout
+    rips = rvm_ips()
+    if len(rips) < k+m or rvm_ip not in rips[:k+m]:
+        return None
+    if fs.stat(path)['size'] < erasure.ERASURE_MIN_BYTES:
+        return None
+    return rips.index(rvm_ip), k, m
+
+
+# Shards travel as raw bytes, described by these headers
+def shard_headers(index: int, k: int, m: int, size: int, checksum: str) -> dict:
+    return {'X-Shard-Index': str(index), 'X-Shard-Layout': str(k)+'+'+str(m), 'X-File-Size': str(size), 'X-File-Checksum': checksum}
+
+
+# @return tuple: (index: int, k: int, m: int, size: int, checksum: str)
+def parse_shard_headers(headers):
+    k, _, m = headers['X-Shard-Layout'].partition('+')
+    return int(headers['X-Shard-Index']), int(k), int(m), int(headers['X-File-Size']), headers['X-File-Checksum']
+
+
+# Rebuild <path>, which we only hold a shard of, from any k of the shards held
+# by the machines at <peer_urls>
+def gather_shards(path: str, peer_urls: list) -> bytes:
+    index, k, m, size, checksum, shard = fs.read_shard(path)
+    shards = {index: shard}
+    for peer_url in peer_urls:
+        if len(shards) >= k:
+            break
+        try:
+            response = requests.get(peer_url+'/read_shard/'+urllib.parse.quote(path, safe=''))
+            if response.status_code != 200:
+                continue
+            peer_index, peer_k, peer_m, peer_size, peer_checksum = parse_shard_headers(response.headers)
+            if (peer_k, peer_m, peer_size, peer_checksum) == (k, m, size, checksum):
+                shards[peer_index] = response.content
+        except Exception as err_msg:
+            log('Failed to fetch a shard of "'+path+'" from '+peer_url+': '+str(err_msg))
+    contents = erasure.decode(shards, k, m, size)
+    if merkle.content_hash(contents) != checksum:
+        raise fs.DistributedFileSystemError(f"gather_shards: Path {path} was rebuilt with the wrong checksum!")
+    return contents
+
+
+# PUT shard <index> of a body command's path to an RVM (in place of the bytes
+# the command would send)
+def put_shard(rvm_ip: str, command: str, index: int, k: int, m: int) -> bool:
+    path = body_command_path(command)
+    size, checksum, shard = DISK_IO.run(shard_of, path, index, k, m, block=True)
+    command_params = urllib.parse.parse_qs(command.partition('?')[2])
+    durability_mode = command_params.get('durability', [fs.DEFAULT_DURABILITY_MODE])[0]
+    params = urllib.parse.urlencode({'index': index, 'k': k, 'm': m, 'size': size, 'checksum': checksum, 'durability': durability_mode})
+    response = requests.put('http://'+rvm_ip+':5000/'+with_stamp('write_shard/'+urllib.parse.quote(path, safe='')+'?'+params, command_params.get('stamp', [None])[0]), data=shard)
+    return response.status_code == 200
+
+
+# Shard <index> of <path>, encoded from our whole copy (or from the file
+# rebuilt out of the shards we and our peers hold)
+def shard_of(path: str, index: int, k: int, m: int):
+    try:
+        return fs.encode_shard(path, index, k, m)
+    except fs.DistributedFileSharded:
+        contents = rebuild_sharded(path)
+        return len(contents), merkle.content_hash(contents), erasure.encode_shard(contents, index, k, m)
+
+
+# Rebuild <path>, which we only hold a shard of: read it whole from the UVM,
+# or else decode it from the other RVMs' shards. Not kept (we only keep our
+# shard of it).
+def rebuild_sharded(path: str) -> bytes:
+    checksum = fs.stat(path)['checksum']
+    try:
+        response = requests.get('http://'+uvm_ip()+':5001/read_bytes/'+urllib.parse.quote(path, safe=''), headers={'Accept-Encoding': fs.compression.CODEC_IDENTITY})
+        if response.status_code == 200 and merkle.content_hash(response.content) == checksum:
+            return response.content
+    except Exception as err_msg:
+        log('Failed to read "'+path+'" from the UVM, rebuilding it from its shards: '+str(err_msg))
+    return gather_shards(path, ['http://'+rip+':5000' for rip in rvm_ips()])
+
+
+# <contents> of a rebuilt file, cut to the range requested (see <requested_range>)
+def contents_range(contents: bytes) -> bytes:
+    offset, length = requested_range()
+    return contents[offset:] if length == fs.READ_ENTIRE_PATH else contents[offset:offset+length]
+
+
+# Rewrite our corrupt copy of <path> with the UVM's, if it matches its
+# checksum (see <fs.repair>; else we're behind the UVM, and anti-entropy will
+# catch us up), on a <DISK_IO> thread (waiting for a free one if <block>, as
+# background repairs do)
+# @return bool: whether <path> is no longer corrupt
+def repair_corrupt(path: str, block: bool = False) -> bool:
+    try:
+        response = requests.get('http://'+uvm_ip()+':5001/read_bytes/'+urllib.parse.quote(path, safe=''), timeout=CORRUPT_REPAIR_TIMEOUT_SECONDS)
+        if response.status_code == 200 and DISK_IO.run(fs.repair, path, response.content, block=block):
+            log('Repaired corrupt "'+path+'" from the UVM')
+            return True
+    except diskio.DiskBusy:
+        raise
+    except Exception as err_msg:
+        log('Failed to fetch "'+path+'" from the UVM to repair it: '+str(err_msg))
+    if path not in fs.corrupt_paths(): # rewritten (or deleted) meanwhile
+        return True
+    log('Failed to repair corrupt "'+path+'" (will retry)')
+    return False
+
+
+# Stream <path>'s <chunks> (see <fs.stream>): if they turn out corrupt, the
+# response is cut short (so the reader sees an incomplete read), and <path>
+# is repaired for the next read
+def repaired_on_corruption(path: str, chunks):
+    try:
+        yield from chunks
+    except fs.DistributedFileCorrupt:
+        log('Cut short a read of corrupt "'+path+'"!')
+        threading.Thread(target=repair_corrupt, args=(path, True), daemon=True).start()
+
+
+# Open a stream of <path> via <opener(path, *args)> (<fs.stream> or
+# <fs.stream_stored>) and pull its first chunk, on a <DISK_IO> thread: the
+# request thread only reads on from there
+# >> NOTE: Raises diskio.DiskBusy if the disk can't get to it in time
+# @return tuple: what <opener> returns, its chunks still all there
+def open_stream(opener, path: str, *args):
+    return DISK_IO.run(primed_stream, opener, path, *args, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+
+
+def primed_stream(opener, path: str, *args):
+    *opened, chunks = opener(path, *args)
+    first = next(chunks, None)
+    return (*opened, chunks if first == None else itertools.chain((first,), chunks))
+
+
+# Open <path>'s file to <sendfile> from (and stat it), on a <DISK_IO> thread
+# >> NOTE: Raises diskio.DiskBusy if the disk can't get to it in time
+# @return tuple: (file, os.stat_result), or None if <path> has no file to
+#                <sendfile> from (storage backend, or compression)
+def open_local_file(path: str):
+    return DISK_IO.run(opened_local_file, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+
+
+def opened_local_file(path: str):
+    local_path = fs.file_path(path)
+    if local_path == None:
+        return None
+    file = open(local_path, 'rb')
+    return file, os.fstat(file.fileno())
+
+
+# <send_file> the <file> opened by <open_local_file> (honoring "Range" and
+# conditional request headers, as <send_file> does for a path)
+def send_local_file(file, stat: os.stat_result) -> Response:
+    response = send_file(file, mimetype='application/octet-stream', conditional=False, etag=False, last_modified=stat.st_mtime)
+    response.content_length = stat.st_size
+    return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+
+
+# Split <commands> into in-order groups: runs of URL commands (sent as one
+# batch), and individual body commands (each streamed on its own)
+def group_commands(commands: list) -> list:
+    groups = []
+    for command in commands:
+        if is_body_command(command) or len(groups) == 0 or is_body_command(groups[-1][0]):
+            groups.append([command])
+        else:
+            groups[-1].append(command)
+    return groups
+
+
+##############################################################################
+# Read repair: reads also compare the version stamp (see <fs.format_stamp>)
+# of our copy of the file with the UVM's, once the read is answered. If they
+# differ, we ask the UVM to compare its version with every RVM's (see its
+# <read_repair>): it sends stale RVMs the newest version, through its
+# replication queue (so it lands in order with the file's other commands).
+# >> NOTE: every read is compared for <READ_REPAIR_WARMUP_SECONDS> after we
+#          launch, then only a <READ_REPAIR_CHANCE> sample of them
+_read_repair_since = time.time()
+_read_repair_pending = set() # paths queued to be compared
+_read_repair_lock = threading.Lock()
+_read_repair_stats = {'compared': 0, 'reported': 0, 'failed': 0}
+_read_repair_pool = ThreadPoolExecutor(max_workers=READ_REPAIR_THREADS)
+
+def count_read_repair(outcome: str):
+    with _read_repair_lock:
+        _read_repair_stats[outcome] += 1
+
+
+# Called by every read of <path>
+def after_read(path: str):
+    if time.time()-_read_repair_since >= READ_REPAIR_WARMUP_SECONDS and random.random() >= READ_REPAIR_CHANCE:
+        return
+    with _read_repair_lock:
+        if path in _read_repair_pending or len(_read_repair_pending) >= READ_REPAIR_MAX_PENDING:
+            return
+        _read_repair_pending.add(path)
+    _read_repair_pool.submit(read_repair, path)
+
+
+# @return dict: <path>'s stat on the UVM (None if it DNE there)
+def uvm_stat(path: str):
+    response = requests.get('http://'+uvm_ip()+':5001/stat/'+urllib.parse.quote(path, safe=''), timeout=READ_REPAIR_TIMEOUT_SECONDS)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise fs.DistributedFileSystemError(f"uvm_stat: the UVM failed to stat {path} (status {response.status_code})!")
+    return response.json().get('stat')
+
+
+def stat_stamp(metadata):
+    return None if metadata == None else fs.parse_stamp(metadata.get('stamp'))
+
+
+def read_repair(path: str):
+    try:
+        if fs.exists(path) and fs.shard_index(path) == None:
+            local_stamp = stat_stamp(fs.stat(path))
+            uvm_metadata = uvm_stat(path)
+            count_read_repair('compared')
+            if uvm_metadata != None and 'stripes' not in uvm_metadata and stat_stamp(uvm_metadata) != local_stamp:
+                log('Read repair: our version of "'+path+'" differs from the UVM\'s, asking it to compare')
+                if ping_uvm(uvm_ip(), 'uvm_read_repair/'+urllib.parse.quote(path, safe='')):
+                    count_read_repair('reported')
+    except Exception as err_msg:
+        count_read_repair('failed')
+        log('Read repair of "'+path+'" failed: '+str(err_msg))
+    finally:
+        with _read_repair_lock:
+            _read_repair_pending.discard(path)
+
+
+##############################################################################
+# Parse the byte range requested via <?offset=N&length=M>, or via an HTTP
+# "Range: bytes=A-B" / "Range: bytes=A-" header
+# @return tuple: (offset: int, length: int), where length -1 reads to EOF
+def requested_range():
+    range_header = request.headers.get('Range')
+    if range_header != None and range_header.startswith('bytes='):
+        start, _, end = range_header[len('bytes='):].split(',')[0].strip().partition('-')
+        offset = int(start)
+        return offset, (int(end)-offset+1 if len(end) > 0 else fs.READ_ENTIRE_PATH)
+    return int(request.args.get('offset','0')), int(request.args.get('length',str(fs.READ_ENTIRE_PATH)))
+
+
+##############################################################################
+# Whether to verify whole-file reads against their checksum: <?verify=0>
+# skips it (for hot paths that can trust the disk)
+def requested_verify() -> bool:
+    return request.args.get('verify', '1') != '0'
+
+
+##############################################################################
+# Durability mode requested via <?durability=MODE> (see <durability.py>)
+def requested_durability() -> str:
+    return fs.validate_durability_mode(request.args.get('durability'))
+
+
+##############################################################################
+# Compression requested via <?compression=CODEC> (None = per the policy, see
+# <compression.py>)
+def requested_compression():
+    encoding = request.args.get('compression')
+    return None if encoding == None else fs.validate_compression(encoding)
+
+
+# Logical (decompressed) size of the request body: <?size=N> if given, else
+# its Content-Length if it isn't compressed (else None)
+def requested_body_size():
+    if 'size' in request.args:
+        return int(request.args.get('size'))
+    if request.headers.get('Content-Encoding', fs.compression.CODEC_IDENTITY) == fs.compression.CODEC_IDENTITY:
+        return request.content_length
+    return None
+
+
+##############################################################################
+# Yield the request body in bounded-size chunks (handles chunked encoding)
+def request_body_chunks():
+    stream = request.stream # bound now: the chunks are read on a disk I/O thread
+    return iter(lambda: stream.read(fs.STREAM_CHUNK_BYTES), b'')
 
 
 ##############################################################################
 # FILE OPERATIONS
 
 ##############################################################################
-# Read the contents of a path
-@app.route('/read/<path>', methods=['GET'])
+# Read the contents of a path (or a byte range of it, see <requested_range>)
+@app.route('/read/<path:path>', methods=['GET'])
 def read(path: str):
     try:
         path = urllib.parse.unquote(path)
-        _, data = fs.read(path, 0, fs.READ_ENTIRE_PATH)
-        return jsonify({'data': data, }), 200
+        after_read(path)
+        offset, length = requested_range()
+        position, data = DISK_IO.run(fs.read, path, offset, length, requested_verify(), timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        return jsonify({'data': data, 'position': position, }), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileSharded:
+        try:
+            data = contents_range(DISK_IO.run(rebuild_sharded, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS))
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return jsonify({'data': data.decode('utf-8', errors='replace'), 'position': requested_range()[0]+len(data), }), 200
+    except fs.DistributedFileCorrupt:
+        try:
+            if not repair_corrupt(path):
+                return jsonify({'error': 'corrupt file'}), 500
+            data = contents_range(DISK_IO.run(fs.read_contents, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS))
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return jsonify({'data': data.decode('utf-8', errors='replace'), 'position': requested_range()[0]+len(data), }), 200
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Read the raw bytes of a path as "application/octet-stream" (no JSON/text
+# decoding). Whole-file reads go through <send_file> (<sendfile> where the
+# WSGI server supports it, and honors "Range" headers); <?offset=N&length=M>
+# reads are streamed out of an mmap of the file. A compressed file is sent as
+# stored (with a "Content-Encoding") if the client's "Accept-Encoding" allows,
+# else decompressed on the fly. Whole files read from disk are verified as
+# they're streamed (unless <?verify=0>), so skip <sendfile>: a corrupt file's
+# response is cut short, and it's repaired from the UVM's copy.
+@app.route('/read_bytes/<path:path>', methods=['GET'])
+def read_bytes(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        verify = requested_verify()
+        after_read(path)
+        if 'offset' in request.args or 'length' in request.args:
+            offset, length = requested_range()
+            total_bytes, chunks = open_stream(fs.stream, path, offset, length)
+            return Response(chunks, status=200, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes)})
+        if 'Range' not in request.headers and fs.negotiate_encoding(path, request.headers.get('Accept-Encoding')) != fs.compression.CODEC_IDENTITY:
+            encoding, total_bytes, chunks = open_stream(fs.stream_stored, path, verify)
+            headers = {'Content-Length': str(total_bytes), 'Vary': 'Accept-Encoding'}
+            if encoding != fs.compression.CODEC_IDENTITY:
+                headers['Content-Encoding'] = encoding
+            return Response(chunks, status=200, mimetype='application/octet-stream', headers=headers)
+        contents = fs.cached_bytes(path)
+        if contents != None:
+            return send_file(io.BytesIO(contents), mimetype='application/octet-stream', conditional=True, etag=False)
+        local_file = None if verify and 'Range' not in request.headers else open_local_file(path)
+        if local_file == None: # storage backend (or compression) has no file to <sendfile> from, or it's verified
+            if 'Range' in request.headers:
+                offset, length = requested_range()
+                total_bytes, chunks = open_stream(fs.stream, path, offset, length)
+                content_range = 'bytes '+str(offset)+'-'+str(offset+total_bytes-1)+'/'+str(fs.stat(path)['size'])
+                return Response(chunks, status=206, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes), 'Content-Range': content_range})
+            total_bytes, chunks = open_stream(fs.stream, path, 0, fs.READ_ENTIRE_PATH, verify)
+            return Response(repaired_on_corruption(path, chunks), status=200, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes)})
+        return send_local_file(*local_file)
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileSharded:
+        try:
+            contents = DISK_IO.run(rebuild_sharded, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return Response(contents_range(contents), status=200, mimetype='application/octet-stream')
+    except fs.DistributedFileCorrupt:
+        try:
+            if not repair_corrupt(path):
+                return jsonify({'error': 'corrupt file'}), 500
+            contents = DISK_IO.run(fs.read_contents, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return Response(contents_range(contents), status=200, mimetype='application/octet-stream')
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # Write a string to the path (creates a new file if <path> DNE)
-@app.route('/write/<path>/<data>', methods=['GET'])
+@app.route('/write/<path:path>/<data>', methods=['GET'])
 def write(path: str, data: str):
     try:
         path = urllib.parse.unquote(path)
         data = urllib.parse.unquote(data)
-        fs.write(path, data)
+        DISK_IO.run(fs.write, path, data, requested_durability(), requested_compression(), block=True)
+        apply_requested_stamp(path)
+        register_command(request.url)
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body to the path (creates a new file if <path> DNE),
+# streaming it to disk in bounded-size chunks. A body sent with a
+# "Content-Encoding" is stored compressed as is (unless <?compression=CODEC>
+# says otherwise).
+@app.route('/write/<path:path>', methods=['PUT', 'POST'])
+def write_body(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        durability_mode = requested_durability()
+        DISK_IO.run(fs.write_stream, path, request_body_chunks(), durability_mode, requested_compression(), request.headers.get('Content-Encoding', fs.compression.CODEC_IDENTITY), requested_body_size(), block=True)
+        apply_requested_stamp(path)
+        record_command(body_command('write', path, durability_mode))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Rewrite the path from the request body: a delta (see <delta.py>) against
+# its version stamped <?base=E.S>, rebuilding a file with content hash
+# <?checksum=HASH> (stored with <?compression=CODEC>)
+# @return 409 if we don't hold that version (the UVM sends the whole file)
+@app.route('/write_delta/<path:path>', methods=['PUT', 'POST'])
+def write_delta(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        durability_mode = requested_durability()
+        if not DISK_IO.run(fs.write_delta, path, request.get_data(), fs.parse_stamp(request.args.get('base', '')), request.args.get('checksum'), durability_mode, requested_compression(), block=True):
+            return jsonify({'error': 'base version not held'}), 409
+        apply_requested_stamp(path)
+        record_command(body_command('write', path, durability_mode))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body, a stripe manifest, to the path (creates a new file
+# if <path> DNE), flagging it as a striped file (see <fs.write_manifest>)
+@app.route('/write_manifest/<path:path>', methods=['PUT', 'POST'])
+def write_manifest(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        durability_mode = requested_durability()
+        DISK_IO.run(fs.write_manifest, path, request.get_data(), durability_mode, block=True)
+        apply_requested_stamp(path)
+        record_command(body_command('write_manifest', path, durability_mode))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Keep just one erasure-coded shard of the path (replacing any copy of it): the
+# body is shard <?index=I> of the <?k=K>+<?m=M> layout, of the <?size=N>-byte
+# file with content hash <?checksum=HASH>
+@app.route('/write_shard/<path:path>', methods=['PUT', 'POST'])
+def write_shard(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        durability_mode = requested_durability()
+        index, k, m = int(request.args.get('index')), int(request.args.get('k')), int(request.args.get('m'))
+        fs.write_shard(path, index, k, m, int(request.args.get('size')), request.args.get('checksum'), request.get_data(), durability_mode)
+        apply_requested_stamp(path)
+        record_command(body_command('write', path, durability_mode))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Give the path the UVM's version stamp <?stamp=E.S> if it's newer than ours,
+# and our copy's content hash is still <?checksum=HASH> (the UVM's, see its
+# <read_repair>)
+@app.route('/restamp/<path:path>', methods=['GET'])
+def restamp(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        stamp = fs.parse_stamp(request.args.get('stamp'))
+        if fs.stamp_key(stamp) > fs.stamp_key(stat_stamp(fs.stat(path))):
+            fs.restamp(path, stamp, request.args.get('checksum'))
+        return jsonify({}), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Which of the POSTed {'chunks': [hash, ...]} we don't hold (chunk store only)
+# @return JSON: {'missing': [hash, ...]}
+@app.route('/missing_chunks', methods=['POST'])
+def missing_chunks():
+    try:
+        return jsonify({'missing': fs.missing_chunks(request.get_json().get('chunks'))}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Read exactly <n_bytes> more of the request body (fewer only at its end)
+def read_request_body(n_bytes: int) -> bytes:
+    data = bytearray()
+    while len(data) < n_bytes:
+        chunk = request.stream.read(n_bytes-len(data))
+        if len(chunk) == 0:
+            break
+        data += chunk
+    return bytes(data)
+
+
+##############################################################################
+# Write the path from a chunk-store peer's deduplicated write: the body is a
+# JSON line {"chunks": [[hash, size], ...], "included": [hash, ...]}, followed
+# by the bytes of each included chunk, in manifest order. Every other chunk
+# must already be held here (else 400, and the sender resends the whole file).
+@app.route('/write_chunks/<path:path>', methods=['PUT', 'POST'])
+def write_chunks(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        durability_mode = requested_durability()
+        manifest = json.loads(request.stream.readline())
+        chunks = [(chash, size) for chash, size in manifest['chunks']]
+        fs.write_chunks(path, chunks, set(manifest['included']), read_request_body, durability_mode)
+        apply_requested_stamp(path)
+        record_command(body_command('write', path, durability_mode))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Append the request body to the path in place (creates a new file if <path> DNE)
+# at byte <?offset=N>, where the UVM appended it (see <fs.append_bytes>)
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/append/<path:path>', methods=['PUT', 'POST'])
+def append(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        contents = request.get_data()
+        offset = int(request.args['offset']) if 'offset' in request.args else None
+        durability_mode = requested_durability()
+        length = DISK_IO.run(fs.append_bytes, path, contents, durability_mode, offset, block=True)
+        apply_requested_stamp(path)
+        record_command(with_stamp(body_command('append', path, durability_mode, length-len(contents) if offset == None else offset, len(contents)), request.args.get('stamp')))
+        return jsonify({'length': length}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body in place at byte <?offset=N> of the path (creates a
+# new file if <path> DNE)
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/write_at/<path:path>', methods=['PUT', 'POST'])
+def write_at(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        offset = int(request.args.get('offset','0'))
+        contents = request.get_data()
+        durability_mode = requested_durability()
+        length = DISK_IO.run(fs.write_at, path, offset, contents, durability_mode, block=True)
+        apply_requested_stamp(path)
+        record_command(with_stamp(body_command('write_at', path, durability_mode, offset, len(contents)), request.args.get('stamp')))
+        return jsonify({'length': length}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Truncate (or zero-extend) <path> to <length> bytes
+@app.route('/truncate/<path:path>/<length>', methods=['GET'])
+def truncate(path: str, length: str):
+    try:
+        path = urllib.parse.unquote(path)
+        length = int(length)
+        DISK_IO.run(fs.truncate, path, length, requested_durability(), block=True)
+        apply_requested_stamp(path)
         register_command(request.url)
         return jsonify({}), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
 ##############################################################################
 # Delete <path>
-@app.route('/delete/<path>', methods=['GET'])
+@app.route('/delete/<path:path>', methods=['GET'])
 def delete(path: str):
     try:
         path = urllib.parse.unquote(path)
-        fs.delete(path)
+        DISK_IO.run(fs.delete, path, block=True)
         register_command(request.url)
         return jsonify({}), 200
     except fs.DistributedFileSystemError:
@@ -147,8 +933,9 @@ def copy(src_path: str, dest_path: str):
     try:
         src_path = urllib.parse.unquote(src_path)
         dest_path = urllib.parse.unquote(dest_path)
-        fs.copy(src_path,dest_path)
-        register_command(request.url)
+        DISK_IO.run(fs.copy, src_path, dest_path, block=True)
+        apply_requested_stamp(dest_path)
+        record_command(with_stamp('copy/'+path_segment(src_path)+'/'+path_segment(dest_path), request.args.get('stamp')))
         return jsonify({}), 200
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
@@ -157,14 +944,15 @@ def copy(src_path: str, dest_path: str):
 
 
 ##############################################################################
-# Rename <old_path> as <new_path>
+# Rename <old_path> as <new_path> (a file, or a whole directory)
 @app.route('/rename/<old_path>/<new_path>', methods=['GET'])
 def rename(old_path: str, new_path: str):
     try:
         old_path = urllib.parse.unquote(old_path)
         new_path = urllib.parse.unquote(new_path)
-        fs.rename(old_path,new_path)
-        register_command(request.url)
+        DISK_IO.run(fs.rename, old_path, new_path, block=True)
+        apply_requested_stamp(new_path)
+        record_command(with_stamp('rename/'+path_segment(old_path)+'/'+path_segment(new_path), request.args.get('stamp')))
         return jsonify({}), 200
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
@@ -173,8 +961,8 @@ def rename(old_path: str, new_path: str):
 
 
 ##############################################################################
-# Rename <old_path> as <new_path>
-@app.route('/exists/<path>', methods=['GET'])
+# Check if the file <path> exists
+@app.route('/exists/<path:path>', methods=['GET'])
 def exists(path: str):
     try:
         path = urllib.parse.unquote(path)
@@ -183,6 +971,197 @@ def exists(path: str):
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Get <path>'s size, mtime, version, checksum, and version stamp from the metadata index
+# (or, for a directory, its number of entries)
+@app.route('/stat/<path:path>', methods=['GET'])
+def stat(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        return jsonify({'stat': fs.stat(path)}), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Make the directory <path> (and any missing parents)
+@app.route('/mkdir/<path:path>', methods=['GET'])
+def mkdir(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        DISK_IO.run(fs.mkdir, path, requested_durability(), block=True)
+        register_command(request.url)
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Remove the empty directory <path>
+@app.route('/rmdir/<path:path>', methods=['GET'])
+def rmdir(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        DISK_IO.run(fs.rmdir, path, block=True)
+        register_command(request.url)
+        return jsonify({}), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing directory'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# List a page of the directory <path> (the root if omitted), see the UVM's
+# </list> route
+@app.route('/list/', defaults={'path': ''}, methods=['GET'])
+@app.route('/list/<path:path>', methods=['GET'])
+def list_directory(path: str):
+    try:
+        path = urllib.parse.unquote(path).strip('/')
+        limit = int(request.args.get('limit', str(fs.namespace.MAX_LIST_ENTRIES)))
+        listing = fs.list_directory(path, request.args.get('prefix',''), request.args.get('start_after',''), limit)
+        return jsonify(listing), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing directory'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# List a page of every file whose path starts with <?prefix=P> (in any
+# directory below), see the UVM's </list_files> route
+@app.route('/list_files', methods=['GET'])
+def list_files():
+    try:
+        limit = int(request.args.get('limit', str(fs.namespace.MAX_LIST_ENTRIES)))
+        return jsonify(fs.list_files(request.args.get('prefix',''), request.args.get('start_after',''), limit)), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Read shard <?index=I&k=K&m=M> of a path as raw bytes described by "X-Shard-*"
+# headers (without an index: the shard we hold)
+@app.route('/read_shard/<path:path>', methods=['GET'])
+def read_shard(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        if 'index' in request.args:
+            index, k, m = int(request.args.get('index')), int(request.args.get('k')), int(request.args.get('m'))
+            size, checksum, shard = DISK_IO.run(shard_of, path, index, k, m, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        else:
+            index, k, m, size, checksum, shard = DISK_IO.run(fs.read_shard, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        return Response(shard, status=200, mimetype='application/octet-stream', headers=shard_headers(index, k, m, size, checksum))
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Report page cache hit ratio and memory use
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    try:
+        return jsonify({'cache': fs.cache_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report the disk I/O pool's queue depth, rejections/timeouts, and mean
+# queueing and service times
+@app.route('/disk_io_stats', methods=['GET'])
+def disk_io_stats():
+    try:
+        return jsonify({'disk_io': DISK_IO.stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report how many paths are locked now, and how often (and how long) an
+# operation had to wait for another's lock on its path
+@app.route('/lock_stats', methods=['GET'])
+def lock_stats():
+    try:
+        return jsonify({'locks': fs.lock_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report the storage backend in use (and bitcask's segment/dead-byte counts)
+@app.route('/storage_stats', methods=['GET'])
+def storage_stats():
+    try:
+        return jsonify({'storage': fs.storage_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report files/bytes per storage tier (memory, disk, cold), promotion and
+# demotion counts, and the mean read latency per tier
+@app.route('/tier_stats', methods=['GET'])
+def tier_stats():
+    try:
+        return jsonify({'tiers': fs.tier_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report scrub passes and throughput, and how many corrupt files reads and
+# scrubbing have found (and how many were repaired, or are still pending)
+@app.route('/integrity_stats', methods=['GET'])
+def integrity_stats():
+    try:
+        return jsonify({'integrity': fs.integrity_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report how many reads compared versions with the UVM (see <read_repair>),
+# and how many found ours differed ("reported" to the UVM to repair)
+@app.route('/read_repair_stats', methods=['GET'])
+def read_repair_stats():
+    try:
+        with _read_repair_lock:
+            stats = dict(_read_repair_stats)
+            stats['pending'] = len(_read_repair_pending)
+        return jsonify({'read_repair': stats}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# REPLICA ANTI-ENTROPY
+
+##############################################################################
+# Get the hashes of comma-separated merkle tree node indices
+@app.route('/merkle_nodes/<nodes>', methods=['GET'])
+def merkle_nodes(nodes: str):
+    try:
+        nodes = [int(node) for node in urllib.parse.unquote(nodes).split(',') if len(node) > 0]
+        return jsonify({'nodes': fs.MERKLE_TREE.node_hashes(nodes)}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Get the {path: content_hash} entries of a merkle tree leaf node
+@app.route('/merkle_bucket/<node>', methods=['GET'])
+def merkle_bucket(node: str):
+    try:
+        node = int(urllib.parse.unquote(node))
+        if not fs.MERKLE_TREE.is_leaf_node(node):
+            return jsonify({'error': 'merkle node '+str(node)+' is not a leaf'}), 400
+        return jsonify({'entries': fs.MERKLE_TREE.bucket(node)}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # RVM HEALTH MONITORING
 
@@ -212,48 +1191,57 @@ def ping_router(ip_address, command):
 
 
 ##############################################################################
-# RVM Addresses Getter
-RVM_IPS_FILENAME = '../ips/'+sys.argv[1]+'/rvm.txt'
-rvm_ips_file_lock = threading.Lock()
+# RVM/UVM Address Getters
+# Family membership is cached in memory, only touching disk upon a change
+MEMBERSHIP = membership.Membership('../ips/'+sys.argv[1]+'/')
+
+# Pool running the file routes' disk I/O, off the request threads (see <diskio.py>)
+DISK_IO = diskio.DiskExecutor()
 
 
 def rvm_ips():
-    with rvm_ips_file_lock:
-        with open(RVM_IPS_FILENAME, 'r') as file:
-            return [line for line in [line.strip() for line in file.read().split('\n')] if len(line) > 0]
+    return MEMBERSHIP.rvm_ips()
 
 
-def write_rvm_ips(rvm_ips_contents: str):
-    with rvm_ips_file_lock:
-        with open(RVM_IPS_FILENAME, 'w') as file:
-            file.write(rvm_ips_contents)
+def uvm_ip():
+    return MEMBERSHIP.uvm_ip()
 
 
-##############################################################################
-# UVM Address Getter
-UVM_IPS_FILENAME = '../ips/'+sys.argv[1]+'/uvm.txt'
-uvm_ips_file_lock = threading.Lock()
+# <epoch> = None for local changes, else the remote sender's epoch
+# @return bool: False if <epoch> is older than ours (update rejected)
+def write_rvm_ips(rvm_ips_contents: str, epoch = None) -> bool:
+    return MEMBERSHIP.update(rvm_ips=membership.parse_ips(rvm_ips_contents), epoch=epoch)
 
 
-def uvm_ip():
-    with uvm_ips_file_lock:
-        with open(UVM_IPS_FILENAME, 'r') as file:
-            return file.read().strip()
+def write_uvm_ip(uvm_ip_contents: str, epoch = None) -> bool:
+    return MEMBERSHIP.update(uvm_ip=uvm_ip_contents.strip(), epoch=epoch)
+
+
+def epoch_query() -> str:
+    return '?epoch='+str(MEMBERSHIP.epoch())
+
 
+# Tells a joining pooled RVM which storage backend (and redundancy mode) our family uses
+def storage_backend_query() -> str:
+    return '&backend='+urllib.parse.quote(fs.STORAGE_BACKEND)+'&redundancy='+urllib.parse.quote(MEMBERSHIP.redundancy())
 
-def write_uvm_ip(uvm_ip_contents: str):
-    with uvm_ips_file_lock:
-        with open(UVM_IPS_FILENAME, 'w') as file:
-            file.write(uvm_ip_contents)
+
+def request_epoch():
+    epoch = request.args.get('epoch')
+    return int(epoch) if epoch != None else None
 
 
 ##############################################################################
 # Get a new IP address for an EC2 RVM
 MIDDLEWARE_IP_FILENAME = '../ips/middleware.txt'
+_middleware_ip = None
 
 def middleware_ip():
-    with open(MIDDLEWARE_IP_FILENAME, 'r') as file:
-        return file.read().strip()
+    global _middleware_ip
+    if _middleware_ip == None:
+        with open(MIDDLEWARE_IP_FILENAME, 'r') as file:
+            _middleware_ip = file.read().strip()
+    return _middleware_ip
 
 
 def get_new_rvm_ip():
@@ -359,7 +1347,7 @@ def awaken_pooled_rvm(pooled_rvm_ip, rvm_txt):
     uvm = urllib.parse.quote(uvm_ip())
     rvms = urllib.parse.quote(rvm_txt)
     if isinstance(pooled_rvm_ip,list):
-        registration_url = 'rvm_pool_register/'+family+'/'+uvm+'/'+rvms
+        registration_url = 'rvm_pool_register/'+family+'/'+uvm+'/'+rvms+epoch_query()+storage_backend_query()
         for ip in pooled_rvm_ip:
             ping_rvm(ip,registration_url)
         for ip in pooled_rvm_ip:
@@ -367,7 +1355,7 @@ def awaken_pooled_rvm(pooled_rvm_ip, rvm_txt):
         for ip in pooled_rvm_ip:
             forward_commands(ip)
     else:
-        ping_rvm(pooled_rvm_ip,'rvm_pool_register_and_awaken/'+family+'/'+uvm+'/'+rvms)
+        ping_rvm(pooled_rvm_ip,'rvm_pool_register_and_awaken/'+family+'/'+uvm+'/'+rvms+epoch_query()+storage_backend_query())
         forward_commands(pooled_rvm_ip)
 
 
@@ -388,7 +1376,7 @@ def replace_self_in_rvm_ip_list(public_ip, new_rvm_ip):
 def forward_new_uvm_ip_to_rvms(public_ip):
     rips = rvm_ips()
     for rip in rips:
-        if not ping_rvm(rip,'rvm_update_uvm_ip/'+public_ip):
+        if not ping_rvm(rip,'rvm_update_uvm_ip/'+public_ip+epoch_query()):
             log_leader("Error trying to forward new UVM IP address to RVM "+rip)
 
 
@@ -478,12 +1466,12 @@ def get_new_rvm_ips(total_new_rvms):
 # Forward the new RVM IP address list to the UVM and each RVM
 def forward_new_rvm_ips_to_rvms(new_rvm_ips, ip_address_list):
     for rip in new_rvm_ips:
-        if not ping_rvm(rip,'rvm_update_rvm_ips/'+ip_address_list):
+        if not ping_rvm(rip,'rvm_update_rvm_ips/'+ip_address_list+epoch_query()):
             log_leader("Error trying to forward new RVM IP address list to RVM "+rip)
 
 
 def forward_new_rvm_ips_to_uvm(uvm_ip, ip_address_list):
-    if not ping_uvm(uvm_ip,'uvm_update_rvm_ips/'+ip_address_list):
+    if not ping_uvm(uvm_ip,'uvm_update_rvm_ips/'+ip_address_list+epoch_query()):
         log_leader("Error trying to forward new RVM IP address list to UVM "+uvm_ip)
 
 
@@ -535,26 +1523,30 @@ def rvm_become_leader():
 
 
 ##############################################################################
-# Update ../ips/rvm.txt
+# Update ../ips/rvm.txt (pass <?epoch=N> to reject stale updates)
 @app.route('/rvm_update_rvm_ips/<ip_address_list>', methods=['GET'])
 def rvm_update_rvm_ips(ip_address_list: str):
     try:
         ip_address_list = urllib.parse.unquote(ip_address_list)
+        if not write_rvm_ips(ip_address_list,request_epoch()):
+            log('Rejected stale RVM <ip_address_list> (epoch '+str(request_epoch())+' < '+str(MEMBERSHIP.epoch())+')')
+            return jsonify({'error': 'stale membership epoch'}), 409
         log('New RVM <ip_address_list>: '+ip_address_list.strip().replace('\n',', '))
-        write_rvm_ips(ip_address_list)
         return jsonify({}), 200
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
 ##############################################################################
-# Update ../ips/uvm.txt
+# Update ../ips/uvm.txt (pass <?epoch=N> to reject stale updates)
 @app.route('/rvm_update_uvm_ip/<ip>', methods=['GET'])
 def rvm_update_uvm_ip(ip: str):
     try:
         ip = urllib.parse.unquote(ip)
+        if not write_uvm_ip(ip,request_epoch()):
+            log('Rejected stale UVM <ip> (epoch '+str(request_epoch())+' < '+str(MEMBERSHIP.epoch())+')')
+            return jsonify({'error': 'stale membership epoch'}), 409
         log('New UVM <ip>: '+ip.strip())
-        write_uvm_ip(ip)
         return jsonify({}), 200
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
@@ -571,24 +1563,176 @@ def rvm_uvm_ping():
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Anti-entropy: compare merkle trees with the UVM, then only transfer the
+# files that differ (catches forwards that were missed by <forward_command>)
+def fetch_uvm_merkle_nodes(nodes):
+    url = 'http://'+uvm_ip()+':5001/merkle_nodes/'+','.join([str(node) for node in nodes])
+    response = requests.get(url)
+    if response.status_code != 200:
+        raise Exception('Failed to fetch UVM merkle nodes: '+url)
+    return {int(node): node_hash for node, node_hash in response.json().get('nodes').items()}
+
+
+def fetch_uvm_merkle_bucket(node):
+    url = 'http://'+uvm_ip()+':5001/merkle_bucket/'+str(node)
+    response = requests.get(url)
+    if response.status_code != 200:
+        raise Exception('Failed to fetch UVM merkle bucket: '+url)
+    return response.json().get('entries')
+
+
+# Our version of <path>: (stamp, checksum), or None if we don't hold it
+def local_version(path: str):
+    try:
+        metadata = fs.stat(path)
+    except fs.DistributedFileNotFound:
+        return None
+    return (stat_stamp(metadata), metadata.get('checksum'))
+
+
+# Make local <path> match the UVM's copy with content hash <chash> (None = DNE).
+# The UVM's copy is fetched first; then, under <path>'s write lock, we only
+# overwrite our copy if it's still the version we compared (else a forwarded
+# command wrote it meanwhile, and the next round compares again)
+def repair_path(path: str, chash):
+    quoted_path = urllib.parse.quote(path)
+    version = local_version(path)
+    if chash == None:
+        if version == None:
+            return True
+        with fs.PATH_LOCKS.writing(path):
+            if local_version(path) != version:
+                return False # written meanwhile: retry next round
+            fs.delete(path)
+            record_command('delete/'+quoted_path)
+        return True
+    if fs.shard_index(path) != None: # keep holding just our shard of it
+        index, k, m, _, _, _ = fs.read_shard(path)
+        response = requests.get('http://'+uvm_ip()+':5001/read_shard/'+quoted_path+'?'+urllib.parse.urlencode({'index': index, 'k': k, 'm': m}))
+        if response.status_code != 200:
+            return False
+        _, _, _, size, checksum = parse_shard_headers(response.headers)
+        if checksum != chash:
+            return False # changed on the UVM since diffing: retry next round
+        with fs.PATH_LOCKS.writing(path):
+            if local_version(path) != version:
+                return False # written meanwhile: retry next round
+            fs.write_shard(path, index, k, m, size, checksum, response.content)
+            record_command(body_command('write', path, fs.DEFAULT_DURABILITY_MODE))
+        return True
+    uvm_metadata = uvm_stat(path)
+    if uvm_metadata == None or uvm_metadata.get('checksum') != chash:
+        return False # changed on the UVM since diffing: retry next round
+    if version != None and fs.stamp_key(version[0]) > fs.stamp_key(stat_stamp(uvm_metadata)):
+        log('Anti-entropy: our version of "'+path+'" is newer than the UVM\'s, asking it to adopt ours')
+        return ping_uvm(uvm_ip(), 'uvm_read_repair/'+urllib.parse.quote(path, safe=''))
+    response = requests.get('http://'+uvm_ip()+':5001/read_bytes/'+quoted_path)
+    if response.status_code != 200:
+        return False
+    contents = response.content
+    if merkle.content_hash(contents) != chash:
+        return False # changed on the UVM since diffing: retry next round
+    with fs.PATH_LOCKS.writing(path):
+        if local_version(path) != version:
+            return False # written meanwhile: retry next round
+        if uvm_metadata.get('striped'):
+            fs.write_manifest(path, contents)
+        else:
+            fs.write_bytes(path, contents)
+        fs.restamp(path, stat_stamp(uvm_metadata), chash)
+        record_command(body_command('write_manifest' if uvm_metadata.get('striped') else 'write', path, fs.DEFAULT_DURABILITY_MODE))
+    return True
+
+
+def reconcile_with_uvm():
+    while EXECUTING_RVM_DAEMONS:
+        time.sleep(ANTI_ENTROPY_TIMEOUT_SECONDS)
+        try:
+            differences = merkle.diff(fs.MERKLE_TREE, fetch_uvm_merkle_nodes, fetch_uvm_merkle_bucket)
+            if len(differences) == 0:
+                continue
+            log('Anti-entropy found '+str(len(differences))+' divergent file(s) from the UVM!')
+            for path, chash in differences.items():
+                if not repair_path(path, chash):
+                    log('Anti-entropy failed to repair "'+path+'" (will retry)')
+        except Exception as err_msg:
+            log('Anti-entropy error: '+str(err_msg))
+
+##############################################################################
+# Periodically persist the metadata index so restarts needn't rehash files
+def persist_index_snapshots():
+    while True:
+        time.sleep(INDEX_SNAPSHOT_TIMEOUT_SECONDS)
+        try:
+            fs.save_index_snapshot()
+        except Exception as err_msg:
+            log('Failed to persist the metadata index snapshot: '+str(err_msg))
+
+
+# Periodically merge the bitcask backend's segments (and the cold tier's pack)
+def compact_storage():
+    while True:
+        time.sleep(STORAGE_COMPACTION_TIMEOUT_SECONDS)
+        try:
+            if fs.compact_storage():
+                log('Merged bitcask segments: '+str(fs.storage_stats()))
+        except Exception as err_msg:
+            log('Failed to compact storage: '+str(err_msg))
+
+
+# Periodically move files between the memory, disk and cold tiers (no-op for
+# the bitcask and chunk store backends)
+def retier_storage():
+    while True:
+        time.sleep(TIERING_TIMEOUT_SECONDS)
+        try:
+            demoted, reloaded = fs.retier()
+            if demoted > 0 or reloaded > 0:
+                log('Demoted '+str(demoted)+' idle file(s) to the cold tier, reloaded '+str(reloaded)+' hot file(s) into the page cache')
+        except Exception as err_msg:
+            log('Failed to retier storage: '+str(err_msg))
+
+
+# Continuously scrub our files at <SCRUB_BYTES_PER_SECOND> (a second's worth
+# at a time), repairing any found corrupt
+def scrub_storage():
+    while True:
+        started = time.time()
+        try:
+            scrubbed_bytes, corrupt, pass_complete = fs.scrub(SCRUB_BYTES_PER_SECOND)
+            for path in corrupt:
+                log('Scrubbing found "'+path+'" corrupt!')
+            if len(corrupt) > 0 or pass_complete:
+                for path in fs.corrupt_paths():
+                    repair_corrupt(path, True)
+            if pass_complete:
+                log('Finished a scrub pass: '+str(fs.integrity_stats()))
+        except Exception as err_msg:
+            log('Failed to scrub storage: '+str(err_msg))
+            scrubbed_bytes, pass_complete = SCRUB_BYTES_PER_SECOND, False
+        time.sleep(SCRUB_PASS_TIMEOUT_SECONDS if pass_complete else max(0, scrubbed_bytes/SCRUB_BYTES_PER_SECOND-(time.time()-started)))
+
+
 ##############################################################################
 # Pooled RVM Waiter: wait until awoken with system parameters
 AWOKEN = False
 awoken_lock = threading.Lock()
 
-def register_family(family_id, current_uvm, current_rvms):
-    global RVM_IPS_FILENAME
-    global UVM_IPS_FILENAME
+def register_family(family_id, current_uvm, current_rvms, epoch, backend = None, redundancy = None):
     sys.argv[1] = urllib.parse.unquote(family_id)
     family_path = '../ips/'+sys.argv[1]+'/'
-    with rvm_ips_file_lock:
-        RVM_IPS_FILENAME = family_path+'rvm.txt'
-    with uvm_ips_file_lock:
-        UVM_IPS_FILENAME = family_path+'uvm.txt'
     if not os.path.isdir(family_path):
         os.makedirs(family_path)
-    write_uvm_ip(urllib.parse.unquote(current_uvm))
-    write_rvm_ips(urllib.parse.unquote(current_rvms))
+    MEMBERSHIP.load(family_path)
+    MEMBERSHIP.update(uvm_ip=urllib.parse.unquote(current_uvm).strip(),
+                      rvm_ips=membership.parse_ips(urllib.parse.unquote(current_rvms)),
+                      epoch=epoch)
+    if backend != None:
+        MEMBERSHIP.set_storage_backend(backend)
+    if redundancy != None:
+        MEMBERSHIP.set_redundancy(redundancy)
+    fs.use_storage_backend(MEMBERSHIP.storage_backend())
     log_pool('Pooled resource given family '+family_id+' information!')
 
 
@@ -602,7 +1746,7 @@ def awaken_pooled_resource():
 @app.route('/rvm_pool_register/<family_id>/<current_uvm>/<current_rvms>', methods=['GET'])
 def rvm_pool_register(family_id, current_uvm, current_rvms):
     try:
-        register_family(family_id,current_uvm,current_rvms)
+        register_family(family_id,current_uvm,current_rvms,request_epoch(),request.args.get('backend'),request.args.get('redundancy'))
         return jsonify({}), 200
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
@@ -620,7 +1764,7 @@ def rvm_pool_awaken():
 @app.route('/rvm_pool_register_and_awaken/<family_id>/<current_uvm>/<current_rvms>', methods=['GET'])
 def rvm_pool_register_and_awaken(family_id, current_uvm, current_rvms):
     try:
-        register_family(family_id,current_uvm,current_rvms)
+        register_family(family_id,current_uvm,current_rvms,request_epoch(),request.args.get('backend'),request.args.get('redundancy'))
         awaken_pooled_resource()
         return jsonify({}), 200
     except Exception as err_msg:
@@ -639,6 +1783,7 @@ def initiate_pool_protocol():
         log_pool('Awoken pooled RVM waiting for '+str(RVM_POOLED_RESOURCE_INTEGRATION_BUFFER_TIME)+'s for system integration!')
         time.sleep(RVM_POOLED_RESOURCE_INTEGRATION_BUFFER_TIME)
     threading.Thread(target=elect_leader_if_missing_ping, daemon=True).start()
+    threading.Thread(target=reconcile_with_uvm, daemon=True).start()
 
 
 ##############################################################################
@@ -649,15 +1794,37 @@ if __name__ == '__main__':
     Welcome to Jordan, Rahul, and Robin's COEN 317 Project!
     Flask will communicate this server's "http" address!
     Communicate to our server by executing GET requests to the following routes:
-        /read/<path>
-        /write/<path>/<data>
+        /read/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /read_bytes/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /write/<path>/<data>?durability=<mode>
+        /write/<path>?durability=<mode> (PUT/POST the data as the request body)
+        /write_manifest/<path>?durability=<mode> (PUT/POST a stripe manifest as the request body)
+        /append/<path>?durability=<mode> (PUT/POST the data as the request body)
+        /write_at/<path>?offset=<n>&durability=<mode> (PUT/POST the data as the request body)
+        /truncate/<path>/<length>?durability=<mode>
         /delete/<path>
         /copy/<src_path>/<dest_path>
         /rename/<old_path>/<new_path>
         /exists/<path>
+        /stat/<path>
+        /mkdir/<path>?durability=<mode>
+        /rmdir/<path>
+        /list/<path>?prefix=<p>&start_after=<name>&limit=<n>
+        /list_files?prefix=<p>&start_after=<path>&limit=<n>
+        /storage_stats
+        /tier_stats
+        /integrity_stats
+        /read_repair_stats
+        /disk_io_stats
+        /lock_stats
 
     Happy coding! :)
     """
     )
+    fs.use_storage_backend(MEMBERSHIP.storage_backend())
     threading.Thread(target=initiate_pool_protocol, daemon=True).start()
+    threading.Thread(target=persist_index_snapshots, daemon=True).start()
+    threading.Thread(target=compact_storage, daemon=True).start()
+    threading.Thread(target=retier_storage, daemon=True).start()
+    threading.Thread(target=scrub_storage, daemon=True).start()
     app.run(host='0.0.0.0', debug=True, use_reloader=False)
\ No newline at end of file
@@ -3,21 +3,34 @@
 #   Route requests from client to corresponding UVMs.
 
 # SUPPORTED ROUTE APIs:
-#   1. read a file
-#   2. write data (also creates files)
+#   1. read a file (as JSON text, or as raw bytes)
+#   2. write data (also creates files, and can stream the request body)
 #   3. delete a file
 #   4. copy a file
 #   5. rename (also moves) a file
 #   6. check if a file exists
-
+#   7. stat a file
+#   8. append data (also creates files; returns the new length)
+#   9. write data at an offset, and truncate a file
+#  10. plan the placement of a large file's stripes across families, and
+#      write its manifest
+#  11. make, list (a page at a time) and remove directories (paths may hold
+#      "/"; renames also move directories)
+#  12. list every file under a prefix across all families, a page at a time
+
+import base64
+import heapq
+import json
 import os
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
 import requests
 from datetime import datetime, timezone
 from threading import Lock
 import threading
 import time
 import urllib.parse
+import uuid
 
 
 ##############################################################################
@@ -27,6 +40,22 @@ app = Flask(__name__)
 # How long the router waits for a UVM to activate
 UVM_SPAWN_TIME_BUFFER = 8
 
+# Stripes of a striped file are stored as "<STRIPE_PATH_PREFIX><id>.<index>"
+STRIPE_PATH_PREFIX = '.dfs-stripe.'
+
+# Fewest (and most) bytes a stripe may hold
+MIN_STRIPE_BYTES = 1024 * 1024
+MAX_STRIPE_BYTES = 1024 * 1024 * 1024
+
+# Most files a cluster-wide listing page returns (and a UVM's </list_files>)
+MAX_LIST_ENTRIES = 1000
+
+# Threads fetching listing pages from the families' UVMs
+LISTING_FETCH_THREADS = 16
+
+# How long we wait on a UVM's listing page before failing the listing
+LISTING_REQUEST_TIMEOUT_SECONDS = 10
+
 
 ##############################################################################
 # Logging Helper(s)
@@ -129,9 +158,9 @@ ALLOCATED_UVMS_LOCK = Lock()
 
 uvm_family_creation_lock = Lock()
 
-def uvm_can_be_routed_to(ip_address: str, operation: str, path: str):
+def uvm_can_be_routed_to(ip_address: str, operation: str, path: str, size: int):
     try:
-        return requests.get('http://'+ip_address+':5001/uvm_can_be_routed_with/'+operation+'/'+path)
+        return requests.get('http://'+ip_address+':5001/uvm_can_be_routed_with/'+operation+'/'+path+'?size='+str(size))
     except Exception:
         log('Request Routing: UVM '+ip_address+' is unreachable!')
         return None
@@ -233,23 +262,68 @@ def allocate_new_uvm(family_id: int, operation: str, path: str):
             ALLOCATED_UVMS[family_id] = 'http://'+new_uip+":5001"
 
 
+##############################################################################
+# Disk-usage-aware placement: UVMs report their byte usage and watermarks
+def usage_ratio(usage: dict) -> float:
+    return usage['used_bytes']/max(usage['high_watermark_bytes'],1)
+
+
+def past_low_watermark(usage: dict) -> bool:
+    return usage['used_bytes'] >= usage['low_watermark_bytes']
+
+
+# Allocate a new UVM/RVM unit ahead of time once every viable UVM is filling up
+scaling_out_lock = Lock()
+scaling_out = False
+
+def scale_out(operation: str, path: str):
+    global scaling_out
+    try:
+        with uvm_family_creation_lock:
+            family_id = get_next_family_unit_id()
+        allocate_new_uvm(family_id,operation,path)
+    finally:
+        with scaling_out_lock:
+            scaling_out = False
+
+
+def scale_out_in_background(operation: str, path: str):
+    global scaling_out
+    with scaling_out_lock:
+        if scaling_out:
+            return
+        scaling_out = True
+    log('Every viable UVM is past its low watermark! Scaling out in the background ...')
+    threading.Thread(target=scale_out, args=(operation,path,), daemon=True).start()
+
+
+# Operations that may create a path on any UVM that has room for it
+CREATING_OPERATIONS = ['write', 'mkdir']
+
 # Determine which UVM can execute <operation> on <path>
-def route(operation: str, path: str):
+# (<size> is the number of bytes a write would store). New paths go to the
+# UVM already holding their parent directory if one can take them, else to
+# the least full one.
+def route(operation: str, path: str, size: int = 0):
     log('Pinged to route operation <'+operation+'> to path <'+path+'>')
     viable_uvms = []
     with node_lock:
         for ip in nodes:
-            response = uvm_can_be_routed_to(ip,operation,path)
+            response = uvm_can_be_routed_to(ip,operation,path,size)
             if response != None and response.status_code == 200:
                 if response.json().get('preferred'):
                     log('Found a preferred UVM to route request to!')
                     return 'http://'+ip+':5001'
                 else:
-                    viable_uvms.append(ip)
+                    viable_uvms.append((not response.json().get('local', False),usage_ratio(response.json().get('usage')),ip,response.json().get('usage')))
     if len(viable_uvms) > 0:
-        log('Found a viable UVM to route request to!')
-        return 'http://'+viable_uvms[0]+":5001"
-    if operation != 'write':
+        viable_uvms.sort()
+        _, _, ip, usage = viable_uvms[0]
+        log('Found a viable UVM to route request to! (least full: '+str(usage['used_bytes'])+'B used)')
+        if operation in CREATING_OPERATIONS and past_low_watermark(usage):
+            scale_out_in_background(operation,path)
+        return 'http://'+ip+":5001"
+    if operation not in CREATING_OPERATIONS:
         if operation == 'exists':
             return False # file does not exist
         raise Exception('router> ['+operation+'] Path "'+path+'" does not exist!')
@@ -262,8 +336,136 @@ def route(operation: str, path: str):
     
 
 ##############################################################################
-# Read the contents of a path
-@app.route('/read/<path>', methods=['GET'])
+# STRIPING LOGIC
+# Place each of <total_stripes> stripes of <stripe_bytes> on the viable UVM
+# that'd be least full after taking it, so consecutive stripes land on
+# different families (read/written in parallel by the client)
+# @return list: the UVM URL of each stripe
+def place_stripes(stripe_path: str, stripe_bytes: int, total_stripes: int) -> list:
+    usages = {} # {ip: usage, ...}
+    with node_lock:
+        for ip in nodes:
+            response = uvm_can_be_routed_to(ip,'write',stripe_path,stripe_bytes)
+            if response != None and response.status_code == 200:
+                usages[ip] = response.json().get('usage')
+    if len(usages) == 0:
+        raise Exception('router> No UVM can store a stripe of '+str(stripe_bytes)+' bytes!')
+    planned_bytes = {ip: usage['used_bytes'] for ip, usage in usages.items()}
+    placements = []
+    for _ in range(total_stripes):
+        ip = min(usages, key=lambda ip: (planned_bytes[ip]+stripe_bytes)/max(usages[ip]['high_watermark_bytes'],1))
+        planned_bytes[ip] += stripe_bytes
+        placements.append('http://'+ip+':5001')
+    return placements
+
+
+# Delete the stripes a striped file no longer references (a UVM reports them as
+# "orphaned_stripes" once it overwrites or deletes the file's manifest). Only
+# stripe paths are ever deleted, whatever a manifest lists.
+def delete_stripes(stripe_paths: list):
+    for stripe_path in stripe_paths:
+        if not stripe_path.startswith(STRIPE_PATH_PREFIX):
+            log('Refused to delete "'+stripe_path+'" as an orphaned stripe: it isn\'t a stripe path!')
+            continue
+        try:
+            url_header = route('delete',stripe_path)
+            response = requests.get(url_header+'/delete/'+urllib.parse.quote(stripe_path, safe=''))
+            if response.status_code != 200:
+                raise Exception('Delete Error Code '+str(response.status_code))
+        except Exception as err_msg:
+            log('Failed to delete orphaned stripe "'+stripe_path+'": '+str(err_msg))
+
+
+def delete_orphaned_stripes(response):
+    stripe_paths = response.json().get('orphaned_stripes', [])
+    if len(stripe_paths) > 0:
+        log('Deleting '+str(len(stripe_paths))+' orphaned stripe(s) in the background ...')
+        threading.Thread(target=delete_stripes, args=(stripe_paths,), daemon=True).start()
+
+
+##############################################################################
+# CLUSTER-WIDE LISTING LOGIC
+# Each family's </list_files> pages come sorted in path order (component by
+# component), so the families' streams are k-way merged into one sorted
+# stream. A family's stream only holds the page being merged plus its next
+# page (prefetched meanwhile), so memory is bounded by the number of families
+# and the page size, never by how many files match.
+LISTING_EXECUTOR = ThreadPoolExecutor(max_workers=LISTING_FETCH_THREADS)
+
+def listing_key(entry: dict) -> list:
+    return entry['path'].split('/')
+
+
+def fetch_listing_page(ip: str, prefix: str, start_after: str, limit: int) -> dict:
+    response = requests.get('http://'+ip+':5001/list_files', params={'prefix': prefix, 'start_after': start_after, 'limit': limit}, timeout=LISTING_REQUEST_TIMEOUT_SECONDS)
+    if response.status_code != 200:
+        raise Exception('router> UVM '+ip+' failed to list files (Error Code '+str(response.status_code)+')')
+    return response.json()
+
+
+# Yield the files of the UVM at <ip>, a page at a time, from the page
+# <pending> will fetch
+def listing_stream(ip: str, prefix: str, pending, limit: int):
+    while pending != None:
+        page = pending.result()
+        pending = None if page['next'] == None else LISTING_EXECUTOR.submit(fetch_listing_page, ip, prefix, page['next'], limit)
+        for entry in page['files']:
+            yield entry
+
+
+# Continuation tokens are opaque to clients: the listing's prefix (so a token
+# can't continue some other listing) and the last path listed
+def encode_continuation(prefix: str, path: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([prefix, path]).encode('utf-8')).decode('ascii')
+
+
+def decode_continuation(prefix: str, continuation: str) -> str:
+    try:
+        token_prefix, path = json.loads(base64.urlsafe_b64decode(continuation.encode('ascii')))
+    except Exception:
+        raise Exception('router> Invalid continuation token!')
+    if token_prefix != prefix:
+        raise Exception('router> Continuation token is for prefix "'+token_prefix+'", not "'+prefix+'"!')
+    return path
+
+
+##############################################################################
+# Forward any <?offset=N&length=M> byte range on to the UVM
+def requested_range_params():
+    return {key: request.args.get(key) for key in ['offset','length'] if key in request.args}
+
+
+# Forward the read's <?verify=0> (skip checking it against its checksum, if
+# given) on to the UVM
+def requested_verify_params():
+    return {'verify': request.args.get('verify')} if 'verify' in request.args else {}
+
+
+# Forward the write's <?durability=MODE> (if given) on to the UVM
+def requested_durability_params():
+    return {'durability': request.args.get('durability')} if 'durability' in request.args else {}
+
+
+# Forward the write's <?compression=CODEC> (if given) on to the UVM
+def requested_compression_params():
+    return {'compression': request.args.get('compression')} if 'compression' in request.args else {}
+
+
+# Forward the listing's <?prefix=P&start_after=NAME&limit=N> (if given) on to the UVM
+def requested_listing_params():
+    return {key: request.args.get(key) for key in ['prefix','start_after','limit'] if key in request.args}
+
+
+# <path> as a single URL segment of a two-path route (</copy/<src>/<dest>>,
+# </rename/<old>/<new>>): quoted twice, since the "/"s it may hold are
+# unquoted once before routing (the route then unquotes the rest)
+def path_segment(path: str) -> str:
+    return urllib.parse.quote(urllib.parse.quote(path, safe=''), safe='')
+
+
+##############################################################################
+# Read the contents of a path (or a byte range of it)
+@app.route('/read/<path:path>', methods=['GET'])
 def read(path: str):
     try:
         # find route, and send request to node
@@ -281,25 +483,108 @@ def read(path: str):
                 else:
                     log('Still allocating resource '+str(token)+'! Still waiting ...')
                     return jsonify({'token': token}), 425 # still allocating
-        response = requests.get(url_header+"/read/"+path)
+        headers = {'Range': request.headers.get('Range')} if 'Range' in request.headers else {}
+        response = requests.get(url_header+"/read/"+path, params={**requested_range_params(), **requested_verify_params()}, headers=headers)
         # when the node responds back, forward response back to client
         if response.status_code == 200:
-            return jsonify({'data': response.json().get("data")}), 200
+            if 'stripe_manifest' in response.json():
+                return jsonify({'stripe_manifest': response.json().get('stripe_manifest')}), 200
+            return jsonify({'data': response.json().get("data"), 'position': response.json().get("position")}), 200
         else:
             raise Exception("router> Read Error Code " + str(response.status_code))
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Read the raw bytes of a path, stream-proxying the UVM's binary response
+# chunk by chunk (never holding the whole file in memory). The client's
+# "Accept-Encoding" is passed on, and compressed responses are proxied as is.
+PROXIED_READ_HEADERS = ['Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified', 'Content-Encoding', 'Vary', 'X-Stripe-Manifest']
+PROXY_CHUNK_BYTES = 64 * 1024
+
+@app.route('/read_bytes/<path:path>', methods=['GET'])
+def read_bytes(path: str):
+    try:
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('read',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        headers = {'Range': request.headers.get('Range')} if 'Range' in request.headers else {}
+        headers['Accept-Encoding'] = request.headers.get('Accept-Encoding', 'identity')
+        response = requests.get(url_header+"/read_bytes/"+path, params={**requested_range_params(), **requested_verify_params()}, headers=headers, stream=True)
+        if response.status_code not in [200, 206]:
+            raise Exception("router> Read Bytes Error Code " + str(response.status_code))
+        proxied_headers = {key: response.headers[key] for key in PROXIED_READ_HEADERS if key in response.headers}
+        return Response(response.raw.stream(PROXY_CHUNK_BYTES, decode_content=False), status=response.status_code, mimetype='application/octet-stream', headers=proxied_headers)
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # Write a string to the path (creates a new file if <path> DNE)
-@app.route('/write/<path>/<data>', methods=['GET'])
+@app.route('/write/<path:path>/<data>', methods=['GET'])
 def write(path: str, data: str):
     try:
         # find route, and send request to node
         token = int(request.args.get('token','-1'))
         if token == -1:
-            url_header = route('write',path)
+            url_header = route('write',path,len(data.encode('utf-8')))
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/write/"+path+"/"+data, params={**requested_durability_params(), **requested_compression_params()})
+        # when the node responds back, forward reponse back to client
+        if response.status_code == 200:
+            delete_orphaned_stripes(response)
+            return jsonify({}), 200
+        else:
+            raise Exception("router> Write Error Code " + str(response.status_code))
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body to the path (creates a new file if <path> DNE),
+# stream-proxying the (optionally chunked, optionally compressed) body on to
+# the UVM in chunks. Pass <?size=N> (if not sending a Content-Length, or
+# sending a compressed body) for capacity routing.
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+def request_body_chunks():
+    while True:
+        chunk = request.stream.read(UPLOAD_CHUNK_BYTES)
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+@app.route('/write/<path:path>', methods=['PUT', 'POST'])
+def write_body(path: str):
+    try:
+        size = int(request.args.get('size')) if 'size' in request.args else (request.content_length or 0)
+        # find route, and send request to node
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('write',path,size)
             if isinstance(url_header,int):
                 return jsonify({'token': url_header}), 425 # allocating a VM
         else:
@@ -311,9 +596,11 @@ def write(path: str, data: str):
                 else:
                     log('Still allocating resource '+str(token)+'! Still waiting ...')
                     return jsonify({'token': token}), 425 # still allocating
-        response = requests.get(url_header+"/write/"+path+"/"+data)
+        headers = {'Content-Encoding': request.headers.get('Content-Encoding')} if 'Content-Encoding' in request.headers else {}
+        response = requests.put(url_header+"/write/"+path, params={'size': size, **requested_durability_params(), **requested_compression_params()}, data=request_body_chunks(), headers=headers)
         # when the node responds back, forward reponse back to client
         if response.status_code == 200:
+            delete_orphaned_stripes(response)
             return jsonify({}), 200
         else:
             raise Exception("router> Write Error Code " + str(response.status_code))
@@ -321,9 +608,138 @@ def write(path: str, data: str):
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Write the request body, the manifest of a striped file (see </stripe_plan>),
+# to the path (creates a new file if <path> DNE)
+@app.route('/write_manifest/<path:path>', methods=['PUT', 'POST'])
+def write_manifest(path: str):
+    try:
+        contents = request.get_data()
+        # find route, and send request to node
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('write',path,len(contents))
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.put(url_header+"/write_manifest/"+path, params=requested_durability_params(), data=contents)
+        # when the node responds back, forward reponse back to client
+        if response.status_code == 200:
+            delete_orphaned_stripes(response)
+            return jsonify({}), 200
+        else:
+            raise Exception("router> Write Manifest Error Code " + str(response.status_code))
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Append the request body to the path (creates a new file if <path> DNE)
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/append/<path:path>', methods=['PUT', 'POST'])
+def append(path: str):
+    try:
+        contents = request.get_data()
+        # find route, and send request to node
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('write',path,len(contents))
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.put(url_header+"/append/"+path, params=requested_durability_params(), data=contents)
+        # when the node responds back, forward reponse back to client
+        if response.status_code == 200:
+            return jsonify({'length': response.json().get('length')}), 200
+        else:
+            raise Exception("router> Append Error Code " + str(response.status_code))
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body in place at byte <?offset=N> of the path (creates a
+# new file if <path> DNE)
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/write_at/<path:path>', methods=['PUT', 'POST'])
+def write_at(path: str):
+    try:
+        contents = request.get_data()
+        # find route, and send request to node
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('write',path,len(contents))
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        params = {'offset': request.args.get('offset','0'), **requested_durability_params()}
+        response = requests.put(url_header+"/write_at/"+path, params=params, data=contents)
+        # when the node responds back, forward reponse back to client
+        if response.status_code == 200:
+            return jsonify({'length': response.json().get('length')}), 200
+        else:
+            raise Exception("router> Write At Error Code " + str(response.status_code))
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Truncate (or zero-extend) <path> to <length> bytes
+@app.route('/truncate/<path:path>/<length>', methods=['GET'])
+def truncate(path: str, length: str):
+    try:
+        # find route, and send request to node
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('truncate',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/truncate/"+path+"/"+length, params=requested_durability_params())
+        # when the node responds back, forward reponse back to client
+        if response.status_code == 200:
+            return jsonify({}), 200
+        else:
+            raise Exception("router> Truncate Error Code " + str(response.status_code))
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # Delete <path>
-@app.route('/delete/<path>', methods=['GET'])
+@app.route('/delete/<path:path>', methods=['GET'])
 def delete(path: str):
     try:
         # find route, and send request to node
@@ -343,6 +759,7 @@ def delete(path: str):
                     return jsonify({'token': token}), 425 # still allocating
         response = requests.get(url_header+"/delete/"+path)
         if response.status_code == 200:
+            delete_orphaned_stripes(response)
             return jsonify({}), 200
         else:
             raise Exception("router> Delete Error Code " + str(response.status_code))
@@ -356,6 +773,8 @@ def delete(path: str):
 @app.route('/copy/<src_path>/<dest_path>', methods=['GET'])
 def copy(src_path: str, dest_path: str):
     try:
+        src_path = urllib.parse.unquote(src_path)
+        dest_path = urllib.parse.unquote(dest_path)
         token = int(request.args.get('token','-1'))
         if token == -1:
             url_header = route('copy',src_path)
@@ -370,8 +789,9 @@ def copy(src_path: str, dest_path: str):
                 else:
                     log('Still allocating resource '+str(token)+'! Still waiting ...')
                     return jsonify({'token': token}), 425 # still allocating
-        response = requests.get(url_header+"/copy/"+src_path+"/"+dest_path)
+        response = requests.get(url_header+"/copy/"+path_segment(src_path)+"/"+path_segment(dest_path))
         if response.status_code == 200:
+            delete_orphaned_stripes(response)
             return jsonify({}), 200
         else:
             raise Exception("router> Copy Error Code " + str(response.status_code))
@@ -381,10 +801,12 @@ def copy(src_path: str, dest_path: str):
 
 
 ##############################################################################
-# Rename <old_path> as <new_path>
+# Rename <old_path> as <new_path> (a file, or a whole directory)
 @app.route('/rename/<old_path>/<new_path>', methods=['GET'])
 def rename(old_path: str, new_path: str):
     try:
+        old_path = urllib.parse.unquote(old_path)
+        new_path = urllib.parse.unquote(new_path)
         token = int(request.args.get('token','-1'))
         if token == -1:
             url_header = route('rename',old_path)
@@ -399,8 +821,9 @@ def rename(old_path: str, new_path: str):
                 else:
                     log('Still allocating resource '+str(token)+'! Still waiting ...')
                     return jsonify({'token': token}), 425 # still allocating
-        response = requests.get(url_header+"/rename/"+old_path+"/"+new_path)
+        response = requests.get(url_header+"/rename/"+path_segment(old_path)+"/"+path_segment(new_path))
         if response.status_code == 200:
+            delete_orphaned_stripes(response)
             return jsonify({}), 200
         else:
             raise Exception("router> Rename Error Code " + str(response.status_code))
@@ -410,8 +833,8 @@ def rename(old_path: str, new_path: str):
 
 
 ##############################################################################
-# Rename <old_path> as <new_path> # is this needed
-@app.route('/exists/<path>', methods=['GET'])
+# Check if the file <path> exists
+@app.route('/exists/<path:path>', methods=['GET'])
 def exists(path: str):
     try:
         token = int(request.args.get('token','-1'))
@@ -439,6 +862,182 @@ def exists(path: str):
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
+
+##############################################################################
+# Get <path>'s size, mtime, version, checksum, and version stamp
+@app.route('/stat/<path:path>', methods=['GET'])
+def stat(path: str):
+    try:
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('stat',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/stat/"+path)
+        if response.status_code == 200:
+            return jsonify({'stat': response.json().get("stat")}), 200
+        else:
+            raise Exception("router> Stat Error Code " + str(response.status_code))
+
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+##############################################################################
+# Make the directory <path> (and any missing parents)
+@app.route('/mkdir/<path:path>', methods=['GET'])
+def mkdir(path: str):
+    try:
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('mkdir',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/mkdir/"+path, params=requested_durability_params())
+        if response.status_code == 200:
+            return jsonify({'created': response.json().get("created")}), 200
+        else:
+            raise Exception("router> Mkdir Error Code " + str(response.status_code))
+
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Remove the empty directory <path>
+@app.route('/rmdir/<path:path>', methods=['GET'])
+def rmdir(path: str):
+    try:
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('rmdir',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/rmdir/"+path)
+        if response.status_code == 200:
+            return jsonify({}), 200
+        else:
+            raise Exception("router> Rmdir Error Code " + str(response.status_code))
+
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# List a page of the directory <path> (the root if omitted), as held by the
+# family holding it: <?prefix=P&start_after=NAME&limit=N> (see the UVM's
+# </list> route)
+# @return JSON: {'entries': [{'name', 'type', 'size', 'mtime'}, ...], 'next': NAME or None}
+@app.route('/list/', defaults={'path': ''}, methods=['GET'])
+@app.route('/list/<path:path>', methods=['GET'])
+def list_directory(path: str):
+    try:
+        path = path.strip('/')
+        token = int(request.args.get('token','-1'))
+        if token == -1:
+            url_header = route('list',path)
+            if isinstance(url_header,int):
+                return jsonify({'token': url_header}), 425 # allocating a VM
+        else:
+            log('Received duplicate request with token '+str(token)+' !')
+            with ALLOCATED_UVMS_LOCK:
+                if token in ALLOCATED_UVMS:
+                    url_header = ALLOCATED_UVMS[token] # done allocating
+                    log('Finished allocating resource '+str(token)+'! Operation will continue at url: '+url_header)
+                else:
+                    log('Still allocating resource '+str(token)+'! Still waiting ...')
+                    return jsonify({'token': token}), 425 # still allocating
+        response = requests.get(url_header+"/list/"+path, params=requested_listing_params())
+        if response.status_code == 200:
+            return jsonify({'entries': response.json().get("entries"), 'next': response.json().get("next")}), 200
+        else:
+            raise Exception("router> List Error Code " + str(response.status_code))
+
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+##############################################################################
+# List a page of every file whose path starts with <?prefix=P> (in any
+# directory below), across every family: each is asked for its files at
+# once, and their sorted streams are merged. <?limit=N> caps the page, and
+# <?continuation=TOKEN> (the previous page's "continuation") continues it.
+# Stripes of striped files aren't listed (their manifests are).
+# @return JSON: {'files': [{'path', 'size', 'mtime'}, ...], 'continuation': TOKEN or None}
+@app.route('/list_all', methods=['GET'])
+def list_all():
+    try:
+        prefix = request.args.get('prefix','')
+        limit = max(1, min(int(request.args.get('limit', str(MAX_LIST_ENTRIES))), MAX_LIST_ENTRIES))
+        start_after = decode_continuation(prefix, request.args.get('continuation')) if 'continuation' in request.args else ''
+        with node_lock:
+            ips = list(nodes)
+        page_limit = min(limit+1, MAX_LIST_ENTRIES) # one more, to tell whether there's another page
+        streams = [listing_stream(ip, prefix, LISTING_EXECUTOR.submit(fetch_listing_page, ip, prefix, start_after, page_limit), page_limit) for ip in ips]
+        files = []
+        last_path = None
+        truncated = False
+        for entry in heapq.merge(*streams, key=listing_key):
+            if entry['path'] == last_path or entry['path'].startswith(STRIPE_PATH_PREFIX):
+                continue # held by 2 families (mid-move), or internal
+            if len(files) == limit:
+                truncated = True
+                break
+            files.append(entry)
+            last_path = entry['path']
+        log('Listed '+str(len(files))+' file(s) with prefix "'+prefix+'" across '+str(len(ips))+' UVM(s)')
+        continuation = encode_continuation(prefix, files[-1]['path']) if truncated else None
+        return jsonify({'files': files, 'continuation': continuation}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Plan how to stripe a <?size=N>-byte file across families, in stripes of
+# <?stripe_bytes=S>. The client writes each stripe straight to its UVM, then
+# writes the manifest to <path> (see the UVM's <stripe_manifest>).
+# @return JSON: {'stripe_bytes': S, 'stripes': [{'path': P, 'uvm': URL}, ...]}
+@app.route('/stripe_plan/<path:path>', methods=['GET'])
+def stripe_plan(path: str):
+    try:
+        size = int(request.args.get('size'))
+        stripe_bytes = int(request.args.get('stripe_bytes'))
+        if stripe_bytes < MIN_STRIPE_BYTES or stripe_bytes > MAX_STRIPE_BYTES:
+            raise Exception('router> Stripes must hold '+str(MIN_STRIPE_BYTES)+' to '+str(MAX_STRIPE_BYTES)+' bytes!')
+        stripe_id = uuid.uuid4().hex
+        stripe_paths = [STRIPE_PATH_PREFIX+stripe_id+'.'+str(index) for index in range(max((size+stripe_bytes-1)//stripe_bytes,1))]
+        placements = place_stripes(stripe_paths[0],stripe_bytes,len(stripe_paths))
+        log('Planned '+str(len(stripe_paths))+' stripe(s) of "'+path+'" across '+str(len(set(placements)))+' UVM(s)')
+        return jsonify({'stripe_bytes': stripe_bytes, 'stripes': [{'path': stripe_path, 'uvm': uvm} for stripe_path, uvm in zip(stripe_paths, placements)]}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # gives machines to nodes that need it
 @app.route('/getmachine', methods=['GET'])
@@ -463,12 +1062,24 @@ if __name__ == '__main__':
     Welcome to Jordan, Rahul, and Robin's COEN 317 Project!
     Flask will communicate this server's "http" address!
     Communicate to our server by executing GET requests to the following routes:
-        /read/<path>
-        /write/<path>/<data>
+        /read/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /read_bytes/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /write/<path>/<data>?durability=<mode>&compression=<codec>
+        /write/<path>?size=<n>&durability=<mode>&compression=<codec> (PUT/POST the data as the request body)
+        /append/<path>?durability=<mode> (PUT/POST the data as the request body)
+        /write_manifest/<path>?durability=<mode> (PUT/POST a stripe manifest as the request body)
+        /write_at/<path>?offset=<n>&durability=<mode> (PUT/POST the data as the request body)
+        /truncate/<path>/<length>?durability=<mode>
         /delete/<path>
         /copy/<src_path>/<dest_path>
         /rename/<old_path>/<new_path>
         /exists/<path>
+        /stat/<path>
+        /mkdir/<path>?durability=<mode>
+        /rmdir/<path>
+        /list/<path>?prefix=<p>&start_after=<name>&limit=<n>
+        /list_all?prefix=<p>&limit=<n>&continuation=<token>
+        /stripe_plan/<path>?size=<n>&stripe_bytes=<n>
 
     Happy coding! :)
     """
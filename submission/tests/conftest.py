@@ -0,0 +1,28 @@
+# File: conftest.py
+# Purpose:
+#   Shared pytest setup: puts <common/> on the module path (as the UVM/RVM
+#   servers do), and mounts <fs.py> on a scratch directory per test.
+#   Run as: python3 -m pytest tests/  (from <submission/>)
+
+import os
+import sys
+
+import pytest
+
+SUBMISSION_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(SUBMISSION_DIRECTORY, 'common'))
+import fs
+
+
+##############################################################################
+# <fs.py> re-anchored to an empty directory (one file per path, no cached
+# contents from other tests)
+@pytest.fixture
+def mounted_fs(tmp_path):
+    root_directory = tmp_path/'rootdir'
+    root_directory.mkdir()
+    fs.STORAGE_BACKEND = fs.STORAGE_BACKEND_FILES
+    fs.PAGE_CACHE.clear()
+    fs.mount(str(root_directory))
+    yield fs
+    fs.PAGE_CACHE.clear()
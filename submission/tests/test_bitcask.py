@@ -0,0 +1,89 @@
+# File: test_bitcask.py
+# Purpose:
+#   Log-structured key/value store (<common/bitcask.py>): reloading the
+#   keydir from data and hint files, torn tails, and compaction (merges).
+
+import os
+
+import bitcask
+
+# Small segments, so a handful of writes rolls over to new ones
+SEGMENT_BYTES = 4 * 1024
+
+
+def open_store(directory) -> bitcask.Bitcask:
+    return bitcask.Bitcask(str(directory), SEGMENT_BYTES)
+
+
+def write_versions(store: bitcask.Bitcask, total_keys: int, total_versions: int) -> dict:
+    expected = {}
+    for version in range(total_versions):
+        for i in range(total_keys):
+            expected['key-'+str(i)] = (str(version)+':'+str(i)).encode('utf-8')*20
+            store.put('key-'+str(i), expected['key-'+str(i)])
+    return expected
+
+
+def assert_holds(store: bitcask.Bitcask, expected: dict):
+    assert set(store.items()) == set(expected)
+    for key, value in expected.items():
+        assert store.get(key) == value
+        assert store.read(key, 5, 10) == value[5:15]
+
+
+def test_reload_replays_puts_deletes_and_renames(tmp_path):
+    store = open_store(tmp_path)
+    expected = write_versions(store, 20, 3)
+    store.delete('key-0')
+    del expected['key-0']
+    store.rename('key-1', 'renamed')
+    expected['renamed'] = expected.pop('key-1')
+    store.copy('key-2', 'copied')
+    expected['copied'] = expected['key-2']
+    assert_holds(store, expected)
+    assert store.stats()['segments'] > 1
+    store.close()
+    reloaded = open_store(tmp_path)
+    assert_holds(reloaded, expected)
+    assert not reloaded.contains('key-0')
+    reloaded.close()
+
+
+def test_reload_cuts_off_a_torn_record(tmp_path):
+    store = open_store(tmp_path)
+    store.put('kept', b'kept value')
+    store.put('torn', b'x'*100)
+    active = store.segment_filename(store.active_id, bitcask.DATA_SUFFIX)
+    store.close()
+    os.truncate(active, os.path.getsize(active)-10) # crashed mid-write
+    reloaded = open_store(tmp_path)
+    assert reloaded.get('kept') == b'kept value'
+    assert not reloaded.contains('torn')
+    reloaded.put('after', b'appended after the cut')
+    reloaded.close()
+    reloaded = open_store(tmp_path)
+    assert reloaded.get('after') == b'appended after the cut'
+    reloaded.close()
+
+
+def test_merge_compacts_dead_records(tmp_path):
+    store = open_store(tmp_path)
+    expected = write_versions(store, 10, 10)
+    for i in range(5):
+        store.delete('key-'+str(i))
+        del expected['key-'+str(i)]
+    before = store.stats()
+    assert store.needs_merge()
+    store.merge()
+    after = store.stats()
+    assert after['merges'] == 1
+    assert after['total_bytes'] < before['total_bytes']
+    assert after['dead_bytes'] == 0
+    assert_holds(store, expected)
+    store.put('key-9', b'written after the merge')
+    expected['key-9'] = b'written after the merge'
+    store.close()
+    reloaded = open_store(tmp_path) # merged segments load from their hint files
+    assert_holds(reloaded, expected)
+    assert not any(name.endswith(bitcask.MERGE_SUFFIX) for name in os.listdir(tmp_path))
+    reloaded.close()
@@ -0,0 +1,81 @@
+# File: test_chunkstore.py
+# Purpose:
+#   Content-addressed chunk store (<common/chunkstore.py>): deduplication,
+#   reference counted deletes, and recounting references on reload.
+
+import os
+
+import pytest
+
+import chunkstore
+
+CHUNK_BYTES = chunkstore.CHUNK_BYTES
+
+
+def stored_chunk_files(store: chunkstore.ChunkStore) -> set:
+    return {name for prefix in os.listdir(store.chunks_directory) for name in os.listdir(store.chunks_directory+prefix)}
+
+
+@pytest.mark.parametrize('chunking', chunkstore.CHUNKINGS)
+def test_duplicates_and_copies_share_chunks(tmp_path, chunking: str):
+    store = chunkstore.ChunkStore(str(tmp_path), chunking)
+    value = os.urandom(8*CHUNK_BYTES)
+    store.put('original', value)
+    chunks = store.stats()['chunks']
+    store.put('duplicate', value)
+    store.copy('original', 'copy')
+    stats = store.stats()
+    assert stats['chunks'] == chunks
+    assert stats['logical_bytes'] == 3*len(value)
+    assert stats['stored_bytes'] == len(value)
+    assert store.get('duplicate') == value and store.get('copy') == value
+    edited = value[:CHUNK_BYTES//2]+b'edit'+value[CHUNK_BYTES//2:]
+    store.put('edited', edited)
+    assert store.get('edited') == edited
+    if chunking == chunkstore.CHUNKING_CDC: # cut points move with the content: only the edited chunk is new
+        assert store.stats()['stored_bytes'] < len(value)+2*chunkstore.CDC_MAX_CHUNK_BYTES
+
+
+def test_deletes_free_chunks_once_unreferenced(tmp_path):
+    store = chunkstore.ChunkStore(str(tmp_path))
+    shared, own = os.urandom(CHUNK_BYTES), os.urandom(CHUNK_BYTES)
+    store.put('a', shared+own)
+    store.put('b', shared)
+    assert len(stored_chunk_files(store)) == 2
+    store.delete('a')
+    assert stored_chunk_files(store) == {chunkstore.chunk_hash(shared)}
+    assert store.get('b') == shared
+    store.put('b', own) # overwriting drops the old value's references too
+    assert stored_chunk_files(store) == {chunkstore.chunk_hash(own)}
+    store.delete('b')
+    assert stored_chunk_files(store) == set()
+    assert store.stats()['chunks'] == 0
+
+
+def test_streams_pin_their_chunks(tmp_path):
+    store = chunkstore.ChunkStore(str(tmp_path))
+    value = os.urandom(3*CHUNK_BYTES)
+    store.put('a', value)
+    _, chunks = store.stream('a')
+    first = next(chunks)
+    store.delete('a') # mid-read: the chunks stay until the stream ends
+    assert first+b''.join(chunks) == value
+    assert stored_chunk_files(store) == set()
+
+
+def test_reload_recounts_references_and_drops_orphans(tmp_path):
+    store = chunkstore.ChunkStore(str(tmp_path))
+    value = os.urandom(2*CHUNK_BYTES)
+    store.put('a', value)
+    store.copy('a', 'b')
+    orphan = chunkstore.chunk_hash(b'orphan')
+    os.makedirs(os.path.dirname(store.chunk_filename(orphan)), exist_ok=True)
+    with open(store.chunk_filename(orphan), 'wb') as file: # crashed before its manifest was written
+        file.write(b'orphan')
+    reloaded = chunkstore.ChunkStore(str(tmp_path))
+    assert orphan not in stored_chunk_files(reloaded)
+    assert reloaded.get('b') == value
+    reloaded.delete('a')
+    assert reloaded.get('b') == value
+    reloaded.delete('b')
+    assert stored_chunk_files(reloaded) == set()
@@ -0,0 +1,51 @@
+# File: test_delta.py
+# Purpose:
+#   rsync-style delta encoding (<common/delta.py>): round-trips of edited
+#   files, and giving up on mostly-new contents.
+
+import os
+
+import pytest
+
+import delta
+
+OLD = os.urandom(64*delta.DELTA_BLOCK_BYTES+123)
+
+
+def round_trip(old: bytes, new: bytes) -> bytes:
+    encoded = delta.encode(delta.signatures(old), new)
+    assert encoded != None
+    assert delta.decode(encoded, old) == new
+    return encoded
+
+
+@pytest.mark.parametrize('new', [
+    OLD,
+    OLD[:100]+b'X'*50+OLD[150:], # overwrite
+    OLD[:10]+b'inserted'+OLD[10:], # insert (shifts every later block)
+    OLD[:5000]+OLD[9000:], # delete
+    OLD+b'appended', # grow
+    OLD[:len(OLD)//2], # shrink
+    OLD[delta.DELTA_BLOCK_BYTES:]+OLD[:delta.DELTA_BLOCK_BYTES], # reorder blocks
+])
+def test_edits_round_trip(new: bytes):
+    round_trip(OLD, new)
+
+
+def test_small_edits_send_little():
+    encoded = round_trip(OLD, OLD[:10]+b'inserted'+OLD[10:])
+    assert len(encoded) < 2*delta.DELTA_BLOCK_BYTES
+
+
+def test_mostly_new_contents_give_up():
+    assert delta.encode(delta.signatures(OLD), os.urandom(len(OLD))) == None
+
+
+def test_empty_versions():
+    assert delta.encode(delta.signatures(b''), b'new') == None # nothing to copy from
+    assert delta.decode(delta.encode(delta.signatures(OLD), b''), OLD) == b''
+
+
+def test_decode_rejects_garbage():
+    with pytest.raises(ValueError):
+        delta.decode(b'not a delta at all', OLD)
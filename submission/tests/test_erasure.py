@@ -0,0 +1,44 @@
+# File: test_erasure.py
+# Purpose:
+#   Reed-Solomon erasure coding (<common/erasure.py>): decoding after losing
+#   up to <m> of the <k>+<m> shards.
+
+import itertools
+import os
+
+import pytest
+
+import erasure
+
+LAYOUTS = [(1, 0), (2, 1), (4, 2), (3, 3)]
+
+
+@pytest.mark.parametrize('k, m', LAYOUTS)
+@pytest.mark.parametrize('size', [0, 1, 1000, 4096+7])
+def test_decodes_after_losing_any_m_shards(k: int, m: int, size: int):
+    data = os.urandom(size)
+    shards = erasure.encode(data, k, m)
+    assert len(shards) == k+m
+    for lost in itertools.combinations(range(k+m), m):
+        kept = {index: shard for index, shard in enumerate(shards) if index not in lost}
+        assert erasure.decode(kept, k, m, size) == data
+
+
+@pytest.mark.parametrize('k, m', LAYOUTS)
+def test_encode_shard_matches_encode(k: int, m: int):
+    data = os.urandom(5000)
+    shards = erasure.encode(data, k, m)
+    assert [erasure.encode_shard(data, index, k, m) for index in range(k+m)] == shards
+
+
+def test_losing_more_than_m_shards_fails():
+    data = os.urandom(1000)
+    shards = erasure.encode(data, 4, 2)
+    with pytest.raises(ValueError):
+        erasure.decode({0: shards[0], 4: shards[4], 5: shards[5]}, 4, 2, len(data))
+
+
+def test_shard_headers_round_trip():
+    header = erasure.pack_header(3, 4, 2, 12345, 'ab'*32)
+    assert len(header) == erasure.SHARD_HEADER_BYTES
+    assert erasure.unpack_header(header) == (3, 4, 2, 12345, 'ab'*32)
@@ -0,0 +1,106 @@
+# File: test_fs.py
+# Purpose:
+#   Local file operations (<common/fs.py>) on a scratch directory: appends at
+#   an offset (as replayed by RVMs), writes at an offset, truncates, and
+#   rebuilding the metadata index from its snapshot.
+
+import os
+
+import pytest
+
+import durability
+import merkle
+
+
+# <mounted_fs> on each storage backend
+@pytest.fixture(params=['files', 'bitcask', 'chunks'])
+def backend_fs(mounted_fs, request):
+    mounted_fs.use_storage_backend(request.param)
+    yield mounted_fs
+    mounted_fs.use_storage_backend(mounted_fs.STORAGE_BACKEND_FILES)
+
+
+def assert_contents(fs, path: str, contents: bytes):
+    assert fs.read_contents(path) == contents
+    assert fs.stat(path)['size'] == len(contents)
+    assert fs.stat(path)['checksum'] == merkle.content_hash(contents)
+
+
+##############################################################################
+# Appends + Offset Writes
+def test_appends_at_an_offset_are_idempotent(backend_fs):
+    fs = backend_fs
+    assert fs.append_bytes('log', b'first ', durability.DURABILITY_NONE, 0) == 6
+    assert fs.append_bytes('log', b'second', durability.DURABILITY_NONE, 6) == 12
+    assert fs.append_bytes('log', b'first ', durability.DURABILITY_NONE, 0) == 12 # replayed: already applied
+    assert fs.append_bytes('log', b'second', durability.DURABILITY_NONE, 6) == 12
+    assert_contents(fs, 'log', b'first second')
+    assert fs.append_bytes('log', b'!', durability.DURABILITY_NONE) == 13 # no offset: at the end
+    assert_contents(fs, 'log', b'first second!')
+
+
+def test_write_at_overwrites_extends_and_fills_holes(backend_fs):
+    fs = backend_fs
+    fs.write_bytes('file', b'0123456789', durability.DURABILITY_NONE)
+    fs.write_at('file', 2, b'ab', durability.DURABILITY_NONE)
+    assert_contents(fs, 'file', b'01ab456789')
+    fs.write_at('file', 8, b'XYZ', durability.DURABILITY_NONE)
+    assert_contents(fs, 'file', b'01ab4567XYZ')
+    fs.write_at('file', 14, b'!', durability.DURABILITY_NONE)
+    assert_contents(fs, 'file', b'01ab4567XYZ\0\0\0!')
+    fs.write_at('new', 3, b'abc', durability.DURABILITY_NONE)
+    assert_contents(fs, 'new', b'\0\0\0abc')
+    assert fs.read_range('file', 2, 4) == b'ab45'
+
+
+def test_truncate_shrinks_and_zero_extends(backend_fs):
+    fs = backend_fs
+    fs.write_bytes('file', b'0123456789', durability.DURABILITY_NONE)
+    fs.truncate('file', 4, durability.DURABILITY_NONE)
+    assert_contents(fs, 'file', b'0123')
+    fs.truncate('file', 6, durability.DURABILITY_NONE)
+    assert_contents(fs, 'file', b'0123\0\0')
+    fs.append_bytes('file', b'tail', durability.DURABILITY_NONE) # appends pick up from the new length
+    assert_contents(fs, 'file', b'0123\0\0tail')
+    with pytest.raises(fs.DistributedFileNotFound):
+        fs.truncate('missing', 0)
+    with pytest.raises(fs.DistributedFileSystemError):
+        fs.write_at('file', -1, b'x')
+
+
+##############################################################################
+# Index Snapshot Rebuild
+def test_rebuild_reuses_the_snapshot_for_unchanged_files(mounted_fs, monkeypatch):
+    fs = mounted_fs
+    for i in range(5):
+        fs.write_bytes('file-'+str(i), b'contents '+str(i).encode('utf-8'), durability.DURABILITY_NONE)
+        fs.restamp('file-'+str(i), [1, i+1])
+    fs.save_index_snapshot()
+    with open(fs.ROOT_DIRECTORY+'file-0', 'ab') as file: # changed behind the index's back
+        file.write(b' and more')
+    os.utime(fs.ROOT_DIRECTORY+'file-0', (1, 1))
+    hashed = []
+    hash_file = fs.hash_file
+    monkeypatch.setattr(fs, 'hash_file', lambda path: hashed.append(path) or hash_file(path))
+    fs.rebuild_index()
+    assert hashed == ['file-0']
+    assert fs.stat('file-0')['checksum'] == merkle.content_hash(b'contents 0 and more')
+    assert fs.stat('file-0')['stamp'] == None # its version is unknown
+    for i in range(1, 5):
+        assert fs.stat('file-'+str(i))['stamp'] == '1.'+str(i+1)
+        assert fs.stat('file-'+str(i))['checksum'] == merkle.content_hash(b'contents '+str(i).encode('utf-8'))
+    assert fs.MERKLE_TREE.get('file-0') == merkle.content_hash(b'contents 0 and more')
+
+
+def test_rebuild_without_a_snapshot_rehashes_everything(mounted_fs):
+    fs = mounted_fs
+    fs.write_bytes('dir/nested', b'nested', durability.DURABILITY_NONE)
+    fs.write_bytes('top', b'top', durability.DURABILITY_NONE)
+    root = fs.MERKLE_TREE.root()
+    os.remove(fs.INDEX_SNAPSHOT_FILENAME)
+    open(fs.ROOT_DIRECTORY+fs.TEMP_FILE_PREFIX+'interrupted', 'wb').close()
+    fs.rebuild_index()
+    assert sorted(file['path'] for file in fs.list_files()['files']) == ['dir/nested', 'top']
+    assert fs.stat('dir/nested')['checksum'] == merkle.content_hash(b'nested')
+    assert fs.MERKLE_TREE.root() == root
+    assert not os.path.exists(fs.ROOT_DIRECTORY+fs.TEMP_FILE_PREFIX+'interrupted')
@@ -0,0 +1,122 @@
+# File: test_listing.py
+# Purpose:
+#   Paginated listings: a directory's entries and a walk of every file below
+#   a prefix (<common/namespace.py>, via <fs.py>), and the router's k-way
+#   merge of every family's walk into one cluster-wide listing (<server.py>).
+
+import importlib.util
+import os
+import random
+
+import pytest
+
+import durability
+import namespace
+
+SUBMISSION_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PATHS = ['a', 'a.txt', 'a/b', 'a/c/d', 'a/c/e', 'b', 'logs/2023/x', 'logs/2024/y', 'logs/2024/z', 'logs3/w', 'z']
+
+
+def sorted_paths(paths: list) -> list:
+    return sorted(paths, key=namespace.path_key)
+
+
+# Every page of <list_page(start_after, limit)>, joined
+def all_pages(list_page, limit: int, key: str) -> list:
+    listed, start_after = [], ''
+    while True:
+        page = list_page(start_after, limit)
+        listed += [entry[key] for entry in page[0]]
+        if page[1] == None:
+            return listed
+        start_after = page[1]
+
+
+##############################################################################
+# One Machine
+@pytest.fixture
+def filled_fs(mounted_fs):
+    for path in PATHS:
+        if path != 'a': # "a" is a directory
+            mounted_fs.write_bytes(path, path.encode('utf-8'), durability.DURABILITY_NONE)
+    mounted_fs.mkdir('empty')
+    return mounted_fs
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 1000])
+def test_directory_pages(filled_fs, limit: int):
+    fs = filled_fs
+    list_page = lambda start_after, limit: (lambda page: (page['entries'], page['next']))(fs.list_directory('', '', start_after, limit))
+    assert all_pages(list_page, limit, 'name') == ['a', 'a.txt', 'b', 'empty', 'logs', 'logs3', 'z']
+    prefixed = lambda start_after, limit: (lambda page: (page['entries'], page['next']))(fs.list_directory('logs/2024', 'y', start_after, limit))
+    assert all_pages(prefixed, limit, 'name') == ['y']
+    entries = fs.list_directory('a')['entries']
+    assert [(entry['name'], entry['type']) for entry in entries] == [('b', 'file'), ('c', 'directory')]
+    assert entries[0]['size'] == len(b'a/b')
+
+
+@pytest.mark.parametrize('limit', [1, 2, 5, 1000])
+@pytest.mark.parametrize('prefix', ['', 'a', 'a/', 'a/c', 'logs', 'logs/20', 'logs/2024/', 'nothing'])
+def test_walk_pages(filled_fs, limit: int, prefix: str):
+    fs = filled_fs
+    list_page = lambda start_after, limit: (lambda page: (page['files'], page['next']))(fs.list_files(prefix, start_after, limit))
+    assert all_pages(list_page, limit, 'path') == sorted_paths([path for path in PATHS if path != 'a' and path.startswith(prefix)])
+
+
+def test_listing_follows_renames_and_deletes(filled_fs):
+    fs = filled_fs
+    fs.rename('a', 'moved')
+    fs.delete('b')
+    assert [file['path'] for file in fs.list_files('moved')['files']] == ['moved/b', 'moved/c/d', 'moved/c/e']
+    assert 'b' not in [entry['name'] for entry in fs.list_directory()['entries']]
+    with pytest.raises(fs.DistributedFileNotFound):
+        fs.list_directory('a')
+
+
+##############################################################################
+# Across Families (the router)
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.chdir(SUBMISSION_DIRECTORY) # reads <ips/> on import
+    spec = importlib.util.spec_from_file_location('router', os.path.join(SUBMISSION_DIRECTORY, 'server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Spread <PATHS> (and a stripe, and one path mid-move) over 3 families'
+# fake UVMs, each answering </list_files> pages from its own namespace
+@pytest.fixture
+def families(router, monkeypatch):
+    trees = {ip: namespace.Namespace() for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.3']}
+    random.seed(0)
+    for path in PATHS+[router.STRIPE_PATH_PREFIX+'x.0']:
+        if path != 'a':
+            random.choice(list(trees.values())).add_file(path)
+    trees['10.0.0.1'].add_file('logs/2024/y') # held by 2 families (mid-move)
+    trees['10.0.0.2'].add_file('logs/2024/y')
+    def fetch_listing_page(ip: str, prefix: str, start_after: str, limit: int) -> dict:
+        paths, truncated = trees[ip].walk(prefix, start_after, limit)
+        return {'files': [{'path': path, 'size': 0, 'mtime': 0} for path in paths], 'next': paths[-1] if truncated else None}
+    monkeypatch.setattr(router, 'fetch_listing_page', fetch_listing_page)
+    monkeypatch.setattr(router, 'nodes', list(trees))
+    return router.app.test_client()
+
+
+@pytest.mark.parametrize('limit', [1, 3, 1000])
+@pytest.mark.parametrize('prefix', ['', 'a', 'logs', 'logs/2024/'])
+def test_cluster_listing_merges_every_family(families, limit: int, prefix: str):
+    def list_page(continuation, limit):
+        query = {'prefix': prefix, 'limit': limit}
+        if len(continuation) > 0:
+            query['continuation'] = continuation
+        response = families.get('/list_all', query_string=query)
+        assert response.status_code == 200
+        return response.get_json()['files'], response.get_json()['continuation']
+    assert all_pages(list_page, limit, 'path') == sorted_paths([path for path in PATHS if path != 'a' and path.startswith(prefix)])
+
+
+def test_continuations_are_bound_to_their_prefix(families, router):
+    response = families.get('/list_all', query_string={'prefix': 'b', 'continuation': router.encode_continuation('a', 'a/b')})
+    assert response.status_code == 400
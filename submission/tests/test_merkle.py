@@ -0,0 +1,50 @@
+# File: test_merkle.py
+# Purpose:
+#   Merkle tree diffs (<common/merkle.py>), as RVM anti-entropy uses them.
+
+import merkle
+
+
+def filled_tree(total_files: int) -> merkle.MerkleTree:
+    tree = merkle.MerkleTree()
+    for i in range(total_files):
+        tree.update('file-'+str(i), merkle.content_hash(b'contents of '+str(i).encode('utf-8')))
+    return tree
+
+
+# @return tuple: (differences: dict, node hashes fetched: int)
+def diff_against(local: merkle.MerkleTree, remote: merkle.MerkleTree):
+    fetched = []
+    def fetch_nodes(nodes):
+        fetched.extend(nodes)
+        return remote.node_hashes(nodes)
+    return merkle.diff(local, fetch_nodes, remote.bucket), len(fetched)
+
+
+def test_identical_trees_only_compare_roots():
+    differences, fetched = diff_against(filled_tree(1000), filled_tree(1000))
+    assert differences == {}
+    assert fetched == 1
+
+
+def test_diff_finds_changed_added_and_removed_paths():
+    local, remote = filled_tree(1000), filled_tree(1000)
+    remote.update('file-3', merkle.content_hash(b'changed'))
+    remote.update('new-file', merkle.content_hash(b'new'))
+    remote.remove('file-9')
+    differences, fetched = diff_against(local, remote)
+    assert differences == {'file-3': merkle.content_hash(b'changed'), 'new-file': merkle.content_hash(b'new'), 'file-9': None}
+    assert fetched < 2*3*(merkle.MERKLE_TREE_DEPTH+1) # only the mismatched subtrees are descended into
+
+
+def test_applying_the_diff_converges():
+    local, remote = filled_tree(500), filled_tree(400)
+    remote.update('file-7', merkle.content_hash(b'changed'))
+    differences, _ = diff_against(local, remote)
+    for path, chash in differences.items():
+        if chash == None:
+            local.remove(path)
+        else:
+            local.update(path, chash)
+    assert local.root() == remote.root()
+    assert diff_against(local, remote)[0] == {}
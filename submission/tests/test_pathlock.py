@@ -0,0 +1,85 @@
+# File: test_pathlock.py
+# Purpose:
+#   Per-path readers-writer locks (<common/pathlock.py>): reentrancy, the
+#   read->write upgrade error, and writers excluding readers.
+
+import threading
+import time
+
+import pytest
+
+import pathlock
+
+
+def test_locks_are_reentrant():
+    locks = pathlock.PathLocks()
+    with locks.writing('a'):
+        with locks.writing('a'):
+            with locks.reading('a'): # a writer may also read
+                pass
+    with locks.reading('a'):
+        with locks.reading('a'):
+            pass
+    assert locks.stats()['locked_paths'] == 0
+
+
+def test_upgrading_a_read_lock_raises():
+    locks = pathlock.PathLocks()
+    with locks.reading('a'):
+        with pytest.raises(RuntimeError, match='upgrade'):
+            with locks.writing('a'):
+                pass
+        with locks.reading('a'): # still held, and still reentrant
+            pass
+    with locks.writing('a'): # released despite the failed upgrade
+        pass
+    assert locks.stats()['locked_paths'] == 0
+
+
+def test_a_failed_guard_releases_what_it_acquired():
+    locks = pathlock.PathLocks()
+    with locks.reading('b'):
+        with pytest.raises(RuntimeError):
+            with locks.writing('a', 'b'): # 'a' is acquired, then 'b' can't be upgraded
+                pass
+    done = threading.Event()
+    def writer():
+        with locks.writing('a'):
+            done.set()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert done.wait(5)
+    thread.join()
+
+
+def test_writer_excludes_readers_of_the_same_path_only():
+    locks = pathlock.PathLocks()
+    events = []
+    def reader(path: str):
+        with locks.reading(path):
+            events.append(path)
+    with locks.writing('a'):
+        blocked = threading.Thread(target=reader, args=('a',))
+        free = threading.Thread(target=reader, args=('b',))
+        blocked.start()
+        free.start()
+        free.join(5)
+        time.sleep(0.05)
+        assert events == ['b']
+    blocked.join(5)
+    assert events == ['b', 'a']
+    assert locks.stats()['waits'] >= 1
+
+
+def test_paths_lock_their_ancestors_for_reading():
+    locks = pathlock.PathLocks(separator='/')
+    acquired = threading.Event()
+    def rename_directory():
+        with locks.writing('logs'):
+            acquired.set()
+    with locks.writing('logs/2024/app.log'):
+        thread = threading.Thread(target=rename_directory)
+        thread.start()
+        assert not acquired.wait(0.05) # a file below it is being written
+    assert acquired.wait(5)
+    thread.join()
@@ -3,34 +3,119 @@
 #   UVM server functionality to listen to client file operation requests.
 
 # SUPPORTED FILE APIs:
-#   1. read a file
-#   2. write data (also creates files)
+#   1. read a file (as JSON text, or as raw bytes)
+#   2. write data (also creates files, and can stream the request body)
 #   3. delete a file
 #   4. copy a file
 #   5. rename (also moves) a file
 #   6. check if a file exists
-
+#   7. stat a file
+#   8. append data (also creates files; returns the new length)
+#   9. write data at an offset, and truncate a file
+#  10. read an erasure-coded shard of a file
+#  11. hold the manifest of a file striped across families
+#  12. make, list (a page at a time) and remove directories (paths may hold
+#      "/"; renames also move directories)
+#  13. verify reads against each file's checksum, and scrub every file in the
+#      background (corrupt files are rewritten from an RVM's copy)
+#  14. stamp every version of a file (family epoch, sequence), and compare
+#      the RVMs' versions with ours after reads, sending the newest version
+#      to whichever copies are stale (read repair)
+#  15. send large files' rewrites to the RVMs holding their previous version
+#      as deltas (only the changed blocks, see <delta.py>)
+
+import io
+import itertools
+import json
 import os
 import requests
 import sys
 import threading
 import time
+import random
 import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file
 
+# Modules shared with the RVM server (see <../common/>)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import delta
+import diskio
+import erasure
 import fs
+import membership
+import merkle
 
 ##############################################################################
 # App Creation + Invariants
 app = Flask(__name__)
 
-# How many files we want to allow to be allocated per UVM (beyond README.md)
-UVM_MAXIMUM_NUMBER_OF_FILES = 3
+# Hard byte quota for this UVM/RVM family (None: derived from <statvfs> of rootdir)
+UVM_FAMILY_QUOTA_BYTES = None
+
+# Fraction of the family's quota past which we refuse to store more bytes
+UVM_HIGH_WATERMARK_FRACTION = 0.9
+
+# Fraction of the family's quota past which the router starts scaling out
+UVM_LOW_WATERMARK_FRACTION = 0.75
+
+# How long we reuse a <statvfs> reading of rootdir before taking a new one
+DISK_STATS_TIMEOUT_SECONDS = 5
 
 # How long we wait between checks as to whether every RVM has died
 RVM_HEALTH_PING_TIMEOUT = 3
 
+# How long we gather concurrent mutations before replicating them as one batch
+REPLICATION_BATCH_WINDOW_SECONDS = 0.005
+
+# Most mutations we replicate in a single batch
+REPLICATION_BATCH_MAX_COMMANDS = 64
+
+# How often we persist the metadata index snapshot (speeds up restarts)
+INDEX_SNAPSHOT_TIMEOUT_SECONDS = 10
+
+# How often we check whether the bitcask storage backend needs a merge
+STORAGE_COMPACTION_TIMEOUT_SECONDS = 30
+
+# How often we demote idle files to the cold tier (and reload hot ones into
+# the page cache)
+TIERING_TIMEOUT_SECONDS = 60
+
+# How often we rebuild files we only hold a shard of (after taking over as UVM)
+SHARD_REBUILD_TIMEOUT_SECONDS = 5
+
+# Bytes per second the scrubber rereads (so it never hogs the disk), and how
+# long it waits between complete passes over every file
+SCRUB_BYTES_PER_SECOND = 4 * 1024 * 1024
+SCRUB_PASS_TIMEOUT_SECONDS = 10 * 60
+
+# How long we wait on a peer for its copy of a corrupt file
+CORRUPT_REPAIR_TIMEOUT_SECONDS = 10
+
+# Chance that a read also compares the file's version with the RVMs' copies
+# (see <read_repair>), and how long after launching every read does
+READ_REPAIR_CHANCE = 0.05
+READ_REPAIR_WARMUP_SECONDS = 5 * 60
+
+# Most reads' comparisons we run at once, and keep queued (more are skipped),
+# and how long we wait on a peer during one
+READ_REPAIR_THREADS = 4
+READ_REPAIR_MAX_PENDING = 256
+READ_REPAIR_TIMEOUT_SECONDS = 10
+
+# Most paths we remember the version last compared of (see <after_read>)
+READ_REPAIR_MAX_COMPARED = 4096
+
+# A file striped across families is held here as a manifest: JSON
+# {'size': N, 'stripe_bytes': S, 'stripes': [{'path': P, 'uvm': URL}, ...]},
+# whose stripes' paths all start with the router's <STRIPE_PATH_PREFIX>
+STRIPE_PATH_PREFIX = '.dfs-stripe.'
+
+# Manifests longer than this are refused
+STRIPE_MANIFEST_MAX_BYTES = 1024 * 1024
+
 
 ##############################################################################
 # Logging Helper(s)
@@ -59,37 +144,508 @@ def ping_rvm(ip_address, command):
 
 ##############################################################################
 # UVM/RVM File Command Forwarding URL Command Extractor
-UVM_IPS_FILENAME = '../ips/'+sys.argv[1]+'/uvm.txt'
-RVM_IPS_FILENAME = '../ips/'+sys.argv[1]+'/rvm.txt'
-rvm_ips_file_lock = threading.Lock()
+# Family membership is cached in memory, only touching disk upon a change
+MEMBERSHIP = membership.Membership('../ips/'+sys.argv[1]+'/')
+
+# Pool running the file routes' disk I/O, off the request threads (see <diskio.py>)
+DISK_IO = diskio.DiskExecutor()
 
 def uvm_ip():
-    with open(UVM_IPS_FILENAME, 'r') as file:
-        return file.read().strip()
+    return MEMBERSHIP.uvm_ip()
 
 
 def rvm_ips():
-    with rvm_ips_file_lock:
-        with open(RVM_IPS_FILENAME, 'r') as file:
-            return [line for line in [line.strip() for line in file.read().split('\n')] if len(line) > 0]
+    return MEMBERSHIP.rvm_ips()
+
+
+# <epoch> = None for local changes, else the remote sender's epoch
+# @return bool: False if <epoch> is older than ours (update rejected)
+def write_rvm_ips(rvm_ips_contents: str, epoch = None) -> bool:
+    return MEMBERSHIP.update(rvm_ips=membership.parse_ips(rvm_ips_contents), epoch=epoch)
+
+
+def request_epoch():
+    epoch = request.args.get('epoch')
+    return int(epoch) if epoch != None else None
+
+
+##############################################################################
+# Group-commit replication: concurrent mutations are gathered for up to
+# <REPLICATION_BATCH_WINDOW_SECONDS> (or <REPLICATION_BATCH_MAX_COMMANDS>
+# commands), then shipped to each RVM as a single ordered batch request.
+class PendingCommand:
+    def __init__(self, command: str, rvm_ip: str = None):
+        self.command = command
+        self.rvm_ip = rvm_ip # None: for every RVM
+        self.sequence = None # its index in <_command_history> (if kept there)
+        self.forwarded = threading.Event()
+
+
+_replication_queue = []
+_replication_queue_condition = threading.Condition()
+_replication_stats = {'commands': 0, 'batches': 0, 'requests': 0, 'delta_writes': 0, 'delta_bytes': 0, 'delta_saved_bytes': 0}
+_replication_stats_lock = threading.Lock()
+
+
+# POST <commands> to an RVM to be applied in order, without interleaving with
+# other batches
+# >> NOTE: not atomic: commands before one that fails stay applied (each one's
+#          status is logged, and anti-entropy repairs the divergence)
+def post_batch(rvm_ip: str, commands: list) -> bool:
+    try:
+        response = requests.post('http://'+rvm_ip+':5000/rvm_apply_batch', json={'commands': commands})
+        if response.status_code != 200:
+            return False
+        for command, status in zip(commands, response.json().get('statuses')):
+            if status != 200:
+                log('RVM '+rvm_ip+' failed to apply action "'+command+'" (status '+str(status)+')')
+        return True
+    except Exception as err_msg:
+        log('Error posting batch to RVM '+rvm_ip+': '+str(err_msg))
+        return False
+
+
+# Streamed (request body) commands are recorded without a data segment, their
+# bytes are streamed from our local copy instead:
+#   * "write/<path>?durability=MODE": the whole file
+#   * "write_manifest/<path>?durability=MODE": the whole file, a stripe manifest
+#   * "append/<path>?offset=N&length=M&durability=MODE": just the appended range
+#   * "write_at/<path>?offset=N&length=M&durability=MODE": just the written range
+BODY_OPERATIONS = ['write', 'write_manifest', 'append', 'write_at']
+
+def is_body_command(command: str) -> bool:
+    operation, _, rest = command.partition('/')
+    return operation in BODY_OPERATIONS and '/' not in rest.partition('?')[0]
+
+
+def body_command(operation: str, path: str, durability_mode: str, offset: int = None, length: int = None) -> str:
+    params = {} if offset == None else {'offset': offset, 'length': length}
+    params['durability'] = durability_mode
+    return operation+'/'+urllib.parse.quote(path, safe='')+'?'+urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+
+
+def body_command_path(command: str) -> str:
+    return urllib.parse.unquote(command.partition('/')[2].partition('?')[0])
+
+
+# <command> carrying <?stamp=E.S>: the version stamp (see <fs.format_stamp>)
+# of what it leaves at its path, which RVMs give their copy too
+def with_stamp(command: str, stamp: str) -> str:
+    if stamp == None:
+        return command
+    return command+('&' if '?' in command else '?')+'stamp='+stamp
+
+
+# "write/<path>" <command> carrying <?base=E.S>: the stamp of the version it
+# overwrote, to be sent as a delta against (see <put_delta>)
+def with_base(command: str, base: str) -> str:
+    if base == None:
+        return command
+    return command+('&' if '?' in command else '?')+'base='+base
+
+
+# Run the fs mutation <operation>(*args) (on a <DISK_IO> thread) holding the
+# locks of its paths (<locks>: {'reads': [...], 'writes': [...]}), and queue
+# the command replicating it before releasing them: mutations of a path thus
+# reach the RVMs in the order they were applied here. <command(result, stamp)>
+# builds that command (None: nothing to replicate) from the mutation's result
+# and the (formatted) version stamp it gave (None if none).
+# @return tuple: (its result, the PendingCommand to <wait_forwarded> on)
+def replicated(locks: dict, command, operation, *args):
+    with fs.PATH_LOCKS.locking(**locks):
+        fs.take_stamp()
+        result = operation(*args)
+        pending = queue_command(command(result, fs.format_stamp(fs.take_stamp())))
+    return result, pending
+
+
+# <path> as a single URL segment of a two-path route (</copy/<src>/<dest>>,
+# </rename/<old>/<new>>): quoted twice, since the "/"s it may hold are
+# unquoted once before routing (the route then unquotes the rest)
+def path_segment(path: str) -> str:
+    return urllib.parse.quote(urllib.parse.quote(path, safe=''), safe='')
+
 
+# @return tuple: (offset: int, length: int) of the local bytes to stream
+def body_command_range(command: str):
+    params = urllib.parse.parse_qs(command.partition('?')[2])
+    return int(params.get('offset',['0'])[0]), int(params.get('length',[str(fs.READ_ENTIRE_PATH)])[0])
 
-def write_rvm_ips(rvm_ips_contents: str):
-    with rvm_ips_file_lock:
-        with open(RVM_IPS_FILENAME, 'w') as file:
-            file.write(rvm_ips_contents)
 
+# Chunk-store writes only send the chunks the RVM lacks: ask which those are,
+# then PUT "write_chunks/..." with the manifest as one JSON line, followed by
+# the missing chunks' bytes (see the RVM's </write_chunks> route)
+def put_chunks(rvm_ip: str, command: str, manifest: list) -> bool:
+    try:
+        response = requests.post('http://'+rvm_ip+':5000/missing_chunks', json={'chunks': [chash for chash, _ in manifest]})
+        if response.status_code != 200:
+            return False
+        missing = set(response.json().get('missing'))
+        def body():
+            yield (json.dumps({'chunks': manifest, 'included': sorted(missing)})+'\n').encode('utf-8')
+            sent = set()
+            for chash, _ in manifest:
+                if chash in missing and chash not in sent:
+                    sent.add(chash)
+                    yield fs.read_chunk(chash)
+        response = requests.put('http://'+rvm_ip+':5000/write_chunks/'+command.partition('/')[2], data=body())
+        return response.status_code == 200
+    except Exception as err_msg:
+        log('Error sending the chunks of "'+command+'" to RVM '+rvm_ip+' (resending the whole file): '+str(err_msg))
+        return False
+
+
+# Delta-encoded rewrites (see <delta.py>): before a large file is overwritten,
+# we keep the signatures of the version it replaces (its "base"). Each RVM then
+# gets the new version as a delta against it, which it can only apply if it
+# holds that very version (same stamp): if not (or if the delta wouldn't be
+# much smaller), the whole file is sent instead. Replayed history commands
+# always send the whole file, the bases being dropped once forwarded.
+_delta_bases = {} # {(path, base stamp): delta.Signatures, ...}
+_delta_encoded = {} # {(path, base stamp): (stamp, checksum, encoding, delta), ...}
+_delta_lock = threading.Lock()
+
+
+# Keep the signatures of <path>'s current version, if worth a delta
+# @return str: its (formatted) stamp, to pass as the write's <?base=E.S>
+def delta_base(path: str):
+    if len(rvm_ips()) == 0 or fs.STORAGE_BACKEND == fs.STORAGE_BACKEND_CHUNKS: # chunk stores only send new chunks already
+        return None
+    if file_size(path) < delta.DELTA_MIN_BYTES:
+        return None
+    try:
+        stamp, signatures = fs.delta_signatures(path)
+    except Exception as err_msg:
+        log('Failed to take the delta base of "'+path+'" (sending it whole): '+str(err_msg))
+        return None
+    if stamp == None:
+        return None
+    base = fs.format_stamp(stamp)
+    with _delta_lock:
+        _delta_bases[(path, base)] = signatures
+    return base
+
+
+def drop_delta_base(path: str, base: str):
+    with _delta_lock:
+        _delta_bases.pop((path, base), None)
+        _delta_encoded.pop((path, base), None)
+
+
+# Our current copy of <path> as a delta against <base> (encoded once, for all RVMs)
+# @return tuple: (stamp: str, checksum: str, encoding: str, delta: bytes), or None
+def delta_for(path: str, base: str):
+    with _delta_lock:
+        signatures = _delta_bases.get((path, base))
+        encoded = _delta_encoded.get((path, base))
+    if signatures == None:
+        return None
+    if encoded == None or encoded[0] != fs.stat(path)['stamp']: # (re-)encode our current copy
+        stamp, checksum, encoding, delta_bytes = fs.delta_against(path, signatures)
+        if delta_bytes == None:
+            return None
+        encoded = (fs.format_stamp(stamp), checksum, encoding, delta_bytes)
+        with _delta_lock:
+            if (path, base) in _delta_bases:
+                _delta_encoded[(path, base)] = encoded
+    return encoded
+
+
+# PUT a "write/<path>?base=E.S" command's file to an RVM as a delta against
+# its base version (see the RVM's </write_delta> route)
+# @return bool: False if it must be sent whole instead
+def put_delta(rvm_ip: str, command: str) -> bool:
+    path = body_command_path(command)
+    command_params = urllib.parse.parse_qs(command.partition('?')[2])
+    base = command_params.get('base', [None])[0]
+    if base == None:
+        return False
+    try:
+        encoded = delta_for(path, base)
+        if encoded == None:
+            return False
+        stamp, checksum, encoding, delta_bytes = encoded
+        params = {'base': base, 'checksum': checksum, 'compression': encoding, 'durability': command_params.get('durability', [fs.DEFAULT_DURABILITY_MODE])[0]}
+        response = requests.put('http://'+rvm_ip+':5000/'+with_stamp('write_delta/'+urllib.parse.quote(path, safe='')+'?'+urllib.parse.urlencode(params, quote_via=urllib.parse.quote), stamp), data=delta_bytes)
+        if response.status_code != 200:
+            return False
+        with _replication_stats_lock:
+            _replication_stats['delta_writes'] += 1
+            _replication_stats['delta_bytes'] += len(delta_bytes)
+            _replication_stats['delta_saved_bytes'] += max(0, fs.stat(path)['size']-len(delta_bytes))
+        return True
+    except Exception as err_msg:
+        log('Error sending "'+command+'" to RVM '+rvm_ip+' as a delta (sending the whole file): '+str(err_msg))
+        return False
 
-def get_forwarded_url(original_url, rvm_ip):
-    return 'http://'+rvm_ip+':5000'+original_url[original_url.find(':5001')+5:]
+
+# Stream our local copy of a body command's bytes to an RVM via chunked PUT.
+# Whole-file writes are sent as stored (still compressed, if they are), for
+# the RVM to store with the same encoding. RVMs keeping a shard of the file
+# get their (re-encoded) shard instead.
+def put_body(rvm_ip: str, command: str) -> bool:
+    try:
+        if command.startswith('write/') or command.startswith('write_manifest/'): # sends our current copy: stamp (and flag) it as such
+            path = body_command_path(command)
+            operation = 'write_manifest' if fs.is_striped(path) else 'write'
+            command = with_stamp(operation+'/'+command.partition('/')[2], fs.stat(path)['stamp'])
+            if operation == 'write_manifest':
+                response = requests.put('http://'+rvm_ip+':5000/'+command, data=fs.read_contents(path))
+                return response.status_code == 200
+        layout = shard_layout_for(rvm_ip, body_command_path(command))
+        if layout != None:
+            return put_shard(rvm_ip, command, *layout)
+        if fs.shard_index(body_command_path(command)) != None: # we only hold a shard, they keep it all
+            contents = DISK_IO.run(rebuild_sharded, body_command_path(command), block=True)
+            response = requests.put('http://'+rvm_ip+':5000/'+with_stamp(body_command('write', body_command_path(command), fs.DEFAULT_DURABILITY_MODE), fs.stat(body_command_path(command))['stamp']), data=contents)
+            return response.status_code == 200
+        if command.startswith('write/'):
+            if put_delta(rvm_ip, command):
+                return True
+            manifest = fs.chunk_manifest(body_command_path(command))
+            if manifest != None and put_chunks(rvm_ip, command, manifest):
+                return True
+            encoding, _, chunks = fs.stream_stored(body_command_path(command))
+            response = requests.put('http://'+rvm_ip+':5000/'+command+'&compression='+encoding, data=chunks, headers={'Content-Encoding': encoding})
+            return response.status_code == 200
+        offset, length = body_command_range(command)
+        _, chunks = fs.stream(body_command_path(command), offset, length)
+        response = requests.put('http://'+rvm_ip+':5000/'+command, data=chunks)
+        return response.status_code == 200
+    except Exception as err_msg:
+        log('Error streaming "'+command+'" to RVM '+rvm_ip+': '+str(err_msg))
+        return False
 
 
-def forward_command(original_url):
+##############################################################################
+# Erasure coding (see <erasure.py>): in an "erasure" family with at least k+m
+# RVMs, the i-th RVM of <rvm.txt> (i < k+m) only keeps shard i of each file of
+# at least <erasure.ERASURE_MIN_BYTES>. Shards are (re-)encoded whenever a
+# write to the file is forwarded, so a replacement RVM gets its shards back
+# from the replayed command history.
+def erasure_layout():
+    mode, k, m = erasure.parse_redundancy(MEMBERSHIP.redundancy())
+    return None if mode == erasure.REDUNDANCY_REPLICATE else (k, m)
+
+
+# @return tuple: (index, k, m) of the shard of <path> that <rvm_ip> should
+#                keep, or None if it should keep the whole file
+def shard_layout_for(rvm_ip: str, path: str):
+    layout = erasure_layout()
+    if layout == None or fs.STORE != None:
+        return None
+    k, m = layout
     rips = rvm_ips()
+    if len(rips) < k+m or rvm_ip not in rips[:k+m]:
+        return None
+    if fs.stat(path)['size'] < erasure.ERASURE_MIN_BYTES:
+        return None
+    return rips.index(rvm_ip), k, m
+
+
+# Shards travel as raw bytes, described by these headers
+def shard_headers(index: int, k: int, m: int, size: int, checksum: str) -> dict:
+    return {'X-Shard-Index': str(index), 'X-Shard-Layout': str(k)+'+'+str(m), 'X-File-Size': str(size), 'X-File-Checksum': checksum}
+
+
+# @return tuple: (index: int, k: int, m: int, size: int, checksum: str)
+def parse_shard_headers(headers):
+    k, _, m = headers['X-Shard-Layout'].partition('+')
+    return int(headers['X-Shard-Index']), int(k), int(m), int(headers['X-File-Size']), headers['X-File-Checksum']
+
+
+# Rebuild <path>, which we only hold a shard of, from any k of the shards held
+# by the machines at <peer_urls>
+def gather_shards(path: str, peer_urls: list) -> bytes:
+    index, k, m, size, checksum, shard = fs.read_shard(path)
+    shards = {index: shard}
+    for peer_url in peer_urls:
+        if len(shards) >= k:
+            break
+        try:
+            response = requests.get(peer_url+'/read_shard/'+urllib.parse.quote(path, safe=''))
+            if response.status_code != 200:
+                continue
+            peer_index, peer_k, peer_m, peer_size, peer_checksum = parse_shard_headers(response.headers)
+            if (peer_k, peer_m, peer_size, peer_checksum) == (k, m, size, checksum):
+                shards[peer_index] = response.content
+        except Exception as err_msg:
+            log('Failed to fetch a shard of "'+path+'" from '+peer_url+': '+str(err_msg))
+    contents = erasure.decode(shards, k, m, size)
+    if merkle.content_hash(contents) != checksum:
+        raise fs.DistributedFileSystemError(f"gather_shards: Path {path} was rebuilt with the wrong checksum!")
+    return contents
+
+
+# PUT shard <index> of a body command's path to an RVM (in place of the bytes
+# the command would send)
+def put_shard(rvm_ip: str, command: str, index: int, k: int, m: int) -> bool:
+    path = body_command_path(command)
+    size, checksum, shard = DISK_IO.run(shard_of, path, index, k, m, block=True)
+    command_params = urllib.parse.parse_qs(command.partition('?')[2])
+    durability_mode = command_params.get('durability', [fs.DEFAULT_DURABILITY_MODE])[0]
+    params = urllib.parse.urlencode({'index': index, 'k': k, 'm': m, 'size': size, 'checksum': checksum, 'durability': durability_mode})
+    response = requests.put('http://'+rvm_ip+':5000/'+with_stamp('write_shard/'+urllib.parse.quote(path, safe='')+'?'+params, command_params.get('stamp', [None])[0]), data=shard)
+    return response.status_code == 200
+
+
+# We keep whole files: shards are encoded from them
+def shard_of(path: str, index: int, k: int, m: int):
+    try:
+        return fs.encode_shard(path, index, k, m)
+    except fs.DistributedFileSharded:
+        rebuild_sharded(path)
+        return fs.encode_shard(path, index, k, m)
+
+
+# Rebuild <path> (which we only hold a shard of, as an RVM that took over as
+# UVM) from the RVMs' shards, and keep the whole file from now on
+# >> NOTE: Callers run it on a <DISK_IO> thread: it writes the whole file back
+def rebuild_sharded(path: str) -> bytes:
+    contents = gather_shards(path, ['http://'+rip+':5000' for rip in rvm_ips()])
+    fs.write_bytes(path, contents)
+    log('Rebuilt "'+path+'" from its erasure-coded shards')
+    return contents
+
+
+# <contents> of a rebuilt file, cut to the range requested (see <requested_range>)
+def contents_range(contents: bytes) -> bytes:
+    offset, length = requested_range()
+    return contents[offset:] if length == fs.READ_ENTIRE_PATH else contents[offset:offset+length]
+
+
+##############################################################################
+# Rewrite our corrupt copy of <path> with the first RVM copy that matches its
+# checksum (see <fs.repair>), on a <DISK_IO> thread (waiting for a free one
+# if <block>, as background repairs do)
+# @return bool: whether <path> is no longer corrupt
+def repair_corrupt(path: str, block: bool = False) -> bool:
+    for rip in rvm_ips():
+        try:
+            response = requests.get('http://'+rip+':5000/read_bytes/'+urllib.parse.quote(path, safe=''), timeout=CORRUPT_REPAIR_TIMEOUT_SECONDS)
+            if response.status_code == 200 and DISK_IO.run(fs.repair, path, response.content, block=block):
+                log('Repaired corrupt "'+path+'" from RVM '+rip)
+                return True
+        except diskio.DiskBusy:
+            raise
+        except Exception as err_msg:
+            log('Failed to fetch "'+path+'" from RVM '+rip+' to repair it: '+str(err_msg))
+        if path not in fs.corrupt_paths(): # rewritten (or deleted) meanwhile
+            return True
+    log('Failed to repair corrupt "'+path+'": no RVM holds a healthy copy (will retry)')
+    return False
+
+
+# Stream <path>'s <chunks> (see <fs.stream>): if they turn out corrupt, the
+# response is cut short (so the client sees an incomplete read), and <path>
+# is repaired for the next read
+def repaired_on_corruption(path: str, chunks):
+    try:
+        yield from chunks
+    except fs.DistributedFileCorrupt:
+        log('Cut short a read of corrupt "'+path+'"!')
+        threading.Thread(target=repair_corrupt, args=(path, True), daemon=True).start()
+
+
+# Open a stream of <path> via <opener(path, *args)> (<fs.stream> or
+# <fs.stream_stored>) and pull its first chunk, on a <DISK_IO> thread: the
+# request thread only reads on from there
+# >> NOTE: Raises diskio.DiskBusy if the disk can't get to it in time
+# @return tuple: what <opener> returns, its chunks still all there
+def open_stream(opener, path: str, *args):
+    return DISK_IO.run(primed_stream, opener, path, *args, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+
+
+def primed_stream(opener, path: str, *args):
+    *opened, chunks = opener(path, *args)
+    first = next(chunks, None)
+    return (*opened, chunks if first == None else itertools.chain((first,), chunks))
+
+
+# Open <path>'s file to <sendfile> from (and stat it), on a <DISK_IO> thread
+# >> NOTE: Raises diskio.DiskBusy if the disk can't get to it in time
+# @return tuple: (file, os.stat_result), or None if <path> has no file to
+#                <sendfile> from (storage backend, or compression)
+def open_local_file(path: str):
+    return DISK_IO.run(opened_local_file, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+
+
+def opened_local_file(path: str):
+    local_path = fs.file_path(path)
+    if local_path == None:
+        return None
+    file = open(local_path, 'rb')
+    return file, os.fstat(file.fileno())
+
+
+# <send_file> the <file> opened by <open_local_file> (honoring "Range" and
+# conditional request headers, as <send_file> does for a path)
+def send_local_file(file, stat: os.stat_result) -> Response:
+    response = send_file(file, mimetype='application/octet-stream', conditional=False, etag=False, last_modified=stat.st_mtime)
+    response.content_length = stat.st_size
+    return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+
+
+# Split <commands> into in-order groups: runs of URL commands (sent as one
+# batch), and individual body commands (each streamed on its own)
+def group_commands(commands: list) -> list:
+    groups = []
+    for command in commands:
+        if is_body_command(command) or len(groups) == 0 or is_body_command(groups[-1][0]):
+            groups.append([command])
+        else:
+            groups[-1].append(command)
+    return groups
+
+
+# Send <commands> in order to an RVM
+# @return int: number of requests made
+def send_commands(rvm_ip: str, commands: list) -> int:
+    groups = group_commands(commands)
+    for group in groups:
+        sent = put_body(rvm_ip, group[0]) if is_body_command(group[0]) else post_batch(rvm_ip, group)
+        if not sent:
+            log('UVM-to-RVM Forwarding Error: couldn\'t send '+str(len(group))+' action(s) to RVM '+rvm_ip)
+    return len(groups)
+
+
+def forward_batch(batch: list):
+    rips = rvm_ips()
+    with _command_history_lock:
+        replayed = dict(_replayed_to)
+    total_requests = 0
     for rip in rips:
-        rurl = get_forwarded_url(original_url,rip)
-        if get_request(rurl) != 200:
-            log('UVM-to-RVM Forwarding Error: couldn\'t GET '+rurl)
+        total_requests += send_commands(rip, [pending.command for pending in batch if pending.rvm_ip in (None, rip) and not is_replayed(pending, replayed.get(rip, 0))])
+    with _replication_stats_lock:
+        _replication_stats['commands'] += len(batch)
+        _replication_stats['batches'] += 1
+        _replication_stats['requests'] += total_requests
+
+
+# Wait for a command, then keep gathering until the window closes or the batch is full
+def take_replication_batch():
+    with _replication_queue_condition:
+        while len(_replication_queue) == 0:
+            _replication_queue_condition.wait()
+        deadline = time.time()+REPLICATION_BATCH_WINDOW_SECONDS
+        while len(_replication_queue) < REPLICATION_BATCH_MAX_COMMANDS:
+            remaining = deadline-time.time()
+            if remaining <= 0:
+                break
+            _replication_queue_condition.wait(remaining)
+        batch = _replication_queue[:REPLICATION_BATCH_MAX_COMMANDS]
+        del _replication_queue[:REPLICATION_BATCH_MAX_COMMANDS]
+        return batch
+
+
+def replicate_batches():
+    while True:
+        batch = take_replication_batch()
+        try:
+            forward_batch(batch)
+        finally:
+            for pending in batch:
+                pending.forwarded.set()
 
 
 ##############################################################################
@@ -97,25 +653,241 @@ def forward_command(original_url):
 _command_history = []
 _command_history_lock = threading.Lock()
 
-def register_command(url: str):
+# RVMs seeded with our history (see <forward_commands>): {rvm_ip: number of
+# commands replayed to it (None while replaying), ...}. Those commands are
+# left out when forwarding batches to it, so each reaches it once, in order.
+_replayed_to = {}
+
+# Whether the history <pending> was sent by replaying <replayed> commands
+def is_replayed(pending: PendingCommand, replayed) -> bool:
+    return pending.sequence != None and (replayed == None or pending.sequence < replayed)
+
+# Register <command> in our history and queue it for every RVM
+# @return PendingCommand: to <wait_forwarded> on (None if <command> is None)
+def queue_command(command: str):
+    if command == None:
+        return None
+    pending = PendingCommand(command)
     with _command_history_lock:
-        _command_history.append(url[url.find(':5001')+6:])
+        pending.sequence = len(_command_history)
+        _command_history.append(pending.command)
+        with _replication_queue_condition:
+            _replication_queue.append(pending)
+            _replication_queue_condition.notify()
+    return pending
 
 
-def forward_commands(rvm_ip: str):
+# Block until the batch holding <pending> (if any) has been forwarded
+def wait_forwarded(pending):
+    if pending != None:
+        pending.forwarded.wait()
+
+
+# >> NOTE: Blocks until the batch holding the command has been forwarded!
+def enqueue_command(command: str):
+    wait_forwarded(queue_command(command))
+
+
+# Queue <command> for <rvm_ip> alone, in order with every other command (it
+# isn't kept in our history: see <read_repair>)
+# >> NOTE: Blocks until the batch holding the command has been forwarded!
+def enqueue_command_for(rvm_ip: str, command: str):
+    pending = PendingCommand(command, rvm_ip)
+    with _replication_queue_condition:
+        _replication_queue.append(pending)
+        _replication_queue_condition.notify()
+    pending.forwarded.wait()
+
+
+# The command replicating the request to <url> (our own route, as is)
+def url_command(url: str) -> str:
+    return url[url.find(':5001')+6:]
+
+
+def replicate_command(url: str):
+    enqueue_command(url_command(url))
+
+
+# Mark <rvm_ip> as about to be seeded: batches forwarded meanwhile skip our
+# history's commands for it (see <forward_commands>)
+# >> NOTE: call before adding it to our RVMs!
+def start_replay(rvm_ip: str):
     with _command_history_lock:
-        for command in _command_history:
-            if not ping_rvm(rvm_ip,command):
-                log('Failed to forward action "'+command+'" to VM '+rvm_ip)
+        _replayed_to[rvm_ip] = None
+
+
+# Seed <rvm_ip> with our whole history, then hand it over to the replication
+# queue. The history is sent in copied slices, never while holding its lock
+# (sending reads the files, taking their path locks, which writers hold while
+# queuing commands); whatever's added meanwhile is caught up on after.
+def forward_commands(rvm_ip: str):
+    replayed = 0
+    while True:
+        with _command_history_lock:
+            commands = _command_history[replayed:replayed+REPLICATION_BATCH_MAX_COMMANDS]
+            if len(commands) == 0: # caught up: newer commands are forwarded in batches
+                _replayed_to[rvm_ip] = replayed
+                return
+        send_commands(rvm_ip, commands)
+        replayed += len(commands)
+
+
+##############################################################################
+# Read repair: reads also compare the version stamp (see <fs.format_stamp>)
+# of our copy of the file with each RVM's, once the read is answered. RVMs
+# holding an older version (or none) are sent ours, through the replication
+# queue (so it lands in order with the file's other commands). If an RVM
+# holds a newer version than ours (as when we took over as UVM from an RVM
+# that missed a forward), we adopt it and send it on to every RVM.
+# >> NOTE: every read is compared for <READ_REPAIR_WARMUP_SECONDS> after we
+#          launch (when our copies are most likely stale), then only a
+#          <READ_REPAIR_CHANCE> sample of them (anti-entropy covers the rest)
+# >> NOTE: a path whose version (our stamp, and our RVMs) was already
+#          compared isn't compared again until it changes
+_read_repair_since = time.time()
+_read_repair_pending = set() # paths queued to be compared
+_read_repair_compared = OrderedDict() # {path: version last compared, ...} (least recent first)
+_read_repair_lock = threading.Lock()
+_read_repair_stats = {'compared': 0, 'pushed': 0, 'pulled': 0, 'restamped': 0, 'failed': 0}
+_read_repair_pool = ThreadPoolExecutor(max_workers=READ_REPAIR_THREADS)
+
+def count_read_repair(outcome: str):
+    with _read_repair_lock:
+        _read_repair_stats[outcome] += 1
+
+
+# Called by every read of <path>
+def after_read(path: str):
+    if time.time()-_read_repair_since < READ_REPAIR_WARMUP_SECONDS or random.random() < READ_REPAIR_CHANCE:
+        version = compared_version(path)
+        with _read_repair_lock:
+            if version != None and _read_repair_compared.get(path) == version:
+                return
+        schedule_read_repair(path)
+
+
+# @return tuple: (our stamp of <path>, our RVMs), or None if it DNE
+def compared_version(path: str):
+    try:
+        return fs.stat(path).get('stamp'), tuple(rvm_ips())
+    except fs.DistributedFileSystemError:
+        return None
+
+
+# Remember that <path> was compared at <version> (see <compared_version>)
+def remember_compared(path: str, version):
+    with _read_repair_lock:
+        _read_repair_compared[path] = version
+        _read_repair_compared.move_to_end(path)
+        while len(_read_repair_compared) > READ_REPAIR_MAX_COMPARED:
+            _read_repair_compared.popitem(last=False)
+
+
+# Queue <path> to be compared (unless it already is, or too many are)
+def schedule_read_repair(path: str):
+    if len(rvm_ips()) == 0:
+        return
+    with _read_repair_lock:
+        if path in _read_repair_pending or len(_read_repair_pending) >= READ_REPAIR_MAX_PENDING:
+            return
+        _read_repair_pending.add(path)
+    _read_repair_pool.submit(read_repair, path)
+
+
+# @return dict: <path>'s stat on the machine at <peer_url> (None if it DNE there)
+def peer_stat(peer_url: str, path: str):
+    response = requests.get(peer_url+'/stat/'+urllib.parse.quote(path, safe=''), timeout=READ_REPAIR_TIMEOUT_SECONDS)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise fs.DistributedFileSystemError(f"peer_stat: {peer_url} failed to stat {path} (status {response.status_code})!")
+    return response.json().get('stat')
+
+
+def stat_stamp(metadata):
+    return None if metadata == None else fs.parse_stamp(metadata.get('stamp'))
+
+
+def read_repair(path: str):
+    try:
+        repair_versions(path)
+    except Exception as err_msg:
+        count_read_repair('failed')
+        log('Read repair of "'+path+'" failed: '+str(err_msg))
+    finally:
+        with _read_repair_lock:
+            _read_repair_pending.discard(path)
+
+
+def repair_versions(path: str):
+    if not fs.exists(path) or fs.shard_index(path) != None:
+        return
+    local = fs.stat(path)
+    peers = {}
+    ips = rvm_ips()
+    for rip in ips:
+        try:
+            peers[rip] = peer_stat('http://'+rip+':5000', path)
+        except Exception as err_msg: # left to anti-entropy
+            log('Read repair couldn\'t stat "'+path+'" on RVM '+rip+': '+str(err_msg))
+    count_read_repair('compared')
+    newest = max(peers, key=lambda rip: fs.stamp_key(stat_stamp(peers[rip])), default=None)
+    if newest != None and fs.stamp_key(stat_stamp(peers[newest])) > fs.stamp_key(stat_stamp(local)):
+        if not adopt_newer(path, newest, peers[newest], local):
+            return
+        local = fs.stat(path)
+    local_stamp = stat_stamp(local)
+    if local_stamp == None:
+        return
+    if len(peers) == len(ips): # every RVM compared: they have (or are sent) this version
+        remember_compared(path, (local['stamp'], tuple(ips)))
+    for rip, metadata in peers.items():
+        if metadata != None and stat_stamp(metadata) == local_stamp:
+            continue
+        if metadata != None and (metadata.get('checksum'), metadata.get('striped')) == (local['checksum'], local['striped']): # same bytes: just copy our stamp
+            enqueue_command_for(rip, 'restamp/'+urllib.parse.quote(path, safe='')+'?'+urllib.parse.urlencode({'stamp': local['stamp'], 'checksum': local['checksum']}))
+            count_read_repair('restamped')
+        else:
+            log('Read repair: sending RVM '+rip+' our newer version of "'+path+'"')
+            enqueue_command_for(rip, body_command('write', path, fs.DEFAULT_DURABILITY_MODE))
+            count_read_repair('pushed')
+
+
+# Adopt RVM <rvm_ip>'s newer version of <path> (stat <metadata>) in place of
+# ours (stat <local>): just its stamp if the bytes are the same, else its
+# bytes too, sent on to every RVM
+# @return bool: whether the RVMs still need our (new) stamp, i.e. False if
+#               they were sent the version, or <path> changed here meanwhile
+def adopt_newer(path: str, rvm_ip: str, metadata: dict, local: dict) -> bool:
+    stamp = stat_stamp(metadata)
+    if (metadata.get('checksum'), metadata.get('striped')) == (local['checksum'], local['striped']):
+        if not fs.restamp(path, stamp, local['checksum']):
+            return False
+        count_read_repair('restamped')
+        return True
+    response = requests.get('http://'+rvm_ip+':5000/read_bytes/'+urllib.parse.quote(path, safe=''), headers={'Accept-Encoding': fs.compression.CODEC_IDENTITY}, timeout=READ_REPAIR_TIMEOUT_SECONDS)
+    if response.status_code != 200 or merkle.content_hash(response.content) != metadata.get('checksum'):
+        raise fs.DistributedFileSystemError(f"adopt_newer: RVM {rvm_ip} didn't send the version of {path} it holds!")
+    adopted, pending = replicated({'writes': [path]}, lambda adopted, _: body_command('write', path, fs.DEFAULT_DURABILITY_MODE) if adopted else None, fs.adopt, path, response.content, stamp, stat_stamp(local), metadata.get('striped', False))
+    if not adopted:
+        return False
+    log('Read repair: adopted RVM '+rvm_ip+'\'s newer version of "'+path+'"')
+    count_read_repair('pulled')
+    wait_forwarded(pending)
+    return False
 
 
 ##############################################################################
 # Get a new IP address for an EC2 RVM
 MIDDLEWARE_IP_FILENAME = '../ips/middleware.txt'
+_middleware_ip = None
 
 def middleware_ip():
-    with open(MIDDLEWARE_IP_FILENAME, 'r') as file:
-        return file.read().strip()
+    global _middleware_ip
+    if _middleware_ip == None:
+        with open(MIDDLEWARE_IP_FILENAME, 'r') as file:
+            _middleware_ip = file.read().strip()
+    return _middleware_ip
 
 
 def ping_middleware_for_new_rvm_ip():
@@ -144,60 +916,380 @@ def get_new_rvm_ip():
         rips[0] = rip
     rvm_txt = '\n'.join(rips)
     rvms = urllib.parse.quote(rvm_txt)
-    if ping_rvm(rip,'rvm_pool_register_and_awaken/'+family+'/'+uvm+'/'+rvms):
+    epoch = '?epoch='+str(MEMBERSHIP.epoch()+1)+'&backend='+urllib.parse.quote(fs.STORAGE_BACKEND)+'&redundancy='+urllib.parse.quote(MEMBERSHIP.redundancy())
+    if ping_rvm(rip,'rvm_pool_register_and_awaken/'+family+'/'+uvm+'/'+rvms+epoch):
+        start_replay(rip)
         write_rvm_ips(rvm_txt)
         forward_commands(rip)
         return rip
     return None
 
 
+##############################################################################
+# Striping: clients write each stripe of a large file straight to its family
+# (per the router's </stripe_plan>), then write the manifest to <path> via
+# </write_manifest>, which flags it as one in our index (see
+# <fs.write_manifest>). Reads of a manifest answer with it (flagged by
+# "X-Stripe-Manifest", or a "stripe_manifest" JSON key) for the client to read
+# the stripes itself.
+# >> NOTE: Raises diskio.DiskBusy if the disk can't get to the manifest in time
+# @return dict: <path>'s stripe manifest, or None if it isn't striped
+def stripe_manifest(path: str):
+    if not fs.is_striped(path):
+        return None
+    return json.loads(DISK_IO.run(fs.read_contents, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS))
+
+
+# Check the manifest <contents> is well-formed
+# @return bytes: the manifest as we store it (so it's sent back byte for byte)
+def parse_stripe_manifest(contents: bytes) -> bytes:
+    try:
+        manifest = json.loads(contents)
+        valid = isinstance(manifest.get('size'), int) and manifest['size'] >= 0 \
+            and isinstance(manifest.get('stripe_bytes'), int) and manifest['stripe_bytes'] > 0 \
+            and isinstance(manifest.get('stripes'), list) and len(manifest['stripes']) > 0 \
+            and all(isinstance(stripe.get('path'), str) and stripe['path'].startswith(STRIPE_PATH_PREFIX) and isinstance(stripe.get('uvm'), str) for stripe in manifest['stripes'])
+    except Exception:
+        valid = False
+    if not valid or len(contents) > STRIPE_MANIFEST_MAX_BYTES:
+        raise fs.DistributedFileSystemError("write_manifest: not a valid stripe manifest!")
+    return json.dumps(manifest).encode('utf-8')
+
+
+# Stripes only the manifest at <path> referenced: once it's overwritten or
+# deleted, the router deletes them from their families
+def orphaned_stripes(manifest) -> dict:
+    return {} if manifest == None else {'orphaned_stripes': [stripe['path'] for stripe in manifest['stripes']]}
+
+
+# Striped files can only be rewritten whole (their bytes live elsewhere)
+def check_unstriped(path: str, operation: str):
+    if fs.is_striped(path):
+        raise fs.DistributedFileSystemError(f"{operation}: Path {path} is striped across families (rewrite it whole instead)!")
+
+
+##############################################################################
+# Parse the byte range requested via <?offset=N&length=M>, or via an HTTP
+# "Range: bytes=A-B" / "Range: bytes=A-" header
+# @return tuple: (offset: int, length: int), where length -1 reads to EOF
+def requested_range():
+    range_header = request.headers.get('Range')
+    if range_header != None and range_header.startswith('bytes='):
+        start, _, end = range_header[len('bytes='):].split(',')[0].strip().partition('-')
+        offset = int(start)
+        return offset, (int(end)-offset+1 if len(end) > 0 else fs.READ_ENTIRE_PATH)
+    return int(request.args.get('offset','0')), int(request.args.get('length',str(fs.READ_ENTIRE_PATH)))
+
+
+##############################################################################
+# Whether to verify whole-file reads against their checksum: <?verify=0>
+# skips it (for hot paths that can trust the disk)
+def requested_verify() -> bool:
+    return request.args.get('verify', '1') != '0'
+
+
+##############################################################################
+# Durability mode requested via <?durability=MODE> (see <durability.py>)
+def requested_durability() -> str:
+    return fs.validate_durability_mode(request.args.get('durability'))
+
+
+##############################################################################
+# Compression requested via <?compression=CODEC> (None = per the policy, see
+# <compression.py>)
+def requested_compression():
+    encoding = request.args.get('compression')
+    return None if encoding == None else fs.validate_compression(encoding)
+
+
+# Logical (decompressed) size of the request body: <?size=N> if given, else
+# its Content-Length if it isn't compressed (else None)
+def requested_body_size():
+    if 'size' in request.args:
+        return int(request.args.get('size'))
+    if request.headers.get('Content-Encoding', fs.compression.CODEC_IDENTITY) == fs.compression.CODEC_IDENTITY:
+        return request.content_length
+    return None
+
+
+##############################################################################
+# Yield the request body in bounded-size chunks (handles chunked encoding)
+def request_body_chunks():
+    stream = request.stream # bound now: the chunks are read on a disk I/O thread
+    return iter(lambda: stream.read(fs.STREAM_CHUNK_BYTES), b'')
+
+
 ##############################################################################
 # FILE OPERATIONS
 
 ##############################################################################
-# Read the contents of a path
+# Read the contents of a path (or a byte range of it, see <requested_range>)
 # >> NOTE: No need to forward to our RVMs here!
-@app.route('/read/<path>', methods=['GET'])
+@app.route('/read/<path:path>', methods=['GET'])
 def read(path: str):
     try:
         path = urllib.parse.unquote(path)
-        _, data = fs.read(path, 0, fs.READ_ENTIRE_PATH)
-        return jsonify({'data': data, }), 200
+        manifest = stripe_manifest(path)
+        if manifest != None:
+            return jsonify({'stripe_manifest': manifest}), 200
+        after_read(path)
+        offset, length = requested_range()
+        position, data = DISK_IO.run(fs.read, path, offset, length, requested_verify(), timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        return jsonify({'data': data, 'position': position, }), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileSharded:
+        try:
+            data = contents_range(DISK_IO.run(rebuild_sharded, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS))
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return jsonify({'data': data.decode('utf-8', errors='replace'), 'position': requested_range()[0]+len(data), }), 200
+    except fs.DistributedFileCorrupt:
+        try:
+            if not repair_corrupt(path):
+                return jsonify({'error': 'corrupt file'}), 500
+            data = contents_range(DISK_IO.run(fs.read_contents, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS))
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return jsonify({'data': data.decode('utf-8', errors='replace'), 'position': requested_range()[0]+len(data), }), 200
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Read the raw bytes of a path as "application/octet-stream" (no JSON/text
+# decoding). Whole-file reads go through <send_file> (<sendfile> where the
+# WSGI server supports it, and honors "Range" headers); <?offset=N&length=M>
+# reads are streamed out of an mmap of the file. A compressed file is sent as
+# stored (with a "Content-Encoding") if the client's "Accept-Encoding" allows,
+# else decompressed on the fly. Whole files read from disk are verified as
+# they're streamed (unless <?verify=0>), so skip <sendfile>: a corrupt file's
+# response is cut short, and it's repaired from an RVM's copy.
+@app.route('/read_bytes/<path:path>', methods=['GET'])
+def read_bytes(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        verify = requested_verify()
+        manifest = stripe_manifest(path)
+        if manifest != None:
+            return Response(json.dumps(manifest), status=200, mimetype='application/json', headers={'X-Stripe-Manifest': str(len(manifest['stripes']))})
+        after_read(path)
+        if 'offset' in request.args or 'length' in request.args:
+            offset, length = requested_range()
+            total_bytes, chunks = open_stream(fs.stream, path, offset, length)
+            return Response(chunks, status=200, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes)})
+        if 'Range' not in request.headers and fs.negotiate_encoding(path, request.headers.get('Accept-Encoding')) != fs.compression.CODEC_IDENTITY:
+            encoding, total_bytes, chunks = open_stream(fs.stream_stored, path, verify)
+            headers = {'Content-Length': str(total_bytes), 'Vary': 'Accept-Encoding'}
+            if encoding != fs.compression.CODEC_IDENTITY:
+                headers['Content-Encoding'] = encoding
+            return Response(chunks, status=200, mimetype='application/octet-stream', headers=headers)
+        contents = fs.cached_bytes(path)
+        if contents != None:
+            return send_file(io.BytesIO(contents), mimetype='application/octet-stream', conditional=True, etag=False)
+        local_file = None if verify and 'Range' not in request.headers else open_local_file(path)
+        if local_file == None: # storage backend (or compression) has no file to <sendfile> from, or it's verified
+            if 'Range' in request.headers:
+                offset, length = requested_range()
+                total_bytes, chunks = open_stream(fs.stream, path, offset, length)
+                content_range = 'bytes '+str(offset)+'-'+str(offset+total_bytes-1)+'/'+str(fs.stat(path)['size'])
+                return Response(chunks, status=206, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes), 'Content-Range': content_range})
+            total_bytes, chunks = open_stream(fs.stream, path, 0, fs.READ_ENTIRE_PATH, verify)
+            return Response(repaired_on_corruption(path, chunks), status=200, mimetype='application/octet-stream', headers={'Content-Length': str(total_bytes)})
+        return send_local_file(*local_file)
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileSharded:
+        try:
+            contents = DISK_IO.run(rebuild_sharded, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return Response(contents_range(contents), status=200, mimetype='application/octet-stream')
+    except fs.DistributedFileCorrupt:
+        try:
+            if not repair_corrupt(path):
+                return jsonify({'error': 'corrupt file'}), 500
+            contents = DISK_IO.run(fs.read_contents, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        except diskio.DiskBusy as err_msg:
+            return jsonify({'error': str(err_msg)}), 503
+        return Response(contents_range(contents), status=200, mimetype='application/octet-stream')
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
 ##############################################################################
 # Write a string to the path (creates a new file if <path> DNE)
-@app.route('/write/<path>/<data>', methods=['GET'])
+@app.route('/write/<path:path>/<data>', methods=['GET'])
 def write(path: str, data: str):
     try:
         path = urllib.parse.unquote(path)
         data = urllib.parse.unquote(data)
-        if not fs.exists(path) and not can_add_files_to_this_machine():
+        if not can_store_bytes(len(data.encode('utf-8'))-file_size(path)):
             err_msg = '[write] Insufficient file storage to create file "'+path+'"'
             log(err_msg)
             return jsonify({'error': err_msg}), 400
-        fs.write(path,data)
-        register_command(request.url)
-        forward_command(request.url)
+        replaced = stripe_manifest(path)
+        command = url_command(request.url)
+        _, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: with_stamp(command, stamp), fs.write, path, data, requested_durability(), requested_compression())
+        wait_forwarded(pending)
+        return jsonify(orphaned_stripes(replaced)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body to the path (creates a new file if <path> DNE).
+# The body (optionally chunked) is streamed to disk in bounded-size chunks,
+# then streamed on to each RVM, so it's never held in memory as a whole.
+# Pass <?size=N> (if not sending a Content-Length, or sending a compressed
+# body) to check the bytes fit. A body sent with a "Content-Encoding" is
+# stored compressed as is (unless <?compression=CODEC> says otherwise).
+@app.route('/write/<path:path>', methods=['PUT', 'POST'])
+def write_body(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        size = requested_body_size()
+        if not can_store_bytes((size or request.content_length or 0)-file_size(path)):
+            err_msg = '[write] Insufficient file storage to create file "'+path+'"'
+            log(err_msg)
+            return jsonify({'error': err_msg}), 400
+        replaced = stripe_manifest(path)
+        durability_mode = requested_durability()
+        base = DISK_IO.run(delta_base, path)
+        try:
+            _, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: with_base(body_command('write', path, durability_mode), base), fs.write_stream, path, request_body_chunks(), durability_mode, requested_compression(), request.headers.get('Content-Encoding', fs.compression.CODEC_IDENTITY), size)
+            wait_forwarded(pending)
+        finally:
+            if base != None:
+                drop_delta_base(path, base)
+        return jsonify(orphaned_stripes(replaced)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body, a stripe manifest (see <stripe_manifest>), to the
+# path (creates a new file if <path> DNE), flagging it as a striped file
+@app.route('/write_manifest/<path:path>', methods=['PUT', 'POST'])
+def write_manifest(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        contents = parse_stripe_manifest(request.get_data())
+        if not can_store_bytes(len(contents)-file_size(path)):
+            err_msg = '[write_manifest] Insufficient file storage to create file "'+path+'"'
+            log(err_msg)
+            return jsonify({'error': err_msg}), 400
+        replaced = stripe_manifest(path)
+        durability_mode = requested_durability()
+        _, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: body_command('write_manifest', path, durability_mode), fs.write_manifest, path, contents, durability_mode)
+        wait_forwarded(pending)
+        return jsonify(orphaned_stripes(replaced)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Append the request body to the path in place (creates a new file if <path>
+# DNE). Only the appended bytes are forwarded on to each RVM.
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/append/<path:path>', methods=['PUT', 'POST'])
+def append(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        contents = request.get_data()
+        if not can_store_bytes(len(contents)):
+            err_msg = '[append] Insufficient file storage to append to file "'+path+'"'
+            log(err_msg)
+            return jsonify({'error': err_msg}), 400
+        check_unstriped(path, 'append')
+        durability_mode = requested_durability()
+        length, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda length, stamp: with_stamp(body_command('append', path, durability_mode, length-len(contents), len(contents)), stamp), fs.append_bytes, path, contents, durability_mode)
+        wait_forwarded(pending)
+        return jsonify({'length': length}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Write the request body in place at byte <?offset=N> of the path (creates a
+# new file if <path> DNE). Only the written range is forwarded on to each RVM.
+# @return JSON: {'length': the file's new length in bytes}
+@app.route('/write_at/<path:path>', methods=['PUT', 'POST'])
+def write_at(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        offset = int(request.args.get('offset','0'))
+        contents = request.get_data()
+        if not can_store_bytes(max(0, offset+len(contents)-file_size(path))):
+            err_msg = '[write_at] Insufficient file storage to write to file "'+path+'"'
+            log(err_msg)
+            return jsonify({'error': err_msg}), 400
+        check_unstriped(path, 'write_at')
+        durability_mode = requested_durability()
+        length, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: with_stamp(body_command('write_at', path, durability_mode, offset, len(contents)), stamp), fs.write_at, path, offset, contents, durability_mode)
+        wait_forwarded(pending)
+        return jsonify({'length': length}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Truncate (or zero-extend) <path> to <length> bytes
+@app.route('/truncate/<path:path>/<length>', methods=['GET'])
+def truncate(path: str, length: str):
+    try:
+        path = urllib.parse.unquote(path)
+        length = int(length)
+        if not can_store_bytes(max(0, length-file_size(path))):
+            err_msg = '[truncate] Insufficient file storage to extend file "'+path+'"'
+            log(err_msg)
+            return jsonify({'error': err_msg}), 400
+        check_unstriped(path, 'truncate')
+        sharded = erasure_layout() != None and file_size(path) >= erasure.ERASURE_MIN_BYTES
+        durability_mode = requested_durability()
+        command = url_command(request.url)
+        def truncate_command(_, stamp):
+            if sharded: # RVMs may only keep a shard: re-encode theirs
+                return body_command('write', path, durability_mode)
+            return with_stamp(command, stamp)
+        _, pending = DISK_IO.run(replicated, {'writes': [path]}, truncate_command, fs.truncate, path, length, durability_mode)
+        wait_forwarded(pending)
         return jsonify({}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
 ##############################################################################
 # Delete <path>
-@app.route('/delete/<path>', methods=['GET'])
+@app.route('/delete/<path:path>', methods=['GET'])
 def delete(path: str):
     try:
         path = urllib.parse.unquote(path)
-        fs.delete(path)
-        register_command(request.url)
-        forward_command(request.url)
-        return jsonify({}), 200
+        manifest = stripe_manifest(path)
+        command = url_command(request.url)
+        _, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: command, fs.delete, path)
+        wait_forwarded(pending)
+        return jsonify(orphaned_stripes(manifest)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
@@ -211,31 +1303,36 @@ def copy(src_path: str, dest_path: str):
     try:
         src_path = urllib.parse.unquote(src_path)
         dest_path = urllib.parse.unquote(dest_path)
-        if fs.exists(src_path) and not can_add_files_to_this_machine():
+        if fs.exists(src_path) and not can_store_bytes(file_size(src_path)-file_size(dest_path)):
             err_msg = '[copy] Insufficient file storage to create file "'+src_path+'"'
             log(err_msg)
             return jsonify({'error': err_msg}), 400
-        fs.copy(src_path,dest_path)
-        register_command(request.url)
-        forward_command(request.url)
-        return jsonify({}), 200
-    except fs.DistributedFileSystemError:
+        check_unstriped(src_path, 'copy')
+        replaced = stripe_manifest(dest_path)
+        _, pending = DISK_IO.run(replicated, {'reads': [src_path], 'writes': [dest_path]}, lambda _, stamp: with_stamp('copy/'+path_segment(src_path)+'/'+path_segment(dest_path), stamp), fs.copy, src_path, dest_path)
+        wait_forwarded(pending)
+        return jsonify(orphaned_stripes(replaced)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
         return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
 
 
 ##############################################################################
-# Rename <old_path> as <new_path>
+# Rename <old_path> as <new_path> (a file, or a whole directory)
 @app.route('/rename/<old_path>/<new_path>', methods=['GET'])
 def rename(old_path: str, new_path: str):
     try:
         old_path = urllib.parse.unquote(old_path)
         new_path = urllib.parse.unquote(new_path)
-        fs.rename(old_path,new_path)
-        register_command(request.url)
-        forward_command(request.url)
-        return jsonify({}), 200
+        replaced = stripe_manifest(new_path) if old_path != new_path else None
+        _, pending = DISK_IO.run(replicated, {'writes': [old_path, new_path]}, lambda _, stamp: with_stamp('rename/'+path_segment(old_path)+'/'+path_segment(new_path), stamp), fs.rename, old_path, new_path) # directory renames keep their files' stamps
+        wait_forwarded(pending)
+        return jsonify(orphaned_stripes(replaced)), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
     except fs.DistributedFileSystemError:
         return jsonify({'error': 'missing file'}), 404
     except Exception as err_msg:
@@ -243,9 +1340,9 @@ def rename(old_path: str, new_path: str):
 
 
 ##############################################################################
-# Rename <old_path> as <new_path>
+# Check if the file <path> exists
 # >> NOTE: No need to forward to our RVMs here!
-@app.route('/exists/<path>', methods=['GET'])
+@app.route('/exists/<path:path>', methods=['GET'])
 def exists(path: str):
     try:
         path = urllib.parse.unquote(path)
@@ -254,17 +1351,255 @@ def exists(path: str):
         return jsonify({'error': str(err_msg)}), 400
 
 
+##############################################################################
+# Get <path>'s size, mtime, version, checksum, and version stamp from the metadata index
+# (or, for a directory, its number of entries)
+@app.route('/stat/<path:path>', methods=['GET'])
+def stat(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        metadata = fs.stat(path)
+        manifest = stripe_manifest(path) if fs.exists(path) else None
+        if manifest != None: # report the striped file's size, not its manifest's
+            metadata.update({'size': manifest['size'], 'stripes': len(manifest['stripes'])})
+        return jsonify({'stat': metadata}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Make the directory <path> (and any missing parents). Writes also create
+# their file's missing parents, so this is only needed for empty directories.
+@app.route('/mkdir/<path:path>', methods=['GET'])
+def mkdir(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        command = url_command(request.url)
+        created, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda created, _: command if created else None, fs.mkdir, path, requested_durability())
+        wait_forwarded(pending)
+        return jsonify({'created': created}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Remove the empty directory <path>
+@app.route('/rmdir/<path:path>', methods=['GET'])
+def rmdir(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        command = url_command(request.url)
+        _, pending = DISK_IO.run(replicated, {'writes': [path]}, lambda _, stamp: command, fs.rmdir, path)
+        wait_forwarded(pending)
+        return jsonify({}), 200
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing directory'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# List a page of the directory <path> (the root if omitted) from the
+# in-memory namespace: <?prefix=P> filters entries by name, <?limit=N> caps
+# the page, and <?start_after=NAME> (the previous page's "next") continues it.
+# >> NOTE: No need to forward to our RVMs here!
+# @return JSON: {'entries': [{'name', 'type', 'size', 'mtime'}, ...], 'next': NAME or None}
+@app.route('/list/', defaults={'path': ''}, methods=['GET'])
+@app.route('/list/<path:path>', methods=['GET'])
+def list_directory(path: str):
+    try:
+        path = urllib.parse.unquote(path).strip('/')
+        limit = int(request.args.get('limit', str(fs.namespace.MAX_LIST_ENTRIES)))
+        listing = fs.list_directory(path, request.args.get('prefix',''), request.args.get('start_after',''), limit)
+        return jsonify(listing), 200
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing directory'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# List a page of every file whose path starts with <?prefix=P> (in any
+# directory below), in path order: <?limit=N> caps the page, and
+# <?start_after=PATH> (the previous page's "next") continues it. The router
+# merges these pages from every family into one listing (see its </list_all>).
+# >> NOTE: No need to forward to our RVMs here!
+# @return JSON: {'files': [{'path', 'size', 'mtime'}, ...], 'next': PATH or None}
+@app.route('/list_files', methods=['GET'])
+def list_files():
+    try:
+        limit = int(request.args.get('limit', str(fs.namespace.MAX_LIST_ENTRIES)))
+        return jsonify(fs.list_files(request.args.get('prefix',''), request.args.get('start_after',''), limit)), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Read shard <?index=I&k=K&m=M> of a path (encoded from our whole copy), as raw
+# bytes described by "X-Shard-*" headers. Without an index, read the shard we
+# hold (only after taking over as UVM, before rebuilding it).
+@app.route('/read_shard/<path:path>', methods=['GET'])
+def read_shard(path: str):
+    try:
+        path = urllib.parse.unquote(path)
+        if 'index' in request.args:
+            index, k, m = int(request.args.get('index')), int(request.args.get('k')), int(request.args.get('m'))
+            size, checksum, shard = DISK_IO.run(shard_of, path, index, k, m, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        else:
+            index, k, m, size, checksum, shard = DISK_IO.run(fs.read_shard, path, timeout=diskio.DISK_IO_READ_TIMEOUT_SECONDS)
+        return Response(shard, status=200, mimetype='application/octet-stream', headers=shard_headers(index, k, m, size, checksum))
+    except diskio.DiskBusy as err_msg:
+        return jsonify({'error': str(err_msg)}), 503
+    except fs.DistributedFileNotFound:
+        return jsonify({'error': 'missing file'}), 404
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Report page cache hit ratio and memory use
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    try:
+        return jsonify({'cache': fs.cache_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report the disk I/O pool's queue depth, rejections/timeouts, and mean
+# queueing and service times
+@app.route('/disk_io_stats', methods=['GET'])
+def disk_io_stats():
+    try:
+        return jsonify({'disk_io': DISK_IO.stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report how many paths are locked now, and how often (and how long) an
+# operation had to wait for another's lock on its path
+@app.route('/lock_stats', methods=['GET'])
+def lock_stats():
+    try:
+        return jsonify({'locks': fs.lock_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report the storage backend in use (and bitcask's segment/dead-byte counts)
+@app.route('/storage_stats', methods=['GET'])
+def storage_stats():
+    try:
+        return jsonify({'storage': fs.storage_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report files/bytes per storage tier (memory, disk, cold), promotion and
+# demotion counts, and the mean read latency per tier
+@app.route('/tier_stats', methods=['GET'])
+def tier_stats():
+    try:
+        return jsonify({'tiers': fs.tier_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report scrub passes and throughput, and how many corrupt files reads and
+# scrubbing have found (and how many were repaired, or are still pending)
+@app.route('/integrity_stats', methods=['GET'])
+def integrity_stats():
+    try:
+        return jsonify({'integrity': fs.integrity_stats()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+# Report how many reads compared versions with the RVMs (see <read_repair>),
+# and how many stale copies that fixed: RVMs sent our version ("pushed") or
+# just our stamp ("restamped"), and newer RVM versions adopted ("pulled")
+@app.route('/read_repair_stats', methods=['GET'])
+def read_repair_stats():
+    try:
+        with _read_repair_lock:
+            stats = dict(_read_repair_stats)
+            stats['pending'] = len(_read_repair_pending)
+        return jsonify({'read_repair': stats}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# REPLICA ANTI-ENTROPY
+
+##############################################################################
+# Get the hashes of comma-separated merkle tree node indices
+@app.route('/merkle_nodes/<nodes>', methods=['GET'])
+def merkle_nodes(nodes: str):
+    try:
+        nodes = [int(node) for node in urllib.parse.unquote(nodes).split(',') if len(node) > 0]
+        return jsonify({'nodes': fs.MERKLE_TREE.node_hashes(nodes)}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Get the {path: content_hash} entries of a merkle tree leaf node
+@app.route('/merkle_bucket/<node>', methods=['GET'])
+def merkle_bucket(node: str):
+    try:
+        node = int(urllib.parse.unquote(node))
+        if not fs.MERKLE_TREE.is_leaf_node(node):
+            return jsonify({'error': 'merkle node '+str(node)+' is not a leaf'}), 400
+        return jsonify({'entries': fs.MERKLE_TREE.bucket(node)}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+
+##############################################################################
+# Report how many mutations were replicated, and in how many batches/requests
+@app.route('/uvm_replication_stats', methods=['GET'])
+def uvm_replication_stats():
+    try:
+        with _replication_stats_lock:
+            return jsonify(dict(_replication_stats)), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
+
+##############################################################################
+# Compare our version of <path> with the RVMs' (see <read_repair>): sent by an
+# RVM that found its version differs from ours
+@app.route('/uvm_read_repair/<path:path>', methods=['GET'])
+def uvm_read_repair(path: str):
+    try:
+        schedule_read_repair(urllib.parse.unquote(path))
+        return jsonify({}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
+
 ##############################################################################
 # UVM HEALTH MONITORING
 
 ##############################################################################
-# Update ../ips/rvm.txt
+# Update ../ips/rvm.txt (pass <?epoch=N> to reject stale updates)
 @app.route('/uvm_update_rvm_ips/<ip_address_list>', methods=['GET'])
 def uvm_update_rvm_ips(ip_address_list: str):
     try:
         ip_address_list = urllib.parse.unquote(ip_address_list)
+        if not write_rvm_ips(ip_address_list,request_epoch()):
+            log('Rejected stale RVM <ip_address_list> (epoch '+str(request_epoch())+' < '+str(MEMBERSHIP.epoch())+')')
+            return jsonify({'error': 'stale membership epoch'}), 409
         log('New RVM <ip_address_list>: '+ip_address_list.strip().replace('\n',', '))
-        write_rvm_ips(ip_address_list)
         return jsonify({}), 200
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
@@ -309,36 +1644,140 @@ def keep_rvms_alive():
         time.sleep(RVM_HEALTH_PING_TIMEOUT)
 
 
+##############################################################################
+# Rebuild every file we only hold a shard of (after an RVM took over as UVM)
+def rebuild_sharded_files():
+    while True:
+        time.sleep(SHARD_REBUILD_TIMEOUT_SECONDS)
+        for path in fs.sharded_paths():
+            try:
+                DISK_IO.run(rebuild_sharded, path, block=True)
+            except Exception as err_msg:
+                log('Failed to rebuild "'+path+'" from its shards (will retry): '+str(err_msg))
+
+
+##############################################################################
+# Periodically persist the metadata index so restarts needn't rehash files
+def persist_index_snapshots():
+    while True:
+        time.sleep(INDEX_SNAPSHOT_TIMEOUT_SECONDS)
+        try:
+            fs.save_index_snapshot()
+        except Exception as err_msg:
+            log('Failed to persist the metadata index snapshot: '+str(err_msg))
+
+
+# Periodically merge the bitcask backend's segments (and the cold tier's pack)
+def compact_storage():
+    while True:
+        time.sleep(STORAGE_COMPACTION_TIMEOUT_SECONDS)
+        try:
+            if fs.compact_storage():
+                log('Merged bitcask segments: '+str(fs.storage_stats()))
+        except Exception as err_msg:
+            log('Failed to compact storage: '+str(err_msg))
+
+
+# Periodically move files between the memory, disk and cold tiers (no-op for
+# the bitcask and chunk store backends)
+def retier_storage():
+    while True:
+        time.sleep(TIERING_TIMEOUT_SECONDS)
+        try:
+            demoted, reloaded = fs.retier()
+            if demoted > 0 or reloaded > 0:
+                log('Demoted '+str(demoted)+' idle file(s) to the cold tier, reloaded '+str(reloaded)+' hot file(s) into the page cache')
+        except Exception as err_msg:
+            log('Failed to retier storage: '+str(err_msg))
+
+
+# Continuously scrub our files at <SCRUB_BYTES_PER_SECOND> (a second's worth
+# at a time), repairing any found corrupt
+def scrub_storage():
+    while True:
+        started = time.time()
+        try:
+            scrubbed_bytes, corrupt, pass_complete = fs.scrub(SCRUB_BYTES_PER_SECOND)
+            for path in corrupt:
+                log('Scrubbing found "'+path+'" corrupt!')
+            if len(corrupt) > 0 or pass_complete:
+                for path in fs.corrupt_paths():
+                    repair_corrupt(path, True)
+            if pass_complete:
+                log('Finished a scrub pass: '+str(fs.integrity_stats()))
+        except Exception as err_msg:
+            log('Failed to scrub storage: '+str(err_msg))
+            scrubbed_bytes, pass_complete = SCRUB_BYTES_PER_SECOND, False
+        time.sleep(SCRUB_PASS_TIMEOUT_SECONDS if pass_complete else max(0, scrubbed_bytes/SCRUB_BYTES_PER_SECOND-(time.time()-started)))
+
+
 ##############################################################################
 # ROUTER UVM SELECTION
-FILES_ROOT_DIRECTORY = os.path.dirname(__file__)+'/../rootdir/'
+_disk_quota_lock = threading.Lock()
+_disk_quota_bytes = 0
+_disk_quota_time = 0
+
+# Bytes this family may hold: what we hold now plus what's free on the disk
+def family_quota_bytes() -> int:
+    global _disk_quota_bytes, _disk_quota_time
+    if UVM_FAMILY_QUOTA_BYTES != None:
+        return UVM_FAMILY_QUOTA_BYTES
+    with _disk_quota_lock:
+        if time.time()-_disk_quota_time >= DISK_STATS_TIMEOUT_SECONDS:
+            disk = os.statvfs(fs.ROOT_DIRECTORY)
+            _disk_quota_bytes = fs.total_bytes()+disk.f_bavail*disk.f_frsize
+            _disk_quota_time = time.time()
+        return _disk_quota_bytes
+
+
+def storage_usage() -> dict:
+    quota = family_quota_bytes()
+    return {
+        'used_bytes': fs.total_bytes(),
+        'quota_bytes': quota,
+        'high_watermark_bytes': int(quota*UVM_HIGH_WATERMARK_FRACTION),
+        'low_watermark_bytes': int(quota*UVM_LOW_WATERMARK_FRACTION),
+    }
+
 
-def number_of_files_in_uvm():
-    count = 0
-    for entry in os.listdir(FILES_ROOT_DIRECTORY):
-        if entry != 'README.md' and os.path.isfile(os.path.join(FILES_ROOT_DIRECTORY,entry)):
-            count += 1
-    return count
+def can_store_bytes(n_bytes: int) -> bool:
+    usage = storage_usage()
+    return usage['used_bytes']+n_bytes <= usage['high_watermark_bytes']
 
 
-def can_add_files_to_this_machine():
-    return number_of_files_in_uvm() < UVM_MAXIMUM_NUMBER_OF_FILES
+def file_size(path: str) -> int:
+    return fs.stat(path)['size'] if fs.exists(path) else 0
+
+
+@app.route('/uvm_storage_usage', methods=['GET'])
+def uvm_storage_usage():
+    try:
+        return jsonify({'usage': storage_usage()}), 200
+    except Exception as err_msg:
+        return jsonify({'error': str(err_msg)}), 400
 
 
-@app.route('/uvm_can_be_routed_with/<operation>/<path>', methods=['GET'])
+# Pass <?size=N> for writes so we can check the incoming bytes fit. New files
+# (and directories) are "local" here if their parent directory is, so the
+# router can keep a directory's files together in one family.
+@app.route('/uvm_can_be_routed_with/<operation>/', defaults={'path': ''}, methods=['GET'])
+@app.route('/uvm_can_be_routed_with/<operation>/<path:path>', methods=['GET'])
 def uvm_can_be_routed_with(operation, path):
     try:
         operation = urllib.parse.unquote(operation)
         path = urllib.parse.unquote(path)
+        size = int(request.args.get('size','0'))
         log('Pinged whether can support operation "'+operation+'" on file "'+path+'"!')
-        if fs.exists(path):
-            if operation == 'copy' and not can_add_files_to_this_machine():
+        if fs.exists(path) or fs.is_directory(path):
+            if operation == 'copy' and not can_store_bytes(file_size(path)):
                 return jsonify({'error': 'UVM can\'t support operation "'+operation+'" for file "'+path+'"'}), 403
-            return jsonify({ 'preferred': True }), 200
+            return jsonify({ 'preferred': True, 'usage': storage_usage() }), 200
         if operation == 'exists':
-            return jsonify({ 'preferred': False }), 200 # use this UVM iff no others have the file
-        if(operation == 'write' and can_add_files_to_this_machine()):
-            return jsonify({ 'preferred': False }), 200 # use this UVM iff no others have the file
+            return jsonify({ 'preferred': False, 'usage': storage_usage() }), 200 # use this UVM iff no others have the file
+        if(operation in ['write', 'mkdir'] and can_store_bytes(size)):
+            parent = fs.namespace.parent(path)
+            local = parent != fs.namespace.ROOT_PATH and fs.is_directory(parent)
+            return jsonify({ 'preferred': False, 'local': local, 'usage': storage_usage() }), 200 # use this UVM iff no others have the file
         return jsonify({'error': 'UVM can\'t support operation "'+operation+'" for file "'+path+'"'}), 403
     except Exception as err_msg:
         return jsonify({'error': str(err_msg)}), 400
@@ -352,15 +1791,41 @@ if __name__ == '__main__':
     Welcome to Jordan, Rahul, and Robin's COEN 317 Project!
     Flask will communicate this server's "http" address!
     Communicate to our server by executing GET requests to the following routes:
-        /read/<path>
-        /write/<path>/<data>
+        /read/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /read_bytes/<path>?offset=<n>&length=<n>&verify=<0|1>
+        /write/<path>/<data>?durability=<mode>
+        /write/<path>?durability=<mode> (PUT/POST the data as the request body)
+        /write_manifest/<path>?durability=<mode> (PUT/POST a stripe manifest as the request body)
+        /append/<path>?durability=<mode> (PUT/POST the data as the request body)
+        /write_at/<path>?offset=<n>&durability=<mode> (PUT/POST the data as the request body)
+        /truncate/<path>/<length>?durability=<mode>
         /delete/<path>
         /copy/<src_path>/<dest_path>
         /rename/<old_path>/<new_path>
         /exists/<path>
+        /stat/<path>
+        /mkdir/<path>?durability=<mode>
+        /rmdir/<path>
+        /list/<path>?prefix=<p>&start_after=<name>&limit=<n>
+        /list_files?prefix=<p>&start_after=<path>&limit=<n>
+        /storage_stats
+        /tier_stats
+        /integrity_stats
+        /read_repair_stats
+        /disk_io_stats
+        /lock_stats
 
     Happy coding! :)
     """
     )
+    fs.use_storage_backend(MEMBERSHIP.storage_backend())
+    fs.STAMP_EPOCH = MEMBERSHIP.epoch()
+    fs.stamp_unstamped()
     threading.Thread(target=keep_rvms_alive, daemon=True).start()
+    threading.Thread(target=replicate_batches, daemon=True).start()
+    threading.Thread(target=persist_index_snapshots, daemon=True).start()
+    threading.Thread(target=compact_storage, daemon=True).start()
+    threading.Thread(target=retier_storage, daemon=True).start()
+    threading.Thread(target=rebuild_sharded_files, daemon=True).start()
+    threading.Thread(target=scrub_storage, daemon=True).start()
     app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
\ No newline at end of file